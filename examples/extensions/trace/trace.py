@@ -23,5 +23,9 @@ if __name__ == '__main__':
     #
     # for example, showing last 32 trace records before the crash:
     # trace.enable_history_trace(ql, 32)
+    #
+    # both methods may be limited to a specific image or a range of addresses; instructions
+    # outside of it are not hooked, so they execute at full speed:
+    # trace.enable_full_trace(ql, image='x8664_hello')
 
     ql.run()
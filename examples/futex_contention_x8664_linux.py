@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import sys
+import time
+
+sys.path.append("..")
+
+from qiling import Qiling
+from qiling.const import QL_VERBOSE
+
+def my_sandbox(path, rootfs):
+    ql = Qiling(path, rootfs, verbose=QL_VERBOSE.DEFAULT, multithread=True)
+
+    started = time.perf_counter()
+    ql.run()
+    elapsed = time.perf_counter() - started
+
+    print(f'elapsed: {elapsed:.3f} seconds')
+
+    for tid, (_, switches) in ql.os.thread_management.stats().items():
+        print(f'thread {tid}: {switches} context switches')
+
+if __name__ == "__main__":
+    my_sandbox(["rootfs/x8664_linux/bin/x8664_futex_contention"], "rootfs/x8664_linux")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Simple example of how to use the built-in fuzzing engine, which needs neither AFL++ nor
+unicornafl.
+
+Note: this example refers to linux_x8664/qlfuzzer_x8664_linux.py
+
+Steps:
+  o Start fuzzing
+    $ python3 ./builtin_fuzzer_x8664_linux.py
+
+  o Watch progress
+    $ cat fuzz_outputs/fuzzer_stats
+
+  o Cleanup results
+    $ rm -fr fuzz_outputs/
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+
+from typing import TYPE_CHECKING, Sequence
+
+# replace this if qiling is located elsewhere
+QLHOME = os.path.realpath(r'../../..')
+
+sys.path.append(QLHOME)
+from qiling.extensions.afl.qlfuzzer import QlFuzzer
+from qiling.extensions.fuzzer import QlFuzzEngine, QlInputChannel
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+class MyFuzzer(QlFuzzer):
+    """Custom fuzzer.
+    """
+
+    def __init__(self, argv: Sequence[str], rootfs: str, **kwargs) -> None:
+        super().__init__(argv, rootfs, **kwargs)
+
+        # map an input channel into the emulated memory and have stdin read from it
+        self.channel = QlInputChannel(self.ql)
+        self.channel.bind_stdin()
+
+    def feed_input(self, ql: Qiling, stimuli: bytes, pround: int) -> bool:
+        # place fuzzed input as-is in the input channel
+        self.channel.feed(stimuli)
+
+        # signal the engine to proceed with this input
+        return True
+
+
+def main(argv: Sequence[str], rootfs: str, seeds_dir: str, outdir: str):
+    # initialize our custom fuzzer
+    fuzzer = MyFuzzer(argv, rootfs)
+
+    # calculate fuzzing scope effective addresses
+    main_begins = fuzzer.ea(0x1275)
+    main_ends = fuzzer.ea(0x1293)
+
+    # count stack protection violations as crashes by flagging calls to __stack_chk_fail@plt
+    stack_chk_fail = fuzzer.ea(0x126e)
+
+    seeds = []
+
+    for name in os.listdir(seeds_dir):
+        with open(os.path.join(seeds_dir, name), 'rb') as infile:
+            seeds.append(infile.read())
+
+    engine = QlFuzzEngine(fuzzer, outdir, main_begins, [main_ends], [stack_chk_fail],
+        seeds=seeds,
+        dictionary=[b'AAAA'],
+        workers=os.cpu_count() or 1,
+        timeout=500
+    )
+
+    # fuzz for a minute; emulation state is rolled back to 'main' between iterations
+    status = engine.run(duration=60)
+
+    print(f'{status["execs"]} execs, {status["edges"]} edges, {status["corpus"]} corpus inputs, {status["crashes"]} crashes')
+
+
+if __name__ == '__main__':
+    main(
+        rf'{QLHOME}/examples/fuzzing/linux_x8664/x8664_fuzz'.split(),
+        rf'{QLHOME}/examples/rootfs/x8664_linux',
+        rf'{QLHOME}/examples/fuzzing/linux_x8664/afl_inputs',
+        rf'{QLHOME}/examples/fuzzing/linux_x8664/fuzz_outputs'
+    )
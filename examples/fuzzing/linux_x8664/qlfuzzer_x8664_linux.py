@@ -43,8 +43,8 @@ class MyFuzzer(QlFuzzer):
     """Custom fuzzer.
     """
 
-    def setup(self, infilename: str, entry: int, exits: Collection[int], crashes: Optional[Collection[int]] = None) -> None:
-        super().setup(infilename, entry, exits, crashes)
+    def setup(self, infilename: str, entry: int, exits: Collection[int], crashes: Optional[Collection[int]] = None, persistent_iters: int = 1) -> None:
+        super().setup(infilename, entry, exits, crashes, persistent_iters)
 
         # redirect stdin to our mock to feed it with incoming fuzzed keystrokes
         self.ql.os.stdin = pipe.SimpleInStream(sys.stdin.fileno())
@@ -69,8 +69,9 @@ def main(argv: Sequence[str], rootfs: str, infilename: str):
     # this way afl will count stack protection violations as fuzzing crashes
     stack_chk_fail = fuzzer.ea(0x126e)
 
-    # set up fuzzing parameters
-    fuzzer.setup(infilename, main_begins, [main_ends], [stack_chk_fail])
+    # set up fuzzing parameters. emulation state is rolled back between persistent iterations,
+    # so many inputs may be fed to the same process without them affecting each other
+    fuzzer.setup(infilename, main_begins, [main_ends], [stack_chk_fail], persistent_iters=10000)
 
     # start fuzzing.
     #
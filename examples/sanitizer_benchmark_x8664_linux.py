@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+"""Measure the emulation overhead of the memory sanitizer.
+
+Every workload runs a loop that works on a local buffer within an instrumented stack frame,
+and differs in where its other memory accesses go and how often it calls functions. The time
+it takes to emulate each workload is compared with and without the sanitizer.
+"""
+
+import sys
+import time
+
+from typing import Dict, Tuple
+
+from keystone import Ks, KS_ARCH_X86, KS_MODE_64
+
+sys.path.append("..")
+from qiling import Qiling
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+from qiling.extensions.sanitizers.memory import QlMemorySanitizer
+
+ITERATIONS = 200000
+
+# workload functions, in the order they are laid out. each function may refer only to the
+# ones that precede it
+#
+# work(rdi: number of iterations, rsi: buffer to accumulate into, rdx: iterations between calls)
+# main(r12: whether to accumulate into a heap buffer, r13: iterations between calls, r14: number of iterations,
+#      r15: scratch buffer)
+FUNCTIONS = {
+    # allocation routines are replaced by the sanitizer; otherwise, a scratch buffer is used
+    'malloc': '''
+        mov     rax, r15
+        ret
+    ''',
+
+    'free': '''
+        ret
+    ''',
+
+    'leaf': '''
+        push    rbp
+        mov     rbp, rsp
+        sub     rsp, 0x20
+        mov     qword ptr [rsp], rdi
+        leave
+        ret
+    ''',
+
+    'work': '''
+        push    rbp
+        mov     rbp, rsp
+        sub     rsp, 0x40
+        mov     r8, rdx
+        mov     r9, rdx
+        xor     edx, edx
+        xor     eax, eax
+
+    loop:
+        mov     ecx, edx
+        and     ecx, 7
+        mov     qword ptr [rsp + rcx * 8], rdx
+        add     rax, qword ptr [rsp + rcx * 8]
+        add     qword ptr [rsi], rax
+        dec     r8
+        jnz     next
+
+        mov     r8, r9
+        push    rdi
+        call    {leaf:#x}
+        pop     rdi
+
+    next:
+        inc     rdx
+        cmp     rdx, rdi
+        jne     loop
+
+        leave
+        ret
+    ''',
+
+    'main': '''
+        push    rbp
+        mov     rbp, rsp
+        sub     rsp, 0x40
+        test    r12, r12
+        jz      on_stack
+
+        mov     rdi, 0x40
+        call    {malloc:#x}
+        mov     rsi, rax
+        jmp     start
+
+    on_stack:
+        lea     rsi, [rsp]
+
+    start:
+        mov     rdi, r14
+        mov     rdx, r13
+        call    {work:#x}
+
+        mov     rdi, rsi
+        test    r12, r12
+        jz      done
+
+        call    {free:#x}
+
+    done:
+        leave
+    '''
+}
+
+# workload name: (accumulate into a heap buffer, iterations between calls)
+SCENARIOS = {
+    'stack-bound compute' : (False, ITERATIONS),
+    'call every 16 iters' : (False, 16),
+    'heap-bound compute'  : (True,  ITERATIONS)
+}
+
+
+def assemble(base: int) -> Tuple[bytes, Dict[str, int]]:
+    """Assemble the workload and locate its functions.
+    """
+
+    ks = Ks(KS_ARCH_X86, KS_MODE_64)
+
+    # the workload starts with a jump to main, which is laid out last
+    code = bytearray(5)
+    offsets = {}
+
+    for name, source in FUNCTIONS.items():
+        offsets[name] = len(code)
+
+        encoding, _ = ks.asm(source.format(**{k: base + v for k, v in offsets.items()}), base + len(code))
+        code.extend(encoding)
+
+    encoding, _ = ks.asm(f'jmp {base + offsets["main"]:#x}', base)
+    code[:5] = bytes(encoding).ljust(5, b'\x90')
+
+    return bytes(code), offsets
+
+
+def emulate(heap: bool, period: int, sanitize: bool) -> float:
+    # the shellcode base address is not known before qiling is initialized, so the workload is
+    # assembled twice: once to learn its size, and once more at its actual address
+    code, _ = assemble(0)
+
+    ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+    base = ql.os.entry_point
+
+    code, offsets = assemble(base)
+    ql.mem.write(base, code)
+
+    if sanitize:
+        san = QlMemorySanitizer(ql)
+
+        san.hook_allocator('malloc', base + offsets['malloc'])
+        san.hook_allocator('free', base + offsets['free'])
+
+        san.instrument_frame(base + offsets['leaf'], offsets['work'] - offsets['leaf'])
+        san.instrument_frame(base + offsets['work'], offsets['main'] - offsets['work'])
+        san.instrument_frame(base + offsets['main'], len(code) - offsets['main'])
+
+    ql.arch.regs.r12 = int(heap)
+    ql.arch.regs.r13 = period
+    ql.arch.regs.r14 = ITERATIONS
+    ql.arch.regs.r15 = base - 0x8000
+
+    started = time.perf_counter()
+    ql.run()
+
+    if sanitize:
+        assert not san.reports, [str(r) for r in san.reports]
+
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    print(f'{"workload":<24}{"plain":>10}{"sanitized":>12}{"ratio":>8}')
+
+    for name, (heap, period) in SCENARIOS.items():
+        plain = emulate(heap, period, False)
+        sanitized = emulate(heap, period, True)
+
+        print(f'{name:<24}{plain:>9.3f}s{sanitized:>11.3f}s{sanitized / plain:>7.2f}x')
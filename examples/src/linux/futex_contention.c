@@ -0,0 +1,83 @@
+// Futex contention benchmark: a few threads hammering a plain mutex, a
+// priority-inheritance mutex and a condition variable, plus a timed wait.
+#define _GNU_SOURCE
+#include <errno.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <time.h>
+
+#define NTHREADS    8
+#define ITERATIONS  2000
+
+static pthread_mutex_t mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_mutex_t pi_mutex;
+static pthread_cond_t cond = PTHREAD_COND_INITIALIZER;
+
+static long counter = 0;
+static long pi_counter = 0;
+static int turn = 0;
+
+static void *worker(void *arg) {
+    long id = (long) arg;
+    int i;
+
+    for (i = 0; i < ITERATIONS; i++) {
+        pthread_mutex_lock(&mutex);
+        counter++;
+        pthread_mutex_unlock(&mutex);
+
+        pthread_mutex_lock(&pi_mutex);
+        pi_counter++;
+        pthread_mutex_unlock(&pi_mutex);
+    }
+
+    // take turns in order, waking everybody up on each one
+    pthread_mutex_lock(&mutex);
+
+    while (turn != id) {
+        pthread_cond_wait(&cond, &mutex);
+    }
+
+    turn++;
+    pthread_cond_broadcast(&cond);
+    pthread_mutex_unlock(&mutex);
+
+    return NULL;
+}
+
+int main(void) {
+    pthread_t threads[NTHREADS];
+    pthread_mutexattr_t attr;
+    struct timespec deadline;
+    long i;
+    int ret;
+
+    pthread_mutexattr_init(&attr);
+    pthread_mutexattr_setprotocol(&attr, PTHREAD_PRIO_INHERIT);
+    pthread_mutex_init(&pi_mutex, &attr);
+
+    for (i = 0; i < NTHREADS; i++) {
+        pthread_create(&threads[i], NULL, worker, (void *) i);
+    }
+
+    for (i = 0; i < NTHREADS; i++) {
+        pthread_join(threads[i], NULL);
+    }
+
+    // nobody is going to signal this one
+    clock_gettime(CLOCK_REALTIME, &deadline);
+    deadline.tv_nsec += 100000000;
+
+    if (deadline.tv_nsec >= 1000000000) {
+        deadline.tv_sec++;
+        deadline.tv_nsec -= 1000000000;
+    }
+
+    pthread_mutex_lock(&mutex);
+    ret = pthread_cond_timedwait(&cond, &mutex, &deadline);
+    pthread_mutex_unlock(&mutex);
+
+    printf("counter=%ld pi_counter=%ld turns=%d timedwait=%s\n", counter, pi_counter, turn, ret == ETIMEDOUT ? "ETIMEDOUT" : "?");
+
+    return 0;
+}
@@ -4,16 +4,18 @@
 #
 
 from abc import ABC, abstractmethod
+from functools import cached_property
 from typing import ClassVar, Optional
 
 from unicorn import Uc
 from unicorn.unicorn import UcContext
-from capstone import Cs
+from capstone import Cs, CsInsn
 from keystone import Ks
 
 from qiling import Qiling
 from qiling.const import QL_ARCH, QL_ENDIAN
 
+from .decoder import InsnLite, QlArchDecoder
 from .models import QL_CPU
 from .register import QlRegisterManager
 from .utils import QlArchUtils
@@ -120,6 +122,41 @@ class QlArch(ABC):
 
         pass
 
+    @cached_property
+    def decoder(self) -> QlArchDecoder:
+        """Decoded instructions cache.
+        """
+
+        return QlArchDecoder(self.ql)
+
+    def decode(self, address: int, *, detail: bool = False, md: Optional[Cs] = None) -> Optional[CsInsn]:
+        """Decode a single instruction. Decoded instructions are cached, so decoding the same
+        instruction again does not require disassembling it.
+
+        Args:
+            address: instruction address
+            detail: whether detailed instruction info is required
+            md: disassembler to use, or `None` to use the disassembler bound to arch
+
+        Returns: decoded instruction, or `None` if it could not be read or decoded
+        """
+
+        return self.decoder.decode(address, detail=detail, md=md)
+
+    def decode_lite(self, address: int, *, md: Optional[Cs] = None) -> Optional[InsnLite]:
+        """Decode a single instruction, when detailed info is not required. Decoded instructions
+        are cached, so decoding the same instruction again does not require disassembling it.
+
+        Args:
+            address: instruction address
+            md: disassembler to use, or `None` to use the disassembler bound to arch
+
+        Returns: a tuple of instruction address, size, mnemonic and operands, or `None` if it
+        could not be read or decoded
+        """
+
+        return self.decoder.decode_lite(address, md=md)
+
     @property
     @abstractmethod
     def assembler(self) -> Ks:
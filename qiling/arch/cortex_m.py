@@ -3,6 +3,8 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
+import struct
+
 from functools import cached_property
 from contextlib import ContextDecorator
 from typing import Optional
@@ -23,14 +25,20 @@ from qiling.extensions.multitask import MultiTaskUnicorn
 
 
 class QlInterruptContext(ContextDecorator):
+    # basic exception frame, from the lowest address up
+    frame = struct.Struct('<8I')
+
     def __init__(self, ql: Qiling):
         self.ql = ql
-        self.reg_context = ['xpsr', 'pc', 'lr', 'r12', 'r3', 'r2', 'r1', 'r0']
+        self.reg_context = ['r0', 'r1', 'r2', 'r3', 'r12', 'lr', 'pc', 'xpsr']
 
     def __enter__(self):
-        for reg in self.reg_context:
-            val = self.ql.arch.regs.read(reg)
-            self.ql.arch.stack_push(val)
+        regs = self.ql.arch.regs
+
+        # stack the whole frame with a single memory write
+        sp = regs.arch_sp - self.frame.size
+        self.ql.mem.write(sp, self.frame.pack(*regs.read_batch(self.reg_context)))
+        regs.arch_sp = sp
 
         if self.ql.verbose >= QL_VERBOSE.DISASM:
             self.ql.log.info(f'Enter into interrupt')
@@ -42,23 +50,25 @@ class QlInterruptContext(ContextDecorator):
             self.ql.stop()
 
         else:
+            regs = self.ql.arch.regs
+
             # Exit handler mode
-            self.ql.arch.regs.write('ipsr', 0)
+            regs.write('ipsr', 0)
 
             # switch the stack accroding exc_return
-            old_ctrl = self.ql.arch.regs.read('control')
+            old_ctrl = regs.read('control')
             if retval & EXC_RETURN.RETURN_SP:
-                self.ql.arch.regs.write('control', old_ctrl | CONTROL.SPSEL)
+                regs.write('control', old_ctrl | CONTROL.SPSEL)
             else:
-                self.ql.arch.regs.write('control', old_ctrl & ~CONTROL.SPSEL)
+                regs.write('control', old_ctrl & ~CONTROL.SPSEL)
 
             # Restore stack
-            for reg in reversed(self.reg_context):
-                val = self.ql.arch.stack_pop()
-                if reg == 'xpsr':
-                    self.ql.arch.regs.write('XPSR_NZCVQG', val)
-                else:
-                    self.ql.arch.regs.write(reg, val)
+            sp = regs.arch_sp
+            values = self.frame.unpack(self.ql.mem.read(sp, self.frame.size))
+            names = self.reg_context[:-1] + ['XPSR_NZCVQG']
+
+            regs.write_batch(zip(names, values))
+            regs.arch_sp = sp + self.frame.size
 
         if self.ql.verbose >= QL_VERBOSE.DISASM:
             self.ql.log.info('Exit from interrupt')
@@ -165,8 +175,6 @@ class QlArchCORTEX_M(QlArchARM):
             entry = ql.mem.read_ptr(offset)
             exc_return = 0xFFFFFFFD if self.using_psp() else 0xFFFFFFF9
 
-            self.regs.write('ipsr', isr)
-            self.regs.write('pc', entry)
-            self.regs.write('lr', exc_return)
+            self.regs.write_batch((('ipsr', isr), ('pc', entry), ('lr', exc_return)))
 
             self.uc.emu_start(self.effective_pc, 0, 0, 0xffffff)
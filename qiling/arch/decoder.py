@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Union
+
+from capstone import Cs, CsInsn
+from unicorn import UcError, UC_PROT_WRITE
+
+from qiling.const import QL_ARCH
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+# capstone light disassembly result: address, size, mnemonic and operands
+InsnLite = Tuple[int, int, str, str]
+
+# cached entry: the instruction bytes, the decoding result and whether the entry may be
+# used without checking the instruction bytes in memory first
+Entry = Tuple[bytes, Union[CsInsn, InsnLite, None], bool]
+
+# entry kinds, as different decoding flavors may be requested for the same address
+KIND_LITE = 0
+KIND_INSN = 1
+KIND_DETAIL = 2
+
+# longest instruction encoding, per architecture
+MAX_INSN_SIZE = {
+    QL_ARCH.A8086: 15,
+    QL_ARCH.X86:   15,
+    QL_ARCH.X8664: 15
+}
+
+
+class QlArchDecoder:
+    """Decoded instructions cache.
+
+    Instructions are cached by their address and the disassembler mode they were decoded
+    in, along with their bytes. Instructions that reside in non-writable memory can only be
+    modified on the host side, which invalidates their cache entries, so they are used as-is.
+    Instructions that reside in writable memory may be modified by the emulated code at any
+    time, so their bytes are compared against memory before their cache entries are used.
+    """
+
+    def __init__(self, ql: Qiling):
+        self.ql = ql
+
+        self.pagesize = ql.mem.pagesize
+        self.maxsize = MAX_INSN_SIZE.get(ql.arch.type, 4)
+
+        # cached entries, by containing page
+        self.__pages: Dict[int, Dict[Tuple[int, int, int], Entry]] = {}
+
+        # memory permissions of cached pages, or None for memory that should not be cached
+        self.__perms: Dict[int, Optional[int]] = {}
+
+        ql.mem.observers.append(self.__on_host_change)
+
+    def __on_host_change(self, address: int, size: int) -> None:
+        # drop entries of instructions that might overlap the modified range
+        lbound = (address - self.maxsize + 1) & ~(self.pagesize - 1)
+
+        for page in range(lbound, address + size, self.pagesize):
+            self.__pages.pop(page, None)
+            self.__perms.pop(page, None)
+
+    def __page_perms(self, page: int) -> Optional[int]:
+        if page not in self.__perms:
+            # mmio ranges are not cached, since reading them has side effects
+            self.__perms[page] = next((perms for lbound, ubound, perms, _, is_mmio in self.ql.mem.map_info if lbound <= page < ubound and not is_mmio), None)
+
+        return self.__perms[page]
+
+    def __read(self, address: int) -> Optional[bytes]:
+        size = self.maxsize
+
+        try:
+            data = self.ql.mem.read(address, size)
+        except UcError:
+            # the instruction might be located right before an unmapped page
+            size = min(size, self.pagesize - (address & (self.pagesize - 1)))
+
+            try:
+                data = self.ql.mem.read(address, size)
+            except UcError:
+                return None
+
+        return bytes(data)
+
+    def __decode(self, address: int, md: Cs, kind: int):
+        page = address & ~(self.pagesize - 1)
+        key = (address, md.mode, kind)
+
+        entries = self.__pages.get(page)
+        entry = entries.get(key) if entries else None
+
+        if entry and entry[2]:
+            return entry[1]
+
+        data = self.__read(address)
+
+        if data is None:
+            return None
+
+        if entry and data.startswith(entry[0]):
+            return entry[1]
+
+        if kind == KIND_LITE:
+            insn = next(md.disasm_lite(data, address, 1), None)
+
+        else:
+            # capstone requires the disassembler to have its details enabled also when instruction
+            # details are accessed, so it is left that way
+            if kind == KIND_DETAIL:
+                md.detail = True
+
+            insn = next(md.disasm(data, address, 1), None)
+
+        code = data if insn is None else data[:insn[1] if kind == KIND_LITE else insn.size]
+
+        perms = self.__page_perms(page)
+
+        if perms is not None:
+            # the instruction might cross a page boundary, in which case both pages are considered
+            last = (address + len(code) - 1) & ~(self.pagesize - 1)
+            last_perms = perms if last == page else self.__page_perms(last)
+
+            stable = last_perms is not None and not ((perms | last_perms) & UC_PROT_WRITE)
+
+            self.__pages.setdefault(page, {})[key] = (code, insn, stable)
+
+        return insn
+
+    def decode(self, address: int, *, detail: bool = False, md: Optional[Cs] = None) -> Optional[CsInsn]:
+        """Decode a single instruction.
+
+        Args:
+            address: instruction address
+            detail: whether detailed instruction info is required
+            md: disassembler to use, or `None` to use the disassembler bound to arch
+
+        Returns: decoded instruction, or `None` if it could not be read or decoded
+        """
+
+        return self.__decode(address, md or self.ql.arch.disassembler, KIND_DETAIL if detail else KIND_INSN)
+
+    def decode_lite(self, address: int, *, md: Optional[Cs] = None) -> Optional[InsnLite]:
+        """Decode a single instruction, when detailed info is not required.
+
+        Args:
+            address: instruction address
+            md: disassembler to use, or `None` to use the disassembler bound to arch
+
+        Returns: a tuple of instruction address, size, mnemonic and operands, or `None` if it
+        could not be read or decoded
+        """
+
+        return self.__decode(address, md or self.ql.arch.disassembler, KIND_LITE)
+
+    def clear(self) -> None:
+        """Discard all cached entries.
+        """
+
+        self.__pages.clear()
+        self.__perms.clear()
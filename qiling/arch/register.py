@@ -3,7 +3,7 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
-from typing import Any, Mapping, MutableMapping, Union
+from typing import Any, Iterable, Mapping, MutableMapping, Sequence, Tuple, Union
 
 from unicorn import Uc
 
@@ -68,6 +68,22 @@ class QlRegisterManager:
 
         return self.uc.reg_write(register, value)
 
+    def read_batch(self, registers: Sequence[Union[str, int]]) -> Tuple:
+        """Read several register values at once.
+        """
+
+        regs = [self.register_mapping[reg.lower()] if isinstance(reg, str) else reg for reg in registers]
+
+        return self.uc.reg_read_batch(regs)
+
+    def write_batch(self, values: Iterable[Tuple[Union[str, int], int]]) -> None:
+        """Write several register values at once.
+        """
+
+        regs = [(self.register_mapping[reg.lower()] if isinstance(reg, str) else reg, val) for reg, val in values]
+
+        self.uc.reg_write_batch(regs)
+
     def save(self) -> MutableMapping[str, Any]:
         """Save CPU context.
         """
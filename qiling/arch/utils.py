@@ -98,6 +98,33 @@ class QlArchUtils:
                 self._block_hook = self.ql.hook_block(ql_hook_block_disasm)
 
 
+# registers holding the return address on entry to a function, for architectures that do not
+# keep it on the stack
+RETADDR_REGS = {
+    QL_ARCH.ARM     : 'lr',
+    QL_ARCH.ARM64   : 'lr',
+    QL_ARCH.MIPS    : 'ra',
+    QL_ARCH.RISCV   : 'ra',
+    QL_ARCH.RISCV64 : 'ra',
+    QL_ARCH.PPC     : 'lr'
+}
+
+
+def call_site(ql: Qiling) -> int:
+    """Get the return address of the function that is currently being called, which is where
+    the call came from. Meaningful only on function entry, e.g. from within an OS API hook.
+    """
+
+    arch = ql.arch
+
+    if arch.type in (QL_ARCH.X86, QL_ARCH.X8664):
+        return arch.stack_read(0)
+
+    reg = RETADDR_REGS.get(arch.type)
+
+    return 0 if reg is None else arch.regs.read(reg)
+
+
 # used by qltool prior to ql instantiation. to get an assembler object
 # after ql instantiation, use the appropriate ql.arch method
 def assembler(arch: QL_ARCH, endianness: QL_ENDIAN, is_thumb: bool) -> Ks:
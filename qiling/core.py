@@ -443,6 +443,8 @@ class Qiling(QlCoreHooks, QlCoreStructs):
               - "gdb:0.0.0.0:1234" : gdb which listens on 0.0.0.0:1234
               - "qdb": enable qdb.
               - "qdb:rr": enable qdb with reverse debugging support.
+              - "qdb:rr=0x10000000": enable qdb with reverse debugging support, limiting
+                the memory used for recording to the specified amount of bytes.
 
             Example: ql.debugger = True
                      ql.debugger = "qdb"
@@ -18,8 +18,8 @@ import socket
 import re
 import tempfile
 from functools import partial
-from logging import Logger
-from typing import IO, Iterator, MutableMapping, Optional, Union
+from logging import DEBUG, Logger
+from typing import IO, Iterator, List, MutableMapping, Optional, Union
 
 from unicorn import UcError
 from unicorn.unicorn_const import (
@@ -56,6 +56,9 @@ SIGCHLD = 16
 SIGCONT = 17
 SIGSTOP = 18
 
+# maximal packet size the server accepts; this allows reading and writing memory in large chunks
+PACKET_SIZE = 0x20000
+
 # common replies
 REPLY_ACK = b'+'
 REPLY_EMPTY = b''
@@ -169,6 +172,64 @@ class QlGdb(QlDebugger):
 
             return int.from_bytes(raw, 'big')
 
+        # registers values as hex strings, cached per stop. gdb clients query registers over and over
+        # while the emulation is stopped, so the cache is invalidated only when emulation is resumed
+        # or registers are modified
+        regs_cache: Optional[List[str]] = None
+
+        def __get_regs_values() -> List[str]:
+            nonlocal regs_cache
+
+            if regs_cache is None:
+                regs_cache = [__get_reg_value(*entry) for entry in self.regsmap]
+
+            return regs_cache
+
+        def __invalidate_regs() -> None:
+            nonlocal regs_cache
+
+            regs_cache = None
+
+        # whether the client expects binary memory reads to be prefixed
+        binary_upload = False
+
+        def __read_mem(addr: int, size: int) -> Optional[bytes]:
+            """Read target memory. If the range is partially mapped, only the contiguous mapped
+            part of it that starts at the specified address is read.
+
+            Returns: memory content, or `None` if no memory is mapped at the specified address
+            """
+
+            try:
+                return bytes(self.ql.mem.read(addr, size))
+            except UcError:
+                pass
+
+            end = addr
+
+            for lbound, ubound, *_ in self.ql.mem.map_info:
+                if lbound <= end < ubound:
+                    end = ubound
+
+            if end == addr:
+                return None
+
+            return bytes(self.ql.mem.read(addr, min(end - addr, size)))
+
+        def __memory_map() -> str:
+            """Generate an xml memory map of the target from its mapped memory ranges.
+
+            @see: https://sourceware.org/gdb/current/onlinedocs/gdb/Memory-Map-Format.html
+            """
+
+            return '\r\n'.join((
+                '<?xml version="1.0"?>',
+                '<!DOCTYPE memory-map PUBLIC "+//IDN gnu.org//DTD GDB Memory Map V1.0//EN" "http://sourceware.org/gdb/gdb-memory-map.dtd">',
+                '<memory-map>',
+                *(f'<memory type="ram" start="{lbound:#x}" length="{ubound - lbound:#x}"/>' for lbound, ubound, *_ in self.ql.mem.map_info),
+                '</memory-map>'
+            ))
+
         def handle_exclaim(subcmd: str) -> Reply:
             return REPLY_OK
 
@@ -209,7 +270,7 @@ class QlGdb(QlDebugger):
                 """
 
                 regnum = __get_reg_idx(ucreg)
-                hexval = __get_reg_value(*self.regsmap[regnum])
+                hexval = __get_regs_values()[regnum]
 
                 return f'{regnum:02x}:{hexval};'
 
@@ -223,6 +284,8 @@ class QlGdb(QlDebugger):
             return f'T{SIGTRAP:02x}{bp_info}{sp_info}{pc_info}'
 
         def handle_c(subcmd: str) -> Reply:
+            __invalidate_regs()
+
             try:
                 self.gdb.resume_emu()
             except UcError as err:
@@ -268,11 +331,13 @@ class QlGdb(QlDebugger):
             #
             # see: ./xml/arm/arm-fpa.xml
 
-            return ''.join(__get_reg_value(*entry) for entry in self.regsmap)
+            return ''.join(__get_regs_values())
 
         def handle_G(subcmd: str) -> Reply:
             data = subcmd
 
+            __invalidate_regs()
+
             for reg, pos, nibbles in self.regsmap:
                 hexval = data[pos : pos + nibbles]
 
@@ -300,12 +365,12 @@ class QlGdb(QlDebugger):
 
             addr, size = (int(p, 16) for p in subcmd.split(','))
 
-            try:
-                data = self.ql.mem.read(addr, size)
-            except UcError as ex:
-                return f'E{ex.errno:02d}'
-            else:
-                return data.hex()
+            data = __read_mem(addr, size)
+
+            if data is None:
+                return 'E14'
+
+            return data.hex()
 
         def handle_M(subcmd: str) -> Reply:
             """Write target memory.
@@ -315,9 +380,11 @@ class QlGdb(QlDebugger):
             size, data = data.split(':')
 
             addr = int(addr, 16)
+            size = int(size, 16)
             data = bytes.fromhex(data)
 
-            assert len(data) == size
+            if len(data) != size:
+                return 'E00'
 
             try:
                 self.ql.mem.write(addr, data)
@@ -332,7 +399,10 @@ class QlGdb(QlDebugger):
 
             idx = int(subcmd, 16)
 
-            return __get_reg_value(*self.regsmap[idx])
+            if idx < len(self.regsmap):
+                return __get_regs_values()[idx]
+
+            return 'E00'
 
         def handle_P(subcmd: str) -> Reply:
             """Write register value by index.
@@ -342,6 +412,7 @@ class QlGdb(QlDebugger):
             idx = int(idx, 16)
 
             if idx < len(self.regsmap):
+                __invalidate_regs()
                 __set_reg_value(*self.regsmap[idx], hexval=data)
 
                 return REPLY_OK
@@ -377,6 +448,8 @@ class QlGdb(QlDebugger):
             return REPLY_OK
 
         def handle_q(subcmd: str) -> Reply:
+            nonlocal binary_upload
+
             query, *data = subcmd.split(':')
 
             # qSupported command
@@ -384,8 +457,13 @@ class QlGdb(QlDebugger):
             # @see: https://sourceware.org/gdb/onlinedocs/gdb/General-Query-Packets.html#qSupported
 
             if query == 'Supported':
+                # gdb clients that support binary memory reads expect the data to be prefixed with 'b'
+                # while others (e.g. lldb) expect raw data
+                binary_upload = bool(data) and 'binary-upload+' in data[0].split(';')
+
                 # list of supported features excluding the multithreading-related ones
                 features = [
+                    f'PacketSize={PACKET_SIZE:x}',
                     'BreakpointCommands+',
                     'ConditionalBreakpoints+',
                     'ConditionalTracepoints+',
@@ -405,6 +483,7 @@ class QlGdb(QlDebugger):
                     'TraceStateVariables+',
                     'TracepointSource+',
                     # 'augmented-libraries-svr4-read+',
+                    'binary-upload+',
                     'exec-events+',
                     'fork-events+',
                     'hwbreak+',
@@ -412,6 +491,7 @@ class QlGdb(QlDebugger):
                     'no-resumed+',
                     'qXfer:features:read+',
                     # 'qXfer:libraries-svr4:read+',
+                    'qXfer:memory-map:read+',
                     # 'qXfer:osdata:read+',
                     'qXfer:siginfo:read+',
                     'qXfer:siginfo:write+',
@@ -425,7 +505,6 @@ class QlGdb(QlDebugger):
                 # might or might not need for multi thread
                 if self.ql.multithread:
                     features += [
-                        'PacketSize=47ff',
                         'FastTracepoints+',
                         'QThreadEvents+',
                         'Qbtrace-conf:bts:size+',
@@ -440,7 +519,6 @@ class QlGdb(QlDebugger):
 
                 else:
                     features += [
-                        'PacketSize=3fff',
                         'qXfer:spu:read+',
                         'qXfer:spu:write+'
                     ]
@@ -480,6 +558,11 @@ class QlGdb(QlDebugger):
 
                     return f'{"l" if len(content) < length else "m"}{content}'
 
+                elif feature == 'memory-map' and op == 'read':
+                    content = __memory_map()[offset:offset + length]
+
+                    return f'{"l" if len(content) < length else "m"}{content}'
+
                 elif feature == 'threads' and op == 'read':
                     content = '\r\n'.join((
                         '<threads>',
@@ -678,6 +761,8 @@ class QlGdb(QlDebugger):
             """Perform a single step.
             """
 
+            __invalidate_regs()
+
             self.gdb.resume_emu(steps=1)
 
             # if emulation has been stopped, signal program termination
@@ -687,6 +772,23 @@ class QlGdb(QlDebugger):
             # otherwise, this is just single stepping
             return f'S{SIGTRAP:02x}'
 
+        def handle_x(subcmd: str) -> Reply:
+            """Read target memory, in binary form.
+            """
+
+            addr, size = (int(p, 16) for p in subcmd.split(','))
+
+            # lldb probes for binary reads support with a zero-length read
+            if size == 0 and not binary_upload:
+                return REPLY_OK
+
+            data = __read_mem(addr, size)
+
+            if data is None:
+                return 'E14'
+
+            return b'b' + data if binary_upload else data
+
         def handle_X(subcmd: str) -> Reply:
             """Write data to memory.
             """
@@ -757,6 +859,7 @@ class QlGdb(QlDebugger):
             'Q': handle_Q,
             's': handle_s,
             'v': handle_v,
+            'x': handle_x,
             'X': handle_X,
             'Z': handle_Z,
             'z': handle_z
@@ -789,7 +892,7 @@ class GdbSerialConn:
     """
 
     # default recieve buffer size
-    BUFSIZE = 4096
+    BUFSIZE = PACKET_SIZE
 
     def __init__(self, ipaddr: str, port: int, logger: Logger) -> None:
         """Create a new gdb serial connection handler.
@@ -843,31 +946,34 @@ class GdbSerialConn:
 
             buffer += incoming
 
-            # discard incoming acks
-            if buffer.startswith(REPLY_ACK):
-                del buffer[0]
+            # the buffer may hold more than one packet
+            while True:
+                # discard incoming acks
+                while buffer.startswith(REPLY_ACK):
+                    del buffer[0]
 
-            packet = pattern.match(buffer)
+                packet = pattern.match(buffer)
 
-            # if there is no match, the rest of the packet might be missing
-            if not packet:
-                continue
+                # if there is no match, the rest of the packet might be missing
+                if not packet:
+                    break
 
-            data = packet['data']
-            read_csum = int(packet['checksum'], 16)
-            calc_csum = GdbSerialConn.checksum(data)
+                data = packet['data']
+                read_csum = int(packet['checksum'], 16)
+                calc_csum = GdbSerialConn.checksum(data)
 
-            if read_csum != calc_csum:
-                raise IOError(f'checksum error: expected {calc_csum:02x} but got {read_csum:02x}')
+                if read_csum != calc_csum:
+                    raise IOError(f'checksum error: expected {calc_csum:02x} but got {read_csum:02x}')
 
-            # follow gdbserver debug output format
-            self.log.debug(f'getpkt ("{GdbSerialConn.__printable_prefix(data).decode(ENCODING)}");')
+                # follow gdbserver debug output format
+                if self.log.isEnabledFor(DEBUG):
+                    self.log.debug(f'getpkt ("{GdbSerialConn.__printable_prefix(data).decode(ENCODING)}");')
 
-            data = GdbSerialConn.rle_decode(data)
-            data = GdbSerialConn.unescape(data)
+                data = GdbSerialConn.rle_decode(data)
+                data = GdbSerialConn.unescape(data)
 
-            del buffer[:packet.endpos]
-            yield data
+                del buffer[:packet.end()]
+                yield data
 
     def send(self, data: Reply, raw: bool = False) -> None:
         """Send out a packet.
@@ -892,7 +998,8 @@ class GdbSerialConn:
             packet = b'$' + data + b'#' + f'{GdbSerialConn.checksum(data):02x}'.encode()
 
         # follow gdbserver debug output format
-        self.log.debug(f'putpkt ("{GdbSerialConn.__printable_prefix(data).decode(ENCODING)}");')
+        if self.log.isEnabledFor(DEBUG):
+            self.log.debug(f'putpkt ("{GdbSerialConn.__printable_prefix(data).decode(ENCODING)}");')
 
         self.client.sendall(packet)
 
@@ -921,12 +1028,13 @@ class GdbSerialConn:
         """Escape data according to gdb protocol escaping rules.
         """
 
-        def __repl(m: 're.Match[bytes]') -> bytes:
-            ch, *_ = m[0]
-
-            return bytes([ord('}'), ch ^ 0x20])
+        # the escape character is replaced first, so the ones added by the following replacements
+        # are left intact. this is considerably faster than substituting by a regular expression
+        # when sending out large binary packets
+        for ch in b'}*#$':
+            data = data.replace(bytes([ch]), bytes([ord('}'), ch ^ 0x20]))
 
-        return re.sub(br'[*#$}]', __repl, data, flags=re.DOTALL)
+        return data
 
     @staticmethod
     def unescape(data: bytes) -> bytes:
@@ -971,7 +1079,9 @@ class GdbSerialConn:
 
             return __encode_rep(ch, times)
 
-        return re.sub(br'(.)\1{3,96}', __repl, data, flags=re.DOTALL)
+        # runs are repeated from the last decoded character, so a run must not begin with an escaped
+        # character: its escape prefix is decoded along with it
+        return re.sub(br'(?<!})(.)\1{3,96}', __repl, data, flags=re.DOTALL)
 
     @staticmethod
     def rle_decode(data: bytes) -> bytes:
@@ -57,16 +57,9 @@ class Context:
         """Helper function for disassembling.
         """
 
-        insn_bytes = self.read_insn(address) or b''
-        insn = None
+        insn = self.ql.arch.decode(address, detail=detail)
 
-        if insn_bytes:
-            md = self.ql.arch.disassembler
-            md.detail = detail
-
-            insn = next(md.disasm(insn_bytes, address, 1), None)
-
-        return insn or InvalidInsn(insn_bytes, address)
+        return insn or InvalidInsn(self.read_insn(address) or b'', address)
 
     def disasm_lite(self, address: int) -> Tuple[int, int, str, str]:
         """Helper function for light disassembling, when details are not required.
@@ -75,15 +68,7 @@ class Context:
             A tuple of: instruction address, size, mnemonic and operands
         """
 
-        insn_bytes = self.read_insn(address) or b''
-        insn = None
-
-        if insn_bytes:
-            md = self.ql.arch.disassembler
-
-            insn = next(md.disasm_lite(insn_bytes, address, 1), None)
-
-        return insn or tuple()
+        return self.ql.arch.decode_lite(address) or tuple()
 
     def read_mem(self, address: int, size: int) -> bytearray:
         """Read data of a certain size from specified memory location.
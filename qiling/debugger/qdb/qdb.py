@@ -7,7 +7,7 @@ from __future__ import annotations
 
 import sys
 
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 from cmd import Cmd
 from contextlib import contextmanager
 
@@ -61,10 +61,10 @@ class QlQdb(Cmd, QlDebugger):
     The built-in debugger of Qiling Framework
     """
 
-    def __init__(self, ql: Qiling, init_hook: List[str] = [], rr: bool = False, script: str = "") -> None:
+    def __init__(self, ql: Qiling, init_hook: List[str] = [], rr: Union[bool, int] = False, script: str = "") -> None:
         """
         @init_hook: the entry to be paused at
-        @rr: record/replay debugging
+        @rr: record/replay debugging; may also be set to the memory budget of the recorded steps, in bytes
         """
 
         self.ql = ql
@@ -74,7 +74,17 @@ class QlQdb(Cmd, QlDebugger):
         self.bp_list: Dict[int, Breakpoint] = {}
         self.marker = Marker()
 
-        self.rr = SnapshotManager(ql) if rr else None
+        self.rr: Optional[SnapshotManager] = None
+
+        if rr is True:
+            self.rr = SnapshotManager(ql)
+
+        elif rr is not False:
+            if rr <= 0:
+                raise ValueError(f'rr memory budget has to be positive, got {rr}')
+
+            self.rr = SnapshotManager(ql, rr)
+
         self.helper = setup_command_helper(ql)
         self.predictor = setup_branch_predictor(ql)
         self.render = setup_context_render(ql, self.predictor)
@@ -604,14 +614,13 @@ class QlQdb(Cmd, QlDebugger):
                 qdb_print(QDB_MSG.INFO, '')
 
                 # ram diff
-                if recent.ram:
-                    for rng, (opcode, diff) in sorted(recent.ram.items()):
-                        lbound, ubound = rng
-                        perms, label, data = diff
+                if recent.layout is not None:
+                    qdb_print(QDB_MSG.INFO, 'Memory layout changed')
 
-                        qdb_print(QDB_MSG.INFO, f'{opcode.name} {lbound:010x} - {ubound:010x} {perms:03b} {label:24s} ~{len(data)}')
+                for page in sorted(recent.pages):
+                    qdb_print(QDB_MSG.INFO, f'{page:010x} - {page + self.rr.pagesize:010x}')
 
-                else:
+                if recent.layout is None and not recent.pages:
                     qdb_print(QDB_MSG.INFO, 'Memory identical')
 
             else:
@@ -5,10 +5,13 @@
 
 from __future__ import annotations
 
-from enum import Enum
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Mapping, Optional, Tuple, Type, TypeVar, Union
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple, Type
+
+from unicorn import UcError
 
 from qiling.const import QL_ARCH
+from qiling.extensions.snapshot import QlPageTracker
 
 from .render import (
     ContextRender,
@@ -36,10 +39,6 @@ if TYPE_CHECKING:
     from .qdb import QlQdb
 
 
-_K = TypeVar('_K')
-_V = TypeVar('_V')
-
-
 def qdb_print(level: QDB_MSG, msg: str) -> None:
     """Log printing.
     """
@@ -135,222 +134,227 @@ def setup_context_render(ql: Qiling, predictor: BranchPredictor) -> ContextRende
     return r(ql, predictor)
 
 
-class MemDiff(Enum):
-    ADD = '+'
-    REM = '-'
-    MOD = '*'
-
-
-RamKey = Tuple[int, int]
-RamVal = Tuple[int, str, bytes]
+# tuple: range start, range end, permissions mask, range label
+RamRange = Tuple[int, int, int, str]
 
-RamDiffKey = Tuple[int, int]
-RamDiffVal = Tuple[MemDiff, Tuple[int, str, Union[bytes, Tuple]]]
+# default amount of memory recorded steps may occupy, in bytes
+RR_BUDGET = 256 * 1024 * 1024
 
 
-class DiffedState:
+class UndoRecord:
     """
-    internal container for storing diffed state
+    internal container for storing the state a single recorded step has overwritten
     """
 
-    def __init__(self, reg, xreg, ram, loader):
+    def __init__(self, reg, xreg, pages, layout, loader):
+        # registers values prior to the step, only of those that got changed
         self.reg: Dict[str, int] = reg
         self.xreg: Dict[str, int] = xreg
-        self.ram: Dict[RamDiffKey, RamDiffVal] = ram
-        self.loader: Dict[str, Any] = loader
 
+        # original content of the memory pages that got modified by the step
+        self.pages: Dict[int, bytes] = pages
 
-class State:
-    """
-    internal container for storing raw state from qiling
+        # memory layout and loader state prior to the step, only if they got changed
+        self.layout: Optional[List[RamRange]] = layout
+        self.loader: Optional[Mapping[str, Any]] = loader
+
+    @property
+    def size(self) -> int:
+        """Amount of memory content held by this record, in bytes.
+        """
+
+        return sum(len(data) for data in self.pages.values())
+
+
+class SnapshotManager:
+    """Record/replay undo log.
+
+    Every recorded step keeps only what it has overwritten: the values of the registers
+    it changed and the original content of the memory pages it modified. Pages are saved
+    on their first write, either by the emulated code or by the host through the memory
+    manager, so both recording a step and stepping backwards cost in proportion to the
+    changes made rather than to the amount of mapped memory.
+
+    Once the recorded steps exceed the memory budget, the oldest ones are discarded. The
+    most recent step is always kept.
     """
 
-    def __init__(self, saved: Mapping[str, Mapping]):
-        self.reg: Dict[str, int] = saved.get("reg") or {}
-        self.xreg: Dict[str, int] = saved.get("cpr") or saved.get("msr") or {}
+    def __init__(self, ql: Qiling, budget: int = RR_BUDGET):
+        self.ql = ql
+        self.budget = budget
+        self.layers: Deque[UndoRecord] = deque()
 
-        mem = saved.get("mem") or {}
-        ram = mem.get("ram") or []
+        # amount of memory content held by the recorded steps
+        self.size = 0
 
-        # saved ram lists might not match in order, we turn them into dicts to work around
-        # that. in these dicts every memory content is mapped to its memory entry's properties
-        self.ram: Dict[RamKey, RamVal] = {(lbound, ubound): (perms, label, data) for lbound, ubound, perms, label, data in ram}
+        self.pagesize = ql.mem.pagesize
+        self.tracker = QlPageTracker(ql, self.__save_page)
 
-        self.loader: Dict[str, Any] = saved.get('loader') or {}
+        # state of the step that is being recorded
+        self.__reg: Dict[str, int] = {}
+        self.__xreg: Dict[str, int] = {}
+        self.__loader: Mapping[str, Any] = {}
+        self.__layout: List[RamRange] = []
+        self.__pages: Dict[int, bytes] = {}
 
-    @staticmethod
-    def __dict_diff(d0: Mapping[_K, _V], d1: Mapping[_K, _V]) -> Dict[_K, _V]:
-        return {k: v for k, v in d0.items() if v != d1.get(k)}
+    def __ram_layout(self) -> List[RamRange]:
+        return [(lbound, ubound, perms, label) for lbound, ubound, perms, label, is_mmio in self.ql.mem.map_info if not is_mmio]
 
-    def _diff_reg(self, other: State) -> Dict[str, int]:
-        return State.__dict_diff(self.reg, other.reg)
+    def __save_xreg(self) -> Dict[str, int]:
+        if self.ql.arch.type in (QL_ARCH.ARM, QL_ARCH.ARM64):
+            return self.ql.arch.cpr.save()
 
-    def _diff_xreg(self, other: State) -> Dict[str, int]:
-        return State.__dict_diff(self.xreg, other.xreg)
+        return {}
 
-    def _diff_ram(self, other: State) -> Dict[RamDiffKey, RamDiffVal]:
-        ram0 = self.ram
-        ram1 = other.ram
+    @staticmethod
+    def __subtract(ranges: List[Tuple[int, int]], others: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Get the parts of ranges that are not covered by any of the others. Both lists
+        are expected to be sorted.
+        """
+
+        result = []
 
-        ram_diff: Dict[RamDiffKey, RamDiffVal] = {}
+        for lbound, ubound in ranges:
+            for olbound, oubound in others:
+                if olbound >= ubound:
+                    break
 
-        removed  = [rng for rng in ram0 if rng not in ram1]
-        added    = [rng for rng in ram1 if rng not in ram0]
-        modified = [rng for rng in ram0 if rng in ram1 and ram0[rng] != ram1[rng]]
+                if oubound <= lbound:
+                    continue
 
-        # memory regions that got removed should be re-added
-        for rng in removed:
-            ram_diff[rng] = (MemDiff.ADD, ram0[rng])
+                if olbound > lbound:
+                    result.append((lbound, olbound))
 
-        # memory regions that got added should be removed
-        for rng in added:
-            _, label, _ = ram1[rng]
+                lbound = oubound
 
-            # though we discard data as it is not required anymore, label is still required
-            # to determine the method of removing the region: brk, mmap, or ordinary map
-            ram_diff[rng] = (MemDiff.REM, (-1, label, b''))
+                if lbound >= ubound:
+                    break
 
-        # memory regions that fot modified should be reverted back
-        for rng in modified:
-            perms0, label0, data0 = ram0[rng]
-            perms1, label1, data1 = ram1[rng]
+            if lbound < ubound:
+                result.append((lbound, ubound))
 
-            perms = -1 if perms0 == perms1 else perms0
+        return result
 
-            assert label0 == label1, 'memory region label changed unexpectedly'
-            assert len(data0) == len(data1), 'memory contents differ in size'
+    def __save_page(self, page: int) -> None:
+        try:
+            self.__pages[page] = bytes(self.ql.uc.mem_read(page, self.pagesize))
+        except UcError:
+            # page is not mapped
+            pass
 
-            # scan both data chunks and keep the index and byte value of the unmatched ones.
-            # if memory contents are identical, this will result in an empty tuple
-            data_diff = tuple((i, b0) for i, (b0, b1) in enumerate(zip(data0, data1)) if b0 != b1)
+    def begin(self) -> None:
+        """Start recording a step.
+        """
 
-            ram_diff[rng] = (MemDiff.MOD, (perms, label0, data_diff))
+        ql = self.ql
 
-        # <DEBUG>
-        # for rng, (opcode, diff) in sorted(ram_diff.items()):
-        #     lbound, ubound = rng
-        #     perms, label, data = diff
-        #
-        #     print(f'{opcode.name} {lbound:010x} - {ubound:010x} {perms:03b} {label:24s} ~{len(data)}')
-        # </DEBUG>
+        self.__reg = ql.arch.regs.save()
+        self.__xreg = self.__save_xreg()
+        self.__loader = ql.loader.save()
+        self.__layout = self.__ram_layout()
+        self.__pages = {}
 
-        return ram_diff
+        # only the first write to each page costs a callback, where its original content is
+        # saved. ranges that get mapped during the step have no content to restore, so only
+        # the ones that are already mapped are tracked
+        self.tracker.track([(lbound, ubound, perms) for lbound, ubound, perms, _ in self.__layout])
 
-    def diff(self, other: State) -> DiffedState:
-        """Diff between previous and current state.
+    def end(self) -> None:
+        """Stop recording a step and add it to the undo log.
         """
 
-        return DiffedState(
-            self._diff_reg(other),
-            self._diff_xreg(other),
-            self._diff_ram(other),
-            self.loader
-        )
+        ql = self.ql
 
+        self.tracker.untrack()
 
-class SnapshotManager:
-    """Differential snapshot object.
-    """
+        reg = ql.arch.regs.save()
+        xreg = self.__save_xreg()
+        loader = ql.loader.save()
+        layout = self.__ram_layout()
 
-    def __init__(self, ql: Qiling):
-        self.ql = ql
-        self.layers: List[DiffedState] = []
+        record = UndoRecord(
+            {k: v for k, v in self.__reg.items() if v != reg.get(k)},
+            {k: v for k, v in self.__xreg.items() if v != xreg.get(k)},
+            self.__pages,
+            None if layout == self.__layout else self.__layout,
+            None if loader == self.__loader else self.__loader
+        )
 
-    def save(self) -> State:
-        """
-        acquire current State by wrapping saved context from ql.save()
-        """
+        self.__pages = {}
+
+        self.layers.append(record)
+        self.size += record.size
 
-        return State(self.ql.save(reg=True, mem=True, loader=True))
+        # discard oldest steps till the undo log fits into the budget
+        while self.size > self.budget and len(self.layers) > 1:
+            self.size -= self.layers.popleft().size
 
     @staticmethod
     def snapshot(func: Callable) -> Callable:
         """
-        decorator function for saving differential context on certian qdb command
+        decorator function for recording certian qdb command as a step
         """
 
         def magic(self: QlQdb, *args, **kwargs):
             if self.rr:
-                # save State before execution
-                before = self.rr.save()
-
-                # certian execution to be snapshot
-                func(self, *args, **kwargs)
+                self.rr.begin()
 
-                # save State after execution
-                after = self.rr.save()
-
-                # merge two saved States into a DiffedState
-                self.rr.layers.append(before.diff(after))
+                try:
+                    func(self, *args, **kwargs)
+                finally:
+                    self.rr.end()
             else:
                 func(self, *args, **kwargs)
 
         return magic
 
-    def restore(self):
-        """
-        helper function for restoring running state from an existing incremental snapshot
+    def __restore_layout(self, layout: List[RamRange]) -> None:
+        """Unmap ranges that were mapped during the step, map back the ones that were
+        unmapped and revert permissions changes.
         """
 
-        prev_st = self.layers.pop()  # DiffedState
-        curr_st = self.save()        # State, expected to be identical to 'after' State in snapshot method
+        mem = self.ql.mem
+        saved = [(lbound, ubound) for lbound, ubound, _, _ in layout]
 
-        curr_st.reg.update(prev_st.reg)
-        curr_st.xreg.update(prev_st.xreg)
+        current = [(lbound, ubound) for lbound, ubound, _, _ in self.__ram_layout()]
 
-        if prev_st.ram:
-            diff_ram = prev_st.ram
-            curr_ram = curr_st.ram
+        for lbound, ubound in self.__subtract(current, saved):
+            mem.unmap_between(lbound, ubound)
 
-            # we must begin by removing unwanted memory regions, otherwise we would not be able to
-            # add new ones in case they overlap. here we iterate over the diff dictionary but handle
-            # only remove opcodes
-            for rng, (opcode, props) in diff_ram.items():
-                lbound, ubound = rng
-                size = ubound - lbound
+        current = [(lbound, ubound) for lbound, ubound, _, _ in self.__ram_layout()]
 
-                if opcode is MemDiff.REM:
-                    # NOTE: it doesn't seem like distinguishing between brk, mmap, mmap annonymous
-                    # and regular maps is actually required
-                    self.ql.mem.unmap(lbound, size)
+        # content of unmapped ranges is restored along with the rest of the modified pages
+        for lbound, ubound, perms, label in layout:
+            for gap_lbound, gap_ubound in self.__subtract([(lbound, ubound)], current):
+                mem.map(gap_lbound, gap_ubound - gap_lbound, perms, label)
 
-            # doind a second pass, but this time handling add and modify opcodes
-            for rng, (opcode, props) in diff_ram.items():
-                lbound, ubound = rng
-                perms, label, data = props
-                size = ubound - lbound
+        current_layout = set(self.__ram_layout())
 
-                if opcode is MemDiff.ADD:
-                    # TODO: distinguish between brk, mmap, mmap annonymous and regular maps
+        for lbound, ubound, perms, label in layout:
+            if (lbound, ubound, perms, label) not in current_layout:
+                mem.protect(lbound, ubound - lbound, perms)
 
-                    self.ql.mem.map(lbound, size, perms, label)
-                    self.ql.mem.write(lbound, data)
+    def restore(self) -> None:
+        """
+        helper function for undoing the most recent recorded step
+        """
 
-                elif opcode is MemDiff.MOD:
-                    if perms != -1:
-                        self.ql.mem.protect(lbound, size, perms)
+        ql = self.ql
+        record = self.layers.pop()
 
-                    # is there a diff for this memory range?
-                    if data:
-                        # get current memory content
-                        _, _, curr_data = curr_ram[rng]
-                        curr_data = bytearray(curr_data)
+        self.size -= record.size
 
-                        # patch with existing diff
-                        for i, b in data:
-                            curr_data[i] = b
+        if record.layout is not None:
+            self.__restore_layout(record.layout)
 
-                        # write patched data
-                        self.ql.mem.write(lbound, bytes(curr_data))
+        # written through the memory manager, so cached decoded instructions get invalidated
+        for page, data in record.pages.items():
+            ql.mem.write(page, data)
 
-        self.ql.restore({
-            'reg': curr_st.reg,
+        ql.arch.regs.restore(record.reg)
 
-            # though we have arch-specific context to restore, we want to keep this arch-agnostic.
-            # one way to work around that is to include 'xreg' both as msr (intel) and cpr (arm).
-            # only the relevant one will be picked up while the other one will be discarded
-            'msr': curr_st.xreg,
-            'cpr': curr_st.xreg,
+        if record.xreg:
+            ql.arch.cpr.restore(record.xreg)
 
-            'loader': prev_st.loader
-        })
+        if record.loader is not None:
+            ql.loader.restore(record.loader)
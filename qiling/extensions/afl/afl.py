@@ -2,11 +2,17 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Any, Collection, Optional, Callable
 
-from unicornafl import UcAflError, UC_AFL_RET_CALLED_TWICE, uc_afl_fuzz_custom
+# unicornafl is an optional dependency; its absence is reported only once fuzzing is attempted
+try:
+    from unicornafl import UcAflError, UC_AFL_RET_CALLED_TWICE, uc_afl_fuzz_custom
+except ImportError:
+    pass
+
 from unicorn import UcError, UC_ERR_OK
 
 from qiling import Qiling
 from qiling.exception import QlErrorNotImplemented
+from qiling.extensions.snapshot import QlSnapshot
 
 
 if TYPE_CHECKING:
@@ -24,7 +30,8 @@ def ql_afl_fuzz(ql: Qiling,
                 exits: Collection[int],
                 validate_crash_callback: Optional[CrashValidationCallback] = None,
                 always_validate: bool = False,
-                persistent_iters: int = 1) -> None:
+                persistent_iters: int = 1,
+                restore_state: bool = True) -> None:
     """Fuzz a range of code with afl++.
     This function wraps some common logic with unicornafl.uc_afl_fuzz.
 
@@ -52,6 +59,11 @@ def ql_afl_fuzz(ql: Qiling,
         persistent_iters:       Reuse the same process for this many fuzzing iterations before forking
                                 a new child process (default: 1)
 
+        restore_state:          in persistent mode, roll back to the emulation state captured when fuzzing
+                                started before every iteration, so iterations do not affect each other.
+                                only the state that was modified by the previous iteration is restored
+                                (default: True)
+
     Raises:
         UcAflError: If something wrong happens with the fuzzer.
     """
@@ -81,7 +93,8 @@ def ql_afl_fuzz(ql: Qiling,
         exits,
         validate_crash_callback or __null_crash_validation,
         always_validate,
-        persistent_iters)
+        persistent_iters,
+        restore_state)
 
 
 def ql_afl_fuzz_custom(ql: Qiling,
@@ -91,9 +104,17 @@ def ql_afl_fuzz_custom(ql: Qiling,
                        exits: Collection[int],
                        validate_crash_callback: CrashValidationCallback,
                        always_validate: bool = False,
-                       persistent_iters: int = 1):
+                       persistent_iters: int = 1,
+                       restore_state: bool = True):
+
+    # capture the state to roll back to between persistent iterations. children are forked
+    # off with the snapshot already in place, so it needs to be captured only once
+    snapshot = QlSnapshot(ql) if restore_state and persistent_iters > 1 else None
 
     def __place_input_wrapper(uc: Uc, input_bytes: Array[c_char], iters: int, context: Any) -> bool:
+        if snapshot is not None:
+            snapshot.restore()
+
         return place_input_callback(ql, input_bytes.raw, iters)
 
     def __validate_crash_wrapper(uc: Uc, result: int, input_bytes: bytes, iters: int, context: Any) -> bool:
@@ -128,3 +149,7 @@ def ql_afl_fuzz_custom(ql: Qiling,
             #
             # For other exceptions, we raise them.
             raise
+
+    finally:
+        if snapshot is not None:
+            snapshot.remove()
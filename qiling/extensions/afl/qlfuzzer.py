@@ -59,7 +59,7 @@ class QlFuzzer(ABC):
         for address in crashes:
             self.ql.hook_address(__crash, address)
 
-    def __install_kickoff_hook(self, infilename: str, entry: int, exits: Collection[int]) -> None:
+    def __install_kickoff_hook(self, infilename: str, entry: int, exits: Collection[int], persistent_iters: int) -> None:
         def __kickoff(ql: Qiling):
             """Have Unicorn forked and start instrumentation.
             """
@@ -67,7 +67,7 @@ class QlFuzzer(ABC):
             # this is just a one-time hook; remove it
             ko_hook.remove()
 
-            afl.ql_afl_fuzz(ql, infilename, self.feed_input, exits)
+            afl.ql_afl_fuzz(ql, infilename, self.feed_input, exits, persistent_iters=persistent_iters)
 
         # set afl instrumentation [re]starting point
         ko_hook = self.ql.hook_address(__kickoff, entry)
@@ -119,7 +119,7 @@ class QlFuzzer(ABC):
 
         return image.base + offset
 
-    def setup(self, infilename: str, entry: int, exits: Collection[int], crashes: Optional[Collection[int]] = None) -> None:
+    def setup(self, infilename: str, entry: int, exits: Collection[int], crashes: Optional[Collection[int]] = None, persistent_iters: int = 1) -> None:
         """Set up the fuzzing parameters.
 
         Args:
@@ -130,6 +130,8 @@ class QlFuzzer(ABC):
             crashes: simulate a crash on these addresses to make AFL mark it as a successfull case.
             this is useful to mark "fuzzing points of interest" that would be otherwise overlooked
             by AFL since they do not crash the program
+            persistent_iters: number of fuzzing iterations to run in the same process before a new one is
+            forked. emulation state is rolled back to the entry point snapshot between iterations
 
         Notes:
             - starting a fuzzing session without calling this method first will result in a dry-run
@@ -140,7 +142,7 @@ class QlFuzzer(ABC):
             self.__install_crash_hooks(crashes)
 
         # hook the fuzzing entry address to kick-off AFL
-        self.__install_kickoff_hook(infilename, entry, exits)
+        self.__install_kickoff_hook(infilename, entry, exits, persistent_iters)
 
     def run(self, begin: Optional[int] = None) -> None:
         """Start the fuzzing session.
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import struct
+import time
+import zlib
+
+from array import array
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .formats.base import QlBaseCoverage
+from .formats.drcov import QlDrCoverage
+from .formats.edgemap import QlEdgeMapCoverage
+from .formats.ezcov import QlEzCoverage
+from .utils import factory
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+class Module(NamedTuple):
+    path: str
+    build: str
+
+
+class Block(NamedTuple):
+    path: str
+    build: str
+    offset: int
+    size: int
+
+
+# drcov basic block table entry: start offset, size and module id
+DRCOV_BB_ENTRY = struct.Struct('<IHH')
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS modules (
+    id      INTEGER PRIMARY KEY,
+    path    TEXT NOT NULL,
+    build   TEXT NOT NULL,
+    size    INTEGER NOT NULL,
+    UNIQUE (path, build)
+);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT,
+    timestamp   REAL NOT NULL
+);
+
+-- blocks hit by every run, per module
+CREATE TABLE IF NOT EXISTS run_blocks (
+    run     INTEGER NOT NULL,
+    module  INTEGER NOT NULL,
+    count   INTEGER NOT NULL,
+    data    BLOB NOT NULL,
+    PRIMARY KEY (run, module)
+) WITHOUT ROWID;
+
+-- edges taken by every run
+CREATE TABLE IF NOT EXISTS run_edges (
+    run     INTEGER PRIMARY KEY,
+    count   INTEGER NOT NULL,
+    data    BLOB NOT NULL
+);
+
+-- every block ever hit, along with the first run that hit it
+CREATE TABLE IF NOT EXISTS blocks (
+    module  INTEGER NOT NULL,
+    offset  INTEGER NOT NULL,
+    size    INTEGER NOT NULL,
+    run     INTEGER NOT NULL,
+    PRIMARY KEY (module, offset)
+) WITHOUT ROWID;
+
+-- every edge ever taken, along with the first run that took it
+CREATE TABLE IF NOT EXISTS edges (
+    edge    INTEGER PRIMARY KEY,
+    run     INTEGER NOT NULL
+);
+'''
+
+
+def _pack(values: Iterable[int]) -> bytes:
+    """Compress a set of non-negative integers, by delta-encoding their sorted sequence.
+    """
+
+    prev = 0
+    deltas = array('Q')
+
+    for value in sorted(values):
+        deltas.append(value - prev)
+        prev = value
+
+    return zlib.compress(deltas.tobytes())
+
+
+def _unpack(data: bytes) -> Iterator[int]:
+    deltas = array('Q')
+    deltas.frombytes(zlib.decompress(data))
+
+    value = 0
+
+    for delta in deltas:
+        value += delta
+
+        yield value
+
+
+class QlCoverageDatabase:
+    """A coverage store that accumulates the coverage of many runs into a single SQLite
+    database, rather than a file per run.
+
+    Every run records the blocks it hit, per module, and possibly the edges it took. Modules
+    are identified by their path along with a hash of their content, so coverage of different
+    builds is never mixed. Per-run sets are kept compressed; on top of them the database keeps
+    every block and edge ever seen along with the first run that hit it, so union and "first
+    run" queries do not need to go through the runs at all. Other queries stream through runs
+    one at a time, so memory usage is bounded by the size of a single run rather than by the
+    number of runs.
+
+    Example:
+    with QlCoverageDatabase('coverage.db') as db:
+        with db.collect(ql, 'drcov', 'run-1'):
+            ql.run()
+
+        db.export_drcov('merged.cov')
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+        # build hashes, by module path and its modification time
+        self.__builds: Dict[Tuple[str, float], str] = {}
+
+        # known blocks offsets and edges, loaded on demand, so only new ones get inserted. these
+        # are bounded by the union size rather than by the number of runs. other processes may
+        # add runs to the same database, so these are only a hint
+        self.__known_blocks: Dict[int, Set[int]] = {}
+        self.__known_edges: Optional[Set[int]] = None
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    ##################################################
+    # modules
+    ##################################################
+
+    def build_of(self, path: str) -> str:
+        """Calculate the build hash of a module file. Modules that cannot be read from the
+        host filesystem get an empty build hash.
+        """
+
+        try:
+            key = (path, os.path.getmtime(path))
+        except OSError:
+            return ''
+
+        if key not in self.__builds:
+            digest = hashlib.sha1()
+
+            with open(path, 'rb') as infile:
+                for chunk in iter(lambda: infile.read(0x100000), b''):
+                    digest.update(chunk)
+
+            self.__builds[key] = digest.hexdigest()
+
+        return self.__builds[key]
+
+    def __module_id(self, module: Module, size: int) -> int:
+        self.db.execute('INSERT OR IGNORE INTO modules (path, build, size) VALUES (?, ?, ?)', (*module, size))
+
+        return self.db.execute('SELECT id FROM modules WHERE path = ? AND build = ?', module).fetchone()[0]
+
+    def __module_ids(self, path: Optional[str], build: Optional[str]) -> List[int]:
+        query = 'SELECT id FROM modules WHERE (? IS NULL OR path = ?) AND (? IS NULL OR build = ?) ORDER BY id'
+
+        return [mid for mid, in self.db.execute(query, (path, path, build, build))]
+
+    def modules(self) -> List[Module]:
+        """List all modules that have coverage recorded.
+        """
+
+        return [Module(*row) for row in self.db.execute('SELECT path, build FROM modules ORDER BY id')]
+
+    ##################################################
+    # runs
+    ##################################################
+
+    def add_run(self, blocks: Mapping[Tuple[Module, int], Iterable[Tuple[int, int]]], edges: Optional[Iterable[int]] = None, name: Optional[str] = None) -> int:
+        """Record coverage of a single run.
+
+        Args:
+            blocks: a mapping of modules and their sizes, to the offsets and sizes of blocks hit
+            within them
+            edges: indices of edges taken, as hashed by edge coverage maps
+            name: an optional name for the run, e.g. the input file name
+
+        Returns: run id
+        """
+
+        with self.db:
+            run = self.db.execute('INSERT INTO runs (name, timestamp) VALUES (?, ?)', (name, time.time())).lastrowid
+
+            for (module, size), hits in blocks.items():
+                mid = self.__module_id(module, size)
+                sizes = dict(hits)
+
+                self.db.execute('INSERT INTO run_blocks VALUES (?, ?, ?, ?)', (run, mid, len(sizes), _pack(sizes)))
+
+                known = self.__known_blocks.get(mid)
+
+                if known is None:
+                    known = self.__known_blocks[mid] = {offset for offset, in self.db.execute('SELECT offset FROM blocks WHERE module = ?', (mid,))}
+
+                new = sizes.keys() - known
+
+                self.db.executemany('INSERT OR IGNORE INTO blocks VALUES (?, ?, ?, ?)', ((mid, offset, sizes[offset], run) for offset in new))
+                known.update(new)
+
+            if edges is not None:
+                edges = set(edges)
+
+                self.db.execute('INSERT INTO run_edges VALUES (?, ?, ?)', (run, len(edges), _pack(edges)))
+
+                if self.__known_edges is None:
+                    self.__known_edges = {edge for edge, in self.db.execute('SELECT edge FROM edges')}
+
+                new = edges - self.__known_edges
+
+                self.db.executemany('INSERT OR IGNORE INTO edges VALUES (?, ?)', ((edge, run) for edge in new))
+                self.__known_edges.update(new)
+
+        return run
+
+    def add_coverage(self, cov: QlBaseCoverage, name: Optional[str] = None) -> int:
+        """Record coverage collected by a coverage collector.
+
+        Args:
+            cov: a drcov, ezcov or edge map coverage collector
+            name: an optional name for the run
+
+        Returns: run id
+        """
+
+        images = cov.ql.loader.images
+        hits: List[Tuple[int, int, int]]
+        edges = None
+
+        if isinstance(cov, QlDrCoverage):
+            hits = [(bb.mod_id, bb.start, bb.size) for bb in cov.basic_blocks.values()]
+
+        elif isinstance(cov, QlEdgeMapCoverage):
+            offsets, sizes, mod_ids = cov.attribute()
+
+            hits = list(zip(mod_ids.tolist(), offsets.tolist(), sizes.tolist()))
+            edges = cov.bitmap.nonzero()[0].tolist()
+
+        elif isinstance(cov, QlEzCoverage):
+            # ezcov refers to modules by their base names
+            names = {os.path.basename(img.path): i for i, img in reversed(list(enumerate(images)))}
+
+            hits = [(names[bb.mod_id], bb.offset, bb.size) for bb in cov.basic_blocks]
+
+        else:
+            raise TypeError(f'unsupported coverage format: {cov.FORMAT_NAME}')
+
+        blocks: Dict[Tuple[Module, int], List[Tuple[int, int]]] = {}
+        keys = [(Module(img.path, self.build_of(img.path)), img.end - img.base) for img in images]
+
+        for mod_id, offset, size in hits:
+            blocks.setdefault(keys[mod_id], []).append((offset, size))
+
+        return self.add_run(blocks, edges, name)
+
+    @contextmanager
+    def collect(self, ql: Qiling, name: str, run_name: Optional[str] = None):
+        """Context manager for emulating a given piece of code with coverage collection turned
+        on, and recording it as a new run.
+
+        Example:
+        with db.collect(ql, 'drcov', 'input-0001'):
+            ql.run(...)
+        """
+
+        cov = factory.get_coverage_collector(ql, name)
+        cov.activate()
+
+        try:
+            yield cov
+        finally:
+            cov.deactivate()
+            self.add_coverage(cov, run_name)
+
+    def runs(self) -> List[Tuple[int, Optional[str]]]:
+        """List all recorded runs ids and names.
+        """
+
+        return self.db.execute('SELECT id, name FROM runs ORDER BY id').fetchall()
+
+    def run_blocks(self, run: int) -> Iterator[Block]:
+        """Iterate over blocks hit by a specific run.
+        """
+
+        query = '''
+            SELECT m.id, m.path, m.build, r.data FROM run_blocks r
+            JOIN modules m ON m.id = r.module
+            WHERE r.run = ?
+            ORDER BY m.id
+        '''
+
+        for mid, path, build, data in self.db.execute(query, (run,)).fetchall():
+            sizes = self.__block_sizes(mid)
+
+            for offset in _unpack(data):
+                yield Block(path, build, offset, sizes[offset])
+
+    def run_edges(self, run: int) -> List[int]:
+        """Get edges taken by a specific run.
+        """
+
+        row = self.db.execute('SELECT data FROM run_edges WHERE run = ?', (run,)).fetchone()
+
+        return [] if row is None else list(_unpack(row[0]))
+
+    ##################################################
+    # queries
+    ##################################################
+
+    def __block_sizes(self, mid: int) -> Dict[int, int]:
+        """Get sizes of all blocks ever hit within a module, by their offsets.
+        """
+
+        return dict(self.db.execute('SELECT offset, size FROM blocks WHERE module = ?', (mid,)))
+
+    def union(self, path: Optional[str] = None, build: Optional[str] = None) -> Iterator[Block]:
+        """Iterate over blocks hit by any run.
+
+        Args:
+            path: limit results to a specific module
+            build: limit results to a specific build
+        """
+
+        query = '''
+            SELECT m.path, m.build, b.offset, b.size FROM blocks b
+            JOIN modules m ON m.id = b.module
+            WHERE (? IS NULL OR m.path = ?) AND (? IS NULL OR m.build = ?)
+            ORDER BY b.module, b.offset
+        '''
+
+        for row in self.db.execute(query, (path, path, build, build)):
+            yield Block(*row)
+
+    def intersection(self, runs: Optional[Sequence[int]] = None, path: Optional[str] = None, build: Optional[str] = None) -> Iterator[Block]:
+        """Iterate over blocks hit by every one of the specified runs. Runs are visited one
+        at a time, so only the intersection so far is held in memory.
+
+        Args:
+            runs: ids of runs to intersect, or `None` to intersect all runs
+            path: limit results to a specific module
+            build: limit results to a specific build
+        """
+
+        if runs is None:
+            runs = [run for run, _ in self.runs()]
+
+        if not runs:
+            return
+
+        for mid in self.__module_ids(path, build):
+            common: Optional[Set[int]] = None
+
+            for run in runs:
+                row = self.db.execute('SELECT data FROM run_blocks WHERE run = ? AND module = ?', (run, mid)).fetchone()
+
+                # the module was not hit by this run at all
+                if row is None:
+                    common = set()
+                    break
+
+                offsets = _unpack(row[0])
+                common = set(offsets) if common is None else common.intersection(offsets)
+
+                if not common:
+                    break
+
+            if common:
+                mpath, mbuild = self.db.execute('SELECT path, build FROM modules WHERE id = ?', (mid,)).fetchone()
+                sizes = self.__block_sizes(mid)
+
+                for offset in sorted(common):
+                    yield Block(mpath, mbuild, offset, sizes[offset])
+
+    def first_run(self, path: str, offset: int, build: Optional[str] = None) -> Optional[int]:
+        """Find the first run that hit a specific module offset.
+
+        Args:
+            path: module path
+            offset: offset within the module; it does not have to be the beginning of a block
+            build: limit results to a specific build
+
+        Returns: id of the first run that hit a block containing the offset, or `None` if no
+        run hit it
+        """
+
+        query = '''
+            SELECT MIN(b.run) FROM blocks b
+            JOIN modules m ON m.id = b.module
+            WHERE m.path = ? AND (? IS NULL OR m.build = ?)
+            AND b.offset BETWEEN ? - (SELECT MAX(size) FROM blocks) + 1 AND ?
+            AND b.offset + b.size > ?
+        '''
+
+        return self.db.execute(query, (path, build, build, offset, offset, offset)).fetchone()[0]
+
+    def first_run_edge(self, edge: int) -> Optional[int]:
+        """Find the first run that took a specific edge.
+        """
+
+        row = self.db.execute('SELECT run FROM edges WHERE edge = ?', (edge,)).fetchone()
+
+        return row and row[0]
+
+    ##################################################
+    # export
+    ##################################################
+
+    def export_drcov(self, coverage_file: str, runs: Optional[Sequence[int]] = None) -> None:
+        """Export merged coverage in drcov format. Modules are listed with a zero base address,
+        as their load addresses may differ between runs.
+
+        Args:
+            coverage_file: output file path
+            runs: ids of runs whose coverage should be merged, or `None` to merge all runs
+        """
+
+        modules = self.db.execute('SELECT id, path, size FROM modules ORDER BY id').fetchall()
+        mod_index = {mid: i for i, (mid, _, _) in enumerate(modules)}
+
+        def __blocks() -> Iterator[Tuple[int, int, int]]:
+            if runs is None:
+                yield from self.db.execute('SELECT module, offset, size FROM blocks ORDER BY module, offset')
+
+            else:
+                for mid, _, _ in modules:
+                    merged: Set[int] = set()
+
+                    for run in runs:
+                        row = self.db.execute('SELECT data FROM run_blocks WHERE run = ? AND module = ?', (run, mid)).fetchone()
+
+                        if row is not None:
+                            merged.update(_unpack(row[0]))
+
+                    if merged:
+                        sizes = self.__block_sizes(mid)
+
+                        for offset in sorted(merged):
+                            yield mid, offset, sizes[offset]
+
+        # the number of blocks has to appear before the blocks table, so the table is packed
+        # in advance
+        table = bytearray()
+        count = 0
+
+        for mid, offset, size in __blocks():
+            table += DRCOV_BB_ENTRY.pack(offset, size, mod_index[mid])
+            count += 1
+
+        with open(coverage_file, 'wb') as cov:
+            lines = [
+                'DRCOV VERSION: 2',
+                'DRCOV FLAVOR: drcov',
+                f'Module Table: version 2, count {len(modules)}',
+                'Columns: id, base, end, entry, checksum, timestamp, path',
+                *(f'{i}, 0, {size}, 0, 0, 0, {path}' for i, (_, path, size) in enumerate(modules)),
+                f'BB Table: {count} bbs'
+            ]
+
+            cov.write(''.join(f'{line}\n' for line in lines).encode())
+            cov.write(table)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Set, Tuple
+
+# numpy is an optional dependency; its absence is reported only once this coverage format is used
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from qiling.exception import QlErrorNotImplemented
+
+from .base import QlBaseCoverage
+
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+    from qiling import Qiling
+
+
+MAP_SIZE = 1 << 16
+
+# drcov basic block table entry layout. see: https://www.ayrx.me/drcov-file-format
+DRCOV_BB_ENTRY = [
+    ('start',  '<u4'),
+    ('size',   '<u2'),
+    ('mod_id', '<u2')
+]
+
+
+class QlEdgeMapCoverage(QlBaseCoverage):
+    """
+    Collects edge coverage into a fixed-size hit-count map, in the spirit of AFL: every edge
+    taken between two basic blocks bumps a saturating counter indexed by a hash of the edge
+    endpoints. Addresses and sizes of executed basic blocks are kept in compact arrays as well.
+
+    Both are backed by NumPy arrays, so coverage of different runs can be compared using
+    vectorized operations rather than by walking through per-block records. Blocks are
+    attributed to their containing images only when coverage is exported.
+
+    The default output is the raw hit-count map; drcov and ezcov outputs are available through
+    `dump_drcov` and `dump_ezcov` respectively.
+    """
+
+    FORMAT_NAME = "edgemap"
+
+    def __init__(self, ql: Qiling, map_size: int = MAP_SIZE):
+        super().__init__(ql)
+
+        if np is None:
+            raise QlErrorNotImplemented('edge map coverage requires numpy to be installed')
+
+        # make sure map size is a power of 2
+        assert map_size & (map_size - 1) == 0, 'map size has to be a power of 2'
+
+        self.map_size = map_size
+        self.bitmap: NDArray[np.uint8] = np.zeros(map_size, dtype=np.uint8)
+
+        # indexing a numpy array from python is considerably slower than indexing a buffer,
+        # so hit counts are updated through a memory view of the map
+        self.__counts = memoryview(self.bitmap)
+
+        self.__addresses: NDArray[np.uint64] = np.empty(0x1000, dtype=np.uint64)
+        self.__sizes: NDArray[np.uint32] = np.empty(0x1000, dtype=np.uint32)
+        self.__nblocks = 0
+        self.__seen: Set[int] = set()
+
+        self.prev = 0
+        self.bb_callback = None
+
+    @property
+    def block_addresses(self) -> NDArray[np.uint64]:
+        """Addresses of executed basic blocks, in order of first execution.
+        """
+
+        return self.__addresses[:self.__nblocks]
+
+    @property
+    def block_sizes(self) -> NDArray[np.uint32]:
+        """Sizes of executed basic blocks, in the same order as `block_addresses`.
+        """
+
+        return self.__sizes[:self.__nblocks]
+
+    def __add_block(self, address: int, size: int) -> None:
+        n = self.__nblocks
+
+        # grow the blocks arrays geometrically
+        if n == len(self.__addresses):
+            self.__addresses = np.resize(self.__addresses, n * 2)
+            self.__sizes = np.resize(self.__sizes, n * 2)
+
+        self.__addresses[n] = address
+        self.__sizes[n] = size
+        self.__nblocks = n + 1
+
+        self.__seen.add(address)
+
+    def block_callback(self, ql: Qiling, address: int, size: int):
+        cur = ((address >> 4) ^ (address << 8)) & (self.map_size - 1)
+        edge = cur ^ self.prev
+
+        count = self.__counts[edge]
+
+        # saturate rather than wrap around
+        if count < 0xff:
+            self.__counts[edge] = count + 1
+
+        # shift the previous location so that A->B and B->A are told apart
+        self.prev = cur >> 1
+
+        if address not in self.__seen:
+            self.__add_block(address, size)
+
+    def activate(self) -> None:
+        self.bb_callback = self.ql.hook_block(self.block_callback)
+
+    def deactivate(self) -> None:
+        if self.bb_callback:
+            self.ql.hook_del(self.bb_callback)
+
+    def reset(self) -> None:
+        """Discard all collected coverage.
+        """
+
+        self.bitmap.fill(0)
+        self.prev = 0
+
+        self.__nblocks = 0
+        self.__seen.clear()
+
+    @property
+    def covered(self) -> int:
+        """Number of edges taken so far.
+        """
+
+        return int(np.count_nonzero(self.bitmap))
+
+    def diff(self, baseline: NDArray[np.uint8]) -> Tuple[NDArray[np.intp], NDArray[np.intp]]:
+        """Compare collected edge coverage against a baseline hit-count map.
+
+        Args:
+            baseline: hit-count map of another run, e.g. a copy of `bitmap` or one that was
+            loaded by `load_bitmap`
+
+        Returns: map indices of edges that were taken only in this run, and of edges that were
+        taken only in the baseline run
+        """
+
+        taken = self.bitmap != 0
+        taken_before = baseline != 0
+
+        return np.flatnonzero(taken & ~taken_before), np.flatnonzero(taken_before & ~taken)
+
+    @staticmethod
+    def load_bitmap(bitmap_file: str) -> NDArray[np.uint8]:
+        """Load a hit-count map previously dumped by `dump_coverage`.
+        """
+
+        return np.fromfile(bitmap_file, dtype=np.uint8)
+
+    def attribute(self) -> Tuple[NDArray[np.uint64], NDArray[np.uint32], NDArray[np.intp]]:
+        """Attribute executed basic blocks to their containing images. Blocks that do not belong
+        to any image are left out.
+
+        Returns: offsets of blocks within their containing images, their sizes and the indices
+        of their containing images
+        """
+
+        images = self.ql.loader.images
+        addresses = self.block_addresses
+
+        if not images:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.intp)
+
+        bases = np.array([img.base for img in images], dtype=np.uint64)
+        ends = np.array([img.end for img in images], dtype=np.uint64)
+        order = np.argsort(bases)
+
+        # locate the image that starts at or below each block, and make sure it also ends above it
+        pos = np.searchsorted(bases[order], addresses, side='right') - 1
+        mod_ids = order[np.maximum(pos, 0)]
+
+        valid = (pos >= 0) & (addresses < ends[mod_ids])
+        mod_ids = mod_ids[valid]
+
+        return addresses[valid] - bases[mod_ids], self.block_sizes[valid], mod_ids
+
+    def dump_coverage(self, coverage_file: str) -> None:
+        """Dump the raw hit-count map.
+        """
+
+        self.bitmap.tofile(coverage_file)
+
+    def dump_drcov(self, coverage_file: str) -> None:
+        """Dump basic blocks coverage in drcov format.
+        """
+
+        images = self.ql.loader.images
+        offsets, sizes, mod_ids = self.attribute()
+
+        entries = np.empty(len(offsets), dtype=DRCOV_BB_ENTRY)
+        entries['start'] = offsets
+        entries['size'] = sizes
+        entries['mod_id'] = mod_ids
+
+        lines = [
+            'DRCOV VERSION: 2',
+            'DRCOV FLAVOR: drcov',
+            f'Module Table: version 2, count {len(images)}',
+            'Columns: id, base, end, entry, checksum, timestamp, path',
+            *(f'{mod_id}, {mod.base}, {mod.end}, 0, 0, 0, {mod.path}' for mod_id, mod in enumerate(images)),
+            f'BB Table: {len(entries)} bbs'
+        ]
+
+        with open(coverage_file, 'wb') as cov:
+            cov.write(''.join(f'{line}\n' for line in lines).encode())
+            cov.write(entries.tobytes())
+
+    def dump_ezcov(self, coverage_file: str) -> None:
+        """Dump basic blocks coverage in ezcov format.
+        """
+
+        names = [os.path.basename(img.path) for img in self.ql.loader.images]
+        offsets, sizes, mod_ids = self.attribute()
+
+        with open(coverage_file, 'w') as cov:
+            cov.write('EZCOV VERSION: 1\n')
+            cov.write('# Qiling EZCOV exporter tool\n')
+
+            cov.writelines(f'{offset:#010x},{size},[ {names[mod_id]} ]\n' for offset, size, mod_id in zip(offsets.tolist(), sizes.tolist(), mod_ids.tolist()))
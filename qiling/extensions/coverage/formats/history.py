@@ -1,33 +1,132 @@
 from __future__ import annotations
-from typing import List, Sequence, Tuple, TYPE_CHECKING, Union, Optional, Any
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING, Union, overload
 
 if TYPE_CHECKING:
     from qiling import Qiling
     from qiling.core_hooks_types import HookRet
-    from capstone import Cs
 
 import re
-from capstone import CsInsn
+from array import array
+from capstone import Cs, CsInsn, CS_ARCH_ARM, CS_MODE_ARM, CS_MODE_BIG_ENDIAN, CS_MODE_THUMB
+
+from qiling.const import QL_ARCH, QL_ENDIAN
+
+
+class HistoryView(Sequence[Optional[CsInsn]]):
+    """A read-only sequence of executed instructions, backed by the compact history record.
+    Instructions are disassembled only when they are accessed. Entries that could not be
+    disassembled are `None`.
+    """
+
+    def __init__(self, history: History) -> None:
+        self.__history = history
+
+    def __len__(self) -> int:
+        return len(self.__history)
+
+    @overload
+    def __getitem__(self, index: int) -> Optional[CsInsn]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Optional[CsInsn]]: ...
+
+    def __getitem__(self, index):
+        history = self.__history
+
+        if isinstance(index, slice):
+            return [history.disasm(history.get_address(i)) for i in range(*index.indices(len(history)))]
+
+        if index < 0:
+            index += len(history)
+
+        if not 0 <= index < len(history):
+            raise IndexError('history index out of range')
+
+        return history.disasm(history.get_address(index))
+
+    def __iter__(self) -> Iterator[Optional[CsInsn]]:
+        return map(self.__history.disasm, self.__history.get_addresses())
 
 
 class History:
-    history_hook_handle: HookRet
-    history: List[CsInsn] = []
-    ql: Qiling
-    md: Cs
-    arm_is_thumb: bool
+    """Records the execution history of the emulated code.
+
+    Only the addresses of executed blocks or instructions are recorded, in a compact array.
+    Instructions are disassembled lazily when the history gets queried, through the decoded
+    instructions cache of the arch. Note that instructions are read from memory at query time,
+    so code that was modified or unmapped since it was executed may not be reflected accurately.
+
+    The history may be limited to a fixed number of most recent entries by setting `maxlen`,
+    in which case it is kept in a ring buffer.
+    """
+
+    history_hook_handle: Optional[HookRet]
 
-    def __init__(self, ql: Qiling) -> None:
+    def __init__(self, ql: Qiling, maxlen: Optional[int] = None) -> None:
         self.ql = ql
-        self.md = self.ql.arch.disassembler
-        self.arm_is_thumb = getattr(ql.arch, 'is_thumb', False)
+        self.maxlen = maxlen
+
+        self.addresses = array('Q')
+        self.__ring_pos = 0
+
+        if maxlen is not None:
+            self.addresses.extend([0] * maxlen)
+
+        # recorded entries count; once the ring buffer wraps around, this stays at maxlen
+        self.__count = 0
+
+        # on arm the thumb mode is recorded in the lsb of every address, as it determines how
+        # the instruction should be disassembled later on
+        self.__arm = ql.arch.type is QL_ARCH.ARM
+        self.__arm_md: Dict[int, Cs] = {}
+
+        self.history_hook_handle = None
         self.track_block_coverage()
 
+    def __len__(self) -> int:
+        return self.__count
+
+    @property
+    def history(self) -> HistoryView:
+        """Executed instructions, from the oldest to the most recent one.
+        """
+
+        return HistoryView(self)
+
+    def get_addresses(self) -> Sequence[int]:
+        """Get recorded addresses, from the oldest to the most recent one. On arm, addresses
+        of thumb instructions have their lsb set.
+        """
+
+        if self.maxlen is None:
+            return self.addresses
+
+        if self.__count < self.maxlen:
+            return self.addresses[:self.__count]
+
+        return self.addresses[self.__ring_pos:] + self.addresses[:self.__ring_pos]
+
+    def get_address(self, index: int) -> int:
+        """Get a recorded address by its index, where 0 is the oldest one. On arm, addresses
+        of thumb instructions have their lsb set.
+        """
+
+        if self.maxlen is None or self.__count < self.maxlen:
+            return self.addresses[index]
+
+        # the ring buffer wrapped around: the oldest entry is the one about to be overwritten
+        return self.addresses[(self.__ring_pos + index) % self.maxlen]
+
     def clear_history(self) -> None:
         """Clears the current state of the history
 
         """
-        self.history.clear()
+
+        if self.maxlen is None:
+            del self.addresses[:]
+
+        self.__ring_pos = 0
+        self.__count = 0
 
     def clear_hooks(self) -> None:
         """Clears the current history hook from the Qiling instance
@@ -36,29 +135,64 @@ class History:
             None
         """
 
-        self.ql.hook_del(self.history_hook_handle)
+        if self.history_hook_handle is not None:
+            self.ql.hook_del(self.history_hook_handle)
+            self.history_hook_handle = None
+
+    def __record(self, address: int) -> None:
+        if self.maxlen is None:
+            self.addresses.append(address)
+            self.__count += 1
+
+        else:
+            pos = self.__ring_pos
+
+            self.addresses[pos] = address
+            self.__ring_pos = (pos + 1) % self.maxlen
 
-    def __hook_block(self, ql: Qiling, address: int, size: int) -> Any:
+            if self.__count < self.maxlen:
+                self.__count += 1
+
+    def __hook_block(self, ql: Qiling, address: int, size: int) -> None:
         '''
-        The unicorn block/instruction hook function for the track_block_coverage and track_instruction_coverage functions. This just give us a way to append capstone objects to the history list
+        The unicorn block/instruction hook function for the track_block_coverage and track_instruction_coverage functions.
         '''
 
-        # get the current state of the thumb mode, only applys to arm
-        # originally we were going to access the ql.arch.disassembler directly for all architectures from in this callback, but in the
-        # implementation for arch.arm.disassembler, the capstone instance is recreated every time (to make sure THUMB mode is properly dealt with)
-        if self.arm_is_thumb is not getattr(ql.arch, "is_thumb", False):
-            # the thumb mode has changed, so we need to update the disassembler
-            self.arm_is_thumb = not self.arm_is_thumb
-            self.md = self.ql.arch.disassembler
-
-        # 0x10 is way more than enough bytes to grab a single instruction
-        ins_bytes = ql.mem.read(address, 0x10)
-        try:
-            self.history.append(next(self.md.disasm(ins_bytes, address)))
-        except StopIteration:
-            # if this ever happens, then the unicorn/qiling is going to crash because it tried to execute
-            # an instruction that it cant, so we are just not going to do anything
-            pass
+        if self.__arm:
+            address |= int(ql.arch.is_thumb)
+
+        self.__record(address)
+
+    def __disassembler(self, address: int) -> Cs:
+        if self.__arm:
+            mode = CS_MODE_THUMB if address & 1 else CS_MODE_ARM
+
+            if self.ql.arch.endian is QL_ENDIAN.EB:
+                mode += CS_MODE_BIG_ENDIAN
+
+            if mode not in self.__arm_md:
+                self.__arm_md[mode] = Cs(CS_ARCH_ARM, mode)
+
+            return self.__arm_md[mode]
+
+        return self.ql.arch.disassembler
+
+    def disasm(self, address: int) -> Optional[CsInsn]:
+        """Disassemble a recorded instruction.
+
+        Args:
+            address: recorded address, as returned by `get_addresses`
+
+        Returns: the disassembled instruction, or `None` if it could not be disassembled
+        """
+
+        md = self.__disassembler(address)
+
+        pc = address & ~1 if self.__arm else address
+
+        # if the instruction could not be disassembled, then the unicorn/qiling is going to crash because it
+        # tried to execute an instruction that it cant, so there is nothing to show for it
+        return self.ql.arch.decode(pc, md=md)
 
     def track_block_coverage(self) -> None:
         """Configures the history plugin to track all of the basic blocks that are executed. Removes any existing hooks
@@ -66,8 +200,8 @@ class History:
         Returns:
             None
         """
-        if getattr(self, 'history_hook_handle', None):
-            self.clear_hooks()
+
+        self.clear_hooks()
 
         self.history_hook_handle = self.ql.hook_block(self.__hook_block)
 
@@ -77,11 +211,21 @@ class History:
         Returns:
             None
         """
-        if getattr(self, 'history_hook_handle', None):
-            self.clear_hooks()
+
+        self.clear_hooks()
 
         self.history_hook_handle = self.ql.hook_code(self.__hook_block)
 
+    def __filter(self, libs: Union[str, Sequence[str]], inside: bool) -> List[CsInsn]:
+        executable_maps = [(start, end) for start, end, *_ in self.get_regex_matching_exec_maps(libs)]
+
+        def __in_maps(address: int) -> bool:
+            return any(start <= address <= end for start, end in executable_maps)
+
+        insns = (self.disasm(address) for address in self.get_addresses() if __in_maps(address & ~1 if self.__arm else address) == inside)
+
+        return [insn for insn in insns if insn is not None]
+
     def get_ins_only_lib(self, libs: Union[str, Sequence[str]]) -> List[CsInsn]:
         """Returns a list of addresses that have been executed that are only in mmaps for objects that match the regex of items in the list
 
@@ -95,9 +239,7 @@ class History:
             >>> history.get_ins_only_lib([".*libc.so.*", ".*libpthread.so.*"])
         """
 
-        executable_maps = self.get_regex_matching_exec_maps(libs)
-
-        return [x for x in self.history if any(start <= x.address <= end for start, end, _, _, _ in executable_maps)]
+        return self.__filter(libs, True)
 
     def get_ins_exclude_lib(self, libs: Union[str, Sequence[str]]) -> List[CsInsn]:
         '''Returns a list of history instructions that are not in the libraries that match the regex in the libs list
@@ -112,8 +254,7 @@ class History:
             >>> history.get_ins_exclude_lib([".*libc.so.*", ".*libpthread.so.*"])
         '''
 
-        executable_maps = self.get_regex_matching_exec_maps(libs)
-        return [h for h in self.history if not any(start <= h.address <= end for start, end, _, _, _ in executable_maps)]
+        return self.__filter(libs, False)
 
     def get_mem_map_from_addr(self, ins: Union[int, CsInsn]) -> Optional[Tuple[int, int, str, str, str]]:
         '''Returns the memory map that contains the instruction
@@ -0,0 +1,7 @@
+from .channel import QlChannelStream, QlInputChannel
+from .cmplog import QlCmpLog
+from .corpus import QlCorpus, QlCorpusEntry
+from .coverage import QlEdgeCoverage
+from .engine import QlFuzzEngine
+from .mutator import QlMutator
+from .triage import QlStdinFuzzer, QlTriage
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+import ctypes
+import io
+import mmap
+import os
+import stat
+import time
+
+from typing import TYPE_CHECKING, List, Optional
+
+from unicorn import UC_PROT_READ
+
+from qiling.os.posix.const import NR_OPEN
+from qiling.os.posix.filestruct import ql_socket
+from qiling.os.posix.stat import StatBase
+from qiling.os.posix.syscall.socket import ql_syscall_recv, ql_syscall_recvfrom
+from qiling.os.posix.syscall.unistd import ql_syscall_read
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+class QlChannelStream:
+    """A read-only stream over the fuzzing input channel. Every new input rewinds it.
+    """
+
+    def __init__(self, channel: QlInputChannel, fd: int, name: str = '[fuzz input]'):
+        self.channel = channel
+        self.pos = 0
+
+        self.__fd = fd
+        self.__name = name
+        self.__closed = False
+
+    def read(self, size: int = -1) -> bytes:
+        lbound = min(self.pos, self.channel.length)
+        ubound = self.channel.length if size < 0 else min(lbound + size, self.channel.length)
+
+        self.pos = ubound
+
+        return self.channel.buffer[lbound:ubound]
+
+    def readline(self, end: bytes = b'\n') -> bytes:
+        lbound = min(self.pos, self.channel.length)
+        ubound = self.channel.buffer.find(end, lbound, self.channel.length)
+
+        return self.read(-1 if ubound == -1 else ubound + len(end) - lbound)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {
+            io.SEEK_SET: 0,
+            io.SEEK_CUR: self.pos,
+            io.SEEK_END: self.channel.length
+        }[whence]
+
+        if base + offset < 0:
+            raise OSError('invalid seek offset')
+
+        self.pos = base + offset
+
+        return self.pos
+
+    def lseek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        raise OSError('fuzzing input channel is read-only')
+
+    def fileno(self) -> int:
+        return self.__fd
+
+    def fstat(self) -> StatBase:
+        now = int(time.time())
+        size = self.channel.length
+
+        fields = (stat.S_IFREG | 0o444, 0, 0, 1, 0, 0, size, now, now, now)
+        extra = {
+            'st_atime_ns' : now * 1000000000,
+            'st_mtime_ns' : now * 1000000000,
+            'st_ctime_ns' : now * 1000000000,
+            'st_blksize'  : 4096,
+            'st_blocks'   : (size + 511) // 512,
+            'st_rdev'     : 0
+        }
+
+        return StatBase(os.stat_result(fields, extra))
+
+    def close(self) -> None:
+        self.__closed = True
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    def rewind(self) -> None:
+        self.pos = 0
+        self.__closed = False
+
+
+class QlInputChannel:
+    """A fuzzing input channel: a host buffer mapped straight into the emulated memory.
+
+    Since the emulated memory range is backed by the host buffer, placing a new input does not
+    involve any emulated memory writes; inputs are copied once into the buffer, or may be
+    generated in-place through `view`, after which only their length is updated. The channel
+    may be consumed by the emulated program directly at `address`, or bound to stdin, a file
+    descriptor, a file path or socket receives.
+
+    The buffer is private to the process, so fuzzing processes forked off after the channel
+    was created do not clobber each other inputs. The channel has to be created before a
+    snapshot is captured, since snapshots do not recreate memory ranges backed by host memory.
+    """
+
+    def __init__(self, ql: Qiling, size: int = 0x100000, address: Optional[int] = None, info: str = '[fuzz input]'):
+        """Create a fuzzing input channel.
+
+        Args:
+            ql: qiling instance
+            size: channel capacity, in bytes; rounded up to page size
+            address: emulated address to map the channel at; if not set, a free range is picked
+            info: emulated memory range label
+        """
+
+        self.ql = ql
+        self.size = ql.mem.align_up(size)
+
+        # anonymous memory is private on platforms that support it, and shared otherwise
+        if hasattr(mmap, 'MAP_PRIVATE'):
+            self.buffer = mmap.mmap(-1, self.size, flags=mmap.MAP_PRIVATE)
+        else:
+            self.buffer = mmap.mmap(-1, self.size)
+
+        self.view = memoryview(self.buffer)
+
+        if address is None:
+            address = ql.mem.find_free_space(self.size)
+
+        # the emulated program is not supposed to modify its input, so the range is kept read-only.
+        # that also keeps it out of snapshot dirty pages tracking
+        ptr = ctypes.addressof(ctypes.c_char.from_buffer(self.buffer))
+        ql.mem.map(address, self.size, UC_PROT_READ, info, ptr=ptr)
+
+        self.address = address
+        self.length = 0
+
+        self.streams: List[QlChannelStream] = []
+
+    def set_length(self, length: int) -> None:
+        """Publish an input that was generated in-place.
+
+        Args:
+            length: input length, in bytes
+        """
+
+        assert 0 <= length <= self.size, 'input length exceeds channel capacity'
+
+        self.length = length
+
+        for stream in self.streams:
+            stream.rewind()
+
+    def feed(self, data: bytes) -> int:
+        """Place a new input in the channel. Inputs that exceed the channel capacity are truncated.
+
+        Args:
+            data: input to place
+
+        Returns: number of bytes placed
+        """
+
+        length = min(len(data), self.size)
+
+        self.view[:length] = data[:length]
+        self.set_length(length)
+
+        return length
+
+    @property
+    def data(self) -> memoryview:
+        """Current input.
+        """
+
+        return self.view[:self.length]
+
+    def stream(self, fd: int = -1, name: str = '[fuzz input]') -> QlChannelStream:
+        """Create a stream that reads the current input.
+        """
+
+        stream = QlChannelStream(self, fd, name)
+        self.streams.append(stream)
+
+        return stream
+
+    def bind_stdin(self) -> None:
+        """Feed the current input through stdin.
+        """
+
+        self.ql.os.stdin = self.stream(0, '[stdin]')
+
+    def bind_fd(self, fd: int) -> None:
+        """Feed the current input through an arbitrary file descriptor.
+        """
+
+        self.ql.os.fd[fd] = self.stream(fd)
+
+    def bind_file(self, path: str) -> None:
+        """Feed the current input through a file. Every time the file is opened, reading starts
+        over from the beginning of the input.
+
+        Args:
+            path: virtual path of the file
+        """
+
+        # every open yields a fresh stream, so there is no need to track it for rewinding
+        def __open() -> QlChannelStream:
+            return QlChannelStream(self, -1, path)
+
+        self.ql.add_fs_mapper(path, __open)
+
+    def bind_socket(self, fd: Optional[int] = None) -> None:
+        """Feed the current input through socket receives. Receives on other sockets are handled
+        as usual.
+
+        Args:
+            fd: socket file descriptor to feed, or `None` to feed all sockets
+        """
+
+        stream = self.stream()
+
+        def __is_bound(ql: Qiling, sockfd: int) -> bool:
+            # leave out-of-range descriptors to the original handlers, which fail them with EBADF
+            if sockfd not in range(NR_OPEN):
+                return False
+
+            return (fd is None or sockfd == fd) and isinstance(ql.os.fd[sockfd], ql_socket)
+
+        def __serve(ql: Qiling, buf: int, length: int) -> int:
+            data = stream.read(length)
+            ql.mem.write(buf, data)
+
+            return len(data)
+
+        def __recv(ql: Qiling, sockfd: int, buf: int, length: int, flags: int):
+            if __is_bound(ql, sockfd):
+                return __serve(ql, buf, length)
+
+            return ql_syscall_recv(ql, sockfd, buf, length, flags)
+
+        def __recvfrom(ql: Qiling, sockfd: int, buf: int, length: int, flags: int, addr: int, addrlen: int):
+            if __is_bound(ql, sockfd):
+                return __serve(ql, buf, length)
+
+            return ql_syscall_recvfrom(ql, sockfd, buf, length, flags, addr, addrlen)
+
+        def __read(ql: Qiling, rfd: int, buf: int, length: int):
+            if __is_bound(ql, rfd):
+                return __serve(ql, buf, length)
+
+            return ql_syscall_read(ql, rfd, buf, length)
+
+        self.ql.os.set_syscall('recv', __recv)
+        self.ql.os.set_syscall('recvfrom', __recvfrom)
+        self.ql.os.set_syscall('read', __read)
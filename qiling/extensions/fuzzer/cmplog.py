@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+from array import array
+from typing import TYPE_CHECKING, Iterator, List, Mapping, Optional, Set, Tuple
+
+from unicorn import UC_HOOK_TCG_OPCODE, UC_TCG_OP_SUB, UC_TCG_OP_FLAG_CMP, UcError
+
+from qiling.arch.utils import call_site
+from qiling.const import QL_INTERCEPT
+from qiling.os.const import POINTER, SIZE_T
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+    from qiling.core_hooks_types import HookRet
+
+
+# number of comparison sites the table can tell apart
+CMP_MAP_W = 1 << 12
+
+# number of operand pairs kept per comparison site; newer ones overwrite older ones
+CMP_MAP_H = 8
+
+# maximal operand length, in bytes
+CMP_OPERAND_MAX = 32
+
+# comparison kinds
+CMP_TYPE_INS = 1    # compare instruction; operands are integers
+CMP_TYPE_RTN = 2    # compare routine; operands are byte strings
+
+# compare routines argument layouts
+RTN_STR  = 0    # two null-terminated strings
+RTN_STRN = 1    # two null-terminated strings, bounded by a length argument
+RTN_MEM  = 2    # two buffers of a given length
+RTN_WSTR = 3    # two null-terminated wide strings
+
+ROUTINES: Mapping[str, int] = {
+    'strcmp'      : RTN_STR,
+    'strcasecmp'  : RTN_STR,
+    'strncmp'     : RTN_STRN,
+    'strncasecmp' : RTN_STRN,
+    'memcmp'      : RTN_MEM,
+    'bcmp'        : RTN_MEM,
+    '_stricmp'    : RTN_STR,
+    '_strnicmp'   : RTN_STRN,
+    'wcscmp'      : RTN_WSTR,
+    'lstrcmpA'    : RTN_STR,
+    'lstrcmpiA'   : RTN_STR,
+    'lstrcmpW'    : RTN_WSTR,
+    'lstrcmpiW'   : RTN_WSTR
+}
+
+
+class QlCmpLog:
+    """Comparison operands logger, in the spirit of AFL++ CmpLog.
+
+    Operands of compare instructions and compare routines are recorded into a compact table that
+    is indexed by the comparison site. The fuzzer may then locate one operand within the input that
+    led to the comparison and replace it with the other one (input-to-state replacement), to get
+    past magic values checks that edge coverage alone cannot solve.
+
+    Compare instructions are caught using Unicorn TCG opcode hooks, which cover the architectures
+    whose translators mark compares (e.g. x86 and arm64). Compare routines are caught on entry,
+    either by name using the OS API hooking facility or by address for statically linked code.
+    """
+
+    def __init__(self, ql: Qiling):
+        self.ql = ql
+
+        # per-site comparison kind and number of logged operand pairs
+        self.kinds = bytearray(CMP_MAP_W)
+        self.hits = array('I', bytes(CMP_MAP_W * 4))
+
+        # operand pairs, along with their lengths
+        self.lengths = bytearray(CMP_MAP_W * CMP_MAP_H * 2)
+        self.operands = bytearray(CMP_MAP_W * CMP_MAP_H * 2 * CMP_OPERAND_MAX)
+
+        # sites logged during the current run
+        self.touched: List[int] = []
+
+        self.hook: Optional[int] = None
+        self.routine_hooks: List[HookRet] = []
+
+    @staticmethod
+    def __slot(address: int) -> int:
+        return ((address >> 4) ^ (address << 8)) & (CMP_MAP_W - 1)
+
+    def log(self, address: int, kind: int, op1: bytes, op2: bytes) -> None:
+        """Record a pair of compared operands.
+
+        Args:
+            address: comparison site
+            kind: comparison kind, either `CMP_TYPE_INS` or `CMP_TYPE_RTN`
+            op1: first operand
+            op2: second operand
+        """
+
+        slot = self.__slot(address)
+        hits = self.hits[slot]
+
+        if not hits:
+            self.touched.append(slot)
+
+        self.kinds[slot] = kind
+        self.hits[slot] = hits + 1
+
+        idx = (slot * CMP_MAP_H + hits % CMP_MAP_H) * 2
+
+        op1 = op1[:CMP_OPERAND_MAX]
+        op2 = op2[:CMP_OPERAND_MAX]
+
+        self.lengths[idx] = len(op1)
+        self.lengths[idx + 1] = len(op2)
+
+        base = idx * CMP_OPERAND_MAX
+
+        self.operands[base:base + len(op1)] = op1
+        self.operands[base + CMP_OPERAND_MAX:base + CMP_OPERAND_MAX + len(op2)] = op2
+
+    def __on_cmp(self, uc, address: int, arg1: int, arg2: int, size: int, user_data) -> None:
+        # operands may arrive sign-extended beyond the comparison width
+        mask = (1 << size) - 1
+
+        arg1 &= mask
+        arg2 &= mask
+
+        # equal operands already satisfy the comparison; there is nothing to learn from them
+        if arg1 == arg2:
+            return
+
+        nbytes = size // 8
+
+        self.log(address, CMP_TYPE_INS, arg1.to_bytes(nbytes, 'little'), arg2.to_bytes(nbytes, 'little'))
+
+    def __read_str(self, ptr: int, limit: int, charsize: int = 1) -> bytes:
+        """Read a null-terminated string, tolerating strings that run into unmapped memory.
+        """
+
+        try:
+            data = self.ql.mem.read(ptr, limit)
+        except UcError:
+            data = bytearray()
+
+            for offset in range(limit):
+                try:
+                    data += self.ql.mem.read(ptr + offset, 1)
+                except UcError:
+                    break
+
+        for i in range(0, len(data) - charsize + 1, charsize):
+            if not any(data[i:i + charsize]):
+                return bytes(data[:i])
+
+        return bytes(data)
+
+    def __on_routine(self, layout: int) -> None:
+        ptr1, ptr2, length = self.ql.os.fcall.readParams((POINTER, POINTER, SIZE_T))
+
+        if layout == RTN_MEM:
+            size = min(length, CMP_OPERAND_MAX)
+
+            try:
+                op1 = bytes(self.ql.mem.read(ptr1, size))
+                op2 = bytes(self.ql.mem.read(ptr2, size))
+            except UcError:
+                return
+
+        else:
+            limit = CMP_OPERAND_MAX
+
+            if layout == RTN_STRN:
+                limit = min(length, limit)
+
+            charsize = 2 if layout == RTN_WSTR else 1
+
+            op1 = self.__read_str(ptr1, limit, charsize)
+            op2 = self.__read_str(ptr2, limit, charsize)
+
+        if op1 != op2:
+            self.log(call_site(self.ql), CMP_TYPE_RTN, op1, op2)
+
+    def hook_routines(self, routines: Mapping[str, int] = ROUTINES) -> None:
+        """Log operands of compare routines that are resolved by name.
+
+        Args:
+            routines: a mapping of routine names to their arguments layout
+        """
+
+        for name, layout in routines.items():
+            # on-enter hooks signature differs among operating systems; ignore the arguments
+            def __onenter(ql: Qiling, *args, layout=layout) -> None:
+                self.__on_routine(layout)
+
+            self.ql.os.set_api(name, __onenter, QL_INTERCEPT.ENTER)
+
+    def hook_routine(self, address: int, name: str) -> None:
+        """Log operands of a compare routine found at a specific address. This is useful for
+        statically linked code, where routines cannot be resolved by name.
+
+        Args:
+            address: routine entry point
+            name: routine name, as listed in `ROUTINES`
+        """
+
+        layout = ROUTINES[name]
+
+        def __onenter(ql: Qiling) -> None:
+            self.__on_routine(layout)
+
+        self.routine_hooks.append(self.ql.hook_address(__onenter, address))
+
+    def activate(self) -> None:
+        """Start logging compare instructions.
+        """
+
+        if self.hook is None:
+            self.hook = self.ql.arch.uc.hook_add(UC_HOOK_TCG_OPCODE, self.__on_cmp, None, 1, 0, UC_TCG_OP_SUB, UC_TCG_OP_FLAG_CMP)
+
+    def deactivate(self) -> None:
+        if self.hook is not None:
+            self.ql.arch.uc.hook_del(self.hook)
+            self.hook = None
+
+        for hook in self.routine_hooks:
+            hook.remove()
+
+        self.routine_hooks.clear()
+
+    def reset(self) -> None:
+        """Clear the operands logged during the current run.
+        """
+
+        for slot in self.touched:
+            self.hits[slot] = 0
+
+        self.touched.clear()
+
+    def entries(self) -> Iterator[Tuple[int, bytes, bytes]]:
+        """Iterate over the operand pairs logged during the current run.
+
+        Returns: an iterator of comparison kind and operands
+        """
+
+        for slot in self.touched:
+            kind = self.kinds[slot]
+
+            for i in range(min(self.hits[slot], CMP_MAP_H)):
+                idx = (slot * CMP_MAP_H + i) * 2
+                base = idx * CMP_OPERAND_MAX
+
+                op1 = bytes(self.operands[base:base + self.lengths[idx]])
+                op2 = bytes(self.operands[base + CMP_OPERAND_MAX:base + CMP_OPERAND_MAX + self.lengths[idx + 1]])
+
+                yield kind, op1, op2
+
+    @staticmethod
+    def __replacements(kind: int, op1: bytes, op2: bytes) -> Iterator[Tuple[bytes, bytes]]:
+        """Generate pairs of patterns to look for in the input and their replacements.
+        """
+
+        if kind == CMP_TYPE_RTN:
+            yield op1, op2
+            yield op2, op1
+
+            return
+
+        width = len(op1)
+        a = int.from_bytes(op1, 'little')
+        b = int.from_bytes(op2, 'little')
+
+        # input values are often extended before they get compared, so look for them in narrower
+        # widths as well. replacements are also nudged by one to get past ordering comparisons
+        for w in (8, 4, 2, 1):
+            if w > width or max(a, b) >> (w * 8):
+                continue
+
+            mask = (1 << (w * 8)) - 1
+
+            for endian in ('little', 'big'):
+                for pattern, value in ((a, b), (b, a)):
+                    # zero is too common to be located reliably
+                    if not pattern:
+                        continue
+
+                    for repl in (value, value + 1, value - 1):
+                        yield pattern.to_bytes(w, endian), (repl & mask).to_bytes(w, endian)
+
+    def candidates(self, data: bytes, limit: int = 256) -> Iterator[bytes]:
+        """Generate inputs by replacing logged operands found within the input with their
+        counterparts. Operands should be logged for a run of the same input.
+
+        Args:
+            data: input to derive from
+            limit: maximal number of inputs to generate
+
+        Returns: an iterator of generated inputs
+        """
+
+        generated: Set[bytes] = {data}
+
+        for kind, op1, op2 in self.entries():
+            for pattern, repl in self.__replacements(kind, op1, op2):
+                if not pattern:
+                    continue
+
+                pos = data.find(pattern)
+
+                while pos != -1:
+                    candidate = data[:pos] + repl + data[pos + len(pattern):]
+
+                    if candidate not in generated:
+                        generated.add(candidate)
+
+                        yield candidate
+
+                        if len(generated) > limit:
+                            return
+
+                    pos = data.find(pattern, pos + 1)
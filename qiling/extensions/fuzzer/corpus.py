@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import hashlib
+import os
+import random
+import time
+
+from typing import Dict, List, Optional
+
+
+class QlCorpusEntry:
+    """A corpus input along with its scheduling information.
+    """
+
+    __slots__ = ('name', 'data', 'new_edges', 'fuzzed', 'found')
+
+    def __init__(self, name: str, data: bytes, new_edges: int = 0):
+        self.name = name
+        self.data = data
+
+        # number of edges this input was the first to take
+        self.new_edges = new_edges
+
+        # number of times this input was picked for mutation
+        self.fuzzed = 0
+
+        self.found = time.time()
+
+    @property
+    def weight(self) -> float:
+        # favor short inputs that led to new edges and were not picked many times yet
+        return (1 + self.new_edges) / ((1 + self.fuzzed) * (1 + len(self.data) / 1024))
+
+
+class QlCorpus:
+    """Fuzzing corpus, kept in a directory that may be shared by several fuzzing processes.
+    Inputs are named after their content hash, so the same input found by two processes is
+    kept only once.
+    """
+
+    def __init__(self, path: str, seed: Optional[int] = None):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.random = random.Random(seed)
+
+        self.entries: List[QlCorpusEntry] = []
+        self.names: Dict[str, QlCorpusEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def name_of(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    def add(self, data: bytes, new_edges: int = 0) -> QlCorpusEntry:
+        """Add an input to the corpus and store it to the corpus directory.
+        """
+
+        name = self.name_of(data)
+        entry = self.names.get(name)
+
+        if entry is None:
+            entry = QlCorpusEntry(name, data, new_edges)
+
+            path = os.path.join(self.path, name)
+            temp = os.path.join(self.path, f'.{name}.{os.getpid()}')
+
+            # write to a temporary file first so other processes never see a partial input
+            with open(temp, 'wb') as outfile:
+                outfile.write(data)
+
+            os.replace(temp, path)
+
+            self.entries.append(entry)
+            self.names[name] = entry
+
+        return entry
+
+    def sync(self) -> List[QlCorpusEntry]:
+        """Pick up inputs that were added to the corpus directory by others.
+
+        Returns: newly picked up entries
+        """
+
+        found = []
+
+        for name in os.listdir(self.path):
+            if name.startswith('.') or name in self.names:
+                continue
+
+            with open(os.path.join(self.path, name), 'rb') as infile:
+                data = infile.read()
+
+            entry = QlCorpusEntry(name, data)
+
+            self.entries.append(entry)
+            self.names[name] = entry
+
+            found.append(entry)
+
+        return found
+
+    def choose(self) -> QlCorpusEntry:
+        """Pick an input to fuzz next.
+        """
+
+        entry, = self.random.choices(self.entries, weights=[entry.weight for entry in self.entries])
+
+        return entry
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+    from qiling.core_hooks_types import HookRet
+
+
+MAP_SIZE = 1 << 16
+
+
+# hit counts are bucketed, so an edge taken a few more times than before does not
+# count as a new behavior unless it falls into a different bucket
+COUNT_CLASS = bytes(
+    (0, 1, 2, 4)[count] if count < 4 else
+    8  if count < 8  else
+    16 if count < 16 else
+    32 if count < 32 else
+    64 if count < 128 else
+    128 for count in range(256)
+)
+
+
+class QlEdgeCoverage:
+    """Edge coverage collector, in the spirit of AFL: every edge taken between two basic blocks
+    bumps a hit counter in a fixed-size bitmap, indexed by a hash of the edge endpoints.
+    """
+
+    def __init__(self, ql: Qiling, map_size: int = MAP_SIZE):
+        # make sure map size is a power of 2
+        assert map_size & (map_size - 1) == 0, 'map size has to be a power of 2'
+
+        self.ql = ql
+        self.map_size = map_size
+
+        # hit counts of the current run, and the edges it took so far
+        self.trace = bytearray(map_size)
+        self.touched: List[int] = []
+
+        # hit count classes seen so far, per edge
+        self.seen = bytearray(map_size)
+
+        self.prev = 0
+        self.hook: Optional[HookRet] = None
+
+    def __on_block(self, ql: Qiling, address: int, size: int) -> None:
+        cur = ((address >> 4) ^ (address << 8)) & (self.map_size - 1)
+        edge = cur ^ self.prev
+
+        count = self.trace[edge]
+
+        if not count:
+            self.touched.append(edge)
+
+        # saturate rather than wrap around
+        if count < 0xff:
+            self.trace[edge] = count + 1
+
+        # shift the previous location so that A->B and B->A are told apart
+        self.prev = cur >> 1
+
+    def activate(self) -> None:
+        self.hook = self.ql.hook_block(self.__on_block)
+
+    def deactivate(self) -> None:
+        if self.hook is not None:
+            self.hook.remove()
+            self.hook = None
+
+    def reset(self) -> None:
+        """Clear the current run trace.
+        """
+
+        for edge in self.touched:
+            self.trace[edge] = 0
+
+        self.touched.clear()
+        self.prev = 0
+
+    def merge(self, seen: Optional[bytearray] = None) -> Tuple[int, int]:
+        """Merge the current run trace into a map of hit count classes seen so far.
+
+        Args:
+            seen: map to merge into, or `None` to use the coverage map of this collector
+
+        Returns: number of edges that were taken for the first time, and number of edges
+        that were taken a different number of times than before
+        """
+
+        if seen is None:
+            seen = self.seen
+
+        new_edges = 0
+        new_counts = 0
+
+        for edge in self.touched:
+            cls = COUNT_CLASS[self.trace[edge]]
+            prev = seen[edge]
+
+            if cls & ~prev:
+                if prev:
+                    new_counts += 1
+                else:
+                    new_edges += 1
+
+                seen[edge] = prev | cls
+
+        return new_edges, new_counts
+
+    @property
+    def covered(self) -> int:
+        """Number of edges taken so far.
+        """
+
+        return self.map_size - self.seen.count(0)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import random
+import time
+
+from typing import TYPE_CHECKING, Any, Collection, Dict, Iterable, Mapping, Optional, Sequence
+
+from qiling.exception import QlErrorNotImplemented
+from qiling.extensions.fuzzer.cmplog import QlCmpLog
+from qiling.extensions.fuzzer.corpus import QlCorpus
+from qiling.extensions.fuzzer.coverage import MAP_SIZE, QlEdgeCoverage
+from qiling.extensions.fuzzer.mutator import QlMutator
+from qiling.extensions.snapshot import QlSnapshot
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+    from qiling.extensions.afl.qlfuzzer import QlFuzzer
+
+
+class QlFuzzEngine:
+    """Coverage-guided fuzzing engine that runs entirely within Qiling, with no need for AFL++.
+
+    Emulation runs up to the fuzzing entry point once, and then a number of worker processes are
+    forked off. Each worker captures a snapshot there and keeps on feeding the fuzzed program with
+    mutated inputs, rolling back to the snapshot between them. Inputs that lead to new coverage are
+    added to a corpus directory shared by all workers.
+
+    Unless disabled, comparison operands are logged as well. Whenever a corpus input is picked for
+    the first time, logged operands are located within it and replaced with their counterparts to
+    get past magic values checks.
+
+    Working directory layout:
+        queue/          corpus inputs
+        crashes/        unique crashing inputs
+        hangs/          unique inputs that timed out
+        workers/        per-worker status and coverage map
+        fuzzer_stats    overall status, in json format
+        plot_data       coverage growth over time, in csv format
+    """
+
+    def __init__(self, fuzzer: QlFuzzer, workdir: str, entry: int, exits: Collection[int], crashes: Collection[int] = (), *,
+                 seeds: Iterable[bytes] = (), dictionary: Sequence[bytes] = (), workers: int = 1, timeout: int = 1000,
+                 max_len: int = 4096, map_size: int = MAP_SIZE, energy: int = 32, cmplog: bool = True, sync_interval: float = 5.0, status_interval: float = 1.0):
+        """Initialize a fuzzing engine.
+
+        Args:
+            fuzzer: fuzzer instance, whose `feed_input` method is used to place inputs
+            workdir: working directory to store corpus, findings and status in
+            entry: fuzzing entry point. this is where emulation keeps resetting to on each iteration
+            exits: fuzzing exit points. reaching either one of these addresses means the iteration has ended gracefully
+            crashes: addresses that are considered a crash once reached
+            seeds: initial inputs. these are added to the ones already in the corpus directory, if any
+            dictionary: tokens that are meaningful to the fuzzed program
+            workers: number of fuzzing processes to run
+            timeout: iteration time limit, in milliseconds. an iteration that exceeds it is considered a hang
+            max_len: maximal input length
+            map_size: coverage map size; must be a power of 2
+            energy: number of mutated inputs to generate out of a corpus input each time it is picked
+            cmplog: log comparison operands and use them for input-to-state replacement
+            sync_interval: interval, in seconds, of picking up inputs found by other workers
+            status_interval: interval, in seconds, of updating the status files
+        """
+
+        self.fuzzer = fuzzer
+        self.workdir = workdir
+        self.entry = entry
+        self.exits = exits
+        self.crashes = crashes
+        self.seeds = list(seeds)
+        self.dictionary = dictionary
+        self.workers = workers
+        self.timeout = timeout
+        self.max_len = max_len
+        self.map_size = map_size
+        self.energy = energy
+        self.sync_interval = sync_interval
+        self.status_interval = status_interval
+
+        # comparison operands logger. compare routines in statically linked code may be registered
+        # through it before fuzzing starts
+        self.cmplog = QlCmpLog(fuzzer.ql) if cmplog else None
+
+        for subdir in ('queue', 'crashes', 'hangs', 'workers'):
+            os.makedirs(os.path.join(workdir, subdir), exist_ok=True)
+
+    def __path(self, *names: str) -> str:
+        return os.path.join(self.workdir, *names)
+
+    @staticmethod
+    def __dump(path: str, content: str) -> None:
+        temp = f'{path}.{os.getpid()}'
+
+        with open(temp, 'w') as outfile:
+            outfile.write(content)
+
+        os.replace(temp, path)
+
+    def __worker(self, wid: int, deadline: Optional[float], max_execs: Optional[int]) -> None:
+        ql = self.fuzzer.ql
+
+        seed = random.randrange(1 << 32) ^ os.getpid()
+
+        corpus = QlCorpus(self.__path('queue'), seed)
+        mutator = QlMutator(self.dictionary, self.max_len, seed)
+
+        coverage = QlEdgeCoverage(ql, self.map_size)
+        crashes_seen = bytearray(self.map_size)
+        hangs_seen = bytearray(self.map_size)
+
+        crashed = []
+
+        def __crash(ql: Qiling) -> None:
+            crashed.append(ql.arch.regs.arch_pc)
+            ql.emu_stop()
+
+        for address in self.crashes:
+            ql.hook_address(__crash, address)
+
+        uc = ql.arch.uc
+        uc.ctl_exits_enabled(True)
+        uc.ctl_set_exits(self.exits)
+
+        coverage.activate()
+        snapshot = QlSnapshot(ql)
+
+        stats: Dict[str, Any] = {
+            'pid'       : os.getpid(),
+            'started'   : time.time(),
+            'execs'     : 0,
+            'corpus'    : 0,
+            'crashes'   : 0,
+            'hangs'     : 0,
+            'edges'     : 0,
+            'last_find' : 0
+        }
+
+        def __execute(data: bytes) -> Optional[str]:
+            """Run the fuzzed program on a single input.
+
+            Returns: 'crash' or 'hang' if the iteration did not end gracefully, an empty string
+            if it did, or `None` if the input was rejected
+            """
+
+            snapshot.restore()
+            coverage.reset()
+            crashed.clear()
+
+            if self.cmplog:
+                self.cmplog.reset()
+
+            if not self.fuzzer.feed_input(ql, data, stats['execs']):
+                return None
+
+            # if we are fuzzing an arm code, make sure to take the effective pc
+            pc = getattr(ql.arch, 'effective_pc', ql.arch.regs.arch_pc)
+
+            stats['execs'] += 1
+            started = time.perf_counter()
+
+            try:
+                ql.emu_start(pc, 0, self.timeout * 1000)
+
+            # either a cpu exception, or an error raised by qiling while handling the fuzzed program
+            except Exception:
+                return 'crash'
+
+            if crashed:
+                return 'crash'
+
+            if time.perf_counter() - started >= self.timeout / 1000:
+                return 'hang'
+
+            return ''
+
+        def __evaluate(data: bytes, save: bool) -> None:
+            outcome = __execute(data)
+
+            if outcome is None:
+                return
+
+            if outcome:
+                # findings are told apart by the coverage of their paths
+                seen, subdir = (crashes_seen, 'crashes') if outcome == 'crash' else (hangs_seen, 'hangs')
+
+                if any(coverage.merge(seen)):
+                    stats[subdir] += 1
+
+                    with open(self.__path(subdir, QlCorpus.name_of(data)), 'wb') as outfile:
+                        outfile.write(data)
+
+                return
+
+            new_edges, new_counts = coverage.merge()
+
+            if save and (new_edges or new_counts):
+                corpus.add(data, new_edges)
+                stats['last_find'] = time.time()
+
+        def __sync() -> None:
+            # run the inputs found by others to learn their coverage
+            for entry in corpus.sync():
+                __evaluate(entry.data, False)
+
+        def __report() -> None:
+            stats['corpus'] = len(corpus)
+            stats['edges'] = coverage.covered
+
+            self.__dump(self.__path('workers', f'{wid}.json'), json.dumps(stats))
+
+            with open(self.__path('workers', f'{wid}.map'), 'wb') as outfile:
+                outfile.write(coverage.seen)
+
+        __sync()
+
+        if not len(corpus):
+            __evaluate(b'\x00', True)
+
+        # the probe may have crashed, hung or been rejected, yet there has to be something to mutate
+        if not len(corpus):
+            corpus.add(b'\x00')
+
+        next_sync = time.time() + self.sync_interval
+        next_report = 0.0
+
+        while (deadline is None or time.time() < deadline) and (max_execs is None or stats['execs'] < max_execs):
+            entry = corpus.choose()
+            other = corpus.choose()
+
+            # replace comparison operands found in a fresh input to solve magic values
+            if self.cmplog and not entry.fuzzed and __execute(entry.data) is not None:
+                for candidate in list(self.cmplog.candidates(entry.data)):
+                    __evaluate(candidate[:self.max_len], True)
+
+            for _ in range(self.energy):
+                __evaluate(mutator.mutate(entry.data, other.data), True)
+
+            entry.fuzzed += 1
+
+            now = time.time()
+
+            if now >= next_sync:
+                __sync()
+                next_sync = now + self.sync_interval
+
+            if now >= next_report:
+                __report()
+                next_report = now + self.status_interval
+
+        __report()
+
+    def __count(self, subdir: str) -> int:
+        # inputs that are being written are kept in hidden temporary files
+        return sum(1 for name in os.listdir(self.__path(subdir)) if not name.startswith('.'))
+
+    def __collect(self, started: float) -> Mapping[str, Any]:
+        """Aggregate workers status.
+        """
+
+        status = {
+            'started'       : started,
+            'elapsed'       : time.time() - started,
+            'workers'       : 0,
+            'execs'         : 0,
+            'execs_per_sec' : 0.0,
+            'corpus'        : self.__count('queue'),
+            'crashes'       : self.__count('crashes'),
+            'hangs'         : self.__count('hangs'),
+            'edges'         : 0,
+            'last_find'     : 0
+        }
+
+        covered = 0
+
+        for wid in range(self.workers):
+            try:
+                with open(self.__path('workers', f'{wid}.json')) as infile:
+                    stats = json.load(infile)
+
+                with open(self.__path('workers', f'{wid}.map'), 'rb') as infile:
+                    covered |= int.from_bytes(infile.read(), 'little')
+
+            except (OSError, ValueError):
+                continue
+
+            status['workers'] += 1
+            status['execs'] += stats['execs']
+            status['execs_per_sec'] += stats['execs'] / max(time.time() - stats['started'], 1e-6)
+            status['last_find'] = max(status['last_find'], stats['last_find'])
+
+        status['edges'] = self.map_size - covered.to_bytes(self.map_size, 'little').count(0)
+
+        return status
+
+    def __report(self, status: Mapping[str, Any]) -> None:
+        self.__dump(self.__path('fuzzer_stats'), json.dumps(status, indent=4))
+
+        with open(self.__path('plot_data'), 'a') as outfile:
+            if not outfile.tell():
+                outfile.write('elapsed,execs,execs_per_sec,edges,corpus,crashes,hangs\n')
+
+            outfile.write(f'{status["elapsed"]:.1f},{status["execs"]},{status["execs_per_sec"]:.1f},{status["edges"]},{status["corpus"]},{status["crashes"]},{status["hangs"]}\n')
+
+    def run(self, begin: Optional[int] = None, duration: Optional[float] = None, execs: Optional[int] = None) -> Mapping[str, Any]:
+        """Start the fuzzing session and wait for it to end.
+
+        Args:
+            begin: emulation starting point. emulation runs from there up to the fuzzing entry point
+            before fuzzing starts; if not set, emulation will start from the default starting point
+            duration: fuzzing session time limit, in seconds; unlimited by default
+            execs: number of iterations each worker should run; unlimited by default
+
+        Returns: final fuzzing status
+        """
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise QlErrorNotImplemented('fuzzing engine requires a platform that supports forking')
+
+        ql = self.fuzzer.ql
+
+        def __kickoff(ql: Qiling) -> None:
+            hook.remove()
+            ql.emu_stop()
+
+        if self.cmplog:
+            self.cmplog.hook_routines()
+            self.cmplog.activate()
+
+        # emulate up to the entry point; workers are forked off from there
+        hook = ql.hook_address(__kickoff, self.entry)
+        self.fuzzer.run(begin)
+
+        corpus = QlCorpus(self.__path('queue'))
+
+        for data in self.seeds:
+            corpus.add(data[:self.max_len])
+
+        started = time.time()
+        deadline = None if duration is None else started + duration
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=self.__worker, args=(wid, deadline, execs), daemon=True) for wid in range(self.workers)]
+
+        for process in processes:
+            process.start()
+
+        try:
+            while any(process.is_alive() for process in processes):
+                self.__report(self.__collect(started))
+
+                for process in processes:
+                    process.join(self.status_interval / len(processes))
+
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+            for process in processes:
+                process.join()
+
+        status = self.__collect(started)
+        self.__report(status)
+
+        return status
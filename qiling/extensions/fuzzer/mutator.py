@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import random
+
+from typing import Callable, List, Optional, Sequence
+
+
+# values that tend to trigger edge cases: boundaries, off-by-ones, common sizes
+INTERESTING_8  = (-128, -1, 0, 1, 16, 32, 64, 100, 127)
+INTERESTING_16 = INTERESTING_8 + (-32768, -129, 128, 255, 256, 512, 1000, 1024, 4096, 32767)
+INTERESTING_32 = INTERESTING_16 + (-2147483648, -100663046, -32769, 32768, 65535, 65536, 100663045, 2147483647)
+
+INTERESTING = {
+    1: INTERESTING_8,
+    2: INTERESTING_16,
+    4: INTERESTING_32
+}
+
+# max delta used by arithmetic mutations
+ARITH_MAX = 35
+
+
+class QlMutator:
+    """Input mutator, in the spirit of AFL havoc stage: every mutated input is the result of a
+    random stack of mutations, picked out of bit flips, arithmetics, interesting values, block
+    operations, dictionary tokens and splicing with another input.
+    """
+
+    def __init__(self, dictionary: Sequence[bytes] = (), max_len: int = 4096, seed: Optional[int] = None):
+        """Initialize a mutator instance.
+
+        Args:
+            dictionary: tokens that are meaningful to the fuzzed program, e.g. keywords or magic values
+            max_len: maximal length of a mutated input
+            seed: random generator seed, for reproducibility
+        """
+
+        self.random = random.Random(seed)
+        self.dictionary = [bytes(token) for token in dictionary if token]
+        self.max_len = max_len
+
+        self.strategies: List[Callable[[bytearray], None]] = [
+            self.flip_bit,
+            self.flip_byte,
+            self.arith,
+            self.interesting,
+            self.random_byte,
+            self.delete_block,
+            self.insert_block,
+            self.overwrite_block
+        ]
+
+        if self.dictionary:
+            self.strategies.extend((self.insert_token, self.overwrite_token))
+
+    def __width(self, buf: bytearray) -> int:
+        return self.random.choice([w for w in (1, 2, 4) if w <= len(buf)])
+
+    def __endian(self) -> str:
+        return self.random.choice(('little', 'big'))
+
+    def flip_bit(self, buf: bytearray) -> None:
+        bit = self.random.randrange(len(buf) * 8)
+
+        buf[bit >> 3] ^= 0x80 >> (bit & 7)
+
+    def flip_byte(self, buf: bytearray) -> None:
+        buf[self.random.randrange(len(buf))] ^= 0xff
+
+    def arith(self, buf: bytearray) -> None:
+        width = self.__width(buf)
+        endian = self.__endian()
+        pos = self.random.randrange(len(buf) - width + 1)
+
+        delta = self.random.randint(1, ARITH_MAX) * self.random.choice((1, -1))
+        value = int.from_bytes(buf[pos:pos + width], endian) + delta
+
+        buf[pos:pos + width] = (value & ((1 << (width * 8)) - 1)).to_bytes(width, endian)
+
+    def interesting(self, buf: bytearray) -> None:
+        width = self.__width(buf)
+        endian = self.__endian()
+        pos = self.random.randrange(len(buf) - width + 1)
+
+        value = self.random.choice(INTERESTING[width])
+
+        buf[pos:pos + width] = (value & ((1 << (width * 8)) - 1)).to_bytes(width, endian)
+
+    def random_byte(self, buf: bytearray) -> None:
+        # xor with a non-zero value to make sure the byte actually changes
+        buf[self.random.randrange(len(buf))] ^= self.random.randint(1, 0xff)
+
+    def __block_len(self, limit: int) -> int:
+        # favor short blocks
+        return self.random.randint(1, max(1, min(limit, self.random.choice((8, 32, 128, limit)))))
+
+    def delete_block(self, buf: bytearray) -> None:
+        if len(buf) < 2:
+            return
+
+        size = self.__block_len(len(buf) - 1)
+        pos = self.random.randrange(len(buf) - size + 1)
+
+        del buf[pos:pos + size]
+
+    def insert_block(self, buf: bytearray) -> None:
+        if len(buf) >= self.max_len:
+            return
+
+        size = self.__block_len(min(len(buf), self.max_len - len(buf)))
+        pos = self.random.randrange(len(buf) + 1)
+
+        # either clone a chunk of the input or insert a run of a constant byte
+        if self.random.random() < 0.75:
+            src = self.random.randrange(len(buf) - size + 1)
+            block = buf[src:src + size]
+        else:
+            block = bytes([self.random.choice((0, 0xff, self.random.randrange(256)))]) * size
+
+        buf[pos:pos] = block
+
+    def overwrite_block(self, buf: bytearray) -> None:
+        if len(buf) < 2:
+            return
+
+        size = self.__block_len(len(buf) - 1)
+        src = self.random.randrange(len(buf) - size + 1)
+        dst = self.random.randrange(len(buf) - size + 1)
+
+        buf[dst:dst + size] = buf[src:src + size]
+
+    def insert_token(self, buf: bytearray) -> None:
+        token = self.random.choice(self.dictionary)
+
+        if len(buf) + len(token) > self.max_len:
+            return
+
+        pos = self.random.randrange(len(buf) + 1)
+
+        buf[pos:pos] = token
+
+    def overwrite_token(self, buf: bytearray) -> None:
+        token = self.random.choice(self.dictionary)
+
+        if len(token) > len(buf):
+            return
+
+        pos = self.random.randrange(len(buf) - len(token) + 1)
+
+        buf[pos:pos + len(token)] = token
+
+    def splice(self, buf: bytearray, other: bytes) -> bytearray:
+        """Cross the input over with another one: keep a head of the first and a tail of the other.
+        """
+
+        if len(buf) < 2 or len(other) < 2:
+            return buf
+
+        head = self.random.randrange(1, len(buf))
+        tail = self.random.randrange(1, len(other))
+
+        return buf[:head] + other[tail:]
+
+    def mutate(self, data: bytes, other: Optional[bytes] = None) -> bytes:
+        """Generate a new input out of an existing one.
+
+        Args:
+            data: input to mutate
+            other: another input to optionally splice with
+
+        Returns: mutated input
+        """
+
+        buf = bytearray(data) or bytearray(1)
+
+        if other is not None and self.random.random() < 0.2:
+            buf = self.splice(buf, other)
+
+        for _ in range(1 << self.random.randint(0, 4)):
+            self.random.choice(self.strategies)(buf)
+
+            if not buf:
+                buf.append(0)
+
+        return bytes(buf[:self.max_len])
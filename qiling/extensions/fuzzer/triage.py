@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+from typing import TYPE_CHECKING, Any, Collection, Dict, List, Mapping, Optional, Sequence
+
+from unicorn import UC_PROT_EXEC
+
+from qiling.exception import QlErrorNotImplemented
+from qiling.extensions.afl.qlfuzzer import QlFuzzer
+from qiling.extensions.coverage.formats.drcov import QlDrCoverage
+from qiling.extensions.fuzzer.channel import QlInputChannel
+from qiling.extensions.snapshot import QlSnapshot
+
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+# triage instance shared with the pool workers. workers are forked, so it is inherited
+# rather than pickled
+_triage: Optional[QlTriage] = None
+
+
+def _init_worker() -> None:
+    assert _triage is not None
+
+    _triage._setup()
+
+
+def _replay(path: str) -> Dict[str, Any]:
+    assert _triage is not None
+
+    return _triage._replay(path)
+
+
+class QlStdinFuzzer(QlFuzzer):
+    """A fuzzer that feeds its inputs to the emulated program through stdin.
+    """
+
+    def __init__(self, argv: Sequence[str], rootfs: str, **kwargs) -> None:
+        super().__init__(argv, rootfs, **kwargs)
+
+        self.channel = QlInputChannel(self.ql)
+        self.channel.bind_stdin()
+
+    def feed_input(self, ql: Qiling, stimuli: bytes, pround: int) -> bool:
+        self.channel.feed(stimuli)
+
+        return True
+
+
+class QlTriage:
+    """Replay fuzzing findings across a pool of worker processes.
+
+    Emulation runs up to the fuzzing entry point once, and then worker processes are forked off
+    from there. Each worker captures a snapshot at the entry point and rolls back to it before
+    replaying every input.
+
+    Crashes are bucketed by the crashing location along with a hash of the call stack leading
+    to it. The call stack is recovered by scanning the stack for values that point into executable
+    memory, which does not require any unwinding information but may pick up some stale return
+    addresses along the way; those are consistent among replays of the same crash.
+
+    Corpus minimization keeps the smallest set of inputs that covers all basic blocks covered by
+    the entire corpus, favoring short inputs, much like afl-cmin does.
+    """
+
+    def __init__(self, fuzzer: QlFuzzer, entry: int, exits: Collection[int], crashes: Collection[int] = (), *,
+                 workers: Optional[int] = None, timeout: int = 1000, stack_depth: int = 8, stack_scan: int = 256):
+        """Initialize a triage instance.
+
+        Args:
+            fuzzer: fuzzer instance, whose `feed_input` method is used to place inputs
+            entry: fuzzing entry point. this is where emulation resets to before each replay
+            exits: fuzzing exit points. reaching either one of these addresses means the replay has ended gracefully
+            crashes: addresses that are considered a crash once reached
+            workers: number of replaying processes; defaults to the number of cpus
+            timeout: replay time limit, in milliseconds. a replay that exceeds it is considered a hang
+            stack_depth: number of call stack frames to consider when bucketing crashes
+            stack_scan: number of stack slots to scan when recovering the call stack
+        """
+
+        self.fuzzer = fuzzer
+        self.entry = entry
+        self.exits = exits
+        self.crashes = crashes
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.stack_depth = stack_depth
+        self.stack_scan = stack_scan
+
+        self.ready = False
+
+    def prepare(self, begin: Optional[int] = None) -> None:
+        """Emulate up to the fuzzing entry point. This is done automatically before the first
+        replay, unless a different starting point is required.
+
+        Args:
+            begin: emulation starting point; if not set, emulation will start from the default starting point
+        """
+
+        def __kickoff(ql: Qiling) -> None:
+            hook.remove()
+            ql.emu_stop()
+
+        hook = self.fuzzer.ql.hook_address(__kickoff, self.entry)
+        self.fuzzer.run(begin)
+
+        self.ready = True
+
+    def _setup(self) -> None:
+        """Prepare a worker process for replaying inputs.
+        """
+
+        ql = self.fuzzer.ql
+
+        self.crashed: List[int] = []
+
+        def __crash(ql: Qiling) -> None:
+            self.crashed.append(ql.arch.regs.arch_pc)
+            ql.emu_stop()
+
+        for address in self.crashes:
+            ql.hook_address(__crash, address)
+
+        uc = ql.arch.uc
+        uc.ctl_exits_enabled(True)
+        uc.ctl_set_exits(self.exits)
+
+        # executable ranges of loaded images, used to tell return addresses apart from other stack
+        # values. note that stack and heap may be executable as well, so they are left out
+        self.code = [(lbound, ubound) for lbound, ubound, perms, *_ in ql.mem.map_info if perms & UC_PROT_EXEC and ql.loader.find_containing_image(lbound)]
+        self.code_lbounds = [lbound for lbound, _ in self.code]
+
+        self.coverage = QlDrCoverage(ql)
+        self.coverage.activate()
+
+        self.snapshot = QlSnapshot(ql)
+
+    def _is_code(self, address: int) -> bool:
+        i = bisect.bisect_right(self.code_lbounds, address) - 1
+
+        return i >= 0 and address < self.code[i][1]
+
+    def _locate(self, address: int) -> str:
+        """Describe an address relative to its containing image.
+        """
+
+        image = self.fuzzer.ql.loader.find_containing_image(address)
+
+        if image is None:
+            return f'{address:#x}'
+
+        return f'{os.path.basename(image.path)}+{address - image.base:#x}'
+
+    def _call_stack(self) -> List[int]:
+        arch = self.fuzzer.ql.arch
+        mem = self.fuzzer.ql.mem
+
+        ptrsize = arch.pointersize
+        sp = arch.regs.arch_sp
+
+        frames = []
+
+        for i in range(self.stack_scan):
+            address = sp + i * ptrsize
+
+            if not mem.is_mapped(address, ptrsize):
+                break
+
+            value = mem.read_ptr(address, ptrsize)
+
+            if self._is_code(value):
+                frames.append(value)
+
+                if len(frames) == self.stack_depth:
+                    break
+
+        return frames
+
+    def _replay(self, path: str) -> Dict[str, Any]:
+        """Replay a single input.
+
+        Returns: replay outcome, along with the crash details and covered basic blocks
+        """
+
+        ql = self.fuzzer.ql
+
+        with open(path, 'rb') as infile:
+            data = infile.read()
+
+        self.snapshot.restore()
+        self.coverage.basic_blocks.clear()
+        self.crashed.clear()
+
+        result: Dict[str, Any] = {
+            'file'    : path,
+            'size'    : len(data),
+            'outcome' : 'ok'
+        }
+
+        if not self.fuzzer.feed_input(ql, data, 0):
+            result['outcome'] = 'rejected'
+
+            return result
+
+        # if we are fuzzing an arm code, make sure to take the effective pc
+        pc = getattr(ql.arch, 'effective_pc', ql.arch.regs.arch_pc)
+        reason = None
+
+        started = time.perf_counter()
+
+        try:
+            ql.emu_start(pc, 0, self.timeout * 1000)
+
+        # either a cpu exception, or an error raised by qiling while handling the replayed program
+        except Exception as ex:
+            reason = f'{type(ex).__name__}: {ex}'
+
+        if self.crashed:
+            reason = 'crash address reached'
+
+        if reason is not None:
+            fault = self.crashed[0] if self.crashed else ql.arch.regs.arch_pc
+            stack = [self._locate(address) for address in self._call_stack()]
+
+            result.update({
+                'outcome'  : 'crash',
+                'reason'   : reason,
+                'pc'       : fault,
+                'location' : self._locate(fault),
+                'stack'    : stack,
+                'bucket'   : f'{self._locate(fault)}-{hashlib.sha1(" ".join(stack).encode()).hexdigest()[:8]}'
+            })
+
+        elif time.perf_counter() - started >= self.timeout / 1000:
+            result['outcome'] = 'hang'
+
+        result['blocks'] = sorted(self.coverage.basic_blocks)
+
+        return result
+
+    def replay(self, paths: Sequence[str]) -> List[Dict[str, Any]]:
+        """Replay inputs across the worker pool.
+
+        Args:
+            paths: paths of input files to replay
+
+        Returns: replay results, in the same order as the input paths
+        """
+
+        global _triage
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise QlErrorNotImplemented('triage requires a platform that supports forking')
+
+        if not self.ready:
+            self.prepare()
+
+        _triage = self
+
+        context = multiprocessing.get_context('fork')
+        chunksize = max(1, len(paths) // (self.workers * 4))
+
+        try:
+            with context.Pool(self.workers, initializer=_init_worker) as pool:
+                return pool.map(_replay, paths, chunksize)
+        finally:
+            _triage = None
+
+    @staticmethod
+    def __list(path: str) -> List[str]:
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if not name.startswith('.') and os.path.isfile(os.path.join(path, name)))
+
+    @staticmethod
+    def __dump(summary: Mapping[str, Any], path: Optional[str]) -> None:
+        if path is not None:
+            with open(path, 'w') as outfile:
+                json.dump(summary, outfile, indent=4)
+
+    def triage(self, crashes_dir: str, summary: Optional[str] = None) -> Mapping[str, Any]:
+        """Replay crashing inputs and bucket them by their crash location and call stack.
+
+        Args:
+            crashes_dir: directory of crashing inputs
+            summary: path of a json file to write the results to, if any
+
+        Returns: triage results
+        """
+
+        results = self.replay(self.__list(crashes_dir))
+        buckets: Dict[str, Dict[str, Any]] = {}
+
+        for result in results:
+            if result['outcome'] != 'crash':
+                continue
+
+            bucket = buckets.setdefault(result['bucket'], {
+                'id'       : result['bucket'],
+                'reason'   : result['reason'],
+                'pc'       : result['pc'],
+                'location' : result['location'],
+                'stack'    : result['stack'],
+                'files'    : []
+            })
+
+            bucket['files'].append(result['file'])
+
+        for bucket in buckets.values():
+            bucket['count'] = len(bucket['files'])
+
+            # the shortest input comes first, as the most convenient one to investigate
+            bucket['files'].sort(key=lambda f: (os.path.getsize(f), f))
+
+        status = {
+            'inputs'         : len(results),
+            'crashes'        : sum(bucket['count'] for bucket in buckets.values()),
+            'buckets'        : sorted(buckets.values(), key=lambda b: (-b['count'], b['id'])),
+            'hangs'          : [result['file'] for result in results if result['outcome'] == 'hang'],
+            'not_reproduced' : [result['file'] for result in results if result['outcome'] in ('ok', 'rejected')]
+        }
+
+        self.__dump(status, summary)
+
+        return status
+
+    def minimize(self, corpus_dir: str, output_dir: str, summary: Optional[str] = None) -> Mapping[str, Any]:
+        """Reduce a corpus to the smallest set of inputs that covers the same basic blocks.
+        Crashing inputs and inputs that timed out are left out.
+
+        Args:
+            corpus_dir: directory of corpus inputs
+            output_dir: directory to copy the kept inputs to
+            summary: path of a json file to write the results to, if any
+
+        Returns: minimization results
+        """
+
+        results = [result for result in self.replay(self.__list(corpus_dir)) if result['outcome'] == 'ok']
+
+        # shortest inputs come first, so each block is attributed to the shortest input that covers it
+        results.sort(key=lambda r: (r['size'], r['file']))
+
+        owners: Dict[int, int] = {}
+
+        for i, result in enumerate(results):
+            for block in result['blocks']:
+                owners.setdefault(block, i)
+
+        kept = sorted(set(owners.values()))
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        for i in kept:
+            shutil.copy(results[i]['file'], output_dir)
+
+        status = {
+            'inputs' : len(results),
+            'kept'   : len(kept),
+            'blocks' : len(owners),
+            'files'  : [os.path.basename(results[i]['file']) for i in kept]
+        }
+
+        self.__dump(status, summary)
+
+        return status
+
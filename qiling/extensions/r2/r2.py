@@ -140,6 +140,8 @@ class R2:
         self.baseaddr = baseaddr
         self.loadaddr = loadaddr  # r2 -m [addr]    map file at given address
         self.analyzed = False
+        # disassembly is done on r2 own copy of the binary, which does not change during emulation
+        self._dis_cache: Dict[Tuple[int, int], List[Instruction]] = {}
         self._r2c = libr.r_core.r_core_new()
         if ql.code:
             self._setup_code(ql.code)
@@ -264,8 +266,10 @@ class R2:
         return bytes.fromhex(hexstr)
 
     def dis_nbytes(self, addr: int, size: int) -> List[Instruction]:
-        insts = [Instruction(**dic) for dic in self._cmdj(f"pDj {size} @ {addr}")]
-        return insts
+        key = (addr, size)
+        if key not in self._dis_cache:
+            self._dis_cache[key] = [Instruction(**dic) for dic in self._cmdj(f"pDj {size} @ {addr}")]
+        return self._dis_cache[key]
 
     def disassembler(self, ql: 'Qiling', addr: int, size: int, filt: Pattern[str]=None) -> int:
         '''A human-friendly monkey patch of QlArchUtils.disassembler powered by r2, can be used for hook_code
@@ -1,17 +1,41 @@
 #!/usr/bin/env python3
-# 
+#
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
+from __future__ import annotations
+
+import copy
 import random
-from enum import Enum
 
-from qiling import Qiling
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional
+
+from unicorn import UC_HOOK_MEM_READ, UC_HOOK_MEM_WRITE, UC_MEM_WRITE
+
+from qiling.arch.utils import call_site
+from qiling.extensions.sanitizers.shadow import (
+    GRANULE_SIZE, SHADOW_LEFT_REDZONE, SHADOW_RIGHT_REDZONE, SHADOW_FREED,
+    QlShadowMemory, SanitizerReport
+)
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+class SanitizedChunk:
+    def __init__(self, address: int, size: int, base: int, span: int, alloc_site: int):
+        # user buffer
+        self.address = address
+        self.size = size
+
+        # underlying heap chunk, which also contains the redzones
+        self.base = base
+        self.span = span
+
+        self.alloc_site = alloc_site
+        self.free_site: Optional[int] = None
 
-class CaneryType(Enum):
-        underflow = 0
-        overflow = 1
-        uaf = 2
 
 class QlSanitizedMemoryHeap():
     """
@@ -22,36 +46,67 @@ class QlSanitizedMemoryHeap():
     ql.os.heap.bo_handler = my_bo_handler
     ql.os.heap.bad_free_handler = my_bad_free_handler
     ql.os.heap.uaf_handler = my_uaf_handler
+
+    Heap buffers are surrounded by redzones, and their state is kept in a shadow memory map
+    where every heap granule is described by a single byte, much like ASan does. Accesses to
+    the heap range are caught by a single memory hook that checks them against the shadow map
+    in constant time, regardless of the number of allocations.
+
+    Freed buffers are poisoned and held in a quarantine queue, so they are not recycled right
+    away and accessing them is detected as use-after-free. Once the quarantine grows beyond its
+    size limit, the oldest buffers are returned to the underlying heap.
+
+    Every detected violation is logged and recorded in `reports`, along with the call sites
+    that allocated and freed the relevant buffer.
     """
 
-    CANARY_SIZE = 4
+    REDZONE_SIZE = 16
 
-    def __init__(self, ql: Qiling, heap, fault_rate=0, canary_byte=b'\xCD'):
+    def __init__(self, ql: Qiling, heap, fault_rate=0, canary_byte=b'\xCD', quarantine_size: int = 0x100000, shadow: Optional[QlShadowMemory] = None):
         self.ql = ql
         self.heap = heap
         self.fault_rate = fault_rate
         self.canary_byte = canary_byte
-        self.canaries = []
+        self.quarantine_size = quarantine_size
+
+        # shadow memory map; may be shared with other sanitizers
+        self.shadow = shadow or QlShadowMemory()
+
+        # live buffers, by their address
+        self.chunks: Dict[int, SanitizedChunk] = {}
+
+        # freed buffers that are not recycled yet, along with their total size
+        self.quarantine: Deque[SanitizedChunk] = deque()
+        self.quarantined: Dict[int, SanitizedChunk] = {}
+        self.quarantine_used = 0
+
+        self.reports: List[SanitizerReport] = []
+
+        self.__hook = ql.uc.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, self.__on_access, None, heap.start_address, heap.end_address - 1)
 
     def save(self):
+        # chunks are modified in place as they get freed, and so are the underlying heap records.
+        # a saved state should not change along with the heap, so everything is copied
         saved_state = {}
-        saved_state['heap'] = self.heap.save()
+        saved_state['heap'] = copy.deepcopy(self.heap.save())
         saved_state['fault_rate'] = self.fault_rate
         saved_state['canary_byte'] = self.canary_byte
-        saved_state['canaries'] = self.canaries
+        saved_state['shadow'] = self.shadow.save()
+        saved_state['chunks'] = {addr: copy.copy(chunk) for addr, chunk in self.chunks.items()}
+        saved_state['quarantine'] = [copy.copy(chunk) for chunk in self.quarantine]
+        saved_state['quarantine_used'] = self.quarantine_used
         return saved_state
 
     def restore(self, saved_state):
-        self.heap.restore(saved_state['heap'])
+        # copy the saved state again, so it may be restored more than once
+        self.heap.restore(copy.deepcopy(saved_state['heap']))
         self.fault_rate = saved_state['fault_rate']
         self.canary_byte = saved_state['canary_byte']
-        self.canaries = saved_state['canaries']
-        for (canary_begin, canary_end, canery_type) in self.canaries:
-            if canery_type == CaneryType.underflow or canery_type == CaneryType.overflow:
-                self.ql.hook_mem_write(self.bo_handler, begin=canary_begin, end=canary_end)
-                self.ql.hook_mem_read(self.oob_handler, begin=canary_begin, end=canary_end)
-            else:
-                self.ql.hook_mem_valid(self.uaf_handler, begin=canary_begin, end=canary_end)
+        self.shadow.restore(saved_state['shadow'])
+        self.chunks = {addr: copy.copy(chunk) for addr, chunk in saved_state['chunks'].items()}
+        self.quarantine = deque(copy.copy(chunk) for chunk in saved_state['quarantine'])
+        self.quarantined = {chunk.address: chunk for chunk in self.quarantine}
+        self.quarantine_used = saved_state['quarantine_used']
 
     @staticmethod
     def bo_handler(ql, access, addr, size, value):
@@ -81,61 +136,144 @@ class QlSanitizedMemoryHeap():
         """
         pass
 
-    def alloc(self, size: int):
+    def __on_access(self, uc, access: int, address: int, size: int, value: int, user_data) -> None:
+        faulty = self.shadow.check(address, size)
+
+        if faulty is not None:
+            self.__violation(access, faulty, size, value)
+
+    def __find_chunk(self, address: int) -> Optional[SanitizedChunk]:
+        """Locate the buffer whose underlying heap chunk contains the specified address.
+        """
+
+        for chunk in self.chunks.values():
+            if chunk.base <= address < chunk.base + chunk.span:
+                return chunk
+
+        for chunk in self.quarantine:
+            if chunk.base <= address < chunk.base + chunk.span:
+                return chunk
+
+        return None
+
+    def __report(self, kind: str, access: str, address: int, size: int, chunk: Optional[SanitizedChunk]) -> None:
+        report = SanitizerReport(
+            kind=kind,
+            access=access,
+            address=address,
+            size=size,
+            pc=self.ql.arch.regs.arch_pc,
+            buffer=chunk and chunk.address,
+            buffer_size=chunk.size if chunk else 0,
+            alloc_site=chunk and chunk.alloc_site,
+            free_site=chunk and chunk.free_site
+        )
+
+        self.ql.log.error(f'Sanitizer: {report}')
+        self.reports.append(report)
+
+    def __violation(self, access: int, address: int, size: int, value: int) -> None:
+        shadow = self.shadow.value(address)
+        is_write = access == UC_MEM_WRITE
+
+        if shadow == SHADOW_FREED:
+            kind = 'heap-use-after-free'
+            handler = self.uaf_handler
+        else:
+            kind = 'heap-buffer-overflow'
+            handler = self.bo_handler if is_write else self.oob_handler
+
+        self.__report(kind, 'write' if is_write else 'read', address, size, self.__find_chunk(address))
+
+        handler(self.ql, access, address, size, value)
+
+    def alloc(self, size: int, align: int = GRANULE_SIZE):
         chance = random.randint(1, 100)
         if chance <= self.fault_rate:
             # Fail the allocation.
             return 0
 
-        addr = self.heap.alloc(size + self.CANARY_SIZE * 2)
+        align = max(align, GRANULE_SIZE)
+        aligned_size = (size + GRANULE_SIZE - 1) & ~(GRANULE_SIZE - 1)
+
+        # underlying chunks are not necessarily aligned, so leave enough room to align the user
+        # buffer while keeping the redzones at least their nominal size
+        span = aligned_size + self.REDZONE_SIZE * 2 + align
+        base = self.heap.alloc(span)
+
+        if not base:
+            return 0
+
+        addr = (base + self.REDZONE_SIZE + align - 1) & ~(align - 1)
 
-        canary_begins = addr
-        canary_ends = canary_begins + self.CANARY_SIZE - 1
+        redzone_begins = (base + GRANULE_SIZE - 1) & ~(GRANULE_SIZE - 1)
+        redzone_ends = (base + span) & ~(GRANULE_SIZE - 1)
 
-        # install underflow canary and detection hooks
-        self.ql.mem.write(canary_begins, self.canary_byte * self.CANARY_SIZE)
-        self.ql.hook_mem_write(self.bo_handler, begin=canary_begins, end=canary_ends)
-        self.ql.hook_mem_read(self.oob_handler, begin=canary_begins, end=canary_ends)
-        self.canaries.append((canary_begins, canary_ends, CaneryType.underflow))
+        # fill the redzones with canary bytes, so corruptions made by hooked code, which does
+        # not go through the memory hook, may be detected later on by validate
+        self.ql.mem.write(base, self.canary_byte * (addr - base))
+        self.ql.mem.write(addr + size, self.canary_byte * (base + span - addr - size))
 
-        canary_begins = addr + self.CANARY_SIZE + size
-        canary_ends = canary_begins + self.CANARY_SIZE - 1
+        self.shadow.poison(redzone_begins, addr, SHADOW_LEFT_REDZONE)
+        self.shadow.unpoison(addr, size)
+        self.shadow.poison(addr + aligned_size, redzone_ends, SHADOW_RIGHT_REDZONE)
 
-        # install overflow canary and detection hooks
-        self.ql.mem.write(canary_begins, self.canary_byte * self.CANARY_SIZE)
-        self.ql.hook_mem_write(self.bo_handler, begin=canary_begins, end=canary_ends)
-        self.ql.hook_mem_read(self.oob_handler, begin=canary_begins, end=canary_ends)
-        self.canaries.append((canary_begins, canary_ends, CaneryType.overflow))
+        self.chunks[addr] = SanitizedChunk(addr, size, base, span, call_site(self.ql))
 
-        return (addr + self.CANARY_SIZE)
+        return addr
 
     def size(self, addr: int):
-        return self.heap.size(addr - self.CANARY_SIZE)
+        chunk = self.chunks.get(addr)
+
+        return chunk.size if chunk else 0
 
     def free(self, addr: int) -> bool:
-        chunk = self.heap._find(addr - self.CANARY_SIZE)
+        chunk = self.chunks.pop(addr, None)
+
+        if chunk is None:
+            previous = self.quarantined.get(addr)
 
-        if not chunk:
+            self.__report('double-free' if previous else 'bad-free', 'free', addr, 0, previous)
             self.bad_free_handler(self.ql, addr)
+
             return False
 
-        # Install the UAF canary hook.
-        self.ql.mem.write(addr, self.canary_byte * (chunk.size - 8))
-        uaf_canary = (addr, addr + chunk.size - 8 - 1, CaneryType.uaf)
-        self.ql.hook_mem_valid(self.uaf_handler, begin=uaf_canary[0], end=uaf_canary[1])
-        self.canaries.append(uaf_canary)
+        chunk.free_site = call_site(self.ql)
+
+        # poison the entire chunk, so freed memory is told apart from redzones
+        self.ql.mem.write(addr, self.canary_byte * chunk.size)
+        self.shadow.poison(addr, (chunk.base + chunk.span) & ~(GRANULE_SIZE - 1), SHADOW_FREED)
+
+        self.quarantine.append(chunk)
+        self.quarantined[addr] = chunk
+        self.quarantine_used += chunk.span
 
-        # Make sure the chunk won't be re-used by the underlying heap.
-        self.heap.chunks.remove(chunk)
+        # recycle the oldest quarantined chunks. their memory remains poisoned until it gets
+        # reallocated
+        while self.quarantine_used > self.quarantine_size:
+            oldest = self.quarantine.popleft()
+
+            del self.quarantined[oldest.address]
+            self.quarantine_used -= oldest.span
+
+            self.heap.free(oldest.base)
 
         return True
 
     def validate(self) -> bool:
-        for canary_begin, canary_end, _ in self.canaries:
-            size = canary_end - canary_begin + 1
-            canary = self.ql.mem.read(canary_begin, size)
+        # live buffers redzones
+        for chunk in self.chunks.values():
+            lredzone = self.ql.mem.read(chunk.base, chunk.address - chunk.base)
+            rredzone = self.ql.mem.read(chunk.address + chunk.size, chunk.base + chunk.span - chunk.address - chunk.size)
+
+            if lredzone.count(self.canary_byte) != len(lredzone) or rredzone.count(self.canary_byte) != len(rredzone):
+                return False
+
+        # quarantined buffers content
+        for chunk in self.quarantine:
+            content = self.ql.mem.read(chunk.address, chunk.size)
 
-            if canary.count(self.canary_byte) != len(canary):
+            if content.count(self.canary_byte) != len(content):
                 return False
 
         return True
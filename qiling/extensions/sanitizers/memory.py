@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+import bisect
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from capstone import Cs, CS_ARCH_ARM, CS_ARCH_X86, CS_MODE_32, CS_MODE_64, CS_MODE_ARM, CS_MODE_BIG_ENDIAN, CS_MODE_THUMB, CS_OP_IMM
+from elftools.elf.constants import SH_FLAGS
+from elftools.elf.elffile import ELFFile
+from unicorn import Uc, UC_HOOK_MEM_READ, UC_HOOK_MEM_WRITE, UC_MEM_WRITE, UC_PROT_READ, UC_PROT_WRITE
+
+from qiling.const import QL_ARCH, QL_ENDIAN
+from qiling.exception import QlErrorNotImplemented, QlMemoryMappedError
+from qiling.extensions.sanitizers.heap import QlSanitizedMemoryHeap
+from qiling.extensions.sanitizers.shadow import GRANULE_SIZE, SHADOW_GLOBAL_REDZONE, SHADOW_STACK_REDZONE, QlShadowMemory, SanitizerReport
+from qiling.os.const import POINTER, SIZE_T
+from qiling.os.memory import QlMemoryHeap
+from qiling.os.posix.posix import QlOsPosix
+
+if TYPE_CHECKING:
+    from qiling import Qiling
+
+
+class FrameLayout:
+    """Stack frame layout of an instrumented function, as determined from its prologue.
+    """
+
+    def __init__(self, address: int, entry: int, offset: int, saved: int, locals: int, exempt: Set[int]):
+        self.address = address
+
+        # the instruction that saves the first register marks the entry to the frame. offset is the
+        # distance from the stack pointer at that point to the top of the frame record
+        self.entry = entry
+        self.offset = offset
+
+        # size of the frame record (saved registers and return address) and the local variables area
+        self.saved = saved
+        self.locals = locals
+
+        # addresses of instructions that may access the frame record while the stack pointer is
+        # still below it, such as 'leave'
+        self.exempt = exempt
+
+
+class SanitizedFrame:
+    """A live stack frame of an instrumented function.
+    """
+
+    def __init__(self, layout: FrameLayout, top: int):
+        self.layout = layout
+
+        # the frame record (saved registers and return address) is right above the local variables
+        # area, and serves as its redzone
+        self.top = top
+        self.bottom = top - layout.saved
+
+        self.locals_base = self.bottom - layout.locals
+        self.locals_size = layout.locals
+
+        # only granules that are entirely covered by the frame record are poisoned
+        self.lbound = (self.bottom + GRANULE_SIZE - 1) & ~(GRANULE_SIZE - 1)
+        self.ubound = top & ~(GRANULE_SIZE - 1)
+
+
+class QlMemorySanitizer:
+    """Heap, stack and global buffers sanitizer for Linux and bare-metal targets.
+
+    Heap allocation routines are replaced by a sanitized heap (see `QlSanitizedMemoryHeap`) that
+    is backed by a dedicated memory arena. Routines are intercepted either by name, through the
+    OS API hooking facility, or by address for statically linked code.
+
+    Functions whose prologue saves registers and allocates a stack frame larger than `min_frame`
+    are instrumented. The frame record (saved registers and return address) right above the local
+    variables area is a redzone: it is poisoned in the shadow memory map while the frame is live,
+    and a single ranged hook over the stack mapping checks every stack access against it, so
+    overflowing a local buffer is caught by the very access that reaches the frame record, be it
+    a read or a write. Frames are tracked by that same hook, as the prologue saves the registers
+    and the epilogue restores them. Only granules that are entirely covered by a frame record are
+    poisoned, and the bounds of the individual local variables are not known, so overflows from
+    one local variable to another go undetected. Stack instrumentation is available for x86,
+    x86-64 and ARM.
+
+    Alignment padding between global objects in writable sections, as listed in the symbol table,
+    is poisoned in the same shadow memory map, which is shared with the sanitized heap, and a
+    single ranged hook per section checks accesses to globals against it.
+
+    Every detected violation is logged and recorded in `reports`.
+
+    Every access to the stack, to the sanitized heap arena or to the poisoned globals ranges costs
+    a Python callback, whether it is in bounds or not, so the emulation overhead is proportional
+    to the rate of such accesses. `examples/sanitizer_benchmark_x8664_linux.py` measures it.
+    """
+
+    # largest alignment assumed for global objects
+    MAX_GLOBAL_ALIGN = 64
+
+    def __init__(self, ql: Qiling, *, heap_size: int = 0x1000000, quarantine_size: int = 0x100000, min_frame: int = 16):
+        """Initialize a memory sanitizer.
+
+        Args:
+            ql: qiling instance
+            heap_size: sanitized heap arena size, in bytes
+            quarantine_size: total size of freed heap buffers to hold before recycling them
+            min_frame: minimal local variables area size of functions to instrument, in bytes
+        """
+
+        self.ql = ql
+        self.min_frame = min_frame
+
+        self.shadow = QlShadowMemory()
+
+        # map the heap arena in advance, so emulated memory allocations do not step on it
+        arena = ql.mem.find_free_space(heap_size, minaddr=getattr(ql.loader, 'mmap_address', None))
+        ql.mem.map(arena, heap_size, UC_PROT_READ | UC_PROT_WRITE, '[sanitized heap]')
+
+        arena_heap = QlMemoryHeap(ql, arena, arena + heap_size)
+        arena_heap.current_alloc = heap_size
+
+        self.heap = QlSanitizedMemoryHeap(ql, arena_heap, quarantine_size=quarantine_size, shadow=self.shadow)
+        self.reports: List[SanitizerReport] = self.heap.reports
+
+        self.allocators: Mapping[str, Tuple[Callable[[Qiling, int, Mapping], int], Mapping[str, Any]]] = {
+            'malloc'             : (self.__malloc,         {'size': SIZE_T}),
+            'calloc'             : (self.__calloc,         {'nmemb': SIZE_T, 'size': SIZE_T}),
+            'realloc'            : (self.__realloc,        {'ptr': POINTER, 'size': SIZE_T}),
+            'free'               : (self.__free,           {'ptr': POINTER}),
+            'memalign'           : (self.__memalign,       {'alignment': SIZE_T, 'size': SIZE_T}),
+            'aligned_alloc'      : (self.__memalign,       {'alignment': SIZE_T, 'size': SIZE_T}),
+            'posix_memalign'     : (self.__posix_memalign, {'memptr': POINTER, 'alignment': SIZE_T, 'size': SIZE_T}),
+            'malloc_usable_size' : (self.__usable_size,    {'ptr': POINTER})
+        }
+
+        # live frames of instrumented functions, from outermost to innermost
+        self.frames: List[SanitizedFrame] = []
+        self.layouts: Dict[int, FrameLayout] = {}
+
+        # layouts of instrumented functions, by the address of their frame entry instruction
+        self.entries: Dict[int, FrameLayout] = {}
+        self.__stack_hook: Optional[int] = None
+
+        # global objects, sorted by address
+        self.globals: List[Tuple[int, int, str]] = []
+
+    @staticmethod
+    def stack_handler(ql, access, addr, size, value):
+        """
+        Called when a stack buffer overflow is detected.
+        """
+        pass
+
+    @staticmethod
+    def global_handler(ql, access, addr, size, value):
+        """
+        Called when a global buffer overflow is detected.
+        """
+        pass
+
+    def __report(self, kind: str, access: int, address: int, size: int, buffer: Optional[int], buffer_size: int, alloc_site: Optional[int]) -> None:
+        report = SanitizerReport(
+            kind=kind,
+            access='write' if access == UC_MEM_WRITE else 'read',
+            address=address,
+            size=size,
+            pc=self.ql.arch.regs.arch_pc,
+            buffer=buffer,
+            buffer_size=buffer_size,
+            alloc_site=alloc_site,
+            free_site=None
+        )
+
+        self.ql.log.error(f'Sanitizer: {report}')
+        self.reports.append(report)
+
+    ##################################################
+    # heap
+    ##################################################
+
+    def __malloc(self, ql: Qiling, address: int, params: Mapping) -> int:
+        return self.heap.alloc(params['size'])
+
+    def __calloc(self, ql: Qiling, address: int, params: Mapping) -> int:
+        size = params['nmemb'] * params['size']
+        ptr = self.heap.alloc(size)
+
+        # heap memory may be recycled, so it has to be cleared
+        if ptr:
+            ql.mem.write(ptr, bytes(size))
+
+        return ptr
+
+    def __realloc(self, ql: Qiling, address: int, params: Mapping) -> int:
+        ptr = params['ptr']
+        size = params['size']
+
+        if not ptr:
+            return self.heap.alloc(size)
+
+        old_size = self.heap.size(ptr)
+
+        # let the sanitized heap report the bad pointer
+        if not old_size and ptr not in self.heap.chunks:
+            self.heap.free(ptr)
+
+            return 0
+
+        if not size:
+            self.heap.free(ptr)
+
+            return 0
+
+        new_ptr = self.heap.alloc(size)
+
+        if new_ptr:
+            ql.mem.write(new_ptr, bytes(ql.mem.read(ptr, min(old_size, size))))
+            self.heap.free(ptr)
+
+        return new_ptr
+
+    def __free(self, ql: Qiling, address: int, params: Mapping) -> int:
+        ptr = params['ptr']
+
+        if ptr:
+            self.heap.free(ptr)
+
+        return 0
+
+    def __memalign(self, ql: Qiling, address: int, params: Mapping) -> int:
+        return self.heap.alloc(params['size'], params['alignment'])
+
+    def __posix_memalign(self, ql: Qiling, address: int, params: Mapping) -> int:
+        ptr = self.heap.alloc(params['size'], params['alignment'])
+
+        if not ptr:
+            return 12   # ENOMEM
+
+        ql.mem.write_ptr(params['memptr'], ptr)
+
+        return 0
+
+    def __usable_size(self, ql: Qiling, address: int, params: Mapping) -> int:
+        return self.heap.size(params['ptr'])
+
+    def hook_allocator(self, name: str, address: Optional[int] = None) -> None:
+        """Replace a heap allocation routine with its sanitized counterpart.
+
+        Args:
+            name: routine name, as listed in `allocators`
+            address: routine entry point, for statically linked code; if not set, the routine
+            is hooked by name
+        """
+
+        func, proto = self.allocators[name]
+
+        if address is None:
+            if not isinstance(self.ql.os, QlOsPosix):
+                raise QlErrorNotImplemented('hooking allocation routines by name is supported only on posix systems')
+
+            def __call_by_name(ql: Qiling) -> None:
+                params = ql.os.resolve_fcall_params(proto)
+                retval = func(ql, ql.arch.regs.arch_pc, params)
+
+                ql.os.fcall.cc.setReturnValue(retval)
+
+            self.ql.os.set_api(name, __call_by_name)
+
+        else:
+            def __call_by_address(ql: Qiling) -> None:
+                ql.os.call(address, func, proto, None, None)
+
+            self.ql.hook_address(__call_by_address, address)
+
+    ##################################################
+    # stack
+    ##################################################
+
+    def __disassembler(self, address: int) -> Cs:
+        arch = self.ql.arch
+
+        if arch.type is QL_ARCH.X86:
+            md = Cs(CS_ARCH_X86, CS_MODE_32)
+
+        elif arch.type is QL_ARCH.X8664:
+            md = Cs(CS_ARCH_X86, CS_MODE_64)
+
+        elif arch.type is QL_ARCH.ARM:
+            mode = CS_MODE_THUMB if address & 1 else CS_MODE_ARM
+
+            if arch.endian is QL_ENDIAN.EB:
+                mode += CS_MODE_BIG_ENDIAN
+
+            md = Cs(CS_ARCH_ARM, mode)
+
+        else:
+            raise QlErrorNotImplemented(f'stack instrumentation is not supported on {arch.type.name}')
+
+        # operands details are needed to tell apart constant frame sizes
+        md.detail = True
+
+        return md
+
+    def __analyze(self, address: int, size: int) -> Optional[FrameLayout]:
+        """Determine the stack frame layout of a function from its prologue.
+        """
+
+        md = self.__disassembler(address)
+        intel = self.ql.arch.type in (QL_ARCH.X86, QL_ARCH.X8664)
+
+        # thumb functions are marked by their lsb
+        if not intel:
+            address &= ~1
+
+        code = bytes(self.ql.mem.read(address, size))
+
+        saved = 0
+        locals = 0
+        entry = None
+        prologue_end = None
+
+        for insn in md.disasm(code[:64], address):
+            mnem, ops = insn.mnemonic, insn.op_str
+
+            if intel:
+                if mnem in ('endbr64', 'endbr32', 'nop'):
+                    continue
+
+                # saved register
+                if mnem == 'push' and not ops[0].isdigit():
+                    if entry is None:
+                        entry = insn.address
+
+                    saved += self.ql.arch.pointersize
+                    continue
+
+                # frame pointer setup
+                if mnem == 'mov' and ops in ('rbp, rsp', 'ebp, esp'):
+                    continue
+
+                # local variables area allocation. frames sized at run time (e.g. by alloca) are
+                # not supported
+                if mnem == 'sub' and ops.startswith(('rsp, ', 'esp, ')) and insn.operands[-1].type == CS_OP_IMM:
+                    locals = insn.operands[-1].imm
+                    prologue_end = insn.address + insn.size
+
+            else:
+                # saved registers, along with the return address
+                if mnem.startswith('push') or (mnem.startswith('stmdb') and ops.startswith('sp!')):
+                    if 'lr' not in ops:
+                        break
+
+                    entry = insn.address
+                    saved += 4 * (ops.count(',') + 1)
+                    continue
+
+                # frame pointer setup
+                if mnem.startswith(('add', 'mov')) and ops.startswith(('r7, sp', 'r11, sp', 'fp, sp')):
+                    continue
+
+                # local variables area allocation
+                if mnem.startswith('sub') and ops.startswith('sp, ') and insn.operands[-1].type == CS_OP_IMM and saved:
+                    locals = insn.operands[-1].imm
+                    prologue_end = insn.address + insn.size
+
+            break
+
+        # frames are tracked from the first saved register on, so functions that do not save
+        # any are not supported
+        if prologue_end is None or entry is None or locals < self.min_frame:
+            return None
+
+        # unicorn reports the exact pc of memory accesses only on intel; elsewhere, the pc is the one
+        # of the translation block, so the frame record is guarded by the stack pointer position alone
+        exempt = set()
+
+        if intel:
+            exempt.update(insn.address for insn in md.disasm(code, address) if insn.mnemonic == 'leave')
+
+        # on intel the return address is pushed by the caller, right above the first saved register
+        offset = 0
+
+        if intel:
+            offset = self.ql.arch.pointersize
+            saved += offset
+
+        return FrameLayout(address, entry, offset, saved, locals, exempt)
+
+    def __retire(self, frame: SanitizedFrame) -> None:
+        """Retire a frame along with the frames below it, and unpoison their redzones.
+        """
+
+        while self.frames:
+            inner = self.frames.pop()
+
+            if inner.lbound < inner.ubound:
+                self.shadow.unpoison(inner.lbound, inner.ubound - inner.lbound)
+
+            if inner is frame:
+                break
+
+    def __enter(self, layout: FrameLayout, sp: int) -> None:
+        top = sp + layout.offset
+        frames = self.frames
+
+        # a prologue that saves several registers at once accesses the stack several times
+        if frames and frames[-1].layout is layout and frames[-1].top == top:
+            return
+
+        # frames at or below the new one are stale; they must have exited without going through
+        # an instrumented return (e.g. a tail call or a long jump)
+        while frames and frames[-1].bottom < top:
+            self.__retire(frames[-1])
+
+        frame = SanitizedFrame(layout, top)
+        frames.append(frame)
+
+        if frame.lbound < frame.ubound:
+            self.shadow.poison(frame.lbound, frame.ubound, SHADOW_STACK_REDZONE)
+
+    def __on_stack_access(self, uc: Uc, access: int, address: int, size: int, value: int, user_data) -> None:
+        regs = self.ql.arch.regs
+        pc = uc.reg_read(regs.uc_pc)
+
+        layout = self.entries.get(pc)
+
+        # the prologue saving the first registers, right below the stack pointer
+        if layout is not None and access == UC_MEM_WRITE:
+            sp = uc.reg_read(regs.uc_sp)
+
+            if sp + layout.offset - layout.saved <= address < sp:
+                self.__enter(layout, sp)
+                return
+
+        faulty = self.shadow.check(address, size)
+
+        if faulty is None:
+            return
+
+        frame = next((f for f in reversed(self.frames) if f.bottom <= faulty < f.top), None)
+
+        if frame is None:
+            return
+
+        sp = uc.reg_read(regs.uc_sp)
+
+        # the function saving or restoring its own registers. reading the return address, which is
+        # at the top of the frame record, is the last thing it does before returning
+        if frame.bottom <= sp <= frame.top or pc in frame.layout.exempt:
+            if access != UC_MEM_WRITE and address + size >= frame.top:
+                self.__retire(frame)
+
+            return
+
+        # a live frame is always above the stack pointer, so this one has exited without going
+        # through an instrumented return, and its stack space is being reused
+        if frame.bottom < sp:
+            self.__retire(frame)
+            return
+
+        self.__report('stack-buffer-overflow', access, faulty, size, frame.locals_base, frame.locals_size, frame.layout.address)
+        self.stack_handler(self.ql, access, faulty, size, value)
+
+    def __hook_stack(self) -> None:
+        sp = self.ql.arch.regs.arch_sp
+
+        for lbound, ubound, _, _, is_mmio in self.ql.mem.map_info:
+            if lbound < sp <= ubound and not is_mmio:
+                break
+        else:
+            raise QlMemoryMappedError('stack pointer does not point to mapped memory')
+
+        # stack accesses are frequent, so the hook is registered directly with unicorn to spare
+        # the dispatching overhead
+        self.__stack_hook = self.ql.uc.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, self.__on_stack_access, None, lbound, ubound - 1)
+
+    def instrument_frame(self, address: int, size: int) -> bool:
+        """Guard the stack frame of a function, if it allocates one.
+
+        Args:
+            address: function entry point; the lsb marks thumb functions on arm
+            size: function size, in bytes
+
+        Returns: `True` if the function was instrumented, `False` if its frame is too small or
+        it does not seem to allocate one
+        """
+
+        layout = self.__analyze(address, size)
+
+        if layout is None:
+            return False
+
+        if self.__stack_hook is None:
+            self.__hook_stack()
+
+        self.layouts[layout.address] = layout
+        self.entries[layout.entry] = layout
+
+        return True
+
+    ##################################################
+    # globals
+    ##################################################
+
+    def __on_global_access(self, uc, access: int, address: int, size: int, value: int, user_data) -> None:
+        faulty = self.shadow.check(address, size)
+
+        if faulty is None:
+            return
+
+        # the overflown object is the one preceding the faulty address
+        i = bisect.bisect_right(self.globals, (faulty, float('inf'))) - 1
+        buffer, buffer_size = self.globals[i][:2] if i >= 0 else (None, 0)
+
+        self.__report('global-buffer-overflow', access, faulty, size, buffer, buffer_size, None)
+        self.global_handler(self.ql, access, faulty, size, value)
+
+    def add_globals(self, objects: Iterable[Tuple[int, int, str]]) -> None:
+        """Poison the alignment padding between global objects. Objects are expected to reside
+        in the same writable section.
+
+        Args:
+            objects: an iterable of global objects addresses, sizes and names
+        """
+
+        objects = sorted(objects)
+        lbound = None
+        ubound = None
+
+        for (addr, size, _), (next_addr, _, _) in zip(objects, objects[1:]):
+            end = addr + size
+
+            # aliases and overlapping objects
+            if next_addr < end:
+                continue
+
+            # a gap wider than the alignment of the next object is likely to hold unnamed data
+            # (e.g. literals or compiler generated tables) rather than padding
+            if next_addr - end >= min(next_addr & -next_addr, self.MAX_GLOBAL_ALIGN):
+                continue
+
+            gap_begins = (end + GRANULE_SIZE - 1) & ~(GRANULE_SIZE - 1)
+            gap_ends = next_addr & ~(GRANULE_SIZE - 1)
+
+            if gap_begins > next_addr:
+                continue
+
+            # tail of a partially used granule
+            if end % GRANULE_SIZE:
+                self.shadow.unpoison(end & ~(GRANULE_SIZE - 1), end % GRANULE_SIZE)
+
+            if gap_begins < gap_ends:
+                self.shadow.poison(gap_begins, gap_ends, SHADOW_GLOBAL_REDZONE)
+
+            if lbound is None:
+                lbound = end & ~(GRANULE_SIZE - 1)
+
+            ubound = gap_ends
+
+        self.globals = sorted(self.globals + objects)
+
+        if lbound is not None and lbound < ubound:
+            self.ql.uc.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, self.__on_global_access, None, lbound, ubound - 1)
+
+    ##################################################
+    # images
+    ##################################################
+
+    def instrument(self, path: Optional[str] = None, *, heap: bool = True, stack: bool = True, globals: bool = True) -> None:
+        """Instrument a loaded ELF image using its symbol table.
+
+        Allocation routines that are defined in the image are replaced by address; otherwise,
+        they are replaced by name where supported. Functions and global objects are instrumented
+        according to their symbols.
+
+        Args:
+            path: path of the loaded image to instrument; if not set, the main image is used
+            heap: whether to replace heap allocation routines
+            stack: whether to instrument functions stack frames
+            globals: whether to poison the padding between global objects
+        """
+
+        images = self.ql.loader.images
+
+        image = images[0] if path is None else next(img for img in images if img.path == path)
+
+        with open(image.path, 'rb') as infile:
+            elffile = ELFFile(infile)
+
+            vaddr = min(seg['p_vaddr'] for seg in elffile.iter_segments(type='PT_LOAD'))
+            delta = image.base - self.ql.mem.align(vaddr)
+
+            symtab = elffile.get_section_by_name('.symtab') or elffile.get_section_by_name('.dynsym')
+            symbols = [] if symtab is None else list(symtab.iter_symbols())
+
+            # read-only data is interleaved with unnamed literals, so only writable sections are considered
+            writable = {i for i, sec in enumerate(elffile.iter_sections()) if sec['sh_flags'] & SH_FLAGS.SHF_WRITE}
+
+        functions: Dict[int, Tuple[str, int]] = {}
+        objects: Dict[int, Dict[int, Tuple[int, str]]] = {}
+
+        for sym in symbols:
+            if sym['st_shndx'] == 'SHN_UNDEF' or not sym['st_size']:
+                continue
+
+            stype = sym['st_info']['type']
+            address = sym['st_value'] + delta
+
+            if stype == 'STT_FUNC':
+                # allocation routines may have several aliases; prefer the well-known name
+                if address not in functions or sym.name in self.allocators:
+                    functions[address] = (sym.name, sym['st_size'])
+
+            elif stype == 'STT_OBJECT' and sym['st_shndx'] in writable:
+                section = objects.setdefault(sym['st_shndx'], {})
+
+                if sym['st_size'] > section.get(address, (0, ''))[0]:
+                    section[address] = (sym['st_size'], sym.name)
+
+        hooked = set()
+
+        for address, (name, size) in functions.items():
+            if name in self.allocators:
+                if heap:
+                    self.hook_allocator(name, address)
+                    hooked.add(name)
+
+            elif stack:
+                self.instrument_frame(address, size)
+
+        # allocation routines that are not defined in this image are likely to be imported
+        if heap and not hooked and isinstance(self.ql.os, QlOsPosix):
+            for name in self.allocators:
+                self.hook_allocator(name)
+
+        if globals:
+            for section in objects.values():
+                self.add_globals((address, size, name) for address, (size, name) in section.items())
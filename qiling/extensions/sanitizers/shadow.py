@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from __future__ import annotations
+
+from typing import Dict, Mapping, NamedTuple, Optional
+
+
+# shadow memory granule size, in bytes. every granule of memory is described by one shadow byte
+GRANULE_SIZE = 8
+
+# shadow byte values. values below the granule size indicate a partially addressable granule,
+# where only the first bytes are addressable
+SHADOW_ADDRESSABLE     = 0x00
+SHADOW_STACK_REDZONE   = 0xf2
+SHADOW_GLOBAL_REDZONE  = 0xf9
+SHADOW_LEFT_REDZONE    = 0xfa
+SHADOW_RIGHT_REDZONE   = 0xfb
+SHADOW_FREED           = 0xfd
+
+# number of memory bytes covered by a single shadow page, in bits
+SHADOW_PAGE_BITS = 15
+SHADOW_PAGE_MASK = (1 << SHADOW_PAGE_BITS) - 1
+
+class SanitizerReport(NamedTuple):
+    kind: str                   # e.g. 'heap-buffer-overflow', 'heap-use-after-free', 'stack-buffer-overflow'
+    access: str                 # 'read', 'write' or 'free'
+    address: int                # offending address
+    size: int                   # access size, in bytes
+    pc: int                     # offending instruction address
+    buffer: Optional[int]       # address of the relevant buffer, if known
+    buffer_size: int            # size of the relevant buffer
+    alloc_site: Optional[int]   # where the relevant buffer was allocated from
+    free_site: Optional[int]    # where the relevant buffer was freed from
+
+    def __str__(self) -> str:
+        desc = f'{self.kind}: {self.access} of {self.size} bytes at {self.address:#x}, pc = {self.pc:#x}'
+
+        if self.buffer is not None:
+            desc += f'; {self.address - self.buffer:+d} bytes from a {self.buffer_size} bytes buffer at {self.buffer:#x}'
+
+        if self.alloc_site is not None:
+            desc += f', allocated at {self.alloc_site:#x}'
+
+        if self.free_site is not None:
+            desc += f', freed at {self.free_site:#x}'
+
+        return desc
+
+
+class QlShadowMemory:
+    """A sparse shadow memory map, where every memory granule is described by a single shadow
+    byte, much like ASan does. Shadow pages are allocated only for memory that was poisoned at
+    some point; everything else is considered addressable.
+    """
+
+    def __init__(self):
+        self.pages: Dict[int, bytearray] = {}
+
+    def save(self) -> Mapping[int, bytes]:
+        return {index: bytes(page) for index, page in self.pages.items()}
+
+    def restore(self, saved_state: Mapping[int, bytes]) -> None:
+        self.pages = {index: bytearray(page) for index, page in saved_state.items()}
+
+    def __set(self, lbound: int, ubound: int, value: int) -> None:
+        while lbound < ubound:
+            index = lbound >> SHADOW_PAGE_BITS
+            page = self.pages.get(index)
+
+            if page is None:
+                # unpoisoning memory that was never poisoned; nothing to do
+                if value == SHADOW_ADDRESSABLE:
+                    lbound = (index + 1) << SHADOW_PAGE_BITS
+                    continue
+
+                page = self.pages[index] = bytearray((SHADOW_PAGE_MASK + 1) // GRANULE_SIZE)
+
+            end = min(ubound, (index + 1) << SHADOW_PAGE_BITS)
+
+            g0 = (lbound & SHADOW_PAGE_MASK) // GRANULE_SIZE
+            g1 = ((end - 1) & SHADOW_PAGE_MASK) // GRANULE_SIZE + 1
+
+            page[g0:g1] = bytes([value]) * (g1 - g0)
+
+            lbound = end
+
+    def poison(self, lbound: int, ubound: int, value: int) -> None:
+        """Poison all granules within a range. Both boundaries are expected to be granule-aligned.
+        """
+
+        self.__set(lbound, ubound, value)
+
+    def unpoison(self, address: int, size: int) -> None:
+        """Mark a range as addressable. The range is expected to start on a granule boundary; in
+        case it does not end on one, its last granule is marked as partially addressable.
+        """
+
+        tail = size % GRANULE_SIZE
+
+        self.__set(address, address + size - tail, SHADOW_ADDRESSABLE)
+
+        if tail:
+            self.__set(address + size - tail, address + size, tail)
+
+    def value(self, address: int) -> int:
+        """Get the shadow byte describing the granule that contains a specific address.
+        """
+
+        page = self.pages.get(address >> SHADOW_PAGE_BITS)
+
+        return SHADOW_ADDRESSABLE if page is None else page[(address & SHADOW_PAGE_MASK) // GRANULE_SIZE]
+
+    def check(self, address: int, size: int) -> Optional[int]:
+        """Check whether a memory access is allowed.
+
+        Args:
+            address: accessed address
+            size: access size, in bytes
+
+        Returns: address of the first non-addressable byte accessed, or `None` if the access is allowed
+        """
+
+        last = address + size - 1
+        page = self.pages.get(address >> SHADOW_PAGE_BITS)
+
+        # fast path: an access that does not straddle shadow pages, which is the common case
+        if (address >> SHADOW_PAGE_BITS) == (last >> SHADOW_PAGE_BITS):
+            if page is None:
+                return None
+
+            g0 = (address & SHADOW_PAGE_MASK) // GRANULE_SIZE
+            g1 = (last & SHADOW_PAGE_MASK) // GRANULE_SIZE
+
+            if g0 == g1:
+                shadow = page[g0]
+
+                if shadow == SHADOW_ADDRESSABLE or (shadow < GRANULE_SIZE and last % GRANULE_SIZE < shadow):
+                    return None
+
+            elif not any(page[g0:g1 + 1]):
+                return None
+
+        for offset in range(address, last + 1):
+            shadow = self.value(offset)
+
+            if shadow != SHADOW_ADDRESSABLE and (shadow >= GRANULE_SIZE or offset % GRANULE_SIZE >= shadow):
+                return offset
+
+        return None
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import bisect
+import copy
+import io
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from unicorn import UC_HOOK_MEM_WRITE_PROT, UC_PROT_WRITE
+
+from qiling import Qiling
+from qiling.const import QL_ENDIAN
+
+# tuple: range start, range end, permissions mask, range label, content
+Region = Tuple[int, int, int, str, bytes]
+
+# tuple: range start, range end, permissions mask
+Layout = List[Tuple[int, int, int]]
+
+
+class QlPageTracker:
+    """Track the memory pages that get modified, paying only for the first write to each of them.
+
+    Writable pages of the tracked ranges are write-protected, so the first write to each of them
+    is caught, the page is marked as dirty and its write protection is lifted. Pages modified by
+    the host through the memory manager are marked as dirty as well.
+
+    An optional callback is called with the page address right before the page gets dirty, while
+    it still holds its original content.
+    """
+
+    def __init__(self, ql: Qiling, on_touch: Optional[Callable[[int], None]] = None):
+        self.ql = ql
+        self.on_touch = on_touch
+
+        self.pagesize = ql.mem.pagesize
+        self.pagemask = ~(self.pagesize - 1)
+        self.byteorder = 'big' if ql.arch.endian == QL_ENDIAN.EB else 'little'
+
+        # tracked ranges, sorted by their start address
+        self.ranges: Layout = []
+        self.bounds: List[int] = []
+
+        # pages that were modified since tracking started or was rearmed
+        self.dirty: Set[int] = set()
+
+        self.__hook: Optional[int] = None
+
+    def __range(self, page: int) -> Optional[Tuple[int, int, int]]:
+        """Get the tracked range that contains the specified page.
+        """
+
+        idx = bisect.bisect_right(self.bounds, page) - 1
+
+        if idx < 0:
+            return None
+
+        rng = self.ranges[idx]
+
+        return rng if page < rng[1] else None
+
+    def __on_write_prot(self, uc, access: int, address: int, size: int, value: int, user_data) -> bool:
+        first = address & self.pagemask
+        last = (address + size - 1) & self.pagemask
+
+        # the access may straddle two pages
+        pages = (first,) if first == last else (first, last)
+        clean = [page for page in pages if page not in self.dirty]
+
+        # all pages are already tracked as dirty: this is a genuine write violation
+        if not clean:
+            return False
+
+        for page in pages:
+            rng = self.__range(page)
+
+            if rng is None or not rng[2] & UC_PROT_WRITE:
+                return False
+
+        for page in clean:
+            if self.on_touch is not None:
+                self.on_touch(page)
+
+            uc.mem_protect(page, self.pagesize, self.__range(page)[2])
+            self.dirty.add(page)
+
+        # unicorn drops the faulting write even when the fault is handled, so it has to be carried out here
+        uc.mem_write(address, (value & ((1 << (size * 8)) - 1)).to_bytes(size, self.byteorder))
+
+        return True
+
+    def __on_host_change(self, address: int, size: int) -> None:
+        for page in range(address & self.pagemask, address + size, self.pagesize):
+            # pages outside of the tracked ranges have no original content to care about
+            if page in self.dirty or self.__range(page) is None:
+                continue
+
+            if self.on_touch is not None:
+                self.on_touch(page)
+
+            self.dirty.add(page)
+
+            # lift the write protection, unless the page is not supposed to be writable
+            for lbound, ubound, perms, _, is_mmio in self.ql.mem.map_info:
+                if lbound <= page < ubound:
+                    if not is_mmio:
+                        self.ql.uc.mem_protect(page, self.pagesize, perms)
+
+                    break
+
+    def track(self, ranges: Layout) -> None:
+        """Start tracking the specified ranges from a clean state. Ranges are expected not to
+        overlap each other.
+        """
+
+        ql = self.ql
+
+        if self.__hook is None:
+            # writes to write-protected pages are caught directly on the unicorn level: unlike qiling
+            # memory hooks, unicorn lets the callback decide whether the access is to be considered
+            # handled, so genuine write violations are left for the emulated program to crash on
+            self.__hook = ql.uc.hook_add(UC_HOOK_MEM_WRITE_PROT, self.__on_write_prot)
+
+            ql.mem.observers.append(self.__on_host_change)
+
+        self.ranges = sorted(ranges)
+        self.bounds = [lbound for lbound, _, _ in self.ranges]
+
+        for lbound, ubound, perms in self.ranges:
+            if perms & UC_PROT_WRITE:
+                ql.uc.mem_protect(lbound, ubound - lbound, perms & ~UC_PROT_WRITE)
+
+        self.dirty.clear()
+
+    def rearm(self) -> None:
+        """Write-protect the dirty pages again and mark all pages as clean. Dirty pages are
+        expected to be mapped with their tracked permissions.
+        """
+
+        for page in self.dirty:
+            rng = self.__range(page)
+
+            if rng is not None and rng[2] & UC_PROT_WRITE:
+                self.ql.uc.mem_protect(page, self.pagesize, rng[2] & ~UC_PROT_WRITE)
+
+        self.dirty.clear()
+
+    def untrack(self) -> None:
+        """Stop tracking memory changes and lift the write protection off the tracked pages.
+        """
+
+        ql = self.ql
+
+        if self.__hook is not None:
+            ql.uc.hook_del(self.__hook)
+            ql.mem.observers.remove(self.__on_host_change)
+
+            self.__hook = None
+
+        # the layout may have changed since tracking started, so permissions are taken from the
+        # current one rather than from the tracked ranges
+        for lbound, ubound, perms, _, is_mmio in ql.mem.map_info:
+            if is_mmio or not perms & UC_PROT_WRITE:
+                continue
+
+            for tlbound, tubound, _ in self.ranges:
+                if tlbound < ubound and lbound < tubound:
+                    ql.uc.mem_protect(lbound, ubound - lbound, perms)
+                    break
+
+        self.ranges = []
+        self.bounds = []
+        self.dirty.clear()
+
+
+class QlSnapshot:
+    """Capture the emulation state once and cheaply roll back to it, over and over again.
+
+    Memory is restored incrementally: once captured, modified pages are tracked as dirty (see
+    `QlPageTracker`), so rolling back rewrites only the dirty pages and write-protects them again.
+
+    Besides memory, the snapshot covers the cpu context, the file descriptors table along with
+    the offsets of files and the content of in-memory streams, the loader state, the os heap and
+    the hardware state. Multithreaded emulation is not supported.
+    """
+
+    def __init__(self, ql: Qiling):
+        self.ql = ql
+
+        self.tracker = QlPageTracker(ql)
+
+        self.capture()
+
+    def __layout(self) -> Layout:
+        """Get current ram layout, where adjacent ranges of equal permissions are merged.
+        """
+
+        layout = []
+
+        for lbound, ubound, perms, _, is_mmio in self.ql.mem.map_info:
+            if is_mmio:
+                continue
+
+            if layout and layout[-1][1] == lbound and layout[-1][2] == perms:
+                layout[-1] = (layout[-1][0], ubound, perms)
+            else:
+                layout.append((lbound, ubound, perms))
+
+        return layout
+
+    def __region(self, page: int) -> Optional[Region]:
+        """Get the captured region that contains the specified page.
+        """
+
+        idx = bisect.bisect_right(self.bounds, page) - 1
+
+        if idx < 0:
+            return None
+
+        region = self.regions[idx]
+
+        return region if page < region[1] else None
+
+    @staticmethod
+    def __save_stream(stream: Any) -> Optional[Tuple[Optional[bytes], int]]:
+        # in-memory streams, such as those used to mock stdin
+        if isinstance(stream, io.BytesIO):
+            return io.BytesIO.getvalue(stream), io.BytesIO.tell(stream)
+
+        if hasattr(stream, 'tell') and hasattr(stream, 'seek'):
+            try:
+                return None, stream.tell()
+            except OSError:
+                pass
+
+        return None
+
+    @staticmethod
+    def __restore_stream(stream: Any, state: Tuple[Optional[bytes], int]) -> None:
+        content, offset = state
+
+        if isinstance(stream, io.BytesIO):
+            io.BytesIO.seek(stream, 0)
+            io.BytesIO.truncate(stream)
+            io.BytesIO.write(stream, content)
+            io.BytesIO.seek(stream, offset)
+
+        else:
+            stream.seek(offset)
+
+    def capture(self) -> None:
+        """Capture current emulation state. Subsequent rollbacks will revert to it.
+        """
+
+        ql = self.ql
+
+        self.regions: List[Region] = [(lbound, ubound, perms, label, bytes(ql.mem.read(lbound, ubound - lbound))) for lbound, ubound, perms, label, is_mmio in ql.mem.map_info if not is_mmio]
+        self.bounds = [lbound for lbound, *_ in self.regions]
+        self.layout = self.__layout()
+
+        self.tracker.track([(lbound, ubound, perms) for lbound, ubound, perms, _, _ in self.regions])
+
+        self.context = ql.arch.save()
+        self.loader = ql.loader.save()
+        self.os = ql.os.save()
+
+        heap = getattr(ql.os, 'heap', None)
+        self.heap = None if heap is None else copy.deepcopy(heap.save())
+
+        self.hw = ql.hw.save() if ql.baremetal else None
+
+        fd = getattr(ql.os, 'fd', None)
+        self.fds: Optional[List] = None if fd is None else list(fd)
+        self.streams: Dict[int, Tuple[Any, Tuple[Optional[bytes], int]]] = {}
+
+        if self.fds is not None:
+            for stream in self.fds:
+                if stream is not None and id(stream) not in self.streams:
+                    state = self.__save_stream(stream)
+
+                    if state is not None:
+                        self.streams[id(stream)] = (stream, state)
+
+    def __restore_layout(self) -> None:
+        """Unmap ranges that were mapped or re-protected since the capture, and map back
+        the captured ranges that are missing.
+        """
+
+        mem = self.ql.mem
+        captured = set(self.layout)
+
+        for lbound, ubound, perms in self.__layout():
+            if (lbound, ubound, perms) not in captured:
+                mem.unmap_between(lbound, ubound)
+
+        # newly mapped ranges are marked as dirty, hence get their content restored
+        for lbound, ubound, perms, label, _ in self.regions:
+            if mem.is_available(lbound, ubound - lbound):
+                mem.map(lbound, ubound - lbound, perms, label)
+
+    def restore(self) -> None:
+        """Roll back to the captured emulation state.
+        """
+
+        ql = self.ql
+        uc = ql.uc
+
+        if self.__layout() != self.layout:
+            self.__restore_layout()
+
+        pagesize = self.tracker.pagesize
+
+        for page in self.tracker.dirty:
+            lbound, _, _, _, content = self.__region(page)
+            offset = page - lbound
+
+            uc.mem_write(page, content[offset:offset + pagesize])
+
+        self.tracker.rearm()
+
+        ql.arch.restore(self.context)
+        ql.loader.restore(self.loader)
+        ql.os.restore(self.os)
+
+        if self.heap is not None:
+            ql.os.heap.restore(copy.deepcopy(self.heap))
+
+        if self.hw is not None:
+            ql.hw.restore(self.hw)
+
+        if self.fds is not None:
+            self.__restore_fds()
+
+    def __restore_fds(self) -> None:
+        fd = self.ql.os.fd
+        captured = set(id(stream) for stream in self.fds if stream is not None)
+
+        # close whatever was opened since the capture
+        for stream in fd:
+            if stream is not None and id(stream) not in captured:
+                captured.add(id(stream))
+
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+        fd.restore(list(self.fds))
+
+        for stream, state in self.streams.values():
+            self.__restore_stream(stream, state)
+
+    def remove(self) -> None:
+        """Stop tracking memory changes and lift the write protection off the captured pages.
+        The snapshot cannot be used afterwards.
+        """
+
+        self.tracker.untrack()
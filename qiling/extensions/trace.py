@@ -2,87 +2,217 @@
 
 # More info, please refer to https://github.com/qilingframework/qiling/pull/765
 
-from collections import deque
-from typing import Deque, Iterable, Iterator, Mapping, Tuple
+import logging
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
 
-from capstone import Cs, CsInsn, CS_ARCH_X86, CS_OP_IMM, CS_OP_MEM, CS_OP_REG
+from capstone import CsError, CsInsn, CS_OP_IMM, CS_OP_MEM, CS_OP_REG
 from capstone.x86 import X86Op
-from capstone.x86_const import X86_INS_LEA, X86_REG_INVALID, X86_REG_RIP
+from capstone.x86_const import X86_INS_LEA
 
 from qiling import Qiling
+from qiling.const import QL_ARCH
+from qiling.core_hooks_types import HookRet
+from qiling.exception import QlErrorModuleNotFound
+from qiling.extensions.tracing.formats.registers import ArchRegs, RegsSnapshots
 
-TraceRecord = Tuple[CsInsn, Iterable[Tuple[int, int]]]
+# a register referenced by an instruction: its name, the index of the traced register that holds
+# it and how to extract its value from there
+RegRef = Tuple[str, int, int, int]
 
-# <WORKAROUND>
-def __uc2_workaround() -> Mapping[int, int]:
-    """Starting from Unicorn2, Unicorn and Capstone Intel registers definitions are
-    no longer aligned and cannot be used interchangebly. This temporary workaround
-    maps capstone x86 registers definitions to unicorn x86 registers definitions.
+# a traced instruction: the decoded instruction, the registers it references and a batch reader
+# for the traced registers that hold them
+TraceSite = Tuple[CsInsn, Sequence[RegRef], Optional[RegsSnapshots]]
 
-    see: https://github.com/unicorn-engine/unicorn/issues/1492
+# registers that are not traced on their own, but are part of a traced register: alias name
+# mapped to the traced register name, shift and mask
+RegAliases = Mapping[str, Tuple[str, int, int]]
+
+def __x86_aliases(prefix: str) -> RegAliases:
+    """[private] Map x86 sub-registers to their containing registers, as named in `ArchRegs`.
     """
 
-    from capstone import x86_const as cs_x86_const
-    from unicorn import x86_const as uc_x86_const
+    wide = prefix == 'r'
+    aliases = {}
 
-    def __canonicalized_mapping(module, prefix: str) -> Mapping[str, int]:
-        return dict((k[len(prefix):], getattr(module, k)) for k in dir(module) if k.startswith(prefix))
+    for r in ('a', 'b', 'c', 'd'):
+        aliases[f'{r}x'] = (f'{prefix}{r}x', 0, 0xffff)
+        aliases[f'{r}l'] = (f'{prefix}{r}x', 0, 0xff)
+        aliases[f'{r}h'] = (f'{prefix}{r}x', 8, 0xff)
 
-    cs_x86_regs = __canonicalized_mapping(cs_x86_const, 'X86_REG')
-    uc_x86_regs = __canonicalized_mapping(uc_x86_const, 'UC_X86_REG')
+        if wide:
+            aliases[f'e{r}x'] = (f'r{r}x', 0, 0xffffffff)
 
-    return dict((cs_x86_regs[k], uc_x86_regs[k]) for k in cs_x86_regs if k in uc_x86_regs)
+    for r in ('si', 'di', 'bp', 'sp'):
+        aliases[r] = (f'{prefix}{r}', 0, 0xffff)
+        aliases[f'{r}l'] = (f'{prefix}{r}', 0, 0xff)
 
-CS_UC_REGS = __uc2_workaround()
-# </WORKAROUND>
+        if wide:
+            aliases[f'e{r}'] = (f'r{r}', 0, 0xffffffff)
 
-def __get_trace_records(ql: Qiling, address: int, size: int, md: Cs) -> Iterator[TraceRecord]:
-    """[private] Acquire trace info for the current instruction and yield as a trace record.
-    A trace record is a parsed instruction paired to a list of registers and their values.
+    if wide:
+        for i in range(8, 16):
+            aliases[f'r{i}d'] = (f'r{i}', 0, 0xffffffff)
+            aliases[f'r{i}w'] = (f'r{i}', 0, 0xffff)
+            aliases[f'r{i}b'] = (f'r{i}', 0, 0xff)
 
-    This method might yield more than one record for a single instruction.
-    """
+        aliases['eip'] = ('rip', 0, 0xffffffff)
 
-    # unicorn denotes unsupported instructions by a magic size value. though these instructions
-    # are not emulated, capstone can still parse them.
-    if size == 0xf1f1f1f1:
-        # note that invalid instructions will generate a StopIteration exception here
-        yield next(__get_trace_records(ql, address, 16, md))
-        return
+    return aliases
 
-    # a trace line is generated even for hook addresses that do not contain meaningful opcodes.
-    # in that case, make it look like a nop
-    if address in ql._addr_hook:
-        buf = b'\x90'
-    else:
-        buf = ql.mem.read(address, size)
+def __arm64_aliases() -> RegAliases:
+    """[private] Map arm64 32-bit and special purpose register names to their 64-bit registers.
+    """
+
+    aliases = {f'w{i}': (f'x{i}', 0, 0xffffffff) for i in range(31)}
+
+    aliases['fp'] = ('x29', 0, ~0)
+    aliases['lr'] = ('x30', 0, ~0)
+    aliases['wsp'] = ('sp', 0, 0xffffffff)
+
+    return aliases
+
+__arm_aliases = {
+    'sb': ('r9', 0, ~0),
+    'sl': ('r10', 0, ~0),
+    'fp': ('r11', 0, ~0),
+    'ip': ('r12', 0, ~0)
+}
+
+REG_ALIASES: Mapping[QL_ARCH, RegAliases] = {
+    QL_ARCH.X86:      __x86_aliases('e'),
+    QL_ARCH.X8664:    __x86_aliases('r'),
+    QL_ARCH.ARM:      __arm_aliases,
+    QL_ARCH.CORTEX_M: __arm_aliases,
+    QL_ARCH.ARM64:    __arm64_aliases(),
+    QL_ARCH.MIPS:     {'s8': ('fp', 0, ~0)},
+    QL_ARCH.RISCV:    {'fp': ('s0', 0, ~0)},
+    QL_ARCH.RISCV64:  {'fp': ('s0', 0, ~0)}
+}
+
+def __referenced_regs(insn: CsInsn) -> Iterator[int]:
+    """[private] Get the registers an instruction reads from.
+    """
 
-    for insn in md.disasm(buf, address):
+    try:
         # BUG: insn.regs_read doesn't work well, so we use insn.regs_access()[0]
-        state = tuple((reg, ql.arch.regs.read(CS_UC_REGS[reg])) for reg in insn.regs_access()[0])
+        regs_read, _ = insn.regs_access()
 
-        yield (insn, state)
+    except CsError:
+        # some architectures (e.g. mips and risc-v) do not provide registers access info; settle
+        # for the registers that appear in the operands, even if they are only written to
+        regs_read = list(insn.regs_read)
 
-def __to_trace_line(record: TraceRecord, symsmap: Mapping[int, str] = {}) -> str:
-    """[private] Transform trace info into a formatted trace line.
+        for op in insn.operands:
+            if op.type == CS_OP_REG:
+                regs_read.append(op.value.reg)
+
+            elif op.type == CS_OP_MEM:
+                regs_read.append(op.value.mem.base)
+
+    return (reg for reg in regs_read if reg)
+
+def __make_site_factory(ql: Qiling) -> Callable[[CsInsn], TraceSite]:
+    """[private] Create a method that resolves the registers an instruction references to the
+    registers listed for the arch in `ArchRegs`, and sets up a batch reader for them.
+
+    Registers that are not covered by `ArchRegs` (e.g. flags, segment and vector registers) are
+    left out of the trace.
     """
 
-    insn, state = record
+    # raises an exception on unsupported archs
+    arch_regs = ArchRegs(ql.arch)
 
-    # when the rip register is referenced from within an instruction it is expected to point
-    # to the next instruction boundary. since unicorn has not executed the instruction yet
-    # is uses the cpu state resulted from the previous instruction - and rip points to the
-    # current instruction instead of the next one.
-    #
-    # here we patch rip value recorded in state to point to the next instruction boundary
-    state = tuple((reg, val + insn.size if reg == X86_REG_RIP else val) for reg, val in state)
+    traced = {name[1:]: uc_reg for name, uc_reg in arch_regs.registers.items()}
+    aliases = REG_ALIASES.get(ql.arch.type, {})
 
-    def __read_reg(reg: int) -> int:
-        """[internal] Read a register value from the recorded state. Only registers that were
-        referenced by the current instruction can be read.
-        """
+    def __resolve(name: str) -> Optional[Tuple[str, int, int]]:
+        if name in traced:
+            return (name, 0, ~0)
+
+        return aliases.get(name)
+
+    def __make_site(insn: CsInsn) -> TraceSite:
+        uc_regs: List[int] = []
+        refs: List[RegRef] = []
+
+        for reg in __referenced_regs(insn):
+            name = insn.reg_name(reg)
+            resolved = name and __resolve(name)
+
+            if not resolved or any(r[0] == name for r in refs):
+                continue
+
+            parent, shift, mask = resolved
+            uc_reg = traced[parent]
+
+            if uc_reg not in uc_regs:
+                uc_regs.append(uc_reg)
+
+            refs.append((name, uc_regs.index(uc_reg), shift, mask))
+
+        reader = RegsSnapshots(ql.uc, uc_regs) if uc_regs else None
+
+        return (insn, tuple(refs), reader)
+
+    return __make_site
+
+def __make_site_getter(ql: Qiling) -> Callable[[int], Optional[TraceSite]]:
+    """[private] Create a method that fetches the trace site for an instruction address. Trace
+    sites are built once per decoded instruction, and rebuilt only if the instruction changes.
+
+    The returned method returns `None` if the instruction could not be decoded.
+    """
+
+    make_site = __make_site_factory(ql)
+    sites: Dict[int, TraceSite] = {}
+
+    # a trace line is generated even for hook addresses that do not contain meaningful opcodes.
+    # on intel, make it look like a nop
+    intel = ql.arch.type in (QL_ARCH.X86, QL_ARCH.X8664)
+    nops: Dict[int, CsInsn] = {}
+
+    def __get_site(address: int) -> Optional[TraceSite]:
+        if intel and address in ql._addr_hook:
+            insn = nops.get(address)
+
+            if insn is None:
+                md = ql.arch.disassembler
+                md.detail = True
+
+                insn = nops[address] = next(md.disasm(b'\x90', address))
+
+        # unicorn denotes unsupported instructions by a magic size value. though these instructions
+        # are not emulated, capstone can still parse them. decoded instructions are cached by arch,
+        # so as long as the same instruction object is returned the trace site remains valid
+        else:
+            insn = ql.arch.decode(address, detail=True)
+
+            if insn is None:
+                return None
+
+        site = sites.get(address)
+
+        if site is None or site[0] is not insn:
+            site = sites[address] = make_site(insn)
+
+        return site
+
+    return __get_site
+
+def __read_regs(site: TraceSite) -> Sequence[int]:
+    """[private] Read the values of the registers referenced by a trace site.
+    """
+
+    reader = site[2]
+
+    return () if reader is None else reader.read()[0]
 
-        return 0 if reg == X86_REG_INVALID else next(v for r, v in state if r == reg)
+def __x86_operands(insn: CsInsn, state: Mapping[str, int], symsmap: Mapping[int, str]) -> str:
+    """[private] Format the operands of an intel instruction. Indirect memory references are
+    substitued by the effective address they refer to. If the referenced address is associated
+    with a symbol, it is substitued by that symbol.
+    """
 
     def __resolve(address: int) -> str:
         """[internal] Find the symbol that matches to the specified address (if any).
@@ -90,10 +220,15 @@ def __to_trace_line(record: TraceRecord, symsmap: Mapping[int, str] = {}) -> str
 
         return symsmap.get(address, '')
 
+    def __read_reg(reg: int) -> int:
+        """[internal] Read a register value from the recorded state. Only registers that were
+        referenced by the current instruction can be read.
+        """
+
+        return state[insn.reg_name(reg)] if reg else 0
+
     def __parse_op(op: X86Op) -> str:
-        """[internal] Parse an operand and return its string representation. Indirect memory
-        references will be substitued by the effective address they refer to. If the referenced
-        address is associated with a symbol, it will be substitued by that symbol.
+        """[internal] Parse an operand and return its string representation.
         """
 
         if op.type == CS_OP_REG:
@@ -137,76 +272,180 @@ def __to_trace_line(record: TraceRecord, symsmap: Mapping[int, str] = {}) -> str
         # unexpected op type
         raise RuntimeError
 
-    operands = ', '.join(__parse_op(o) for o in insn.operands)
-    reads = ', '.join(f'{insn.reg_name(reg)} = {val:#x}' for reg, val in state)
+    try:
+        return ', '.join(__parse_op(o) for o in insn.operands)
+
+    # a register needed to calculate an effective address is not traced, or the operand is of
+    # an unexpected kind; show the operands as they are
+    except (KeyError, RuntimeError):
+        return insn.op_str
+
+def __to_trace_line(site: TraceSite, values: Sequence[int], intel: bool, symsmap: Mapping[int, str] = {}) -> str:
+    """[private] Transform trace info into a formatted trace line.
+    """
+
+    insn, refs, _ = site
+
+    state = {name: (values[i] >> shift) & mask for name, i, shift, mask in refs}
+
+    if intel:
+        # when the rip register is referenced from within an instruction it is expected to point
+        # to the next instruction boundary. since unicorn has not executed the instruction yet
+        # is uses the cpu state resulted from the previous instruction - and rip points to the
+        # current instruction instead of the next one.
+        #
+        # here we patch rip value recorded in state to point to the next instruction boundary
+        for pc in ('rip', 'eip'):
+            if pc in state:
+                state[pc] += insn.size
+
+        operands = __x86_operands(insn, state, symsmap)
+    else:
+        operands = insn.op_str
+
+    reads = ', '.join(f'{name} = {val:#x}' for name, val in state.items())
 
     return f'{insn.address:08x} | {insn.bytes.hex():24s} {insn.mnemonic:10} {operands:56s} | {reads}'
 
-def enable_full_trace(ql: Qiling):
+class __LazyStr:
+    """[private] A string that is generated only when needed. This allows passing trace lines
+    to the logger, so they get formatted only if and when they get emitted.
+    """
+
+    __slots__ = ('generate',)
+
+    def __init__(self, generate: Callable[[], str]):
+        self.generate = generate
+
+    def __str__(self) -> str:
+        return self.generate()
+
+def __hook_range(ql: Qiling, image: Optional[str], begin: int, end: int) -> Tuple[int, int]:
+    """[private] Determine the range of addresses to trace.
+    """
+
+    if image is not None:
+        img = ql.loader.get_image_by_name(image)
+
+        if img is None:
+            raise QlErrorModuleNotFound(f'image "{image}" is not loaded')
+
+        # hook ranges are inclusive
+        begin, end = img.base, img.end - 1
+
+    return begin, end
+
+def enable_full_trace(ql: Qiling, *, image: Optional[str] = None, begin: int = 1, end: int = 0) -> HookRet:
     """Enable instruction-level tracing.
 
     Trace line will be emitted for each instruction before it gets executed. The info
     includes static data along with the relevant registers state and symbols resolving.
+    Trace lines are emitted as debug log records and formatted only if they get emitted.
+
+    Tracing may be limited to a specific image or a range of addresses, in which case
+    instructions outside of it are not hooked at all.
 
     Args:
         ql: qiling instance
+        image: name of a loaded image to trace (optional)
+        begin: start of the addresses range to trace (optional)
+        end: end of the addresses range to trace, inclusive (optional)
+
+    Returns: the trace hook handle
     """
 
-    # enable detailed disassembly info
-    md = ql.arch.disassembler
-    md.detail = True
+    begin, end = __hook_range(ql, image, begin, end)
 
-    assert md.arch == CS_ARCH_X86, 'currently available only for intel architecture'
+    get_site = __make_site_getter(ql)
+    intel = ql.arch.type in (QL_ARCH.X86, QL_ARCH.X8664)
 
     # if available, use symbols map to resolve memory accesses
     symsmap = getattr(ql.loader, 'symsmap', {})
 
-    # show trace lines in a darker color so they would be easily distinguished from
-    # ordinary log records
-    faded_color = "\033[2m"
-    reset_color = "\033[0m"
-
     def __trace_hook(ql: Qiling, address: int, size: int):
         """[internal] Trace hook callback.
         """
 
-        for record in __get_trace_records(ql, address, size, md):
-            line = __to_trace_line(record, symsmap)
+        # do not bother collecting trace info if it is not going to be emitted
+        if not ql.log.isEnabledFor(logging.DEBUG):
+            return
+
+        site = get_site(address)
 
-            ql.log.debug(f'{faded_color}{line}{reset_color}')
+        if site is not None:
+            # show trace lines in a darker color so they would be easily distinguished from
+            # ordinary log records
+            ql.log.debug('\033[2m%s\033[0m', __LazyStr(partial(__to_trace_line, site, __read_regs(site), intel, symsmap)))
 
-    ql.hook_code(__trace_hook)
+    return ql.hook_code(__trace_hook, begin=begin, end=end)
 
-def enable_history_trace(ql: Qiling, nrecords: int):
+def enable_history_trace(ql: Qiling, nrecords: int = 32, *, image: Optional[str] = None, begin: int = 1, end: int = 0) -> HookRet:
     """Enable instruction-level tracing in history mode.
 
     To allow faster execution, the trace info collected throughout program execution is not
-    emitted and undergo as minimal post-processing as possible. When program crahses, the
-    last `nrecords` trace lines are shown.
+    emitted and undergo as minimal post-processing as possible: only the instruction and the
+    values of the registers it reads are recorded, in preallocated slots. When program
+    crahses, the last `nrecords` trace lines are formatted and shown.
+
+    Tracing may be limited to a specific image or a range of addresses, in which case
+    instructions outside of it are not hooked at all.
 
     Args:
         ql: qiling instance
         nrecords: number of last records to show
+        image: name of a loaded image to trace (optional)
+        begin: start of the addresses range to trace (optional)
+        end: end of the addresses range to trace, inclusive (optional)
+
+    Returns: the trace hook handle
     """
 
-    # enable detailed disassembly info
-    md = ql.arch.disassembler
-    md.detail = True
+    begin, end = __hook_range(ql, image, begin, end)
 
-    assert md.arch == CS_ARCH_X86, 'currently available only for intel architecture'
+    get_site = __make_site_getter(ql)
+    intel = ql.arch.type in (QL_ARCH.X86, QL_ARCH.X8664)
 
     # if available, use symbols map to resolve memory accesses
     symsmap = getattr(ql.loader, 'symsmap', {})
 
-    history: Deque[TraceRecord] = deque(maxlen=nrecords)
+    # history records are kept in a ring buffer of preallocated slots: the trace sites of the
+    # traced instructions, which hold their addresses, and the values of the registers they read
+    sites: List[Optional[TraceSite]] = [None] * nrecords
+    values: List[Sequence[int]] = [()] * nrecords
+
+    # next record position and the number of recorded entries
+    ring = [0, 0]
 
     def __trace_hook(ql: Qiling, address: int, size: int):
         """[internal] Trace hook callback.
         """
 
-        history.extend(__get_trace_records(ql, address, size, md))
+        site = get_site(address)
+
+        if site is not None:
+            pos, count = ring
+
+            sites[pos] = site
+            values[pos] = __read_regs(site)
+
+            ring[0] = (pos + 1) % nrecords
+            ring[1] = min(count + 1, nrecords)
+
+    def __history() -> Iterator[Tuple[TraceSite, Sequence[int]]]:
+        """[internal] Iterate over the recorded history, from the oldest to the most recent record.
+        """
 
-    ql.hook_code(__trace_hook)
+        pos, count = ring
+        first = (pos - count) % nrecords
+
+        for i in range(first, first + count):
+            site = sites[i % nrecords]
+
+            assert site is not None
+
+            yield site, values[i % nrecords]
+
+    hret = ql.hook_code(__trace_hook, begin=begin, end=end)
 
     # replace the emulation error handler with our own so we can emit the trace
     # records when program crashes. before we do that, we save the original one
@@ -220,11 +459,13 @@ def enable_history_trace(ql: Qiling, nrecords: int):
 
         # then parse and emit the trace info we collected
         ql.log.error(f'History:')
-        for record in history:
-            line = __to_trace_line(record, symsmap)
+        for site, regs in __history():
+            line = __to_trace_line(site, regs, intel, symsmap)
 
             ql.log.error(line)
 
         ql.log.error(f'')
 
     ql.os.emu_error = __emu_error
+
+    return hret
@@ -1,2 +1,2 @@
 # This code structure is copied and modified from the coverage extension
-__all__ = ["base", "tenet"]
\ No newline at end of file
+__all__ = ["base", "binary", "memory", "tenet"]
\ No newline at end of file
@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import bisect
+import shutil
+import struct
+import tempfile
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import qiling
+from qiling.const import QL_ENDIAN
+from .base import QlBaseTrace
+from .registers import ArchRegs, RegsSnapshots
+from unicorn import UcError
+from unicorn.unicorn_const import UC_MEM_READ, UC_MEM_WRITE
+
+# Trace file layout:
+#
+#   file header, followed by the names of the traced registers
+#   segments: every segment covers a fixed number of consecutive instructions, except maybe the
+#             last one. a segment starts with a checkpoint, and is followed by the frames of the
+#             instructions it covers and their data
+#   index   : offsets of all segments
+#   footer
+#
+# A checkpoint holds the values of all traced registers as they were right before the first
+# instruction of the segment got executed, along with the content of all the memory pages that
+# were modified since the previous checkpoint.
+#
+# A frame is a fixed-size record that holds the instruction address, a mask of the registers
+# that changed since the previous instruction and the offset of the instruction data. The data
+# holds the values of the changed registers, followed by the memory accesses the instruction
+# made.
+
+FILE_MAGIC = b'QLTRACE\x00'
+FILE_VERSION = 1
+
+# magic, version, page size, instructions per segment, number of registers, program counter index.
+# the registers names follow, each prefixed by its length
+FILE_HEADER = struct.Struct('<8sHIIHH')
+
+# magic, first instruction index, number of frames, number of checkpoint pages, data size.
+# the checkpoint registers values, checkpoint pages, frames and data follow
+SEGMENT_MAGIC = b'QLSG'
+SEGMENT_HEADER = struct.Struct('<4sQIII')
+
+# instruction address, mask of changed registers, data offset
+FRAME = struct.Struct('<QQI')
+
+# access type, address, size. the accessed bytes follow
+ACCESS_HEADER = struct.Struct('<BQH')
+
+# index offset, number of segments
+FOOTER_MAGIC = b'QLIX'
+FOOTER = struct.Struct('<QI4s')
+
+ACCESS_READ = 0
+ACCESS_WRITE = 1
+
+CHECKPOINT_INTERVAL = 0x4000
+
+
+class MemAccess(NamedTuple):
+    type: int
+    address: int
+    data: bytes
+
+
+class TraceFrame(NamedTuple):
+    index: int
+    pc: int
+    registers: Dict[str, int]
+    accesses: List[MemAccess]
+
+
+class Segment(NamedTuple):
+    first: int
+    registers: List[int]
+    pages: Dict[int, bytes]
+    frames: bytes
+    data: bytes
+
+    @property
+    def nframes(self) -> int:
+        return len(self.frames) // FRAME.size
+
+
+class QlBinaryTrace(QlBaseTrace):
+    """
+    Traces emulation into a compact, indexed binary format that may be randomly accessed by
+    instruction index. See `QlBinaryTraceReader` for reading the trace back.
+
+    Instructions are grouped into segments of a fixed number of instructions, which start with
+    a checkpoint of the registers values and the memory pages modified since the previous one.
+    Only complete segments are kept in memory, so memory use stays constant regardless of the
+    trace length.
+
+    Every activation records a trace of its own. Unless a trace file is specified on construction,
+    the trace is recorded to a temporary file and copied over to its destination by `dump_trace`.
+    """
+
+    FORMAT_NAME = "binary"
+
+    def __init__(self, ql: qiling.Qiling, trace_file: Optional[str] = None, interval: int = CHECKPOINT_INTERVAL):
+        super().__init__()
+        self.ql         = ql
+        self.trace_file = trace_file
+        self.interval   = interval
+
+        self.arch_regs = ArchRegs(ql.arch)
+        self.pagesize = ql.mem.pagesize
+
+        nregs = len(self.arch_regs.registers)
+        self.pc_index = list(self.arch_regs.registers).index(self.arch_regs.pc_key)
+
+        self.__snapshots = RegsSnapshots(ql.uc, list(self.arch_regs.registers.values()))
+
+        # the program counter is recorded in every frame, so it is left out of the mask
+        self.__reg_bits = [0 if i == self.pc_index else 1 << i for i in range(nregs)]
+
+        self.__endian = 'little' if ql.arch.endian == QL_ENDIAN.EL else 'big'
+
+        self.__output: Optional[IO[bytes]] = None
+        self.__hooks = []
+
+    def __reset(self) -> None:
+        self.__count = 0
+        self.__index: List[int] = []
+        self.__dirty = set()
+
+        self.__checkpoint = b''
+        self.__npages = 0
+        self.__frames = bytearray()
+        self.__data = bytearray()
+
+    def __mark_dirty(self, address: int, size: int) -> None:
+        pagemask = ~(self.pagesize - 1)
+
+        self.__dirty.update(range(address & pagemask, address + size, self.pagesize))
+
+    def __on_host_change(self, address: int, size: int) -> None:
+        self.__mark_dirty(address, size)
+
+    def __start_segment(self, values: Sequence[int]) -> None:
+        pages = []
+
+        for page in sorted(self.__dirty):
+            try:
+                content = self.ql.mem.read(page, self.pagesize)
+            except UcError:
+                # page was unmapped since
+                continue
+
+            pages.append(struct.pack('<Q', page) + content)
+
+        self.__dirty.clear()
+
+        self.__checkpoint = struct.pack(f'<{len(values)}Q', *values) + b''.join(pages)
+        self.__npages = len(pages)
+
+    def __flush_segment(self) -> None:
+        if not self.__frames:
+            return
+
+        output = self.__output
+        assert output is not None
+
+        nframes = len(self.__frames) // FRAME.size
+
+        self.__index.append(output.tell())
+
+        output.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, self.__count - nframes, nframes, self.__npages, len(self.__data)))
+        output.write(self.__checkpoint)
+        output.write(self.__frames)
+        output.write(self.__data)
+
+        self.__frames = bytearray()
+        self.__data = bytearray()
+
+    def mem_access_callback(self, ql: qiling.Qiling, access: int, address: int, size: int, value: int) -> None:
+        if access == UC_MEM_READ:
+            # Since we are reading memory, we just read it ourselves
+            data = ql.mem.read(address, size)
+            self.__data += ACCESS_HEADER.pack(ACCESS_READ, address, size)
+
+        elif access == UC_MEM_WRITE:
+            # Hook is before it's written, so we have to use the "value"
+            data = value.to_bytes(size, self.__endian, signed=value < 0)
+            self.__data += ACCESS_HEADER.pack(ACCESS_WRITE, address, size)
+
+            self.__mark_dirty(address, size)
+
+        else:
+            return
+
+        self.__data += data
+
+    def code_callback(self, ql: qiling.Qiling, address: int, size: int) -> None:
+        values, previous = self.__snapshots.read()
+
+        if self.__count % self.interval == 0:
+            self.__flush_segment()
+            self.__start_segment(values)
+
+        changed = []
+        mask = 0
+
+        for bit, v, p in zip(self.__reg_bits, values, previous):
+            if v != p and bit:
+                mask |= bit
+                changed.append(v)
+
+        self.__frames += FRAME.pack(values[self.pc_index], mask, len(self.__data))
+        self.__data += struct.pack(f'<{len(changed)}Q', *changed)
+
+        self.__count += 1
+
+    def activate(self):
+        if self.trace_file is None:
+            self.__output = tempfile.TemporaryFile()
+        else:
+            self.__output = open(self.trace_file, 'wb')
+
+        names = b''.join(bytes([len(name) - 1]) + name[1:].encode() for name in self.arch_regs.registers)
+
+        self.__output.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self.pagesize, self.interval, len(self.arch_regs.registers), self.pc_index))
+        self.__output.write(names)
+
+        self.__reset()
+
+        self.__hooks = [
+            self.ql.hook_code(self.code_callback),
+            self.ql.hook_mem_read(self.mem_access_callback),
+            self.ql.hook_mem_write(self.mem_access_callback)
+        ]
+
+        self.ql.mem.observers.append(self.__on_host_change)
+
+    def deactivate(self):
+        if not self.__hooks:
+            return
+
+        for hook in self.__hooks:
+            self.ql.hook_del(hook)
+
+        self.__hooks.clear()
+        self.ql.mem.observers.remove(self.__on_host_change)
+
+        self.__flush_segment()
+
+        output = self.__output
+        assert output is not None
+
+        offset = output.tell()
+        nsegments = len(self.__index)
+
+        output.write(struct.pack(f'<{nsegments}Q', *self.__index))
+        output.write(FOOTER.pack(offset, nsegments, FOOTER_MAGIC))
+
+        if self.trace_file is None:
+            output.flush()
+        else:
+            output.close()
+
+    def dump_trace(self, trace_file: str):
+        output = self.__output
+
+        if output is None:
+            raise RuntimeError('nothing was traced')
+
+        if self.trace_file is None:
+            output.seek(0)
+
+            with open(trace_file, 'wb') as trace:
+                shutil.copyfileobj(output, trace)
+
+            output.seek(0, 2)
+
+        elif trace_file != self.trace_file:
+            shutil.copyfile(self.trace_file, trace_file)
+
+
+class QlBinaryTraceReader:
+    """
+    Reads traces recorded by `QlBinaryTrace`.
+
+    Instructions are accessed by their index in the trace. Locating an instruction takes constant
+    time, and reconstructing the emulation state at any instruction requires replaying only the
+    instructions since the checkpoint that precedes it.
+
+    Example:
+        with QlBinaryTraceReader('trace.bin') as trace:
+            print(f'{trace.pc(1000):#x}', trace.state(1000))
+    """
+
+    def __init__(self, trace_file: str):
+        self.__file = open(trace_file, 'rb')
+
+        try:
+            self.__parse_header()
+            self.__load_index()
+        except Exception:
+            self.__file.close()
+            raise
+
+        # most recently accessed segment, along with its number
+        self.__segment: Optional[Tuple[int, Segment]] = None
+
+        # segments that hold checkpoint content for each page, in ascending order
+        self.__page_index: Optional[Dict[int, List[int]]] = None
+
+        # registers indices and values layout, by changed registers mask
+        self.__masks: Dict[int, Tuple[List[int], struct.Struct]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def __parse_header(self) -> None:
+        f = self.__file
+
+        magic, version, self.pagesize, self.interval, nregs, self.pc_index = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError('not a supported trace file')
+
+        self.registers: List[str] = []
+
+        for _ in range(nregs):
+            length, = f.read(1)
+            self.registers.append(f.read(length).decode())
+
+        self.pc_name = self.registers[self.pc_index]
+
+    def __load_index(self) -> None:
+        f = self.__file
+        start = f.tell()
+
+        f.seek(0, 2)
+        end = f.tell()
+
+        footer = b''
+
+        if end - start >= FOOTER.size:
+            f.seek(end - FOOTER.size)
+            footer = f.read(FOOTER.size)
+
+        if footer[-4:] == FOOTER_MAGIC:
+            offset, nsegments, _ = FOOTER.unpack(footer)
+
+            f.seek(offset)
+            self.__index = list(struct.unpack(f'<{nsegments}Q', f.read(nsegments * 8)))
+
+        else:
+            # the trace was not properly finalized; locate the segments that were written
+            self.__index = []
+            offset = start
+
+            while offset + SEGMENT_HEADER.size <= end:
+                f.seek(offset)
+                magic, _, nframes, npages, datasize = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+
+                size = self.__segment_size(nframes, npages, datasize)
+
+                if magic != SEGMENT_MAGIC or offset + size > end:
+                    break
+
+                self.__index.append(offset)
+                offset += size
+
+        self.__length = 0
+
+        if self.__index:
+            f.seek(self.__index[-1])
+            _, first, nframes, _, _ = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+
+            self.__length = first + nframes
+
+    def __segment_size(self, nframes: int, npages: int, datasize: int) -> int:
+        return SEGMENT_HEADER.size + len(self.registers) * 8 + npages * (8 + self.pagesize) + nframes * FRAME.size + datasize
+
+    def __read_segment(self, segno: int) -> Segment:
+        if self.__segment is not None and self.__segment[0] == segno:
+            return self.__segment[1]
+
+        f = self.__file
+        f.seek(self.__index[segno])
+
+        _, first, nframes, npages, datasize = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+        nregs = len(self.registers)
+
+        registers = list(struct.unpack(f'<{nregs}Q', f.read(nregs * 8)))
+        pages = {}
+
+        for _ in range(npages):
+            page, = struct.unpack('<Q', f.read(8))
+            pages[page] = f.read(self.pagesize)
+
+        frames = f.read(nframes * FRAME.size)
+        data = f.read(datasize)
+
+        segment = Segment(first, registers, pages, frames, data)
+        self.__segment = (segno, segment)
+
+        return segment
+
+    def __locate(self, index: int) -> Tuple[Segment, int]:
+        if not 0 <= index < self.__length:
+            raise IndexError('instruction index out of range')
+
+        return self.__read_segment(index // self.interval), index % self.interval
+
+    def __mask_layout(self, mask: int) -> Tuple[List[int], struct.Struct]:
+        if mask not in self.__masks:
+            regs = [r for r in range(len(self.registers)) if mask & (1 << r)]
+
+            self.__masks[mask] = (regs, struct.Struct(f'<{len(regs)}Q'))
+
+        return self.__masks[mask]
+
+    def __parse_frame(self, segment: Segment, i: int) -> Tuple[int, Dict[int, int], List[MemAccess]]:
+        pc, mask, offset = FRAME.unpack_from(segment.frames, i * FRAME.size)
+
+        data = segment.data
+        end = FRAME.unpack_from(segment.frames, (i + 1) * FRAME.size)[2] if i + 1 < segment.nframes else len(data)
+
+        regs, layout = self.__mask_layout(mask)
+
+        registers = dict(zip(regs, layout.unpack_from(data, offset)))
+        offset += layout.size
+
+        accesses = []
+
+        while offset < end:
+            access, address, size = ACCESS_HEADER.unpack_from(data, offset)
+            offset += ACCESS_HEADER.size
+
+            accesses.append(MemAccess(access, address, data[offset:offset + size]))
+            offset += size
+
+        return pc, registers, accesses
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def pc(self, index: int) -> int:
+        """Get the address of a traced instruction.
+        """
+
+        segment, i = self.__locate(index)
+
+        return FRAME.unpack_from(segment.frames, i * FRAME.size)[0]
+
+    def frame(self, index: int) -> TraceFrame:
+        """Get the trace record of an instruction: its address, the registers that changed
+        since the previous instruction and the memory accesses the instruction made.
+        """
+
+        segment, i = self.__locate(index)
+        pc, registers, accesses = self.__parse_frame(segment, i)
+
+        return TraceFrame(index, pc, {self.registers[r]: v for r, v in registers.items()}, accesses)
+
+    def __iter__(self) -> Iterator[TraceFrame]:
+        for index in range(self.__length):
+            yield self.frame(index)
+
+    def state(self, index: int) -> Dict[str, int]:
+        """Reconstruct the registers values as they were right before an instruction got executed.
+        """
+
+        segment, i = self.__locate(index)
+        values = list(segment.registers)
+        data = segment.data
+
+        # only registers are of interest here, so there is no need to parse memory accesses
+        for pc, mask, offset in FRAME.iter_unpack(segment.frames[:(i + 1) * FRAME.size]):
+            if mask:
+                regs, layout = self.__mask_layout(mask)
+
+                for r, v in zip(regs, layout.unpack_from(data, offset)):
+                    values[r] = v
+
+        values[self.pc_index] = pc
+
+        return dict(zip(self.registers, values))
+
+    def __checkpoint_page(self, segno: int, page: int) -> Optional[bytes]:
+        """Get the content of a memory page as of the latest checkpoint that recorded it, up to
+        the specified segment.
+        """
+
+        if self.__page_index is None:
+            f = self.__file
+            self.__page_index = {}
+
+            for s, offset in enumerate(self.__index):
+                f.seek(offset)
+                _, _, _, npages, _ = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+
+                f.seek(len(self.registers) * 8, 1)
+
+                for _ in range(npages):
+                    p, = struct.unpack('<Q', f.read(8))
+                    self.__page_index.setdefault(p, []).append(s)
+
+                    f.seek(self.pagesize, 1)
+
+        segments = self.__page_index.get(page, [])
+        pos = bisect.bisect_right(segments, segno)
+
+        if pos == 0:
+            return None
+
+        return self.__read_segment(segments[pos - 1]).pages[page]
+
+    def read_memory(self, index: int, address: int, size: int) -> Optional[bytes]:
+        """Reconstruct memory content as it was right before an instruction got executed.
+
+        Memory content is known from the first checkpoint that follows a modification of its
+        page, and through memory accesses the traced instructions made since that checkpoint.
+        Memory modified on the host side, e.g. by system calls, is reflected only as of the
+        checkpoint that follows the modification.
+
+        Returns: memory content, or `None` if any part of it is unknown
+        """
+
+        segno = index // self.interval
+        pagemask = ~(self.pagesize - 1)
+
+        content = bytearray(size)
+        known = bytearray(size)
+
+        for page in range(address & pagemask, address + size, self.pagesize):
+            data = self.__checkpoint_page(segno, page)
+
+            if data is not None:
+                lbound = max(page, address)
+                ubound = min(page + self.pagesize, address + size)
+
+                content[lbound - address:ubound - address] = data[lbound - page:ubound - page]
+                known[lbound - address:ubound - address] = b'\x01' * (ubound - lbound)
+
+        segment, i = self.__locate(index)
+
+        # both reads and writes reveal memory content
+        for j in range(i):
+            for access in self.__parse_frame(segment, j)[2]:
+                lbound = max(access.address, address)
+                ubound = min(access.address + len(access.data), address + size)
+
+                if lbound < ubound:
+                    content[lbound - address:ubound - address] = access.data[lbound - access.address:ubound - access.address]
+                    known[lbound - address:ubound - address] = b'\x01' * (ubound - lbound)
+
+        if not all(known):
+            return None
+
+        return bytes(content)
+
+    def export_tenet(self, trace_file: str) -> None:
+        """Convert the trace into a Tenet trace.
+        """
+
+        registers = self.registers
+        pc_index = self.pc_index
+
+        prev_pc = None
+        delta: List[str] = []
+
+        with open(trace_file, 'w') as trace:
+            for index in range(self.__length):
+                segment, i = self.__locate(index)
+                pc, changed, accesses = self.__parse_frame(segment, i)
+
+                # the first line holds the entire registers state
+                if prev_pc is None:
+                    changed = dict(enumerate(segment.registers))
+
+                if pc != prev_pc:
+                    if delta:
+                        trace.write(','.join(delta) + '\n')
+                        delta.clear()
+
+                    changed[pc_index] = pc
+                    prev_pc = pc
+
+                delta.extend(f'{registers[r]}={changed[r]:#x}' for r in sorted(changed))
+                delta.extend(f'{"mr" if a.type == ACCESS_READ else "mw"}={a.address:#x}:{a.data.hex()}' for a in accesses)
+
+            if delta:
+                trace.write(','.join(delta) + '\n')
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+from typing import IO, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import qiling
+from qiling.const import QL_ENDIAN
+from qiling.exception import QlErrorModuleNotFound
+from .base import QlBaseTrace
+from .binary import ACCESS_READ, ACCESS_WRITE
+from unicorn import UC_HOOK_BLOCK, UC_HOOK_MEM_READ, UC_HOOK_MEM_WRITE
+from unicorn.unicorn_const import UC_MEM_WRITE
+
+# Trace file layout:
+#
+#   file header
+#   records: a fixed-size record for every sampled memory access, in the order they were made
+
+FILE_MAGIC = b'QLMEMTR\x00'
+FILE_VERSION = 1
+
+# magic, version, record size, sampling rate, burst length, burst gap
+FILE_HEADER = struct.Struct('<8sHHIII')
+
+# access index, program counter, access address, accessed value, access size, access type.
+# the access index counts all the accesses made to the traced regions while they were hooked,
+# including the ones that were not sampled. accessed values wider than 64 bits are truncated
+RECORD = struct.Struct('<QQQQBB6x')
+
+# records are accumulated into a ring of preallocated buffers, which are handed over to a
+# background writer thread as they fill up
+RING_BUFFERS = 8
+RECORDS_PER_BUFFER = 0x1000
+
+# a region to trace: either the name of a loaded image or a memory map label, or a range of
+# addresses where the end address is excluded
+Region = Union[str, Tuple[int, int]]
+
+
+class MemAccessRecord(NamedTuple):
+    index: int
+    pc: int
+    type: int
+    address: int
+    size: int
+    value: int
+
+
+class QlMemTrace(QlBaseTrace):
+    """
+    Traces memory accesses made to selected memory regions, into fixed-size binary records. See
+    `QlMemTraceReader` for reading the trace back.
+
+    Only the selected regions are hooked, so accesses made elsewhere do not reach Python at all.
+    Regions may be specified by image name, by memory map label (e.g. '[stack]') or as ranges of
+    addresses. If no regions are specified, all memory is traced.
+
+    To reduce the tracing overhead, memory accesses may be sampled:
+      - sampling rate: only one of every `rate` accesses is recorded
+      - burst sampling: memory is traced for `burst` accesses at a time, and then left untraced
+        for the following `gap` executed basic blocks. memory is not hooked while left untraced,
+        and only a lightweight block hook runs till the next burst begins
+
+    Records are written to a ring of preallocated buffers and flushed to the trace file by a
+    background thread. Unless a trace file is specified on construction, the trace is recorded to
+    a temporary file and copied over to its destination by `dump_trace`.
+    """
+
+    FORMAT_NAME = "memory"
+
+    def __init__(self, ql: qiling.Qiling, trace_file: Optional[str] = None, regions: Optional[Sequence[Region]] = None,
+                 rate: int = 1, burst: int = 0, gap: int = 0):
+        super().__init__()
+        self.ql         = ql
+        self.trace_file = trace_file
+        self.regions    = regions
+        self.rate       = rate
+        self.burst      = burst
+        self.gap        = gap
+
+        if rate < 1:
+            raise ValueError('sampling rate should be a positive integer')
+
+        if burst < 0 or gap < 0:
+            raise ValueError('burst length and gap should not be negative')
+
+        self.__uc_pc = ql.arch.regs.uc_pc
+        self.__endian = 'little' if ql.arch.endian == QL_ENDIAN.EL else 'big'
+
+        self.__output: Optional[IO[bytes]] = None
+        self.__writer: Optional[threading.Thread] = None
+        self.__writer_error: Optional[BaseException] = None
+
+        self.__free: queue.Queue = queue.Queue()
+        self.__full: queue.Queue = queue.Queue()
+
+        self.__ranges: List[Tuple[int, int]] = []
+        self.__mem_hooks: List[int] = []
+        self.__block_hook: Optional[int] = None
+
+        self.__active = False
+
+    def __resolve_regions(self) -> List[Tuple[int, int]]:
+        """Resolve the traced regions into a sorted list of non-overlapping hook ranges. Hook
+        ranges include their end address.
+        """
+
+        if self.regions is None:
+            return [(1, 0)]
+
+        ranges: List[Tuple[int, int]] = []
+
+        for region in self.regions:
+            if isinstance(region, str):
+                image = self.ql.loader.get_image_by_name(region)
+
+                if image is not None:
+                    ranges.append((image.base, image.end))
+
+                else:
+                    maps = [(lbound, ubound) for lbound, ubound, _, label, _ in self.ql.mem.map_info if label == region]
+
+                    if not maps:
+                        raise QlErrorModuleNotFound(f'no image or memory map named "{region}"')
+
+                    ranges.extend(maps)
+
+            else:
+                ranges.append(region)
+
+        merged: List[Tuple[int, int]] = []
+
+        for lbound, ubound in sorted(ranges):
+            if merged and lbound <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], ubound))
+            else:
+                merged.append((lbound, ubound))
+
+        return [(lbound, ubound - 1) for lbound, ubound in merged if lbound < ubound]
+
+    def __hook_memory(self) -> None:
+        uc = self.ql.uc
+
+        self.__mem_hooks = [uc.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, self.__on_access, None, begin, end) for begin, end in self.__ranges]
+
+    def __unhook_memory(self) -> None:
+        uc = self.ql.uc
+
+        for hook in self.__mem_hooks:
+            uc.hook_del(hook)
+
+        self.__mem_hooks.clear()
+
+    def __put_buffer(self) -> None:
+        self.__full.put((self.__buffer, self.__offset))
+
+        # wait for the writer to hand back a buffer, if all of them are pending to be written
+        self.__buffer = self.__free.get()
+        self.__offset = 0
+
+    def __on_access(self, uc, access: int, address: int, size: int, value: int, user_data) -> None:
+        index = self.__count
+        self.__count = index + 1
+
+        if index % self.rate == 0:
+            if access == UC_MEM_WRITE:
+                # hook is before it's written, so we have to use the "value"
+                atype = ACCESS_WRITE
+                value &= 0xffffffffffffffff
+
+            else:
+                # since we are reading memory, we just read it ourselves
+                atype = ACCESS_READ
+                value = int.from_bytes(uc.mem_read(address, min(size, 8)), self.__endian)
+
+            RECORD.pack_into(self.__buffer, self.__offset, index, uc.reg_read(self.__uc_pc), address, value, size, atype)
+            self.__offset += RECORD.size
+
+            if self.__offset == len(self.__buffer):
+                self.__put_buffer()
+
+        if self.burst:
+            self.__burst_left -= 1
+
+            # burst is over: stop hooking memory and start counting blocks till the next one
+            if self.__burst_left == 0 and self.gap:
+                self.__unhook_memory()
+
+                self.__gap_left = self.gap
+
+    def __on_block(self, uc, address: int, size: int, user_data) -> None:
+        # a burst is in progress
+        if self.__mem_hooks:
+            return
+
+        if self.__gap_left:
+            self.__gap_left -= 1
+
+        # gap is over: start the next burst with this block
+        else:
+            self.__burst_left = self.burst
+            self.__hook_memory()
+
+    def __write(self, output: IO[bytes]) -> None:
+        """Writer thread main loop: write filled buffers to the trace file, till told to stop.
+        """
+
+        while True:
+            item = self.__full.get()
+
+            if item is None:
+                break
+
+            buffer, size = item
+
+            # keep consuming buffers even after a failure, so emulation does not get stuck
+            if self.__writer_error is None:
+                try:
+                    output.write(memoryview(buffer)[:size])
+                except BaseException as ex:
+                    self.__writer_error = ex
+
+            self.__free.put(buffer)
+
+        output.flush()
+
+    def activate(self):
+        if self.__active:
+            return
+
+        self.__ranges = self.__resolve_regions()
+
+        if self.trace_file is None:
+            self.__output = tempfile.TemporaryFile()
+        else:
+            self.__output = open(self.trace_file, 'wb')
+
+        self.__output.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.size, self.rate, self.burst, self.gap))
+
+        self.__free = queue.Queue()
+        self.__full = queue.Queue()
+
+        for _ in range(RING_BUFFERS - 1):
+            self.__free.put(bytearray(RECORD.size * RECORDS_PER_BUFFER))
+
+        self.__buffer = bytearray(RECORD.size * RECORDS_PER_BUFFER)
+        self.__offset = 0
+        self.__count = 0
+        self.__burst_left = self.burst
+        self.__gap_left = 0
+
+        self.__writer_error = None
+        self.__writer = threading.Thread(target=self.__write, args=(self.__output,), name='memtrace-writer', daemon=True)
+        self.__writer.start()
+
+        self.__hook_memory()
+
+        # block hooks are placed in the code as it gets translated, so unlike memory hooks they
+        # do not take effect if added while emulation is running. the block hook is therefore
+        # kept throughout the trace, and counts blocks only while memory is not hooked
+        if self.burst and self.gap:
+            self.__block_hook = self.ql.uc.hook_add(UC_HOOK_BLOCK, self.__on_block)
+
+        self.__active = True
+
+    def deactivate(self):
+        if not self.__active:
+            return
+
+        self.__unhook_memory()
+
+        if self.__block_hook is not None:
+            self.ql.uc.hook_del(self.__block_hook)
+            self.__block_hook = None
+
+        self.__active = False
+
+        # hand over whatever is left and wait for the writer to finish
+        if self.__offset:
+            self.__full.put((self.__buffer, self.__offset))
+
+        self.__full.put(None)
+
+        assert self.__writer is not None
+        self.__writer.join()
+        self.__writer = None
+
+        if self.trace_file is not None:
+            assert self.__output is not None
+            self.__output.close()
+
+        if self.__writer_error is not None:
+            raise self.__writer_error
+
+    def dump_trace(self, trace_file: str):
+        output = self.__output
+
+        if output is None:
+            raise RuntimeError('nothing was traced')
+
+        if self.trace_file is None:
+            output.seek(0)
+
+            with open(trace_file, 'wb') as trace:
+                shutil.copyfileobj(output, trace)
+
+            output.seek(0, 2)
+
+        elif trace_file != self.trace_file:
+            shutil.copyfile(self.trace_file, trace_file)
+
+
+class QlMemTraceReader:
+    """
+    Reads traces recorded by `QlMemTrace`.
+
+    Example:
+        with QlMemTraceReader('memtrace.bin') as trace:
+            writes = sum(1 for record in trace if record.type == ACCESS_WRITE)
+    """
+
+    def __init__(self, trace_file: str):
+        self.__file = open(trace_file, 'rb')
+
+        try:
+            magic, version, record_size, self.rate, self.burst, self.gap = FILE_HEADER.unpack(self.__file.read(FILE_HEADER.size))
+
+            if magic != FILE_MAGIC:
+                raise ValueError('not a memory trace file')
+
+            if version != FILE_VERSION or record_size != RECORD.size:
+                raise ValueError(f'unsupported memory trace version: {version}')
+
+        except Exception:
+            self.__file.close()
+            raise
+
+        # a partially written record at the end of the file is ignored
+        self.__count = (os.fstat(self.__file.fileno()).st_size - FILE_HEADER.size) // RECORD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __getitem__(self, index: int) -> MemAccessRecord:
+        if index < 0:
+            index += self.__count
+
+        if not 0 <= index < self.__count:
+            raise IndexError('record index out of range')
+
+        self.__file.seek(FILE_HEADER.size + index * RECORD.size)
+
+        return self.__unpack(RECORD.unpack(self.__file.read(RECORD.size)))
+
+    @staticmethod
+    def __unpack(fields: Tuple[int, int, int, int, int, int]) -> MemAccessRecord:
+        index, pc, address, value, size, atype = fields
+
+        return MemAccessRecord(index, pc, atype, address, size, value)
+
+    def __iter__(self) -> Iterator[MemAccessRecord]:
+        for first in range(0, self.__count, RECORDS_PER_BUFFER):
+            n = min(self.__count - first, RECORDS_PER_BUFFER)
+
+            # records may be accessed by index while iterating, so do not rely on file position
+            self.__file.seek(FILE_HEADER.size + first * RECORD.size)
+            chunk = self.__file.read(n * RECORD.size)
+
+            yield from map(self.__unpack, RECORD.iter_unpack(chunk))
@@ -1,5 +1,9 @@
+import ctypes
+from typing import List, Sequence, Tuple
+
 import unicorn
-from qiling.arch import arm64, arm, x86
+from qiling.arch import arm64, arm, mips, riscv, x86
+from qiling.exception import QlErrorArch
 
 
 
@@ -61,13 +65,14 @@ class ArchRegs():
         "$x27": unicorn.arm64_const.UC_ARM64_REG_X27,
         "$x28": unicorn.arm64_const.UC_ARM64_REG_X28,
         "$x29": unicorn.arm64_const.UC_ARM64_REG_X29,
+        "$x30": unicorn.arm64_const.UC_ARM64_REG_X30,
     }
 
     x86_registers = {
         '$eax': unicorn.x86_const.UC_X86_REG_EAX,
         '$ebx': unicorn.x86_const.UC_X86_REG_EBX,
         '$ecx': unicorn.x86_const.UC_X86_REG_ECX,
-        '$edx': unicorn.x86_const.UC_X86_REG_ECX,
+        '$edx': unicorn.x86_const.UC_X86_REG_EDX,
         '$ebp': unicorn.x86_const.UC_X86_REG_EBP,
         '$esp': unicorn.x86_const.UC_X86_REG_ESP,
         '$esi': unicorn.x86_const.UC_X86_REG_ESI,
@@ -78,7 +83,7 @@ class ArchRegs():
         '$rax': unicorn.x86_const.UC_X86_REG_RAX ,
         '$rbx': unicorn.x86_const.UC_X86_REG_RBX,
         '$rcx': unicorn.x86_const.UC_X86_REG_RCX,
-        '$rdx': unicorn.x86_const.UC_X86_REG_RCX,
+        '$rdx': unicorn.x86_const.UC_X86_REG_RDX,
         '$rbp': unicorn.x86_const.UC_X86_REG_RBP,
         '$rsp': unicorn.x86_const.UC_X86_REG_RSP,
         '$rsi': unicorn.x86_const.UC_X86_REG_RSI,
@@ -94,6 +99,77 @@ class ArchRegs():
         '$r15': unicorn.x86_const.UC_X86_REG_R15,
     }
 
+    mips_registers = {
+        '$zero': unicorn.mips_const.UC_MIPS_REG_ZERO,
+        '$at': unicorn.mips_const.UC_MIPS_REG_AT,
+        '$v0': unicorn.mips_const.UC_MIPS_REG_V0,
+        '$v1': unicorn.mips_const.UC_MIPS_REG_V1,
+        '$a0': unicorn.mips_const.UC_MIPS_REG_A0,
+        '$a1': unicorn.mips_const.UC_MIPS_REG_A1,
+        '$a2': unicorn.mips_const.UC_MIPS_REG_A2,
+        '$a3': unicorn.mips_const.UC_MIPS_REG_A3,
+        '$t0': unicorn.mips_const.UC_MIPS_REG_T0,
+        '$t1': unicorn.mips_const.UC_MIPS_REG_T1,
+        '$t2': unicorn.mips_const.UC_MIPS_REG_T2,
+        '$t3': unicorn.mips_const.UC_MIPS_REG_T3,
+        '$t4': unicorn.mips_const.UC_MIPS_REG_T4,
+        '$t5': unicorn.mips_const.UC_MIPS_REG_T5,
+        '$t6': unicorn.mips_const.UC_MIPS_REG_T6,
+        '$t7': unicorn.mips_const.UC_MIPS_REG_T7,
+        '$s0': unicorn.mips_const.UC_MIPS_REG_S0,
+        '$s1': unicorn.mips_const.UC_MIPS_REG_S1,
+        '$s2': unicorn.mips_const.UC_MIPS_REG_S2,
+        '$s3': unicorn.mips_const.UC_MIPS_REG_S3,
+        '$s4': unicorn.mips_const.UC_MIPS_REG_S4,
+        '$s5': unicorn.mips_const.UC_MIPS_REG_S5,
+        '$s6': unicorn.mips_const.UC_MIPS_REG_S6,
+        '$s7': unicorn.mips_const.UC_MIPS_REG_S7,
+        '$t8': unicorn.mips_const.UC_MIPS_REG_T8,
+        '$t9': unicorn.mips_const.UC_MIPS_REG_T9,
+        '$k0': unicorn.mips_const.UC_MIPS_REG_K0,
+        '$k1': unicorn.mips_const.UC_MIPS_REG_K1,
+        '$gp': unicorn.mips_const.UC_MIPS_REG_GP,
+        '$sp': unicorn.mips_const.UC_MIPS_REG_SP,
+        '$fp': unicorn.mips_const.UC_MIPS_REG_FP,
+        '$ra': unicorn.mips_const.UC_MIPS_REG_RA,
+        '$pc': unicorn.mips_const.UC_MIPS_REG_PC
+    }
+    riscv_registers = {
+        '$zero': unicorn.riscv_const.UC_RISCV_REG_ZERO,
+        '$ra': unicorn.riscv_const.UC_RISCV_REG_RA,
+        '$sp': unicorn.riscv_const.UC_RISCV_REG_SP,
+        '$gp': unicorn.riscv_const.UC_RISCV_REG_GP,
+        '$tp': unicorn.riscv_const.UC_RISCV_REG_TP,
+        '$t0': unicorn.riscv_const.UC_RISCV_REG_T0,
+        '$t1': unicorn.riscv_const.UC_RISCV_REG_T1,
+        '$t2': unicorn.riscv_const.UC_RISCV_REG_T2,
+        '$s0': unicorn.riscv_const.UC_RISCV_REG_S0,
+        '$s1': unicorn.riscv_const.UC_RISCV_REG_S1,
+        '$a0': unicorn.riscv_const.UC_RISCV_REG_A0,
+        '$a1': unicorn.riscv_const.UC_RISCV_REG_A1,
+        '$a2': unicorn.riscv_const.UC_RISCV_REG_A2,
+        '$a3': unicorn.riscv_const.UC_RISCV_REG_A3,
+        '$a4': unicorn.riscv_const.UC_RISCV_REG_A4,
+        '$a5': unicorn.riscv_const.UC_RISCV_REG_A5,
+        '$a6': unicorn.riscv_const.UC_RISCV_REG_A6,
+        '$a7': unicorn.riscv_const.UC_RISCV_REG_A7,
+        '$s2': unicorn.riscv_const.UC_RISCV_REG_S2,
+        '$s3': unicorn.riscv_const.UC_RISCV_REG_S3,
+        '$s4': unicorn.riscv_const.UC_RISCV_REG_S4,
+        '$s5': unicorn.riscv_const.UC_RISCV_REG_S5,
+        '$s6': unicorn.riscv_const.UC_RISCV_REG_S6,
+        '$s7': unicorn.riscv_const.UC_RISCV_REG_S7,
+        '$s8': unicorn.riscv_const.UC_RISCV_REG_S8,
+        '$s9': unicorn.riscv_const.UC_RISCV_REG_S9,
+        '$s10': unicorn.riscv_const.UC_RISCV_REG_S10,
+        '$s11': unicorn.riscv_const.UC_RISCV_REG_S11,
+        '$t3': unicorn.riscv_const.UC_RISCV_REG_T3,
+        '$t4': unicorn.riscv_const.UC_RISCV_REG_T4,
+        '$t5': unicorn.riscv_const.UC_RISCV_REG_T5,
+        '$t6': unicorn.riscv_const.UC_RISCV_REG_T6,
+        '$pc': unicorn.riscv_const.UC_RISCV_REG_PC
+    }
+
     def __init__(self, arch):
         if isinstance(arch, arm.QlArchARM):
             self.registers = self.arm_registers
@@ -107,5 +183,48 @@ class ArchRegs():
         elif isinstance(arch,x86.QlArchX8664):
             self.registers = self.x86_64_registers
             self.pc_key = "$rip"
+        elif isinstance(arch,mips.QlArchMIPS):
+            self.registers = self.mips_registers
+            self.pc_key = "$pc"
+        elif isinstance(arch,riscv.QlArchRISCV):
+            self.registers = self.riscv_registers
+            self.pc_key = "$pc"
         else:
-            raise("Unsupported arch")
+            raise QlErrorArch("Unsupported arch")
+
+
+class RegsSnapshots():
+    """
+    Reads a set of registers in a single batch, into one of two snapshot buffers which take turns
+    in holding the current and the previous registers values. Batch read arguments are built only
+    once, rather than on every read as the generic batch read method does
+    """
+
+    def __init__(self, uc: unicorn.Uc, reg_ids: Sequence[int], initial: int = 0):
+        nregs = len(reg_ids)
+
+        self.uc = uc
+
+        self.__nregs = ctypes.c_int(nregs)
+        self.__reg_ids = (ctypes.c_int * nregs)(*reg_ids)
+        self.__snapshots = [(ctypes.c_uint64 * nregs)() for _ in range(2)]
+        self.__pointers = [(ctypes.c_void_p * nregs)(*(ctypes.addressof(s) + i * 8 for i in range(nregs))) for s in self.__snapshots]
+        self.__current = 0
+
+        self.__snapshots[1][:] = [initial] * nregs
+
+    def read(self) -> Tuple[List[int], List[int]]:
+        """Read registers values.
+
+        Returns: current registers values, and the values that were read previously
+        """
+
+        current = self.__current
+        self.__current = current ^ 1
+
+        status = self.uc._do_reg_read_batch(self.__reg_ids, self.__pointers[current], self.__nregs)
+
+        if status != unicorn.UC_ERR_OK:
+            raise unicorn.UcError(status)
+
+        return self.__snapshots[current][:], self.__snapshots[current ^ 1][:]
@@ -1,103 +1,240 @@
 # This code structure is copied and modified from the coverage extension
 
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+from typing import IO, List, Optional
+
 import qiling
 from qiling.const import QL_ENDIAN
 from .base import QlBaseTrace
-from .registers import ArchRegs
+from .registers import ArchRegs, RegsSnapshots
 from unicorn.unicorn_const import UC_MEM_READ, UC_MEM_WRITE
 
+# binary delta records, as they are handed over to the writer thread:
+#   registers: tag, mask of changed registers, followed by the values of the changed registers
+#   memory   : tag, access address, access size, followed by the accessed bytes
+REC_REGS = 0
+REC_MEM_READ = 1
+REC_MEM_WRITE = 2
+
+REC_REGS_HEADER = struct.Struct('<BQ')
+REC_MEM_HEADER = struct.Struct('<BQH')
+
+# records are accumulated into chunks of roughly this size before they are handed over
+CHUNK_SIZE = 0x10000
+
+# maximal number of chunks pending to be written. once reached, emulation waits for the writer
+# to catch up, so memory use stays constant regardless of the trace length
+MAX_PENDING_CHUNKS = 16
+
+
 class QlDrTrace(QlBaseTrace):
     """
     Traces emulation and puts it into a format viewable in Tenet
     IDAPro plugin Tenet: https://github.com/gaasedelen/tenet
+
+    Registers are read in a single batch on every instruction and compared against the previous
+    snapshot; only the changes are encoded, in a compact binary form. A background thread turns
+    them into Tenet text lines and streams them to the trace file as emulation goes on.
+
+    Unless a trace file is specified on construction, the trace is streamed to a temporary file
+    and copied over to its destination by `dump_trace`.
     """
 
     FORMAT_NAME = "tenet"
 
-    def __init__(self, ql: qiling.Qiling):
+    def __init__(self, ql: qiling.Qiling, trace_file: Optional[str] = None):
         super().__init__()
         self.ql             = ql
-        self.deltas         = []
-        self.current_delta  = []
-        self.current_pc     = 0x0
+        self.trace_file     = trace_file
 
         self.arch_regs = ArchRegs(ql.arch)
-        self.register_values= dict()
+
+        self.reg_names = [register[1::] for register in self.arch_regs.registers]
+        self.pc_mask = 1 << list(self.arch_regs.registers).index(self.arch_regs.pc_key)
 
         # Initialize with ridiculous value so first delta isn't missed
-        for register in self.arch_regs.registers:
-            self.register_values[register] = 0xFEEDBABE
+        self.__snapshots = RegsSnapshots(ql.uc, list(self.arch_regs.registers.values()), 0xFEEDBABE)
+        self.__reg_bits = [1 << i for i in range(len(self.arch_regs.registers))]
 
+        self.__endian = 'little' if ql.arch.endian == QL_ENDIAN.EL else 'big'
 
-    def _add_delta(self):
-        # Cover glitch cases where nothing changed
-        if self.current_delta != []:
-            # Join all delta fragments into delta line and append 
-            self.deltas.append(",".join(self.current_delta))
-            self.current_delta = []
-        return
+        self.__chunk = bytearray()
+        self.__queue: queue.Queue = queue.Queue(MAX_PENDING_CHUNKS)
+        self.__writer: Optional[threading.Thread] = None
+        self.__writer_error: Optional[BaseException] = None
+        self.__output: Optional[IO[str]] = None
+        self.__hooks = []
 
+    def __put_chunk(self) -> None:
+        self.__queue.put(self.__chunk)
+        self.__chunk = bytearray()
 
-    @staticmethod
-    def mem_access_callback(ql, access, address, size, value, self):
-        access_type = None
+    def mem_access_callback(self, ql: qiling.Qiling, access: int, address: int, size: int, value: int) -> None:
         # Set delta based on access type
         if access == UC_MEM_READ:
             # Since we are reading memory, we just read it ourselves
-            access_type = "mr"
-            value = ql.mem.read(address, size)
-            delta = f"{access_type}={hex(address)}:{value.hex()}"
+            tag = REC_MEM_READ
+            data = ql.mem.read(address, size)
         elif access == UC_MEM_WRITE:
             # Hook is before it's written, so we have to use the "value"
-            access_type = "mw"
-            if ql.arch.endian == QL_ENDIAN.EL:
-                endian = 'little'
-            else:
-                endian = 'big'
-            if value < 0:
-                sign = True
-            else:
-                sign = False
-            value = int.to_bytes(value, size, endian, signed=sign)
-            delta = f"{access_type}={hex(address)}:{value.hex()}"
+            tag = REC_MEM_WRITE
+            data = value.to_bytes(size, self.__endian, signed=value < 0)
         else:
-            print("Invalid access type")
             return
-        # <ACCESS_TYPE>=<ACCESS_ADDRESS>:<HEX_BYTE_0><HEX_BYTE_1><HEX_BYTE_2>... 
-        self.current_delta.append(delta)
-        return
-
-    @staticmethod
-    def code_callback(ql, address, size, self):
-        # Check if PC changed for next delta
-        pc = ql.arch.regs.read(self.arch_regs.registers[self.arch_regs.pc_key])
-        if pc != self.current_pc:
-            self._add_delta()
-            self.current_pc = pc
+
+        self.__chunk += REC_MEM_HEADER.pack(tag, address, size)
+        self.__chunk += data
+
+    def code_callback(self, ql: qiling.Qiling, address: int, size: int) -> None:
+        values, previous = self.__snapshots.read()
+
+        changed = []
+        mask = 0
+
         # Go through each register and see if it changed
-        for register in self.arch_regs.registers:
-            value = ql.arch.regs.read(self.arch_regs.registers[register])
-            if value != self.register_values[register]:
-                # <REG_NAME>=<REG_VALUE_AS_BASE_16>
-                delta = f"{register[1::]}={hex(value)}"
-                self.current_delta.append(delta)
-                # Update value
-                self.register_values[register] = value
-        
-        return
-        
+        for bit, v, p in zip(self.__reg_bits, values, previous):
+            if v != p:
+                mask |= bit
+                changed.append(v)
+
+        # the program counter changes on virtually every instruction, so there is always something to record
+        self.__chunk += REC_REGS_HEADER.pack(REC_REGS, mask)
+        self.__chunk += struct.pack(f'<{len(changed)}Q', *changed)
+
+        if len(self.__chunk) >= CHUNK_SIZE:
+            self.__put_chunk()
+
+    def __write_chunk(self, chunk: bytes, delta: List[str], output: IO[str]) -> None:
+        reg_names = self.reg_names
+        pc_mask = self.pc_mask
+
+        lines = []
+        offset = 0
+
+        while offset < len(chunk):
+            tag = chunk[offset]
+
+            if tag == REC_REGS:
+                _, mask = REC_REGS_HEADER.unpack_from(chunk, offset)
+                offset += REC_REGS_HEADER.size
+
+                # Check if PC changed for next delta
+                if mask & pc_mask and delta:
+                    # Join all delta fragments into delta line
+                    lines.append(','.join(delta))
+                    delta.clear()
+
+                i = 0
+
+                while mask:
+                    if mask & 1:
+                        value, = struct.unpack_from('<Q', chunk, offset)
+                        offset += 8
+
+                        # <REG_NAME>=<REG_VALUE_AS_BASE_16>
+                        delta.append(f'{reg_names[i]}={value:#x}')
+
+                    mask >>= 1
+                    i += 1
+
+            else:
+                _, address, size = REC_MEM_HEADER.unpack_from(chunk, offset)
+                offset += REC_MEM_HEADER.size
+
+                access_type = 'mr' if tag == REC_MEM_READ else 'mw'
+
+                # <ACCESS_TYPE>=<ACCESS_ADDRESS>:<HEX_BYTE_0><HEX_BYTE_1><HEX_BYTE_2>...
+                delta.append(f'{access_type}={address:#x}:{chunk[offset:offset + size].hex()}')
+                offset += size
+
+        output.writelines(f'{line}\n' for line in lines)
+
+    def __write(self, output: IO[str]) -> None:
+        """Writer thread main loop: turn binary delta records into Tenet lines, till told to stop.
+        """
+
+        # delta fragments of the current instruction, which may span more than one chunk
+        delta: List[str] = []
+
+        while True:
+            chunk = self.__queue.get()
+
+            if chunk is None:
+                break
+
+            # keep consuming chunks even after a failure, so emulation does not get stuck
+            if self.__writer_error is None:
+                try:
+                    self.__write_chunk(chunk, delta, output)
+                except BaseException as ex:
+                    self.__writer_error = ex
+
+        if self.__writer_error is None and delta:
+            output.write(','.join(delta) + '\n')
+
+        output.flush()
+
     def activate(self):
-        self.code_callback = self.ql.hook_code(self.code_callback, user_data=self)
-        self.mem_write_callback = self.ql.hook_mem_read(self.mem_access_callback, user_data=self)
-        self.mem_read_callback = self.ql.hook_mem_write(self.mem_access_callback, user_data=self)
+        if self.trace_file is None:
+            if self.__output is None:
+                self.__output = tempfile.TemporaryFile('w+')
+        else:
+            # a previous trace session may have already written to the file
+            self.__output = open(self.trace_file, 'w' if self.__output is None else 'a')
+
+        self.__writer_error = None
+        self.__writer = threading.Thread(target=self.__write, args=(self.__output,), name='tenet-writer', daemon=True)
+        self.__writer.start()
+
+        self.__hooks = [
+            self.ql.hook_code(self.code_callback),
+            self.ql.hook_mem_read(self.mem_access_callback),
+            self.ql.hook_mem_write(self.mem_access_callback)
+        ]
 
     def deactivate(self):
-        self.ql.hook_del(self.code_callback)
-        self.ql.hook_del(self.mem_write_callback)
-        self.ql.hook_del(self.mem_read_callback)
-    
+        for hook in self.__hooks:
+            self.ql.hook_del(hook)
+
+        self.__hooks.clear()
+
+        if self.__writer is None:
+            return
+
+        # hand over whatever is left and wait for the writer to finish
+        if self.__chunk:
+            self.__put_chunk()
+
+        self.__queue.put(None)
+        self.__writer.join()
+        self.__writer = None
+
+        if self.trace_file is not None:
+            assert self.__output is not None
+            self.__output.close()
+
+        if self.__writer_error is not None:
+            raise self.__writer_error
+
     def dump_trace(self, trace_file: str):
-        with open(trace_file, "w") as trace:
-            # Write out each delta on a separate line
-            for delta in self.deltas:
-                trace.write(delta + "\n")
+        output = self.__output
+
+        # nothing was traced
+        if output is None:
+            open(trace_file, 'w').close()
+
+        elif self.trace_file is None:
+            output.flush()
+            output.seek(0)
+
+            with open(trace_file, 'w') as trace:
+                shutil.copyfileobj(output, trace)
+
+            output.seek(0, 2)
+
+        elif trace_file != self.trace_file:
+            shutil.copyfile(self.trace_file, trace_file)
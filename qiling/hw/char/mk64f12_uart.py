@@ -67,6 +67,9 @@ class MK64F12Uart(QlConnectivityPeripheral):
     def write(self, offset, size, value):
         if offset == self.struct.D.offset:
             self.send_to_user(value)
+
+            if not self.tx_ready():
+                self.instance.S1 &= ~(S1.TDRE | S1.TC)
         else:
             self.raw_write(offset, size, value)
 
@@ -81,8 +84,15 @@ class MK64F12Uart(QlConnectivityPeripheral):
         
         return self.raw_read(offset, size)
 
+    @QlConnectivityPeripheral.device_handler
     def step(self):
+        if not self.instance.S1 & S1.TDRE and self.tx_ready():
+            self.instance.S1 |= S1.TDRE | S1.TC
+            self.dirty = True
+
         if self.has_input():
+            self.dirty = True
+
             if self.instance.PFIFO & PFIFO.RXFE:
                 self.instance.RCFIFO = 1
             else:
@@ -58,6 +58,9 @@ class SAM3xaUart(QlConnectivityPeripheral):
     def write(self, offset: int, size: int, value: int):      
         if offset == self.struct.THR.offset:
             self.send_to_user(value)
+
+            if not self.tx_ready():
+                self.instance.SR &= ~SR.TXRDY
         
         elif offset == self.struct.IDR.offset:
             self.instance.IER &= ~value
@@ -69,10 +72,17 @@ class SAM3xaUart(QlConnectivityPeripheral):
             data = (value).to_bytes(size, byteorder='little')
             ctypes.memmove(ctypes.addressof(self.instance) + offset, data, size)
 
+    @QlConnectivityPeripheral.device_handler
     def step(self):
+        if not self.instance.SR & SR.TXRDY and self.tx_ready():
+            self.instance.SR |= SR.TXRDY
+            self.dirty = True
+
         if  self.instance.IER & IER.RXRDY and \
             self.instance.CR  & CR.RXEN   and \
             self.has_input():
             
             self.instance.SR |= SR.RXRDY            
+            self.dirty = True
+
             self.ql.hw.nvic.set_pending(self.intn)
@@ -77,6 +77,9 @@ class STM32F4xxUsart(QlConnectivityPeripheral):
         elif offset == self.struct.DR.offset:
             self.send_to_user(value)
 
+            if not self.tx_ready():
+                self.instance.SR &= ~(USART_SR.TXE | USART_SR.TC)
+
         else:
             data = (value).to_bytes(size, byteorder='little')
             ctypes.memmove(ctypes.addressof(self.instance) + offset, data, size)
@@ -85,6 +88,12 @@ class STM32F4xxUsart(QlConnectivityPeripheral):
         if not (self.instance.SR & USART_SR.RXNE): 
             if self.has_input():
                 self.instance.SR |= USART_SR.RXNE  
+                self.dirty = True
+
+        if not (self.instance.SR & USART_SR.TXE):
+            if self.tx_ready():
+                self.instance.SR |= USART_SR.TXE | USART_SR.TC
+                self.dirty = True
 
     def check_interrupt(self):
         if self.intn is not None:
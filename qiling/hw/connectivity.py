@@ -5,45 +5,134 @@
 
 
 import ctypes
-import queue
+import threading
+from typing import Optional
 
 from qiling.core import Qiling
 from qiling.hw.peripheral import QlPeripheral
 
 
-class PeripheralTube(queue.Queue):
-    def __init__(self):
-        super().__init__()
+class PeripheralTube:
+    """ A byte ring buffer.
+
+        Tubes are thread-safe, so the host may feed and drain a peripheral from
+        another thread while the emulation runs. The buffer grows when data would
+        not fit, while `limit` (if set) is what the peripheral reports as its
+        capacity to implement backpressure.
+    """
+
+    def __init__(self, limit: Optional[int] = None, capacity: int = 0x1000):
+        self.limit = limit
+
+        self._buf = bytearray(capacity)
+        self._head = 0
+        self._tail = 0
+
+        # guards the buffer and both indices
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    def _grow(self, needed: int):
+        capacity = len(self._buf)
+
+        while capacity < needed:
+            capacity *= 2
+
+        data = self._peek()
+        self._buf = bytearray(capacity)
+        self._buf[:len(data)] = data
+        self._tail -= self._head
+        self._head = 0
+
+    def _peek(self, numb: Optional[int] = None) -> bytes:
+        count = len(self) if numb is None else min(numb, len(self))
+        capacity = len(self._buf)
+
+        lbound = self._head % capacity
+        ubound = lbound + count
+
+        if ubound <= capacity:
+            return bytes(self._buf[lbound:ubound])
+
+        return bytes(self._buf[lbound:]) + bytes(self._buf[:ubound - capacity])
+
+    def _write(self, data: bytes):
+        count = len(data)
+        capacity = len(self._buf)
+
+        if len(self) + count > capacity:
+            self._grow(len(self) + count)
+            capacity = len(self._buf)
+
+        lbound = self._tail % capacity
+        ubound = lbound + count
+
+        if ubound <= capacity:
+            self._buf[lbound:ubound] = data
+
+        else:
+            split = capacity - lbound
+
+            self._buf[lbound:] = data[:split]
+            self._buf[:count - split] = data[split:]
+
+        self._tail += count
 
     def readable(self) -> bool:
-        return not self.empty()
+        return self._tail != self._head
 
-    def read(self, numb:int = 4096) -> bytes:
-        data = bytearray()
-        for _ in range(numb):
-            if not self.readable():
-                break
-            data.append(self.get())
+    def writable(self) -> bool:
+        return self.limit is None or len(self) < self.limit
+
+    def empty(self) -> bool:
+        return not self.readable()
 
-        return bytes(data)
+    def qsize(self) -> int:
+        return len(self)
+
+    def peek(self, numb: Optional[int] = None) -> bytes:
+        """ Get up to `numb` pending bytes without consuming them.
+        """
+
+        with self._lock:
+            return self._peek(numb)
+
+    def read(self, numb: int = 4096) -> bytes:
+        with self._lock:
+            data = self._peek(numb)
+            self._head += len(data)
+
+        return data
 
     def write(self, data: bytes):
-        for byte in bytearray(data):
-            self.put(byte)
+        with self._lock:
+            self._write(data)
+
+    def get(self) -> int:
+        """ Consume a single byte, or return 0 if there is nothing to consume.
+        """
+
+        with self._lock:
+            if not self.readable():
+                return 0
+
+            value = self._buf[self._head % len(self._buf)]
+            self._head += 1
+
+        return value
+
+    def put(self, value: int):
+        self.write(bytes([value & 0xff]))
 
     def save(self):
-        data = bytearray()        
-        while self.readable():
-            data.append(self.get())
-        
-        self.write(data)
-        return bytes(data)
+        return self.peek()
 
     def restore(self, data: bytes):
-        while self.readable():
-            self.get()
-        
-        self.write(data)
+        with self._lock:
+            self._head = self._tail = 0
+            self._write(data)
 
 
 class QlConnectivityPeripheral(QlPeripheral):
@@ -72,6 +161,8 @@ class QlConnectivityPeripheral(QlPeripheral):
         self.limit = limit
         self.device_list = []
 
+        self.backend = None
+
     def has_input(self):
         return self.itube.readable()
 
@@ -81,7 +172,8 @@ class QlConnectivityPeripheral(QlPeripheral):
             Example:
                 ql.hw.usart1.send(b'hello')
         """
-        self.itube.write(data)        
+        self.dirty = True
+        self.itube.write(data)
 
     def recv(self, numb:int = 4096) -> bytes:
         """ Receive data from peripheral
@@ -89,6 +181,7 @@ class QlConnectivityPeripheral(QlPeripheral):
             Example:
                 data = ql.hw.i2c1.recv()
         """
+        self.dirty = True
         return self.otube.read(numb)
 
     def send_to_user(self, data: int):
@@ -101,15 +194,33 @@ class QlConnectivityPeripheral(QlPeripheral):
         """        
         return self.itube.get()
 
+    def tx_ready(self) -> bool:
+        """ Whether there is room for more output data, the peripheral
+            should report itself busy otherwise
+        """
+        return self.otube.writable()
+
     def connect(self, device):
         if len(self.device_list) < self.limit:
             self.device_list.append(device)
 
+    def attach(self, backend):
+        """ Attach a host side backend, serviced on every step
+
+            Example:
+                ql.hw.usart2.attach(QlSerialBackend(output='uart.log'))
+        """
+        self.backend = backend
+        backend.bind(self)
+
     @staticmethod
     def device_handler(func):
         """ Send one byte to all devices
         """
-        def wrapper(self):            
+        def wrapper(self):
+            if self.backend is not None:
+                self.backend.step()
+
             if len(self.device_list) > 0:                
                 if self.otube.readable():
                     data = self.recv(1)
@@ -131,4 +242,4 @@ class QlConnectivityPeripheral(QlPeripheral):
         
         self.itube.restore(itube)
         self.otube.restore(otube)
-        ctypes.memmove(ctypes.addressof(self.instance), instance, len(data))
+        ctypes.memmove(ctypes.addressof(self.instance), instance, len(instance))
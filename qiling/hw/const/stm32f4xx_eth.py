@@ -270,3 +270,62 @@ class ETH_DMAMFBOCR(IntEnum):
     MFA  = 0x7ff << 17
     OMFC = 1 << 16
     MFC  = 0xffff << 0
+
+class ETH_TDES0(IntEnum):
+    OWN  = 1 << 31
+    IC   = 1 << 30
+    LS   = 1 << 29
+    FS   = 1 << 28
+    DC   = 1 << 27
+    DP   = 1 << 26
+    TTSE = 1 << 25
+    CIC  = 0x3 << 22
+    TER  = 1 << 21
+    TCH  = 1 << 20
+    TTSS = 1 << 17
+    IHE  = 1 << 16
+    ES   = 1 << 15
+    JT   = 1 << 14
+    FF   = 1 << 13
+    IPE  = 1 << 12
+    LCA  = 1 << 11
+    NC   = 1 << 10
+    LCO  = 1 << 9
+    EC   = 1 << 8
+    VF   = 1 << 7
+    CC   = 0xf << 3
+    ED   = 1 << 2
+    UF   = 1 << 1
+    DB   = 1 << 0
+
+class ETH_TDES1(IntEnum):
+    TBS2 = 0x1fff << 16
+    TBS1 = 0x1fff << 0
+
+class ETH_RDES0(IntEnum):
+    OWN     = 1 << 31
+    AFM     = 1 << 30
+    FL      = 0x3fff << 16
+    ES      = 1 << 15
+    DE      = 1 << 14
+    SAF     = 1 << 13
+    LE      = 1 << 12
+    OE      = 1 << 11
+    VLAN    = 1 << 10
+    FS      = 1 << 9
+    LS      = 1 << 8
+    IPV4HCE = 1 << 7
+    LC      = 1 << 6
+    FT      = 1 << 5
+    RWT     = 1 << 4
+    RE      = 1 << 3
+    DBE     = 1 << 2
+    CE      = 1 << 1
+    PCE     = 1 << 0
+
+class ETH_RDES1(IntEnum):
+    DIC  = 1 << 31
+    RBS2 = 0x1fff << 16
+    RER  = 1 << 15
+    RCH  = 1 << 14
+    RBS1 = 0x1fff << 0
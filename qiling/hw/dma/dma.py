@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+from qiling.core import Qiling
+from qiling.hw.peripheral import QlPeripheral
+
+
+class QlDmaPeripheral(QlPeripheral):
+    def __init__(self, ql: Qiling, label: str, burst: int = 0, cycle_accurate: bool = False):
+        """ Base class for DMA controllers.
+
+            burst: Maximum number of data units moved in a single step when both
+                endpoints are RAM-backed. Use 0 to move the whole remaining transfer.
+            cycle_accurate: Move exactly one data unit per step, whatever the endpoints are.
+        """
+
+        super().__init__(ql, label)
+
+        self.burst = 1 if cycle_accurate else burst
+
+    def is_ram(self, address: int, size: int) -> bool:
+        """ Check whether [address, address + size) lies within a single
+            plain memory mapping, i.e. accessing it has no side effects.
+        """
+
+        for lbound, ubound, _, _, is_mmio in self.ql.mem.map_info:
+            if lbound <= address and address + size <= ubound:
+                return not is_mmio
+
+        return False
+
+    def transfer(self, src: int, dst: int, count: int, src_size: int, dst_size: int, src_inc: bool, dst_inc: bool) -> int:
+        """ Move up to `count` data units from `src` to `dst`. Peripheral endpoints are
+            always accessed one data unit at a time to preserve their side effects.
+
+        Returns:
+            int: Number of data units moved
+        """
+
+        def span(size: int, inc: bool, n: int) -> int:
+            return size * n if inc else size
+
+        n = 1
+
+        if self.burst != 1 and count > 1:
+            n = min(count, self.burst) if self.burst else count
+
+            if not (self.is_ram(src, span(src_size, src_inc, n)) and self.is_ram(dst, span(dst_size, dst_inc, n))):
+                n = 1
+
+        data = bytes(self.ql.mem.read(src, span(src_size, src_inc, n)))
+
+        if src_size != dst_size:
+            data = b''.join(data[i:i + src_size].ljust(dst_size, b'\x00')[:dst_size] for i in range(0, len(data), src_size))
+
+        # a fixed destination only keeps the last unit, while a fixed source repeats the same one
+        if not dst_inc:
+            data = data[-dst_size:]
+
+        elif not src_inc:
+            data *= n
+
+        self.ql.mem.write(dst, data)
+
+        return n
@@ -7,9 +7,54 @@
 import ctypes
 
 from qiling.hw.peripheral import QlPeripheral
+from qiling.hw.dma.dma import QlDmaPeripheral
+from qiling.hw.const.gd32vf1xx_dma import INTF, CH0CTL
 
 
-class GD32VF1xxDma(QlPeripheral):
+class Channel(ctypes.Structure):
+    _fields_ = [
+        ("CTL"     , ctypes.c_uint32), # Channel x control register
+        ("CNT"     , ctypes.c_uint32), # Channel x counter register
+        ("PADDR"   , ctypes.c_uint32), # Channel x peripheral base address register
+        ("MADDR"   , ctypes.c_uint32), # Channel x memory base address register
+        ("RESERVED", ctypes.c_uint32),
+    ]
+
+    def enable(self):
+        return self.CTL & CH0CTL.CHEN
+
+    def transfer_width(self, value):
+        return 1 << value if value < 3 else 4
+
+    def step(self, dma):
+        if self.CNT == 0:
+            return
+
+        dir_flag = self.CTL & CH0CTL.DIR
+
+        pwidth = self.transfer_width((self.CTL & CH0CTL.PWIDTH) >> 8)
+        mwidth = self.transfer_width((self.CTL & CH0CTL.MWIDTH) >> 10)
+
+        minc = bool(self.CTL & CH0CTL.MNAGA)
+        pinc = bool(self.CTL & CH0CTL.PNAGA)
+
+        src, dst = (self.MADDR, self.PADDR) if dir_flag else (self.PADDR, self.MADDR)
+        src_size, dst_size = (mwidth, pwidth) if dir_flag else (pwidth, mwidth)
+        src_inc, dst_inc = (minc, pinc) if dir_flag else (pinc, minc)
+
+        count = dma.transfer(src, dst, self.CNT, src_size, dst_size, src_inc, dst_inc)
+
+        self.CNT -= count
+        if minc:
+            self.MADDR += mwidth * count
+        if pinc:
+            self.PADDR += pwidth * count
+
+        if self.CNT == 0:
+            return True
+
+
+class GD32VF1xxDma(QlDmaPeripheral):
     class Type(ctypes.Structure):
         """ DMA controller 
         """
@@ -17,69 +62,55 @@ class GD32VF1xxDma(QlPeripheral):
         _fields_ = [
             ("INTF"    , ctypes.c_uint32), # Address offset: 0x0, Interrupt flag register
             ("INTC"    , ctypes.c_uint32), # Address offset: 0x04, Interrupt flag clear register
-            ("CH0CTL"  , ctypes.c_uint32), # Address offset: 0x08, Channel 0 control register
-            ("CH0CNT"  , ctypes.c_uint32), # Address offset: 0x0C, Channel 0 counter register
-            ("CH0PADDR", ctypes.c_uint32), # Address offset: 0x10, Channel 0 peripheral base address register
-            ("CH0MADDR", ctypes.c_uint32), # Address offset: 0x14, Channel 0 memory base address register
-            ("CH1CTL"  , ctypes.c_uint32), # Address offset: 0x1C, Channel 1 control register
-            ("CH1CNT"  , ctypes.c_uint32), # Address offset: 0x20, Channel 1 counter register
-            ("CH1PADDR", ctypes.c_uint32), # Address offset: 0x24, Channel 1 peripheral base address register
-            ("CH1MADDR", ctypes.c_uint32), # Address offset: 0x28, Channel 1 memory base address register
-            ("CH2CTL"  , ctypes.c_uint32), # Address offset: 0x30, Channel 2 control register
-            ("CH2CNT"  , ctypes.c_uint32), # Address offset: 0x34, Channel 2 counter register
-            ("CH2PADDR", ctypes.c_uint32), # Address offset: 0x38, Channel 2 peripheral base address register
-            ("CH2MADDR", ctypes.c_uint32), # Address offset: 0x3C, Channel 2 memory base address register
-            ("CH3CTL"  , ctypes.c_uint32), # Address offset: 0x44, Channel 3 control register
-            ("CH3CNT"  , ctypes.c_uint32), # Address offset: 0x48, Channel 3 counter register
-            ("CH3PADDR", ctypes.c_uint32), # Address offset: 0x4C, Channel 3 peripheral base address register
-            ("CH3MADDR", ctypes.c_uint32), # Address offset: 0x50, Channel 3 memory base address register
-            ("CH4CTL"  , ctypes.c_uint32), # Address offset: 0x58, Channel 4 control register
-            ("CH4CNT"  , ctypes.c_uint32), # Address offset: 0x5C, Channel 4 counter register
-            ("CH4PADDR", ctypes.c_uint32), # Address offset: 0x60, Channel 4 peripheral base address register
-            ("CH4MADDR", ctypes.c_uint32), # Address offset: 0x64, Channel 4 memory base address register
-            ("CH5CTL"  , ctypes.c_uint32), # Address offset: 0x6C, Channel 5 control register
-            ("CH5CNT"  , ctypes.c_uint32), # Address offset: 0x70, Channel 5 counter register
-            ("CH5PADDR", ctypes.c_uint32), # Address offset: 0x74, Channel 5 peripheral base address register
-            ("CH5MADDR", ctypes.c_uint32), # Address offset: 0x78, Channel 5 memory base address register
-            ("CH6CTL"  , ctypes.c_uint32), # Address offset: 0x80, Channel 6 control register
-            ("CH6CNT"  , ctypes.c_uint32), # Address offset: 0x84, Channel 6 counter register
-            ("CH6PADDR", ctypes.c_uint32), # Address offset: 0x88, Channel 6 peripheral base address register
-            ("CH6MADDR", ctypes.c_uint32), # Address offset: 0x8C, Channel 6 memory base address register
+            ("channel" , Channel * 7),     # Address offset: 0x08 + 0x14 * x, Channel x registers
+        ]
+
+    def __init__(self, ql, label,
+        stream0_intn=None,
+        stream1_intn=None,
+        stream2_intn=None,
+        stream3_intn=None,
+        stream4_intn=None,
+        stream5_intn=None,
+        stream6_intn=None,
+        burst=0,
+        cycle_accurate=False,
+    ):
+        super().__init__(ql, label, burst, cycle_accurate)
+
+        self.instance = self.struct()
+
+        # kept for reference only: the ECLIC model does not track pending interrupts yet
+        self.intn = [
+            stream0_intn,
+            stream1_intn,
+            stream2_intn,
+            stream3_intn,
+            stream4_intn,
+            stream5_intn,
+            stream6_intn,
         ]
 
-    def __init__(self, ql, label):
-        super().__init__(ql, label)
-
-        self.instance = self.struct(
-            INTF     =  0x00000000,
-            INTC     =  0x00000000,
-            CH0CTL   =  0x00000000,
-            CH0CNT   =  0x00000000,
-            CH0PADDR =  0x00000000,
-            CH0MADDR =  0x00000000,
-            CH1CTL   =  0x00000000,
-            CH1CNT   =  0x00000000,
-            CH1PADDR =  0x00000000,
-            CH1MADDR =  0x00000000,
-            CH2CTL   =  0x00000000,
-            CH2CNT   =  0x00000000,
-            CH2PADDR =  0x00000000,
-            CH2MADDR =  0x00000000,
-            CH3CTL   =  0x00000000,
-            CH3CNT   =  0x00000000,
-            CH3PADDR =  0x00000000,
-            CH3MADDR =  0x00000000,
-            CH4CTL   =  0x00000000,
-            CH4CNT   =  0x00000000,
-            CH4PADDR =  0x00000000,
-            CH4MADDR =  0x00000000,
-            CH5CTL   =  0x00000000,
-            CH5CNT   =  0x00000000,
-            CH5PADDR =  0x00000000,
-            CH5MADDR =  0x00000000,
-            CH6CTL   =  0x00000000,
-            CH6CNT   =  0x00000000,
-            CH6PADDR =  0x00000000,
-            CH6MADDR =  0x00000000,
-        )
+    @QlPeripheral.monitor()
+    def write(self, offset: int, size: int, value: int):
+        if offset == self.struct.INTF.offset:
+            return
+
+        elif offset == self.struct.INTC.offset:
+            self.instance.INTF &= ~value
+
+        else:
+            self.raw_write(offset, size, value)
+
+    def transfer_complete(self, id):
+        self.instance.INTF |= (INTF.GIF0 | INTF.FTFIF0) << (id * 4)
+
+    def step(self):
+        for id, channel in enumerate(self.instance.channel):
+            if not channel.enable() or not channel.CNT:
+                continue
+
+            self.dirty = True
 
+            if channel.step(self):
+                self.transfer_complete(id)
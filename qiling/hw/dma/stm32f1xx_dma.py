@@ -6,6 +6,7 @@
 import ctypes
 
 from qiling.hw.peripheral import QlPeripheral
+from qiling.hw.dma.dma import QlDmaPeripheral
 from qiling.hw.const.stm32f1xx_dma import DMA_CR, DMA
 
 
@@ -42,7 +43,7 @@ class Stream(ctypes.Structure):
         if MSIZE == DMA.MDATAALIGN_WORD:
             return 4
 
-    def step(self, mem):
+    def step(self, dma):
         if self.NDTR == 0:
             return
 
@@ -51,24 +52,27 @@ class Stream(ctypes.Structure):
         psize = self.transfer_peripheral_size()
         msize = self.transfer_memory_size()
 
+        minc = bool(self.CR & DMA_CR.MINC)
+        pinc = bool(self.CR & DMA_CR.PINC)
+
         src, dst = (self.MAR, self.PAR) if dir_flag else (self.PAR, self.MAR)
         src_size, dst_size = (msize, psize) if dir_flag else (psize, msize)
+        src_inc, dst_inc = (minc, pinc) if dir_flag else (pinc, minc)
 
-        data = bytes(mem.read(src, src_size)).ljust(dst_size)[:dst_size]
-        mem.write(dst, data)
+        count = dma.transfer(src, dst, self.NDTR, src_size, dst_size, src_inc, dst_inc)
         
-        self.NDTR -= 1
-        if self.CR & DMA_CR.MINC:
-            self.MAR += msize
-        if self.CR & DMA_CR.PINC:
-            self.PAR += psize
+        self.NDTR -= count
+        if minc:
+            self.MAR += msize * count
+        if pinc:
+            self.PAR += psize * count
 
         if self.NDTR == 0:
             self.CR &= ~DMA_CR.EN
             return True
 
 
-class STM32F1xxDma(QlPeripheral):
+class STM32F1xxDma(QlDmaPeripheral):
     class Type(ctypes.Structure):
         """ the structure available in :
                 stm32f100xb
@@ -99,8 +103,10 @@ class STM32F1xxDma(QlPeripheral):
         stream5_intn=None,
         stream6_intn=None,
         stream7_intn=None,
+        burst=0,
+        cycle_accurate=False,
     ):
-        super().__init__(ql, label)
+        super().__init__(ql, label, burst, cycle_accurate)
         
         self.instance = self.struct()
         
@@ -142,8 +148,10 @@ class STM32F1xxDma(QlPeripheral):
 
     def step(self):
         for id, stream in enumerate(self.instance.stream):
-            if not stream.enable():
+            if not stream.enable() or not stream.NDTR:
                 continue
+
+            self.dirty = True
                                     
-            if stream.step(self.ql.mem):
+            if stream.step(self):
                 self.transfer_complete(id)
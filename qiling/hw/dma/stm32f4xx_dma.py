@@ -5,6 +5,7 @@
 
 import ctypes
 from qiling.hw.peripheral import QlPeripheral
+from qiling.hw.dma.dma import QlDmaPeripheral
 from qiling.hw.const.stm32f4xx_dma import DMA, DMA_SxCR
 
 class Stream(ctypes.Structure):
@@ -41,7 +42,7 @@ class Stream(ctypes.Structure):
         if MSIZE == DMA.MDATAALIGN_WORD:
             return 4
 
-    def step(self, mem):
+    def step(self, dma):
         if self.NDTR == 0:
             return
 
@@ -49,24 +50,27 @@ class Stream(ctypes.Structure):
 
         psize = self.transfer_peripheral_size()
         msize = self.transfer_memory_size()
-        
+
+        minc = bool(self.CR & DMA_SxCR.MINC)
+        pinc = bool(self.CR & DMA_SxCR.PINC)
+
         src, dst = (self.M0AR, self.PAR) if dir_flag else (self.PAR, self.M0AR)
         src_size, dst_size = (msize, psize) if dir_flag else (psize, msize)
+        src_inc, dst_inc = (minc, pinc) if dir_flag else (pinc, minc)
 
-        data = bytes(mem.read(src, src_size)).ljust(dst_size)[:dst_size]
-        mem.write(dst, data)
+        count = dma.transfer(src, dst, self.NDTR, src_size, dst_size, src_inc, dst_inc)
 
-        self.NDTR -= 1
-        if self.CR & DMA_SxCR.MINC:
-            self.M0AR += msize
-        if self.CR & DMA_SxCR.PINC:
-            self.PAR  += psize
+        self.NDTR -= count
+        if minc:
+            self.M0AR += msize * count
+        if pinc:
+            self.PAR  += psize * count
 
         if self.NDTR == 0:
             self.CR &= ~DMA_SxCR.EN
             return True
-        
-class STM32F4xxDma(QlPeripheral):
+
+class STM32F4xxDma(QlDmaPeripheral):
     class Type(ctypes.Structure):
         """ the structure available in :
             stm32f413xx.h
@@ -111,10 +115,12 @@ class STM32F4xxDma(QlPeripheral):
             stream4_intn=None,
             stream5_intn=None,
             stream6_intn=None,
-            stream7_intn=None
+            stream7_intn=None,
+            burst=0,
+            cycle_accurate=False
         ):
 
-        super().__init__(ql, label)
+        super().__init__(ql, label, burst, cycle_accurate)
         
         self.instance = self.struct()
         
@@ -149,7 +155,7 @@ class STM32F4xxDma(QlPeripheral):
 
     def transfer_complete(self, id):
         tc_bits = [5, 11, 21, 27]
-        if id > 4:
+        if id >= 4:
             self.instance.HISR |= 1 << tc_bits[id - 4]
         else:
             self.instance.LISR |= 1 << tc_bits[id]
@@ -159,8 +165,10 @@ class STM32F4xxDma(QlPeripheral):
 
     def step(self):
         for id, stream in enumerate(self.instance.stream):
-            if not stream.enable():
+            if not stream.enable() or not stream.NDTR:
                 continue
+
+            self.dirty = True
                                     
-            if stream.step(self.ql.mem):
+            if stream.step(self):
                 self.transfer_complete(id)                
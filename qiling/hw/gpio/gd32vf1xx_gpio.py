@@ -75,12 +75,14 @@ class GD32VF1xxGpio(QlPeripheral, GpioHooks):
 
     def set_pin(self, i):
         self.ql.log.debug(f'[{self.label}] Set P{self.label[-1].upper()}{i}')
+        self.dirty = True
         
         self.instance.OCTL |= 1 << i        
         self.call_hook_set(i)
     
     def reset_pin(self, i):
         self.ql.log.debug(f'[{self.label}] Reset P{self.label[-1].upper()}{i}')
+        self.dirty = True
         
         self.instance.OCTL &= ~(1 << i)
         self.call_hook_reset(i)
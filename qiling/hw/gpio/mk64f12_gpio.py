@@ -49,6 +49,7 @@ class MK64F12Gpio(QlPeripheral, GpioHooks):
 
     def set_pin(self, i):
         self.ql.log.debug(f'[{self.label}] Set P{self.label[-1].upper()}{i}')
+        self.dirty = True
         
         self.port.send_interrupt(i, self.pin(i), 1)
 
@@ -60,6 +61,7 @@ class MK64F12Gpio(QlPeripheral, GpioHooks):
     
     def reset_pin(self, i):
         self.ql.log.debug(f'[{self.label}] Reset P{self.label[-1].upper()}{i}')
+        self.dirty = True
         
         self.port.send_interrupt(i, self.pin(i), 0)
 
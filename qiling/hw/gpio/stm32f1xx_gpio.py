@@ -84,6 +84,7 @@ class STM32F1xxGpio(QlPeripheral, GpioHooks):
 
     def set_pin(self, i):
         self.ql.log.debug(f'[{self.label}] Set P{self.label[-1].upper()}{i}')
+        self.dirty = True
         
         self.instance.ODR |= 1 << i
         self.instance.IDR |= 1 << i
@@ -91,6 +92,7 @@ class STM32F1xxGpio(QlPeripheral, GpioHooks):
     
     def reset_pin(self, i):
         self.ql.log.debug(f'[{self.label}] Reset P{self.label[-1].upper()}{i}')
+        self.dirty = True
         
         self.instance.ODR &= ~(1 << i)
         self.instance.IDR &= ~(1 << i)
@@ -15,18 +15,11 @@ from qiling.exception import QlErrorModuleFunctionNotFound
 # should adhere to the QlMmioHandler interface, but not extend it directly to
 # avoid potential pickling issues
 class QlPripheralHandler:
-    def __init__(self, hwman: "QlHwManager", base: int, size: int, label: str) -> None:
-        self._hwman = hwman
+    def __init__(self, base: int, size: int, label: str) -> None:
         self._base = base
         self._size = size
         self._label = label
 
-    def __getstate__(self):
-        state = self.__dict__.copy()
-        del state['_hwman']  # remove non-pickleable reference
-
-        return state
-
     @cached_property
     def _mmio(self) -> bytearray:
         """Get memory buffer used to back non-mapped hardware mmio regions.
@@ -36,7 +29,7 @@ class QlPripheralHandler:
 
     def read(self, ql: Qiling, offset: int, size: int) -> int:
         address = self._base + offset
-        hardware = self._hwman.find(address)
+        hardware = ql.hw.find(address)
 
         if hardware:
             return hardware.read(address - hardware.base, size)
@@ -47,7 +40,7 @@ class QlPripheralHandler:
 
     def write(self, ql: Qiling, offset: int, size: int, value: int) -> None:
         address = self._base + offset
-        hardware = self._hwman.find(address)
+        hardware = ql.hw.find(address)
 
         if hardware:
             hardware.write(address - hardware.base, size, value)
@@ -64,6 +57,14 @@ class QlHwManager:
         self.entity: Dict[str, QlPeripheral] = {}
         self.region: Dict[str, List[Tuple[int, int]]] = {}
 
+        # peripherals state as of the most recent save or restore. unless a peripheral
+        # got dirty since then, its current state is known to be the one recorded here
+        self.checkpoint: Dict[str, Any] = {}
+
+        # registers content as of the same checkpoint, for peripherals that do not track their
+        # dirty flag and have to be compared before being skipped
+        self.instances: Dict[str, bytes] = {}
+
     def create(self, label: str, struct: Optional[str] = None, base: Optional[int] = None, kwargs: Optional[Dict[str, Any]] = None) -> QlPeripheral:
         """ Create the peripheral accroding the label and envs.
 
@@ -104,6 +105,12 @@ class QlHwManager:
         if label in self.region:
             del self.region[label]
 
+        if label in self.checkpoint:
+            del self.checkpoint[label]
+
+        if label in self.instances:
+            del self.instances[label]
+
     def load_env(self, label: str) -> Tuple[str, int, Dict[str, Any]]:
         """ Get peripheral information (structure, base address, initialization list) from env.
 
@@ -141,7 +148,7 @@ class QlHwManager:
                 ent.step()
 
     def setup_mmio(self, begin: int, size: int, info: str) -> None:
-        dev = QlPripheralHandler(self, begin, size, info)
+        dev = QlPripheralHandler(begin, size, info)
 
         self.ql.mem.map_mmio(begin, size, dev, info)
 
@@ -162,13 +169,44 @@ class QlHwManager:
     def __getattr__(self, key):
         return self.entity.get(key)
 
+    def __changed(self, label: str, entity: QlPeripheral) -> bool:
+        """Whether a peripheral may have changed since the most recent checkpoint.
+        """
+
+        if entity.dirty:
+            return True
+
+        return not entity.dirty_tracking and bytes(entity.instance) != self.instances.get(label)
+
+    def __mark_clean(self, label: str, entity: QlPeripheral) -> None:
+        if not entity.dirty_tracking:
+            self.instances[label] = bytes(entity.instance)
+
+        entity.dirty = False
+
     def save(self):
+        """Save hardware state.
+
+        Only peripherals that changed since the previous save or restore are
+        actually copied; the rest share their state with the previous checkpoint.
+        """
+
+        for label, entity in self.entity.items():
+            if label not in self.checkpoint or self.__changed(label, entity):
+                self.checkpoint[label] = entity.save()
+                self.__mark_clean(label, entity)
+
         return {
-            'entity': {label: entity.save() for label, entity in self.entity.items()},
+            'entity': {label: self.checkpoint[label] for label in self.entity},
             'region': self.region
         }
 
     def restore(self, saved_state):
+        """Restore hardware state.
+
+        Peripherals that are known to hold the saved state already are left untouched.
+        """
+
         entity = saved_state['entity']
         assert isinstance(entity, dict)
 
@@ -176,12 +214,12 @@ class QlHwManager:
         assert isinstance(region, dict)
 
         for label, data in entity.items():
-            self.entity[label].restore(data)
+            ent = self.entity[label]
 
-        self.region = region
+            if self.checkpoint.get(label) is not data or self.__changed(label, ent):
+                ent.restore(data)
 
-        # a dirty hack to rehydrate non-pickleable hwman
-        # a proper fix would require a deeper refactoring to how peripherals are created and managed
-        for ph in self.ql.mem.mmio_cbs.values():
-            if isinstance(ph, QlPripheralHandler):
-                setattr(ph, '_hwman', self)
+                self.checkpoint[label] = data
+                self.__mark_clean(label, ent)
+
+        self.region = region
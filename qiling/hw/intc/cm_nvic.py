@@ -51,23 +51,72 @@ class CortexMNvic(QlPeripheral):
             (self.struct.ICPR, self.clear_pending),
         ]
 
-        self.intrs = []
+        ## pending exceptions, indexed by exception number (IRQn + 16)
+        self.pending = 0
+
+        ## pending and enabled exceptions, bucketed by priority level (priority + 2, so that the
+        ## fixed NMI and HardFault priorities come first). `ready` has a bit set for every non-empty
+        ## level, which makes the highest priority ready exception its lowest set bit.
+        self.levels = [0] * 258
+        self.ready = 0
+        self.queued = {}
+
         self.interrupt_handler = self.ql.arch.interrupt_handler
 
+    @staticmethod
+    def lowest_bit(bitmap: int) -> int:
+        return (bitmap & -bitmap).bit_length() - 1
+
+    def enqueue(self, IRQn):
+        exc = IRQn + 16
+
+        if exc not in self.queued:
+            level = self.get_priority(IRQn) + 2
+
+            self.queued[exc] = level
+            self.levels[level] |= 1 << exc
+            self.ready |= 1 << level
+
+    def dequeue(self, IRQn):
+        level = self.queued.pop(IRQn + 16, None)
+
+        if level is not None:
+            self.levels[level] &= ~(1 << (IRQn + 16))
+            if not self.levels[level]:
+                self.ready &= ~(1 << level)
+
+    def update_priority(self, IRQn):
+        """ Move a ready exception to its new priority level.
+        """
+
+        if IRQn + 16 in self.queued:
+            self.dequeue(IRQn)
+            self.enqueue(IRQn)
+
     def enable(self, IRQn):
+        self.dirty = True
+
         if IRQn >= 0:
             self.instance.ISER[IRQn >> self.OFFSET] |= 1 << (IRQn & self.MASK)
             self.instance.ICER[IRQn >> self.OFFSET] |= 1 << (IRQn & self.MASK)
         else:
             self.ql.hw.scb.enable(IRQn)
 
+        if (self.pending >> (IRQn + 16)) & 1:
+            self.enqueue(IRQn)
+
     def disable(self, IRQn):
+        self.dirty = True
+
         if IRQn >= 0:
-            self.instance.ISER[IRQn >> self.OFFSET] &= self.MASK ^ (1 << (IRQn & self.MASK))
-            self.instance.ICER[IRQn >> self.OFFSET] &= self.MASK ^ (1 << (IRQn & self.MASK))
+            self.instance.ISER[IRQn >> self.OFFSET] &= ~(1 << (IRQn & self.MASK))
+            self.instance.ICER[IRQn >> self.OFFSET] &= ~(1 << (IRQn & self.MASK))
         else:
             self.ql.hw.scb.disable(IRQn)
 
+        if self.get_enable(IRQn) == 0:
+            self.dequeue(IRQn)
+
     def get_enable(self, IRQn):
         if IRQn >= 0:
             return (self.instance.ISER[IRQn >> self.OFFSET] >> (IRQn & self.MASK)) & 1
@@ -75,25 +124,34 @@ class CortexMNvic(QlPeripheral):
             return self.ql.hw.scb.get_enable(IRQn)
 
     def set_pending(self, IRQn):
+        self.dirty = True
+
         if IRQn >= 0:
             self.instance.ISPR[IRQn >> self.OFFSET] |= 1 << (IRQn & self.MASK)
             self.instance.ICPR[IRQn >> self.OFFSET] |= 1 << (IRQn & self.MASK)
         else:
             self.ql.hw.scb.set_pending(IRQn)
 
+        self.pending |= 1 << (IRQn + 16)
+
         if self.get_enable(IRQn):
-            self.intrs.append(IRQn)
+            self.enqueue(IRQn)
 
     def clear_pending(self, IRQn):
+        self.dirty = True
+
         if IRQn >= 0:
-            self.instance.ISPR[IRQn >> self.OFFSET] &= self.MASK ^ (1 << (IRQn & self.MASK))
-            self.instance.ICPR[IRQn >> self.OFFSET] &= self.MASK ^ (1 << (IRQn & self.MASK))
+            self.instance.ISPR[IRQn >> self.OFFSET] &= ~(1 << (IRQn & self.MASK))
+            self.instance.ICPR[IRQn >> self.OFFSET] &= ~(1 << (IRQn & self.MASK))
         else:
             self.ql.hw.scb.clear_pending(IRQn)
 
+        self.pending &= ~(1 << (IRQn + 16))
+        self.dequeue(IRQn)
+
     def get_pending(self, IRQn):
         if IRQn >= 0:
-            return (self.instance.ISER[IRQn >> self.OFFSET] >> (IRQn & self.MASK)) & 1
+            return (self.instance.ISPR[IRQn >> self.OFFSET] >> (IRQn & self.MASK)) & 1
         else:
             return self.ql.hw.scb.get_pending(IRQn)
 
@@ -103,30 +161,51 @@ class CortexMNvic(QlPeripheral):
         else:
             return self.ql.hw.scb.get_priority(IRQn)
 
+    def is_masked(self, IRQn, priority):
+        basepri, primask, faultmask = self.ql.arch.regs.read_batch(('basepri', 'primask', 'faultmask'))
+        basepri &= 0xF0
+
+        return (
+            (basepri and basepri <= priority)
+            or (IRQn > IRQ.HARD_FAULT and (primask & 0x1))
+            or (IRQn != IRQ.NMI and (faultmask & 0x1))
+        )
+
     def step(self):
-        if not self.intrs:
-            return
+        handled = 0
+
+        while self.ready:
+            level = self.lowest_bit(self.ready)
+            exc = self.lowest_bit(self.levels[level])
+
+            # masking only depends on priority, so if the highest priority
+            # exception is masked, all the others are too
+            if (handled >> exc) & 1 or self.is_masked(exc - 16, level - 2):
+                break
 
-        self.intrs.sort(key=lambda x: self.get_priority(x))
+            handled |= 1 << exc
 
-        postponed = []
+            self.clear_pending(exc - 16)
+            self.interrupt_handler(self.ql, exc - 16)
 
-        while self.intrs:
-            IRQn = self.intrs.pop(0)
+    def save(self):
+        return bytes(self.instance), self.pending
 
-            basepri = self.ql.arch.regs.basepri & 0xF0
-            if (
-                    (basepri and basepri <= self.get_priority(IRQn))
-                    or (IRQn > IRQ.HARD_FAULT and (self.ql.arch.regs.primask & 0x1))
-                    or (IRQn != IRQ.NMI and (self.ql.arch.regs.faultmask & 0x1))
-                    ):
-                postponed.append(IRQn)
-                continue
+    def restore(self, data):
+        instance, self.pending = data
+        ctypes.memmove(ctypes.addressof(self.instance), instance, len(instance))
 
-            self.clear_pending(IRQn)
-            self.interrupt_handler(self.ql, IRQn)
+        self.levels = [0] * len(self.levels)
+        self.ready = 0
+        self.queued = {}
 
-        self.intrs = postponed
+        pending = self.pending
+        while pending:
+            exc = self.lowest_bit(pending)
+            pending &= pending - 1
+
+            if self.get_enable(exc - 16):
+                self.enqueue(exc - 16)
 
     @QlPeripheral.monitor()
     def read(self, offset: int, size: int) -> int:
@@ -150,6 +229,9 @@ class CortexMNvic(QlPeripheral):
 
                 ctypes.memmove(ctypes.addressof(self.instance) + ofs, bytes([byte]), 1)
 
+                if ipr.offset <= ofs < ipr.offset + ipr.size:
+                    self.update_priority(ofs - ipr.offset)
+
         for ofs in range(offset, offset + size):
             write_byte(ofs, value & 0xff)
             value >>= 8
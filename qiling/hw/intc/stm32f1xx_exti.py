@@ -80,6 +80,7 @@ class STM32F1xxExti(QlPeripheral):
     def send_interrupt(self, index):
         if 0 <= index < 20 and (self.instance.IMR >> index) & 1:
             self.instance.PR |= 1 << index
+            self.dirty = True
 
             if index < 16:
                 self.ql.hw.afio.exti(index).set_pin(index)
@@ -12,6 +12,8 @@ from qiling.arch.cortex_m_const import IRQ
 
 class CortexMScb(QlPeripheral):
     def enable(self, IRQn):
+        self.dirty = True
+
         if IRQn == IRQ.USAGE_FAULT:
             self.instance.SHCSR |= 1 << 18
         if IRQn == IRQ.BUS_FAULT:
@@ -20,6 +22,8 @@ class CortexMScb(QlPeripheral):
             self.instance.SHCSR |= 1 << 16
         
     def disable(self, IRQn):
+        self.dirty = True
+
         if IRQn == IRQ.USAGE_FAULT:
             self.instance.SHCSR &= ~(1 << 18)
         if IRQn == IRQ.BUS_FAULT:
@@ -37,6 +41,8 @@ class CortexMScb(QlPeripheral):
         return 1
 
     def set_pending(self, IRQn):
+        self.dirty = True
+
         if IRQn == IRQ.NMI:
             self.instance.ICSR |= 1 << 31
         if IRQn == IRQ.PENDSV:
@@ -54,6 +60,8 @@ class CortexMScb(QlPeripheral):
             self.instance.SHCSR |= 1 << 15
 
     def clear_pending(self, IRQn):
+        self.dirty = True
+
         if IRQn == IRQ.NMI:
             self.instance.ICSR &= ~(1 << 31)
         if IRQn == IRQ.PENDSV:
@@ -89,6 +97,10 @@ class CortexMScb(QlPeripheral):
         return 0
 
     def get_priority(self, IRQn):
+        if IRQn == IRQ.NMI:
+            return -2
+        if IRQn == IRQ.HARD_FAULT:
+            return -1
         return self.instance.SHP[(IRQn & 0xf) - 4]
 
     @QlPeripheral.monitor()
@@ -105,3 +117,7 @@ class CortexMScb(QlPeripheral):
 
         data = (value).to_bytes(size, 'little')
         ctypes.memmove(ctypes.addressof(self.instance) + offset, data, size)
+
+        shp = self.struct.SHP
+        for ofs in range(max(offset, shp.offset), min(offset + size, shp.offset + shp.size)):
+            self.ql.hw.nvic.update_priority(ofs - shp.offset + 4 - 16)
@@ -101,10 +101,13 @@ class STM32F4xxRcc(QlPeripheral):
 
     def step(self):
         for reg, rdyon in self.rdyon.items():
-            value = getattr(self.instance, reg)
+            value = old = getattr(self.instance, reg)
             for rdy, on in rdyon:
                 if value & on:
                     value |= rdy
                 else:
                     value &= ~rdy
-            setattr(self.instance, reg, value)
+
+            if value != old:
+                setattr(self.instance, reg, value)
+                self.dirty = True
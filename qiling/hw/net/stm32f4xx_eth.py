@@ -4,9 +4,74 @@
 #
 
 import ctypes
+import struct
+import zlib
+
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
 
 from qiling.hw.peripheral import QlPeripheral
-from qiling.hw.const.stm32f4xx_eth import ETH_DMABMR, ETH_MACMIIAR
+from qiling.hw.utils.pcap import PcapReader, PcapWriter
+from qiling.hw.const.stm32f4xx_eth import ETH_DMABMR, ETH_MACMIIAR, ETH_DMASR, ETH_DMAOMR, ETH_DMAIER, ETH_TDES0, ETH_TDES1, ETH_RDES0, ETH_RDES1
+
+
+NORMAL_INTERRUPTS = ETH_DMASR.TS | ETH_DMASR.TBUS | ETH_DMASR.RS | ETH_DMASR.ERS
+
+ABNORMAL_INTERRUPTS = ETH_DMASR.TPSS | ETH_DMASR.TJTS | ETH_DMASR.ROS | ETH_DMASR.TUS | ETH_DMASR.RBUS | \
+                      ETH_DMASR.RPSS | ETH_DMASR.RWTS | ETH_DMASR.ETS | ETH_DMASR.FBES
+
+# upper bound on the number of descriptors a single received frame may span
+MAX_FRAME_DESCRIPTORS = 64
+
+
+def inet_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+
+    return ~total & 0xffff
+
+
+def insert_checksums(frame: bytearray, payload: bool):
+    """ Emulate the checksum offload engine on an outgoing IPv4 frame.
+    """
+
+    if len(frame) < 34 or frame[12:14] != b'\x08\x00':
+        return
+
+    ihl = (frame[14] & 0xf) * 4
+    iph = frame[14:14 + ihl]
+
+    frame[24:26] = b'\x00\x00'
+    frame[24:26] = inet_checksum(frame[14:14 + ihl]).to_bytes(2, 'big')
+
+    # fragmented datagrams are left as is
+    if not payload or int.from_bytes(iph[6:8], 'big') & 0x3fff:
+        return
+
+    proto = iph[9]
+    total = int.from_bytes(iph[2:4], 'big')
+
+    offset = {1: 2, 6: 16, 17: 6}.get(proto)
+    lbound = 14 + ihl
+    ubound = 14 + total
+
+    if offset is None or ubound > len(frame) or ubound - lbound < offset + 2:
+        return
+
+    frame[lbound + offset:lbound + offset + 2] = b'\x00\x00'
+    segment = bytes(frame[lbound:ubound])
+
+    if proto != 1:
+        segment = iph[12:20] + struct.pack('!BBH', 0, proto, len(segment)) + segment
+
+    frame[lbound + offset:lbound + offset + 2] = inet_checksum(segment).to_bytes(2, 'big')
+
+
 
 
 class STM32F4xxEth(QlPeripheral):
@@ -92,7 +157,7 @@ class STM32F4xxEth(QlPeripheral):
             ("DMACHRBAR"  , ctypes.c_uint32),
         ]
 
-    def __init__(self, ql, label, intn=None, wkup_intn=None):
+    def __init__(self, ql, label, intn=None, wkup_intn=None, burst=16, backlog=1024):
         super().__init__(ql, label)
                 
         self.instance = self.struct()
@@ -100,6 +165,64 @@ class STM32F4xxEth(QlPeripheral):
         self.intn = intn
         self.wkup_intn = wkup_intn
 
+        # maximal number of frames moved by each dma engine in a single step
+        self.burst = burst
+
+        self.rxq = deque()
+        self.txq = deque(maxlen=backlog)
+
+        self.source = None
+        self.capture = None
+
+        self.tx_frame = bytearray()
+        self.tx_poll = False
+        self.rx_poll = False
+
+    def send(self, frame: bytes):
+        """ Queue a frame to be received by the guest.
+
+            Example:
+                ql.hw.eth.send(bytes.fromhex('ffffffffffff...'))
+        """
+
+        self.rxq.append(bytes(frame))
+        self.rx_poll = True
+
+    def recv(self) -> Optional[bytes]:
+        """ Get the oldest frame transmitted by the guest, if any.
+        """
+
+        return self.txq.popleft() if self.txq else None
+
+    def feed(self, frames: Iterable[bytes]):
+        """ Feed the guest from an iterable of frames. Frames are pulled lazily,
+            only when the guest has room to receive them.
+        """
+
+        self.source = iter(frames)
+        self.rx_poll = True
+
+    def load_pcap(self, path: str):
+        """ Feed the guest with the frames of a pcap file.
+        """
+
+        self.feed(PcapReader(path))
+
+    def capture_pcap(self, path: str):
+        """ Capture frames transmitted by the guest to a pcap file.
+        """
+
+        self.stop_capture()
+        self.capture = PcapWriter(path)
+
+    def stop_capture(self):
+        """ Stop capturing transmitted frames and close the capture file.
+        """
+
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
     @QlPeripheral.monitor()
     def read(self, offset: int, size: int) -> int:
         return self.raw_read(offset, size)
@@ -107,6 +230,12 @@ class STM32F4xxEth(QlPeripheral):
     
     @QlPeripheral.monitor()
     def write(self, offset: int, size: int, value: int):
+        if offset == self.struct.DMASR.offset:
+            self.instance.DMASR &= ~(value & 0x1ffff)
+            self.update_summary()
+
+            return
+
         self.raw_write(offset, size, value)
 
         if offset == self.struct.DMABMR.offset:
@@ -117,3 +246,201 @@ class STM32F4xxEth(QlPeripheral):
             if value & ETH_MACMIIAR.MB:
                 self.instance.MACMIIAR &= ~ETH_MACMIIAR.MB
                 self.instance.MACMIIDR = 0xffff
+
+        if offset == self.struct.DMATDLAR.offset:
+            self.instance.DMACHTDR = value
+
+        if offset == self.struct.DMARDLAR.offset:
+            self.instance.DMACHRDR = value
+
+        if offset in (self.struct.DMATPDR.offset, self.struct.DMAOMR.offset):
+            self.tx_poll = True
+
+        if offset in (self.struct.DMARPDR.offset, self.struct.DMAOMR.offset):
+            self.rx_poll = True
+
+    def read_descriptor(self, address: int) -> Tuple[int, int, int, int]:
+        return struct.unpack('<4I', self.ql.mem.read(address, 16))
+
+    def next_descriptor(self, address: int, end_of_ring: bool, chained: bool, des3: int, base: int) -> int:
+        if end_of_ring:
+            return base
+
+        if chained:
+            return des3
+
+        size = 32 if self.instance.DMABMR & ETH_DMABMR.EDE else 16
+        skip = (self.instance.DMABMR & ETH_DMABMR.DSL) >> 2
+
+        return address + size + skip * 4
+
+    def transmit(self):
+        """ Walk the transmit descriptors ring and send up to `burst` frames.
+        """
+
+        frames = 0
+
+        while frames < self.burst:
+            address = self.instance.DMACHTDR
+            tdes0, tdes1, tdes2, tdes3 = self.read_descriptor(address)
+
+            if not tdes0 & ETH_TDES0.OWN:
+                self.instance.DMASR |= ETH_DMASR.TBUS
+                self.tx_poll = False
+                break
+
+            if tdes0 & ETH_TDES0.FS:
+                self.tx_frame = bytearray()
+
+            size1 = tdes1 & ETH_TDES1.TBS1
+            size2 = (tdes1 & ETH_TDES1.TBS2) >> 16
+
+            self.tx_frame += self.ql.mem.read(tdes2, size1)
+
+            if size2 and not tdes0 & ETH_TDES0.TCH:
+                self.tx_frame += self.ql.mem.read(tdes3, size2)
+
+            self.ql.mem.write_ptr(address, tdes0 & ~ETH_TDES0.OWN, 4)
+
+            self.instance.DMACHTBAR = tdes2
+            self.instance.DMACHTDR = self.next_descriptor(address, tdes0 & ETH_TDES0.TER, tdes0 & ETH_TDES0.TCH, tdes3, self.instance.DMATDLAR)
+
+            if tdes0 & ETH_TDES0.LS:
+                cic = (tdes0 & ETH_TDES0.CIC) >> 22
+
+                if cic:
+                    insert_checksums(self.tx_frame, cic > 1)
+
+                self.emit(bytes(self.tx_frame))
+                frames += 1
+
+                if tdes0 & ETH_TDES0.IC:
+                    self.instance.DMASR |= ETH_DMASR.TS
+
+        # make the captured frames available as they are sent, once per burst
+        if frames and self.capture is not None:
+            self.capture.flush()
+
+    def emit(self, frame: bytes):
+        self.txq.append(frame)
+
+        if self.capture is not None:
+            self.capture.write(frame)
+
+    def collect_descriptors(self, size: int) -> Optional[List[Tuple[int, int, int, int, int]]]:
+        """ Collect guest owned receive descriptors enough to hold `size` bytes.
+        """
+
+        result = []
+        address = self.instance.DMACHRDR
+
+        while size > 0:
+            # the walk wrapped around the whole ring, which is not enough to hold the frame
+            if len(result) >= MAX_FRAME_DESCRIPTORS or (result and address == result[0][0]):
+                return None
+
+            rdes0, rdes1, rdes2, rdes3 = self.read_descriptor(address)
+
+            if not rdes0 & ETH_RDES0.OWN:
+                return None
+
+            size1 = rdes1 & ETH_RDES1.RBS1
+            size2 = 0 if rdes1 & ETH_RDES1.RCH else (rdes1 & ETH_RDES1.RBS2) >> 16
+
+            result.append((address, rdes2, size1, rdes3, size2))
+            size -= size1 + size2
+
+            address = self.next_descriptor(address, rdes1 & ETH_RDES1.RER, rdes1 & ETH_RDES1.RCH, rdes3, self.instance.DMARDLAR)
+
+        self.instance.DMACHRDR = address
+
+        return result
+
+    def deliver(self, frame: bytes) -> bool:
+        data = frame + zlib.crc32(frame).to_bytes(4, 'little')
+        descriptors = self.collect_descriptors(len(data))
+
+        if descriptors is None:
+            return False
+
+        offset = 0
+
+        for i, (address, buf1, size1, buf2, size2) in enumerate(descriptors):
+            for buf, size in ((buf1, size1), (buf2, size2)):
+                chunk = data[offset:offset + size]
+
+                if chunk:
+                    self.ql.mem.write(buf, chunk)
+                    self.instance.DMACHRBAR = buf
+
+                offset += len(chunk)
+
+            status = 0
+
+            if i == 0:
+                status |= ETH_RDES0.FS
+
+            if i == len(descriptors) - 1:
+                status |= ETH_RDES0.LS | ((len(data) << 16) & ETH_RDES0.FL)
+
+                if len(frame) >= 14 and int.from_bytes(frame[12:14], 'big') >= 0x600:
+                    status |= ETH_RDES0.FT
+
+            self.ql.mem.write_ptr(address, status, 4)
+
+        return True
+
+    def receive(self):
+        """ Deliver up to `burst` pending frames into the receive descriptors ring.
+        """
+
+        for _ in range(self.burst):
+            if not self.rxq and self.source is not None:
+                frame = next(self.source, None)
+
+                if frame is None:
+                    self.source = None
+                else:
+                    self.rxq.append(frame)
+
+            if not self.rxq:
+                self.rx_poll = False
+                break
+
+            if not self.deliver(self.rxq[0]):
+                self.instance.DMASR |= ETH_DMASR.RBUS
+                self.rx_poll = False
+                break
+
+            self.rxq.popleft()
+            self.instance.DMASR |= ETH_DMASR.RS
+
+    def update_summary(self):
+        self.instance.DMASR &= ~(ETH_DMASR.NIS | ETH_DMASR.AIS)
+
+        if self.instance.DMASR & NORMAL_INTERRUPTS:
+            self.instance.DMASR |= ETH_DMASR.NIS
+
+        if self.instance.DMASR & ABNORMAL_INTERRUPTS:
+            self.instance.DMASR |= ETH_DMASR.AIS
+
+    def check_interrupt(self):
+        if self.intn is not None:
+            enabled = self.instance.DMASR & self.instance.DMAIER
+
+            if  (enabled & NORMAL_INTERRUPTS   and self.instance.DMAIER & ETH_DMAIER.NISE) or \
+                (enabled & ABNORMAL_INTERRUPTS and self.instance.DMAIER & ETH_DMAIER.AISE):
+                self.ql.hw.nvic.set_pending(self.intn)
+
+    def step(self):
+        if self.tx_poll and self.instance.DMAOMR & ETH_DMAOMR.ST:
+            self.dirty = True
+            self.transmit()
+            self.update_summary()
+
+        if self.rx_poll and self.instance.DMAOMR & ETH_DMAOMR.SR:
+            self.dirty = True
+            self.receive()
+            self.update_summary()
+
+        self.check_interrupt()
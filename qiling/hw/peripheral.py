@@ -60,6 +60,9 @@ class QlPeripheralUtils:
     def monitor(width=4):
         def decorator(func):
             def read(self, offset: int, size: int) -> int:
+                # reads may have side effects as well
+                self.dirty = True
+
                 self._hook_call(self.user_read[QL_INTERCEPT.ENTER], Action.READ, offset, size)
 
                 if self.user_read[QL_INTERCEPT.CALL]:
@@ -75,6 +78,8 @@ class QlPeripheralUtils:
                 return retval
 
             def write(self, offset: int, size: int, value: int):
+                self.dirty = True
+
                 self._hook_call(self.user_write[QL_INTERCEPT.ENTER], Action.WRITE, offset, size, value)
 
                 if self.verbose:
@@ -145,6 +150,11 @@ class QlPeripheral(QlPeripheralUtils):
                 ]
         """        
         _fields_ = []
+
+    # whether every change to the peripheral state raises its dirty flag. peripherals whose
+    # registers may be changed behind their back turn this off, and get their registers
+    # compared against the previous checkpoint instead
+    dirty_tracking = True
     
     def __init__(self, ql: Qiling, label: str):
         super().__init__()
@@ -154,6 +164,9 @@ class QlPeripheral(QlPeripheralUtils):
         self.struct = type(self).Type
         self.instance = self.struct()
 
+        # whether the peripheral state may have changed since the last checkpoint
+        self.dirty = True
+
     def raw_read(self, offset: int, size: int) -> int:
         buf = ctypes.create_string_buffer(size)
         ctypes.memmove(buf, ctypes.addressof(self.instance) + offset, size)
@@ -161,6 +174,8 @@ class QlPeripheral(QlPeripheralUtils):
         return int.from_bytes(buf.raw, byteorder='little')
 
     def raw_write(self, offset: int, size: int, value: int):
+        self.dirty = True
+
         data = (value).to_bytes(size, 'little')
         ctypes.memmove(ctypes.addressof(self.instance) + offset, data, size)
     
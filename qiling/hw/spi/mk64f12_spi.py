@@ -57,3 +57,4 @@ class MK64F12Spi(QlConnectivityPeripheral):
         if self.has_input():
             self.instance.SR |= SR.RFDF
             self.instance.SR |= SR.RXCTR
+            self.dirty = True
@@ -30,6 +30,8 @@ class CortexMSysTick(QlTimerPeripheral):
         if not self.instance.CTRL & SYSTICK_CTRL.ENABLE:
             return
 
+        self.dirty = True
+
         if self.instance.VAL <= 0:
             self.instance.CTRL |= SYSTICK_CTRL.COUNTFLAG
             self.instance.VAL = self.instance.LOAD
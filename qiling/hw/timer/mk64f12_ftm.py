@@ -57,6 +57,8 @@ class MK64F12Ftm(QlTimerPeripheral):
 
     def step(self):
         if self.instance.MODE & MODE.FTMEN and self.instance.SC & SC.CLKS:
+            self.dirty = True
+
             if self.instance.CNT <= 0:
                 self.instance.CNT = 1000000 // ((self.instance.SC & SC.PS) + 1)
             
@@ -122,7 +122,11 @@ class STM32F4xxRtc(QlPeripheral):
         ctypes.memmove(ctypes.addressof(self.instance) + offset, data, size)    
 
     def step(self):
-        if self.instance.ISR & RTC_ISR.INIT:
-            self.instance.ISR |= RTC_ISR.INITF
+        isr = self.instance.ISR | RTC_ISR.RSF
 
-        self.instance.ISR |= RTC_ISR.RSF
+        if isr & RTC_ISR.INIT:
+            isr |= RTC_ISR.INITF
+
+        if isr != self.instance.ISR:
+            self.instance.ISR = isr
+            self.dirty = True
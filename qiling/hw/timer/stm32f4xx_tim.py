@@ -106,6 +106,8 @@ class STM32F4xxTim(QlTimerPeripheral):
         self.ql.hw.nvic.set_pending(self.up_intn)
 
     def set_ratio(self, ratio):
+        self.dirty = True
+
         self.instance.CNT = 0
         self.prescale_count = 0
 
@@ -125,6 +127,8 @@ class STM32F4xxTim(QlTimerPeripheral):
 
     def step(self):
         if self.instance.CR1 & TIM_CR1.CEN:
+            self.dirty = True
+
             if self.instance.CNT >= self.instance.ARR:
                 self.instance.CNT = 0
                 self.prescale_count = 0
@@ -16,6 +16,7 @@ class QlTimerPeripheral(QlPeripheral):
         self._ratio = 1
 
     def set_ratio(self, ratio):
+        self.dirty = True
         self._ratio = ratio
 
     @property
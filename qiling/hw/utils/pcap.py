@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import struct
+import time
+
+from typing import BinaryIO, Iterator, Optional, Union
+
+
+LINKTYPE_ETHERNET = 1
+
+PCAP_MAGIC      = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+
+
+class PcapReader:
+    """ Iterate over the frames of a classic pcap file, without loading it at once.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO]):
+        self.stream = open(target, 'rb') if isinstance(target, str) else target
+
+        header = self.stream.read(24)
+
+        if len(header) < 24:
+            raise ValueError('not a pcap file: header is truncated')
+
+        for endian in ('<', '>'):
+            magic, = struct.unpack(f'{endian}I', header[:4])
+
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NSEC):
+                self.endian = endian
+                break
+
+        else:
+            raise ValueError(f'not a pcap file: unexpected magic {magic:#010x}')
+
+        _, _, _, _, _, self.linktype = struct.unpack(f'{self.endian}HHiIII', header[4:])
+        self.record = struct.Struct(f'{self.endian}IIII')
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            header = self.stream.read(self.record.size)
+
+            if len(header) < self.record.size:
+                break
+
+            _, _, incl_len, _ = self.record.unpack(header)
+
+            yield self.stream.read(incl_len)
+
+    def close(self):
+        self.stream.close()
+
+
+class PcapWriter:
+    """ Write frames to a classic pcap stream.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO], linktype: int = LINKTYPE_ETHERNET, snaplen: int = 0x40000):
+        self.stream = open(target, 'wb') if isinstance(target, str) else target
+        self.record = struct.Struct('<IIII')
+
+        self.stream.write(struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, snaplen, linktype))
+
+    def write(self, frame: bytes, timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        sec = int(timestamp)
+        usec = int((timestamp - sec) * 1000000)
+
+        self.stream.write(self.record.pack(sec, usec, len(frame), len(frame)))
+        self.stream.write(frame)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
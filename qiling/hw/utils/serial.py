@@ -7,9 +7,13 @@ import os
 import pty
 import ctypes
 import select
+import struct
 import termios
 import threading
 
+from collections import deque
+from typing import List, Optional, Tuple
+
 
 class Termios(ctypes.Structure):
     _fields_ = [
@@ -91,9 +95,193 @@ class QlSerial:
 
         t.c_iflag &= ~(termios.IGNBRK|termios.BRKINT|termios.PARMRK|termios.ISTRIP|termios.INLCR|termios.IGNCR|termios.ICRNL|termios.IXON)
         t.c_oflag &= ~termios.OPOST
-        t.c_cflag &= ~(termios.ECHO|termios.ECHONL|termios.ICANON|termios.ISIG|termios.IEXTEN)
-        t.c_lflag &= ~(termios.CSIZE|termios.PARENB)
-        t.c_lflag |= termios.CS8
+        t.c_lflag &= ~(termios.ECHO|termios.ECHONL|termios.ICANON|termios.ISIG|termios.IEXTEN)
+        t.c_cflag &= ~(termios.CSIZE|termios.PARENB)
+        t.c_cflag |= termios.CS8
         t.setattr(master)
 
         return master, slave
+
+
+class QlSerialBackend:
+    """ Buffered, non-blocking host side of a serial peripheral.
+
+        Output is drained from the peripheral in batches and written to a file,
+        a pipe or a pty; input is polled without blocking the emulation. Host
+        streams that cannot keep up leave the data in the peripheral, which in
+        turn reports itself busy (TXE / TXRDY cleared).
+
+        Input chunks can be recorded along with the step they arrived at, and
+        replayed later on at the very same steps for reproducible runs.
+
+        Example:
+            ql.hw.usart2.attach(QlSerialBackend(output='uart.log', replay='stdin.rec'))
+    """
+
+    RECORD_HEADER = struct.Struct('<QI')
+
+    def __init__(self, output=None, input=None, record=None, replay=None, batch: int = 4096, interval: int = 1024, tx_limit: Optional[int] = None):
+        """
+        Args:
+            output: path, file object or file descriptor to write peripheral output to
+            input: path, file object or file descriptor to read peripheral input from
+            record: path of a file to record input chunks to
+            replay: path of a previously recorded file to feed input from
+            batch: output size that triggers a drain regardless of the interval
+            interval: number of steps between host streams servicing
+            tx_limit: peripheral output buffer capacity, above which it reports itself busy
+        """
+
+        self.batch = batch
+        self.interval = interval
+        self.tx_limit = tx_limit
+
+        self.peripheral = None
+        self.tick = 0
+
+        self._owned = []
+        self._ofd = self.__open(output, 'wb')
+        self._ifd = self.__open(input, 'rb')
+
+        # remember the original modes of both streams before touching either of them,
+        # since input and output may share the same file descriptor
+        self._blocking = {fd: os.get_blocking(fd) for fd in (self._ifd, self._ofd) if fd is not None}
+
+        for fd in self._blocking:
+            os.set_blocking(fd, False)
+
+        self._record = open(record, 'wb') if record else None
+        self._replay = deque(QlSerialBackend.load_record(replay)) if replay else deque()
+
+        self.port = None
+
+    @classmethod
+    def open_pty(cls, baudrate: int = 115200, **kwargs) -> 'QlSerialBackend':
+        """ Create a backend serving both directions over a new pty. Its slave
+            device name is available through the `port` attribute.
+        """
+
+        master, slave = QlSerial.create_pty(baudrate)
+
+        backend = cls(output=master, input=master, **kwargs)
+        backend.port = os.ttyname(slave)
+        backend._owned.extend([master, slave])
+
+        return backend
+
+    @staticmethod
+    def load_record(path: str) -> List[Tuple[int, bytes]]:
+        """ Load input chunks previously recorded by a backend.
+        """
+
+        records = []
+        hsize = QlSerialBackend.RECORD_HEADER.size
+
+        with open(path, 'rb') as infile:
+            while True:
+                header = infile.read(hsize)
+
+                if len(header) < hsize:
+                    break
+
+                tick, length = QlSerialBackend.RECORD_HEADER.unpack(header)
+                records.append((tick, infile.read(length)))
+
+        return records
+
+    def __open(self, target, mode: str) -> Optional[int]:
+        if target is None:
+            return None
+
+        if isinstance(target, int):
+            return target
+
+        if isinstance(target, str):
+            target = open(target, mode, buffering=0)
+            self._owned.append(target)
+
+        return target.fileno()
+
+    def bind(self, peripheral):
+        self.peripheral = peripheral
+
+        if self.tx_limit is not None:
+            peripheral.otube.limit = self.tx_limit
+
+    def step(self):
+        self.tick += 1
+
+        while self._replay and self._replay[0][0] <= self.tick:
+            _, data = self._replay.popleft()
+            self.peripheral.send(data)
+
+        if self.tick % self.interval == 0 or len(self.peripheral.otube) >= self.batch:
+            self.poll()
+            self.drain()
+
+    def poll(self):
+        """ Feed the peripheral with whatever input is available at the moment.
+        """
+
+        if self._ifd is None:
+            return
+
+        try:
+            data = os.read(self._ifd, self.batch)
+        except (BlockingIOError, OSError):
+            return
+
+        if data:
+            self.peripheral.send(data)
+
+            if self._record:
+                self._record.write(QlSerialBackend.RECORD_HEADER.pack(self.tick, len(data)))
+                self._record.write(data)
+
+    def drain(self):
+        """ Write pending peripheral output to the host stream. Data the stream
+            does not accept remains buffered in the peripheral.
+        """
+
+        # no output stream: leave the data in the peripheral for the user to recv
+        if self._ofd is None:
+            return
+
+        otube = self.peripheral.otube
+
+        while otube.readable():
+            data = otube.peek(self.batch)
+
+            try:
+                written = os.write(self._ofd, data)
+            except BlockingIOError:
+                written = 0
+
+            otube.read(written)
+
+            if written < len(data):
+                break
+
+    def close(self):
+        """ Flush pending output and release the host streams.
+        """
+
+        if self.peripheral is not None:
+            self.poll()
+            self.drain()
+
+        for fd, blocking in self._blocking.items():
+            os.set_blocking(fd, blocking)
+
+        self._blocking.clear()
+
+        if self._record:
+            self._record.close()
+
+        for obj in self._owned:
+            if isinstance(obj, int):
+                os.close(obj)
+            else:
+                obj.close()
+
+        self._owned.clear()
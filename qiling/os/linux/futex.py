@@ -3,66 +3,308 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
-import gevent
-
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
 
 from gevent.event import Event
-from queue import Queue
+
+from qiling import Qiling
+from qiling.os.posix.const import EAGAIN, EDEADLK, EINVAL, EPERM, ETIMEDOUT
+
+FUTEX_WAITERS    = 0x80000000
+FUTEX_TID_MASK   = 0x3fffffff
+
+# FUTEX_WAKE_OP operations and comparisons
+FUTEX_OP_OPARG_SHIFT = 8
+
+FUTEX_OPS = {
+    0: lambda old, arg: arg,            # FUTEX_OP_SET
+    1: lambda old, arg: old + arg,      # FUTEX_OP_ADD
+    2: lambda old, arg: old | arg,      # FUTEX_OP_OR
+    3: lambda old, arg: old & ~arg,     # FUTEX_OP_ANDN
+    4: lambda old, arg: old ^ arg       # FUTEX_OP_XOR
+}
+
+FUTEX_CMPS = {
+    0: lambda old, arg: old == arg,     # FUTEX_OP_CMP_EQ
+    1: lambda old, arg: old != arg,     # FUTEX_OP_CMP_NE
+    2: lambda old, arg: old < arg,      # FUTEX_OP_CMP_LT
+    3: lambda old, arg: old <= arg,     # FUTEX_OP_CMP_LE
+    4: lambda old, arg: old > arg,      # FUTEX_OP_CMP_GT
+    5: lambda old, arg: old >= arg      # FUTEX_OP_CMP_GE
+}
+
+
+class QlFutexWaiter:
+    """A thread waiting on a futex word.
+    """
+
+    __slots__ = ('thread', 'bitset', 'pi', 'event', 'expired')
+
+    def __init__(self, thread, bitset: int, pi: bool = False):
+        self.thread = thread
+        self.bitset = bitset
+        self.pi = pi
+        self.event = Event()
+        self.expired = False
+
+    def expire(self) -> None:
+        # a waiter that got woken up before its timer fired is not timed out
+        if not self.event.is_set():
+            self.expired = True
+            self.event.set()
+
 
 class QlLinuxFutexManagement:
 
     FUTEX_BITSET_MATCH_ANY = 0xffffffff
 
     def __init__(self):
-        self._wait_list = {}
+        self._wait_list: Dict[int, Deque[QlFutexWaiter]] = {}
 
     @property
     def wait_list(self):
         return self._wait_list
 
-    def futex_wait(self, ql, uaddr, t, val, bitset=FUTEX_BITSET_MATCH_ANY):
-        EAGAIN = 11
+    @staticmethod
+    def __read_word(ql: Qiling, uaddr: int) -> int:
+        return ql.mem.read_ptr(uaddr, 4)
+
+    def __enqueue(self, uaddr: int, waiter: QlFutexWaiter) -> None:
+        if uaddr not in self._wait_list:
+            self._wait_list[uaddr] = deque()
+
+        self._wait_list[uaddr].append(waiter)
+
+    def __dequeue(self, uaddr: int, number: int, bitset: int = FUTEX_BITSET_MATCH_ANY, pi: bool = False) -> Deque[QlFutexWaiter]:
+        """Remove up to `number` waiters on `uaddr` whose bitset matches, keeping the others in order.
+        """
+
+        removed = deque()
+        queue = self._wait_list.get(uaddr)
+
+        if not queue:
+            return removed
+
+        skipped = []
+
+        while queue and len(removed) < number:
+            waiter = queue.popleft()
+
+            if (waiter.bitset & bitset) and waiter.pi == pi:
+                removed.append(waiter)
+            else:
+                skipped.append(waiter)
+
+        # put back the ones we stepped over, ahead of the rest
+        queue.extendleft(reversed(skipped))
+
+        if not queue:
+            del self._wait_list[uaddr]
+
+        return removed
+
+    def __remove(self, uaddr: int, waiter: QlFutexWaiter) -> None:
+        queue = self._wait_list.get(uaddr)
+
+        # the waiter might have been requeued to another futex word in the meantime
+        if queue is None or waiter not in queue:
+            for uaddr, queue in self._wait_list.items():
+                if waiter in queue:
+                    break
+            else:
+                return
+
+        queue.remove(waiter)
+
+        if not queue:
+            del self._wait_list[uaddr]
+
+    def __has_waiters(self, uaddr: int) -> bool:
+        return uaddr in self._wait_list
+
+    def __block(self, ql: Qiling, uaddr: int, waiter: QlFutexWaiter, timeout: Optional[int], on_timeout: Optional[Callable[[], None]] = None) -> None:
+        """Stop emulation and have the calling thread wait on the futex once out of the unicorn context.
+        The timeout, if any, is measured in nanoseconds of the scheduler virtual clock.
+        """
+
         def _sched_wait_event(cur_thread):
             ql.log.debug(f"Wait for notifications.")
-            event.wait()
-        uaddr_value = ql.unpack32(ql.mem.read(uaddr, 4))
+
+            thread_management = ql.os.thread_management
+            timer = None
+
+            if timeout is not None:
+                timer = thread_management.set_timer(timeout, waiter.expire)
+
+            thread_management.block(cur_thread, 'futex', waiter.event.wait)
+
+            if timer is not None:
+                thread_management.cancel_timer(timer)
+
+            if waiter.expired:
+                self.__remove(uaddr, waiter)
+
+                if on_timeout is not None:
+                    on_timeout()
+
+                # the wait is over; get the thread context back to set the actual return value
+                thread_management.switch_to(cur_thread)
+                ql.os.syscall_abi.set_return_value(-ETIMEDOUT)
+
+        self.__enqueue(uaddr, waiter)
+
+        ql.emu_stop()
+        waiter.thread.sched_cb = _sched_wait_event
+
+    def futex_wait(self, ql: Qiling, uaddr: int, t, val: int, bitset: int = FUTEX_BITSET_MATCH_ANY, timeout: Optional[int] = None) -> int:
+        """Wait on `uaddr` as long as it holds `val`, or until `timeout` nanoseconds of virtual time have elapsed.
+        """
+
+        if bitset == 0:
+            return -EINVAL
+
+        uaddr_value = self.__read_word(ql, uaddr)
+
         if uaddr_value != val:
             ql.log.debug(f"uaddr: {hex(uaddr_value)} != {hex(val)}")
             return -EAGAIN
-        ql.emu_stop()
-        if uaddr not in self.wait_list.keys():
-            self.wait_list[uaddr] = Queue()
-        event = Event()
-        self.wait_list[uaddr].put((bitset, t, event))
-        t.sched_cb = _sched_wait_event
+
+        if timeout is not None and timeout <= 0:
+            return -ETIMEDOUT
+
+        self.__block(ql, uaddr, QlFutexWaiter(t, bitset), timeout)
+
         return 0
 
-    def get_futex_wake_list(self, ql, addr, number, bitset=FUTEX_BITSET_MATCH_ANY):
-        wakes = []
-        if addr not in self.wait_list or number == 0:
+    def get_futex_wake_list(self, ql: Qiling, addr: int, number: int, bitset: int = FUTEX_BITSET_MATCH_ANY):
+        """Remove up to `number` matching waiters from `addr`, and return them as (thread, event) pairs.
+        """
+
+        if number <= 0:
+            return []
+
+        wakes = self.__dequeue(addr, number, bitset)
+
+        if not wakes:
             ql.log.debug(f"No thread at {hex(addr)}")
-            return wakes
-        thread_queue = self.wait_list[addr]
-        if thread_queue.qsize() < number:
-            number = thread_queue.qsize()
-        for _ in range(number):
-            orig_bitset, thread, event = thread_queue.get()
-            if orig_bitset & bitset:
-                wakes.append((thread, event))
-        if self.wait_list[addr].qsize() == 0:
-            del self.wait_list[addr]
-        return wakes
-
-    def futex_wake(self, ql, uaddr, t, number, bitset=FUTEX_BITSET_MATCH_ANY):
-        def _sched_set_event(cur_thread):
-            for t, e in wakes:
-                ql.log.debug(f"Notify [Thread {t.get_id()}.")
-                e.set()
-            # Give up control.
-            gevent.sleep(0)
 
-        ql.emu_stop()
+        return [(waiter.thread, waiter.event) for waiter in wakes]
+
+    def futex_wake(self, ql: Qiling, uaddr: int, t, number: int, bitset: int = FUTEX_BITSET_MATCH_ANY) -> int:
+        """Wake up to `number` threads waiting on `uaddr`.
+        """
+
+        if bitset == 0:
+            return -EINVAL
+
         wakes = self.get_futex_wake_list(ql, uaddr, number, bitset)
-        t.sched_cb = _sched_set_event
+
+        # setting an event only schedules the waiter; it does not give up control, so this
+        # is safe to do from within a unicorn callback and there is no need to stop emulation
+        for thread, event in wakes:
+            ql.log.debug(f"Notify {thread}.")
+            event.set()
 
         return len(wakes)
+
+    def futex_requeue(self, ql: Qiling, uaddr: int, number: int, uaddr2: int, limit: int, val3: Optional[int] = None) -> int:
+        """Wake up to `number` threads waiting on `uaddr`, and move up to `limit` of the remaining
+        ones to wait on `uaddr2` instead. If `val3` is specified, `uaddr` has to hold that value.
+
+        Returns: number of woken threads, plus the number of requeued ones if `val3` was specified
+        """
+
+        if val3 is not None and self.__read_word(ql, uaddr) != val3:
+            return -EAGAIN
+
+        woken = self.futex_wake(ql, uaddr, None, number)
+        moved = self.__dequeue(uaddr, limit)
+
+        for waiter in moved:
+            self.__enqueue(uaddr2, waiter)
+
+        return woken + (len(moved) if val3 is not None else 0)
+
+    def futex_wake_op(self, ql: Qiling, uaddr: int, number: int, uaddr2: int, number2: int, val3: int) -> int:
+        """Update the word at `uaddr2` as encoded in `val3`, wake up to `number` threads waiting
+        on `uaddr` and, if the old value of `uaddr2` satisfies the encoded condition, up to
+        `number2` threads waiting on `uaddr2`.
+        """
+
+        op = (val3 >> 28) & 0xf
+        cmp = (val3 >> 24) & 0xf
+        oparg = (val3 >> 12) & 0xfff
+        cmparg = val3 & 0xfff
+
+        if op & FUTEX_OP_OPARG_SHIFT:
+            op &= ~FUTEX_OP_OPARG_SHIFT
+            oparg = 1 << oparg
+
+        if op not in FUTEX_OPS or cmp not in FUTEX_CMPS:
+            return -EINVAL
+
+        oldval = self.__read_word(ql, uaddr2)
+        ql.mem.write_ptr(uaddr2, FUTEX_OPS[op](oldval, oparg) & 0xffffffff, 4)
+
+        woken = self.futex_wake(ql, uaddr, None, number)
+
+        if FUTEX_CMPS[cmp](oldval, cmparg):
+            woken += self.futex_wake(ql, uaddr2, None, number2)
+
+        return woken
+
+    def futex_lock_pi(self, ql: Qiling, uaddr: int, t, timeout: Optional[int] = None, trylock: bool = False) -> int:
+        """Acquire a priority-inheritance futex on behalf of thread `t`. Only ownership hand-off is
+        implemented; priorities are not boosted since the scheduler does not have any.
+        """
+
+        word = self.__read_word(ql, uaddr)
+        owner = word & FUTEX_TID_MASK
+
+        if owner == 0:
+            # keep the waiters bit of a lock whose waiters are still queued
+            ql.mem.write_ptr(uaddr, t.id | (word & FUTEX_WAITERS), 4)
+
+            return 0
+
+        if owner == t.id:
+            return -EDEADLK
+
+        if trylock:
+            return -EAGAIN
+
+        if timeout is not None and timeout <= 0:
+            return -ETIMEDOUT
+
+        ql.mem.write_ptr(uaddr, word | FUTEX_WAITERS, 4)
+
+        def _on_timeout():
+            if not self.__has_waiters(uaddr):
+                ql.mem.write_ptr(uaddr, self.__read_word(ql, uaddr) & ~FUTEX_WAITERS, 4)
+
+        self.__block(ql, uaddr, QlFutexWaiter(t, self.FUTEX_BITSET_MATCH_ANY, pi=True), timeout, _on_timeout)
+
+        return 0
+
+    def futex_unlock_pi(self, ql: Qiling, uaddr: int, t) -> int:
+        """Release a priority-inheritance futex held by thread `t`, handing it over to the first waiter.
+        """
+
+        word = self.__read_word(ql, uaddr)
+
+        if word & FUTEX_TID_MASK != t.id:
+            return -EPERM
+
+        wakes = self.__dequeue(uaddr, 1, pi=True)
+
+        if wakes:
+            waiter = wakes[0]
+            pending = FUTEX_WAITERS if self.__has_waiters(uaddr) else 0
+
+            ql.mem.write_ptr(uaddr, waiter.thread.id | pending, 4)
+            waiter.event.set()
+        else:
+            ql.mem.write_ptr(uaddr, 0, 4)
+
+        return 0
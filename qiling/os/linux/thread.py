@@ -4,11 +4,16 @@
 #
 
 import os
+import heapq
+import itertools
 import gevent
 
-from typing import Callable, Sequence
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Sequence, Tuple
 from abc import abstractmethod
 
+from gevent.event import Event
+
 from unicorn.unicorn import UcError
 
 from qiling import Qiling
@@ -42,6 +47,9 @@ class QlLinuxThread(QlThread):
         self._log_file_fd = None
         self._sched_cb = None
 
+        # set by the thread manager when this thread is handed the cpu
+        self._wakeup = Event()
+
         # Compatibility
         self._log_file_fd = ql.log
 
@@ -197,7 +205,7 @@ class QlLinuxThread(QlThread):
 
     def _default_sched_cb(self):
         # Give up control.
-        gevent.sleep(0)
+        self.ql.os.thread_management.yield_cpu(self)
 
     def _run(self):
         # Some random notes for myself:
@@ -217,17 +225,16 @@ class QlLinuxThread(QlThread):
         #    In this context, we do:
         #        - Call gevent functions to switch threads.
         #        - Forward blocking syscalls to gevent.
-        self.ql.arch.regs.arch_pc = self.start_address
-        if not self._saved_context:
-            self.save()
+        thread_management = self.ql.os.thread_management
+        thread_management.acquire(self)
 
         while self.status != THREAD_STATUS_TERMINATED:
             # Rewrite our status and the current thread.
             self.status = THREAD_STATUS_RUNNING
-            self.ql.os.thread_management.cur_thread = self
+            thread_management.cur_thread = self
 
-            # Restore the context of the currently executing thread and set tls
-            self.restore()
+            # Load the context of this thread and its tls, unless they are still in place
+            thread_management.switch_to(self)
 
             # Sanity check
             if self.ql.arch.regs.arch_pc == self.exit_point:
@@ -240,13 +247,20 @@ class QlLinuxThread(QlThread):
             self.ql.log.debug(f"Scheduled from {hex(start_address)}.")
             try:
                 # Known issue for timeout: https://github.com/unicorn-engine/unicorn/issues/1355
-                self.ql.emu_start(start_address, self.exit_point, count=32337)
+                self.ql.emu_start(start_address, self.exit_point, count=thread_management.quantum)
             except UcError as e:
                 self.ql.os.emu_error()
                 self.ql.log.exception("")
                 raise e
+
+            # every slice takes a quantum of virtual time, however early it got stopped
+            thread_management.advance(thread_management.quantum)
             self.ql.log.debug(f"Suspended at {hex(self.ql.arch.regs.arch_pc)}")
-            self.save()
+
+            exited = self.ql.arch.regs.arch_pc == self.exit_point
+
+            if not thread_management.lazy_switch:
+                thread_management.switch_out(self)
 
             # Note that this callback may be set by UC callbacks.
             # Some thought on this design:
@@ -256,9 +270,12 @@ class QlLinuxThread(QlThread):
             self.ql.log.debug(f"Call sched_cb: {self.sched_cb}")
             self.sched_cb(self)
 
-            if self.status == THREAD_STATUS_TERMINATED or self.ql.arch.regs.arch_pc == self.exit_point:
+            if self.status == THREAD_STATUS_TERMINATED or exited:
                 break
 
+        thread_management.switch_out(self)
+        thread_management.release(self)
+
         self._on_stop()
 
     # Depreciated.
@@ -303,12 +320,7 @@ class QlLinuxThread(QlThread):
         self.ql.arch.restore(self.saved_context)
 
     def set_start_address(self, addr):
-        # We can't modify UcContext directly.
-        old_context = self.ql.arch.save()
-        self.restore_context()
-        self.ql.arch.regs.arch_pc = addr
-        self.save_context()
-        self.ql.arch.restore(old_context)
+        self.saved_context.reg_write(self.ql.arch.regs.uc_pc, addr)
 
     def set_clear_child_tid_addr(self, addr):
         self.clear_child_tid_address = addr
@@ -400,13 +412,18 @@ class QlLinuxX86Thread(QlLinuxThread):
         self.save_context()
         self.tls = self.__read_tls()
 
-        self.ql.log.debug(f'Context saved (fs={self.ql.arch.regs.fs:#06x} gs={self.ql.arch.regs.gs:#06x} gdt_buf=[{" ".join(ent.hex() for ent in self.tls)}])')
+        self.ql.log.debug(f'Context saved (gdt_buf=[{" ".join(ent.hex() for ent in self.tls)}])')
 
     def restore(self):
         self.restore_context()
-        self.__write_tls(self.tls)
 
-        self.ql.log.debug(f'Context restored (fs={self.ql.arch.regs.fs:#06x} gs={self.ql.arch.regs.gs:#06x} gdt_buf=[{" ".join(ent.hex() for ent in self.tls)}])')
+        # the tls descriptors live in the gdt, which is shared by all threads. only
+        # rewrite the entries the outgoing thread left with different values
+        for i, current, entry in zip((12, 13, 14), self.__read_tls(), self.tls):
+            if current != entry:
+                self.ql.os.gdtm.set_entry(i, entry)
+
+        self.ql.log.debug(f'Context restored (gdt_buf=[{" ".join(ent.hex() for ent in self.tls)}])')
 
     def clone(self):
         new_thread = super(QlLinuxX86Thread, self).clone()
@@ -430,12 +447,12 @@ class QlLinuxX8664Thread(QlLinuxThread):
     def save(self):
         self.save_context()
         self.tls = self.ql.arch.msr.read(IA32_FS_BASE_MSR)
-        self.ql.log.debug(f"Saved context: fs={hex(self.ql.arch.regs.fsbase)} tls={hex(self.tls)}")
+        self.ql.log.debug(f"Saved context: tls={hex(self.tls)}")
 
     def restore(self):
+        # fs base is part of the cpu context, no need to set it again
         self.restore_context()
-        self.set_thread_tls(self.tls)
-        self.ql.log.debug(f"Restored context: fs={hex(self.ql.arch.regs.fsbase)} tls={hex(self.tls)}")
+        self.ql.log.debug(f"Restored context: tls={hex(self.tls)}")
 
     def clone(self):
         new_thread = super(QlLinuxX8664Thread, self).clone()
@@ -459,12 +476,12 @@ class QlLinuxMIPS32Thread(QlLinuxThread):
     def save(self):
         self.save_context()
         self.tls = self.ql.arch.regs.cp0_userlocal
-        self.ql.log.debug(f"Saved context. cp0={hex(self.ql.arch.regs.cp0_userlocal)}")
+        self.ql.log.debug(f"Saved context. cp0={hex(self.tls)}")
 
     def restore(self):
+        # cp0 userlocal is part of the cpu context, no need to set it again
         self.restore_context()
-        self.set_thread_tls(self.tls)
-        self.ql.log.debug(f"Restored context. cp0={hex(self.ql.arch.regs.cp0_userlocal)}")
+        self.ql.log.debug(f"Restored context. cp0={hex(self.tls)}")
 
     def clone(self):
         new_thread = super(QlLinuxMIPS32Thread, self).clone()
@@ -491,10 +508,10 @@ class QlLinuxARMThread(QlLinuxThread):
         self.ql.log.debug(f"Context saved. TPIDRURO = {self.tls:#010x}")
 
     def restore(self) -> None:
+        # TPIDRURO is part of the cpu context, no need to set it again
         self.restore_context()
-        self.set_thread_tls(self.tls)
 
-        self.ql.log.debug(f"Context restored. TPIDRURO = {self.ql.arch.cpr.TPIDRURO:#010x}")
+        self.ql.log.debug(f"Context restored. TPIDRURO = {self.tls:#010x}")
 
     def clone(self):
         new_thread = super().clone()
@@ -523,10 +540,10 @@ class QlLinuxARM64Thread(QlLinuxThread):
         self.ql.log.debug(f"Context saved. TPIDR_EL0 = {self.tls:#010x}")
 
     def restore(self) -> None:
+        # TPIDR_EL0 is part of the cpu context, no need to set it again
         self.restore_context()
-        self.set_thread_tls(self.tls)
 
-        self.ql.log.debug(f"Context restored. TPIDR_EL0 = {self.ql.arch.cpr.TPIDR_EL0:#010x}")
+        self.ql.log.debug(f"Context restored. TPIDR_EL0 = {self.tls:#010x}")
 
     def clone(self):
         new_thread = super().clone()
@@ -542,6 +559,186 @@ class QlLinuxThreadManagement:
         self._main_thread = None
         self._cur_thread = None
 
+        # number of instructions a thread may run before another ready thread gets the cpu
+        self.quantum = ql.os.profile.getint('KERNEL', 'thread_quantum', fallback=32337)
+
+        # keep the context of the running thread in the emulator until another thread is
+        # scheduled, rather than saving and restoring it around every quantum
+        self.lazy_switch = ql.os.profile.getboolean('KERNEL', 'thread_lazy_switch', fallback=True)
+
+        # threads that are ready to run, in the order they will get the cpu
+        self.run_queue = deque()
+
+        # threads waiting on a futex, poll or sleep, mapped to what they wait for
+        self.blocked: Dict[QlLinuxThread, str] = {}
+
+        # the thread holding the cpu, and the thread whose context is loaded in the emulator
+        self.running = None
+        self.owner = None
+
+        # per thread statistics, indexed by thread id
+        self.instructions = Counter()
+        self.switches = Counter()
+
+        # virtual time in nanoseconds, taking an instruction as a nanosecond. it does not follow the
+        # host clock, so that timeouts expire at the same point of the emulation on every run
+        self.clock = 0
+
+        # pending timers as a heap of [deadline, sequence, callback] entries
+        self.timers: List[list] = []
+        self.__timer_seq = itertools.count()
+
+        if ql.os.profile.getboolean('KERNEL', 'thread_accounting', fallback=False):
+            self._block_sizes = {}
+            ql.hook_block(self.__count_instructions)
+
+    def __count_instructions(self, ql, address: int, size: int):
+        count = self._block_sizes.get(address)
+
+        if count is None:
+            count = sum(1 for _ in ql.arch.disassembler.disasm_lite(bytes(ql.mem.read(address, size)), address))
+            self._block_sizes[address] = count
+
+        self.instructions[self._cur_thread.id] += count
+
+    def acquire(self, t: QlLinuxThread) -> None:
+        """Wait until the cpu is handed to thread `t`.
+        """
+
+        if self.running is None:
+            self.running = t
+
+        elif self.running is not t:
+            self.run_queue.append(t)
+
+            t._wakeup.wait()
+            t._wakeup.clear()
+
+    def release(self, t: QlLinuxThread) -> None:
+        """Hand the cpu over from thread `t` to the next ready thread, if any.
+        """
+
+        if self.running is not t:
+            return
+
+        if self.run_queue:
+            self.running = self.run_queue.popleft()
+            self.running._wakeup.set()
+        else:
+            self.running = None
+
+            # check for idle time once the threads that are about to start or wake up had their turn
+            gevent.get_hub().loop.run_callback(self.__on_idle)
+
+    def yield_cpu(self, t: QlLinuxThread) -> None:
+        """Let the next ready thread run, and wait for our turn to come again. When no
+        other thread is ready, `t` simply keeps the cpu.
+        """
+
+        # let gevent deliver expired timers and start freshly spawned threads, so
+        # those can line up in the run queue
+        gevent.sleep(0)
+
+        if self.run_queue and self.running is t:
+            self.release(t)
+            self.acquire(t)
+
+    def block(self, t: QlLinuxThread, reason: str, wait: Callable[[], Any]) -> Any:
+        """Give up the cpu while thread `t` waits on `wait`, and get it back once done.
+
+        Returns: whatever `wait` returns
+        """
+
+        if t.status != THREAD_STATUS_TERMINATED:
+            t.status = THREAD_STATUS_BLOCKING
+
+        self.blocked[t] = reason
+        self.release(t)
+
+        try:
+            return wait()
+        finally:
+            del self.blocked[t]
+            self.acquire(t)
+
+    def set_timer(self, delay: int, callback: Callable[[], None]) -> list:
+        """Have `callback` called once `delay` nanoseconds of virtual time have elapsed.
+
+        Returns: a handle to pass to `cancel_timer`
+        """
+
+        timer = [self.clock + delay, next(self.__timer_seq), callback]
+        heapq.heappush(self.timers, timer)
+
+        return timer
+
+    def cancel_timer(self, timer: list) -> None:
+        """Discard a pending timer. Cancelled timers are dropped once they reach the heap top.
+        """
+
+        timer[2] = None
+
+    def advance(self, delta: int) -> None:
+        """Move the virtual clock forward by `delta` nanoseconds and fire the expired timers.
+        """
+
+        self.clock += delta
+
+        while self.timers and self.timers[0][0] <= self.clock:
+            _, _, callback = heapq.heappop(self.timers)
+
+            if callback is not None:
+                callback()
+
+    def __on_idle(self) -> None:
+        # nothing is left to run before the next timer expires, unless a thread waits on something
+        # outside of the virtual clock. skip the idle time
+        if self.running is not None or self.run_queue:
+            return
+
+        if any(reason != 'futex' for reason in self.blocked.values()):
+            return
+
+        while self.timers and self.timers[0][2] is None:
+            heapq.heappop(self.timers)
+
+        if self.timers:
+            self.advance(max(self.timers[0][0] - self.clock, 0))
+
+    def switch_to(self, t: QlLinuxThread) -> None:
+        """Load the context of thread `t` into the emulator.
+        """
+
+        if self.owner is t:
+            return
+
+        self.switch_out(self.owner)
+
+        # a thread without a saved context starts off the current emulator state
+        if not t.saved_context:
+            self.ql.arch.regs.arch_pc = t.start_address
+            t.save()
+
+        t.restore()
+
+        self.owner = t
+        self.switches[t.id] += 1
+
+    def switch_out(self, t: QlLinuxThread) -> None:
+        """Save the context of thread `t` if it is loaded in the emulator.
+        """
+
+        if t is not None and self.owner is t:
+            t.save()
+            self.owner = None
+
+    def stats(self) -> Dict[int, Tuple[int, int]]:
+        """Get the number of executed instructions and context switches of every thread.
+        Instructions are counted only when `thread_accounting` is enabled in the profile.
+        """
+
+        return {tid: (self.instructions[tid], self.switches[tid]) for tid in sorted(self.switches)}
+
     # cur_thread is only guaranteed to be correct in unicorn callbacks context.
     @property
     def cur_thread(self):
@@ -64,6 +64,15 @@ class QlMemoryManager:
         # make sure pagesize is a power of 2
         assert self.pagesize & (self.pagesize - 1) == 0, 'pagesize has to be a power of 2'
 
+        # callables to notify whenever a memory range is modified on the host side rather
+        # than by emulated code: written, mapped, unmapped or re-protected. called with address
+        # and size. writes and unmaps are notified before they take place
+        self.observers: List[Callable[[int, int], Any]] = []
+
+    def __notify(self, addr: int, size: int) -> None:
+        for observer in self.observers:
+            observer(addr, size)
+
     def __read_string(self, addr: int) -> str:
         ret = bytearray()
         c = self.read(addr, 1)
@@ -369,6 +378,9 @@ class QlMemoryManager:
             data: bytes to write
         """
 
+        if self.observers:
+            self.__notify(addr, len(data))
+
         self.ql.uc.mem_write(addr, data)
 
     def write_ptr(self, addr: int, value: int, size: int = 0, *, signed = False) -> None:
@@ -447,6 +459,10 @@ class QlMemoryManager:
             size: range size (in bytes)
         """
 
+        # notify before the range is gone, so observers may still access its content
+        if self.observers:
+            self.__notify(addr, size)
+
         self.del_mapinfo(addr, addr + size)
         self.ql.uc.mem_unmap(addr, size)
 
@@ -613,7 +629,10 @@ class QlMemoryManager:
         self.ql.uc.mem_protect(aligned_address, aligned_size, perms)
         self.change_mapinfo(aligned_address, aligned_address + aligned_size, perms)
 
-    def map(self, addr: int, size: int, perms: int = UC_PROT_ALL, info: Optional[str] = None):
+        if self.observers:
+            self.__notify(aligned_address, aligned_size)
+
+    def map(self, addr: int, size: int, perms: int = UC_PROT_ALL, info: Optional[str] = None, ptr: Optional[int] = None):
         """Map a new memory range.
 
         Args:
@@ -621,7 +640,8 @@ class QlMemoryManager:
             size: memory range size (in bytes)
             perms: requested permissions mask
             info: range label string
-            ptr: pointer to use (if any)
+            ptr: host memory to back the range with (if any). the host memory has to remain
+            valid for as long as the range is mapped
 
         Raises:
             QlMemoryMappedError: in case requested memory range is not fully available
@@ -632,9 +652,16 @@ class QlMemoryManager:
         if not self.is_available(addr, size):
             raise QlMemoryMappedError('Requested memory is unavailable')
 
-        self.ql.uc.mem_map(addr, size, perms)
+        if ptr is None:
+            self.ql.uc.mem_map(addr, size, perms)
+        else:
+            self.ql.uc.mem_map_ptr(addr, size, perms, ptr)
+
         self.add_mapinfo(addr, addr + size, perms, info or '[mapped]', is_mmio=False)
 
+        if self.observers:
+            self.__notify(addr, size)
+
     def map_mmio(self, addr: int, size: int, handler: QlMmioHandler, info: str = '[mmio]'):
         # TODO: mmio memory overlap with ram? Is that possible?
         # TODO: Can read_cb or write_cb be None? How uc handle that access?
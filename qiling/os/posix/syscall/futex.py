@@ -3,7 +3,30 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
+import time
+
+from typing import Optional
+
 from qiling import Qiling
+from qiling.os.posix.const import ENOSYS
+
+FUTEX_WAIT = 0
+FUTEX_WAKE = 1
+FUTEX_FD = 2
+FUTEX_REQUEUE = 3
+FUTEX_CMP_REQUEUE = 4
+FUTEX_WAKE_OP = 5
+FUTEX_LOCK_PI = 6
+FUTEX_UNLOCK_PI = 7
+FUTEX_TRYLOCK_PI = 8
+FUTEX_WAIT_BITSET = 9
+FUTEX_WAKE_BITSET = 10
+FUTEX_WAIT_REQUEUE_PI = 11
+FUTEX_CMP_REQUEUE_PI = 12
+FUTEX_PRIVATE_FLAG = 128
+FUTEX_CLOCK_REALTIME = 256
+
+FUTEX_CMD_MASK = ~(FUTEX_PRIVATE_FLAG | FUTEX_CLOCK_REALTIME)
 
 def ql_syscall_set_robust_list(ql: Qiling, head_ptr: int, head_len: int):
     if ql.multithread:
@@ -13,43 +36,79 @@ def ql_syscall_set_robust_list(ql: Qiling, head_ptr: int, head_len: int):
     return 0
 
 
-def ql_syscall_futex(ql: Qiling, uaddr: int, op: int, val: int, timeout: int, uaddr2: int, val3: int):
-    FUTEX_WAIT = 0
-    FUTEX_WAKE = 1
-    FUTEX_FD = 2
-    FUTEX_REQUEUE = 3
-    FUTEX_CMP_REQUEUE = 4
-    FUTEX_WAKE_OP = 5
-    FUTEX_LOCK_PI = 6
-    FUTEX_UNLOCK_PI = 7
-    FUTEX_TRYLOCK_PI = 8
-    FUTEX_WAIT_BITSET = 9
-    FUTEX_WAKE_BITSET = 10
-    FUTEX_WAIT_REQUEUE_PI = 11
-    FUTEX_CMP_REQUEUE_PI = 12
-    FUTEX_PRIVATE_FLAG = 128
-
-    if op & (FUTEX_PRIVATE_FLAG - 1) == FUTEX_WAIT:
-        # def futex_wait_addr(ql, th, arg):
-        #     addr, val = arg
-        #     return ql.unpack32(ql.mem.read(addr, 4)) == val
-
-        regreturn = ql.os.futexm.futex_wait(ql, uaddr, ql.os.thread_management.cur_thread, val)
-
-    elif op & (FUTEX_PRIVATE_FLAG - 1) == FUTEX_WAIT_BITSET:
-        regreturn = ql.os.futexm.futex_wait(ql, uaddr, ql.os.thread_management.cur_thread, val, val3)
-
-    elif op & (FUTEX_PRIVATE_FLAG - 1) == FUTEX_WAKE:
-        regreturn = ql.os.futexm.futex_wake(ql, uaddr,ql.os.thread_management.cur_thread, val)
-
-    elif op & (FUTEX_PRIVATE_FLAG - 1) == FUTEX_WAKE_BITSET:
-        regreturn = ql.os.futexm.futex_wake(ql, uaddr,ql.os.thread_management.cur_thread, val, val3)
+def __read_timeout(ql: Qiling, timeout: int, absolute: bool, realtime: bool, force_timespec64: bool) -> Optional[int]:
+    """Read the timespec pointed by `timeout` and turn it into a number of nanoseconds from now,
+    to be waited on the scheduler virtual clock.
+    """
+
+    if not timeout:
+        return None
+
+    tv_sec_size = 8 if force_timespec64 else ql.arch.pointersize
+    tv_nsec_size = ql.arch.pointersize
+
+    tv_sec = ql.mem.read_ptr(timeout, tv_sec_size)
+    tv_nsec = ql.mem.read_ptr(timeout + tv_sec_size, tv_nsec_size)
+
+    nanoseconds = tv_sec * 1000000000 + tv_nsec
+
+    # an absolute deadline was computed off the clock the program read, which is the host one
+    if absolute:
+        nanoseconds -= time.time_ns() if realtime else time.monotonic_ns()
+
+    return nanoseconds
+
+
+def __futex_common(ql: Qiling, uaddr: int, op: int, val: int, timeout: int, uaddr2: int, val3: int, force_timespec64: bool = False):
+    cmd = op & FUTEX_CMD_MASK
+    realtime = bool(op & FUTEX_CLOCK_REALTIME)
+
+    futexm = ql.os.futexm
+    cur_thread = ql.os.thread_management.cur_thread
+
+    # relative timeout for FUTEX_WAIT, absolute for the others
+    if cmd == FUTEX_WAIT:
+        regreturn = futexm.futex_wait(ql, uaddr, cur_thread, val & 0xffffffff, timeout=__read_timeout(ql, timeout, False, realtime, force_timespec64))
+
+    elif cmd == FUTEX_WAIT_BITSET:
+        regreturn = futexm.futex_wait(ql, uaddr, cur_thread, val & 0xffffffff, val3 & 0xffffffff, __read_timeout(ql, timeout, True, realtime, force_timespec64))
+
+    elif cmd == FUTEX_WAKE:
+        regreturn = futexm.futex_wake(ql, uaddr, cur_thread, val)
+
+    elif cmd == FUTEX_WAKE_BITSET:
+        regreturn = futexm.futex_wake(ql, uaddr, cur_thread, val, val3 & 0xffffffff)
+
+    # for the requeue operations the timeout argument holds the requeue limit
+    elif cmd == FUTEX_REQUEUE:
+        regreturn = futexm.futex_requeue(ql, uaddr, val, uaddr2, timeout)
+
+    elif cmd == FUTEX_CMP_REQUEUE:
+        regreturn = futexm.futex_requeue(ql, uaddr, val, uaddr2, timeout, val3 & 0xffffffff)
+
+    elif cmd == FUTEX_WAKE_OP:
+        regreturn = futexm.futex_wake_op(ql, uaddr, val, uaddr2, timeout, val3)
+
+    # FUTEX_LOCK_PI always measures its timeout against CLOCK_REALTIME
+    elif cmd == FUTEX_LOCK_PI:
+        regreturn = futexm.futex_lock_pi(ql, uaddr, cur_thread, __read_timeout(ql, timeout, True, True, force_timespec64))
+
+    elif cmd == FUTEX_TRYLOCK_PI:
+        regreturn = futexm.futex_lock_pi(ql, uaddr, cur_thread, trylock=True)
+
+    elif cmd == FUTEX_UNLOCK_PI:
+        regreturn = futexm.futex_unlock_pi(ql, uaddr, cur_thread)
 
     else:
-        ql.log.debug(f'futex({uaddr:x}, {op:d}, {val:d}) = ?')
-        ql.emu_stop()
-        #ql.os.thread_management.cur_thread.stop()
-        #ql.os.thread_management.cur_thread.stop_event = THREAD_EVENT_EXIT_GROUP_EVENT
-        regreturn = 0
+        ql.log.debug(f'futex({uaddr:x}, {op:d}, {val:d}): unsupported operation')
+        regreturn = -ENOSYS
 
     return regreturn
+
+
+def ql_syscall_futex(ql: Qiling, uaddr: int, op: int, val: int, timeout: int, uaddr2: int, val3: int):
+    return __futex_common(ql, uaddr, op, val, timeout, uaddr2, val3)
+
+
+def ql_syscall_futex_time64(ql: Qiling, uaddr: int, op: int, val: int, timeout: int, uaddr2: int, val3: int):
+    return __futex_common(ql, uaddr, op, val, timeout, uaddr2, val3, True)
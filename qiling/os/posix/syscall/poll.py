@@ -8,6 +8,7 @@ from qiling.const import QL_OS, QL_ENDIAN
 from qiling.os.posix.structs import *
 import select
 import ctypes
+import gevent.select
 
 
 def ql_syscall_poll(ql: Qiling, fds: int, nfds: int, timeout: int):
@@ -15,6 +16,15 @@ def ql_syscall_poll(ql: Qiling, fds: int, nfds: int, timeout: int):
 
     if ql.host.os == QL_OS.LINUX:
         fn_map = {}
+
+        def __set_revents(res_list) -> int:
+            for fn, revent in res_list:
+                with pollfd.ref(ql.mem, fds + ctypes.sizeof(pollfd) * fn_map[fn]) as pf:
+                    ql.log.debug(f"receive event on fd {pf.fd}, revent {revent}")
+                    pf.revents = revent
+
+            return len(res_list)
+
         try:
             p = select.poll()
             for i in range(nfds):
@@ -27,17 +37,35 @@ def ql_syscall_poll(ql: Qiling, fds: int, nfds: int, timeout: int):
                     fn_map[fileno] = i
                     p.register(fileno, pf.events)
 
-            res_list = p.poll(timeout)
-            regreturn = len(res_list)
+            # a blocking poll would stall all the other threads; only check what is
+            # ready now, and have the calling thread wait for the rest off the cpu
+            blocking = ql.multithread and timeout != 0
+
+            res_list = p.poll(0 if blocking else timeout)
+            regreturn = __set_revents(res_list)
+
+            if blocking and not res_list:
+                waiter = gevent.select.poll()
+
+                for fileno, i in fn_map.items():
+                    with pollfd.ref(ql.mem, fds + ctypes.sizeof(pollfd) * i) as pf:
+                        waiter.register(fileno, pf.events)
+
+                def _sched_poll(cur_thread):
+                    thread_management = ql.os.thread_management
+                    res_list = thread_management.block(cur_thread, 'poll', lambda: waiter.poll(ctypes.c_int32(timeout).value))
+
+                    # the wait is over; get the thread context back to set the actual return value
+                    thread_management.switch_to(cur_thread)
+                    ql.os.syscall_abi.set_return_value(__set_revents(res_list))
+
+                ql.emu_stop()
+                ql.os.thread_management.cur_thread.sched_cb = _sched_poll
 
-            for fn, revent in res_list:
-                with pollfd.ref(ql.mem, fds + ctypes.sizeof(pollfd) * fn_map[fn]) as pf:
-                    ql.log.debug(f"receive event on fd {pf.fd}, revent {revent}")
-                    pf.revents = revent
         except Exception as e:
             ql.log.error(f'{e} {fds=}, {nfds=}, {timeout=}')
             regreturn = -1
-                
+
         return regreturn
     else:
         ql.log.warning(f'syscall poll not implemented')
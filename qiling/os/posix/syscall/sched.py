@@ -3,7 +3,7 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
-import os, gevent
+import os
 from multiprocessing import Process
 
 from qiling import Qiling
@@ -87,7 +87,7 @@ def ql_syscall_clone(ql: Qiling, flags: int, child_stack: int, parent_tidptr: in
     if flags & CLONE_PARENT_SETTID == CLONE_PARENT_SETTID:
         ql.mem.write_ptr(parent_tidptr, th.id, 4)
 
-    ctx = ql.save(reg=True, mem=False)
+    ctx = ql.arch.save()
     # Whether to set a new tls
     if flags & CLONE_SETTLS == CLONE_SETTLS:
         ql.log.debug(f"new_tls={newtls:#x}")
@@ -117,7 +117,7 @@ def ql_syscall_clone(ql: Qiling, flags: int, child_stack: int, parent_tidptr: in
     # ql.log.debug(f'clone(new_stack = {child_stack:#x}, flags = {flags:#x}, tls = {newtls:#x}, ptidptr = {parent_tidptr:#x}, ctidptr = {child_tidptr:#x}) = {regreturn:d}')
 
     # Restore the stack and return value of the parent process
-    ql.restore(ctx)
+    ql.arch.restore(ctx)
     regreturn = th.id
 
     # Break the parent process and enter the add new thread event
@@ -132,7 +132,7 @@ def ql_syscall_clone(ql: Qiling, flags: int, child_stack: int, parent_tidptr: in
 
 def ql_syscall_sched_yield(ql: Qiling):
     def _sched_yield(cur_thread):
-        gevent.sleep(0)
+        ql.os.thread_management.yield_cpu(cur_thread)
     ql.emu_stop()
     ql.os.thread_management.cur_thread.sched_cb = _sched_yield
     return 0
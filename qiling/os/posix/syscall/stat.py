@@ -1265,6 +1265,10 @@ def ql_syscall_fchmod(ql: Qiling, fd: int, mode: int):
 
 
 def ql_syscall_fstatat64(ql: Qiling, dirfd: int, path: int, buf_ptr: int, flags: int):
+    # stat an open file by its descriptor; it may not have a corresponding host path
+    if flags & AT_EMPTY_PATH and not ql.os.utils.read_cstring(path):
+        return __do_fstat(ql, ql.os.utils.as_signed(dirfd, 32), buf_ptr, pack_stat64_struct)
+
     dirfd, real_path = transform_path(ql, dirfd, path, flags)
 
     try:
@@ -1280,6 +1284,10 @@ def ql_syscall_fstatat64(ql: Qiling, dirfd: int, path: int, buf_ptr: int, flags:
     return ret
 
 def ql_syscall_newfstatat(ql: Qiling, dirfd: int, path: int, buf: int, flags: int):
+    # stat an open file by its descriptor; it may not have a corresponding host path
+    if flags & AT_EMPTY_PATH and not ql.os.utils.read_cstring(path):
+        return __do_fstat(ql, ql.os.utils.as_signed(dirfd, 32), buf, pack_stat_struct)
+
     dirfd, real_path = transform_path(ql, dirfd, path, flags)
 
     try:
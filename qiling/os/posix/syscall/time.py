@@ -31,7 +31,7 @@ def __sleep_common(ql: Qiling, req: int, rem: int, force_timespec64: bool = Fals
 
     if ql.os.thread_management:
         def _sched_sleep(cur_thread):
-            gevent.sleep(tv_sec)
+            ql.os.thread_management.block(cur_thread, 'sleep', lambda: gevent.sleep(tv_sec))
 
         ql.emu_stop()
         ql.os.thread_management.cur_thread.sched_cb = _sched_sleep
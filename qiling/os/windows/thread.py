@@ -44,7 +44,8 @@ class QlWindowsThread(QlThread):
         new_stack = os.heap.alloc(stack_size) + stack_size
 
         asize = ql.arch.pointersize
-        context = ql.arch.regs.save()
+        context = ql.arch.save()
+        regs = {}
 
         # set return address
         ql.mem.write_ptr(new_stack - asize, os.thread_manager.thread_ret_addr)
@@ -53,28 +54,35 @@ class QlWindowsThread(QlThread):
         if ql.arch.type == QL_ARCH.X86:
             ql.mem.write_ptr(new_stack, func_params)
         elif ql.arch.type == QL_ARCH.X8664:
-            context["rcx"] = func_params
+            regs["rcx"] = func_params
 
         # set eip/rip, ebp/rbp, esp/rsp
         if ql.arch.type == QL_ARCH.X86:
-            context["eip"] = func_addr
-            context["ebp"] = new_stack - asize
-            context["esp"] = new_stack - asize
+            regs["eip"] = func_addr
+            regs["ebp"] = new_stack - asize
+            regs["esp"] = new_stack - asize
 
         elif ql.arch.type == QL_ARCH.X8664:
-            context["rip"] = func_addr
-            context["rbp"] = new_stack - asize
-            context["rsp"] = new_stack - asize
+            regs["rip"] = func_addr
+            regs["rbp"] = new_stack - asize
+            regs["rsp"] = new_stack - asize
+
+        context.reg_write_batch([(ql.arch.regs.register_mapping[reg], val) for reg, val in regs.items()])
 
         thread.saved_context = context
 
         return thread
 
     def suspend(self) -> None:
-        self.saved_context = self.ql.arch.regs.save()
+        self.saved_context = self.ql.arch.save()
 
     def resume(self) -> None:
-        self.ql.arch.regs.restore(self.saved_context)
+        self.ql.arch.restore(self.saved_context)
+
+        # threads are switched from within a hook. unlike a register write, restoring a
+        # context does not make unicorn notice the new pc, so set it explicitly
+        self.ql.arch.regs.arch_pc = self.ql.arch.regs.arch_pc
+
         self.status = THREAD_STATUS.RUNNING
 
     def stop(self) -> None:
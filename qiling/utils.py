@@ -355,6 +355,15 @@ def select_debugger(options: Union[str, bool]) -> Optional[QlClassInit['QlDebugg
                 if arg == 'rr':
                     kwargs['rr'] = True
 
+                # rr with a memory budget for the recorded steps, e.g. 'rr=0x10000000'
+                elif arg.startswith('rr=') and __int_nothrow(arg[3:]) is not None:
+                    budget = __int_nothrow(arg[3:])
+
+                    if budget <= 0:
+                        raise QlErrorOutput(f'Invalid rr memory budget: {arg[3:]}')
+
+                    kwargs['rr'] = budget
+
                 elif __int_nothrow(arg) is not None:
                      arg_init_hook.append(arg)
 
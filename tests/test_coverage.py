@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append("..")
+from qiling import Qiling
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+from qiling.exception import QlErrorNotImplemented
+from qiling.extensions.coverage import utils as cov_utils
+from qiling.extensions.coverage.database import Block, QlCoverageDatabase
+from qiling.extensions.coverage.formats import edgemap
+from qiling.extensions.coverage.formats.edgemap import QlEdgeMapCoverage
+from qiling.loader.loader import Image
+
+
+class CoverageTest(unittest.TestCase):
+
+    def test_edgemap_x8664(self):
+        code = bytes.fromhex(
+            '48 85 ff'          # test  rdi, rdi
+            '74 03'             # jz    .skip
+            '48 ff c0'          # inc   rax
+                                # .skip:
+            '90'                # nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        base = ql.os.entry_point
+        ql.loader.images.append(Image(base, base + len(code), 'shellcode'))
+
+        self.assertIn('edgemap', cov_utils.factory.formats)
+
+        cov = cov_utils.factory.get_coverage_collector(ql, 'edgemap')
+        self.assertIsInstance(cov, QlEdgeMapCoverage)
+
+        cov.activate()
+
+        ql.arch.regs.rdi = 0
+        ql.run()
+
+        self.assertEqual(cov.block_addresses.tolist(), [base, base + 8])
+        self.assertEqual(cov.block_sizes.tolist(), [5, 1])
+
+        baseline = cov.bitmap.copy()
+        covered = cov.covered
+
+        # same path, same coverage
+        cov.reset()
+        ql.run()
+
+        gained, lost = cov.diff(baseline)
+        self.assertEqual((len(gained), len(lost)), (0, 0))
+
+        # the other path shares only the first block
+        cov.reset()
+
+        ql.arch.regs.rdi = 1
+        ql.run()
+
+        cov.deactivate()
+
+        self.assertEqual(cov.block_addresses.tolist(), [base, base + 5])
+
+        gained, lost = cov.diff(baseline)
+        self.assertGreater(len(gained), 0)
+        self.assertGreater(len(lost), 0)
+        self.assertEqual(cov.covered, covered + len(gained) - len(lost))
+
+        with tempfile.TemporaryDirectory() as path:
+            bitmap = os.path.join(path, 'cov.map')
+            cov.dump_coverage(bitmap)
+
+            self.assertTrue((QlEdgeMapCoverage.load_bitmap(bitmap) == cov.bitmap).all())
+
+            drcov = os.path.join(path, 'cov.drcov')
+            cov.dump_drcov(drcov)
+
+            with open(drcov, 'rb') as infile:
+                header, entries = infile.read().split(b'BB Table: 2 bbs\n')
+
+            self.assertIn(b'0, %d, %d, 0, 0, 0, shellcode' % (base, base + len(code)), header)
+            self.assertEqual(entries, bytes.fromhex('00000000 0500 0000' '05000000 0400 0000'))
+
+            ezcov = os.path.join(path, 'cov.ezcov')
+            cov.dump_ezcov(ezcov)
+
+            with open(ezcov) as infile:
+                lines = infile.read().splitlines()
+
+            self.assertEqual(lines[2:], ['0x00000000,5,[ shellcode ]', '0x00000005,4,[ shellcode ]'])
+
+    def test_edgemap_without_numpy(self):
+        ql = Qiling(code=b'\x90', archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        # the format stays registered, but refuses to collect coverage
+        with mock.patch.object(edgemap, 'np', None):
+            self.assertIn('edgemap', cov_utils.factory.formats)
+
+            with self.assertRaises(QlErrorNotImplemented):
+                cov_utils.factory.get_coverage_collector(ql, 'edgemap')
+
+    def test_database_x8664(self):
+        code = bytes.fromhex(
+            '48 85 ff'          # test  rdi, rdi
+            '74 03'             # jz    .skip
+            '48 ff c0'          # inc   rax
+                                # .skip:
+            '90'                # nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        base = ql.os.entry_point
+        ql.loader.images.append(Image(base, base + len(code), 'shellcode'))
+
+        with tempfile.TemporaryDirectory() as path:
+            dbpath = os.path.join(path, 'coverage.db')
+
+            with QlCoverageDatabase(dbpath) as db:
+                for i, (fmt, rdi) in enumerate((('drcov', 0), ('edgemap', 1), ('ezcov', 0))):
+                    ql.arch.regs.rdi = rdi
+
+                    with db.collect(ql, fmt, f'run-{i}'):
+                        ql.run()
+
+                self.assertEqual(db.runs(), [(1, 'run-0'), (2, 'run-1'), (3, 'run-2')])
+
+                # the shellcode is not backed by a file, so it has no build hash
+                self.assertEqual([(m.path, m.build) for m in db.modules()], [('shellcode', '')])
+
+                self.assertEqual(list(db.run_blocks(2)), [Block('shellcode', '', 0, 5), Block('shellcode', '', 5, 4)])
+                self.assertGreater(len(db.run_edges(2)), 0)
+                self.assertEqual(db.run_edges(1), [])
+
+            # reopen the database, as another process would
+            with QlCoverageDatabase(dbpath) as db:
+                self.assertEqual([(b.offset, b.size) for b in db.union()], [(0, 5), (5, 4), (8, 1)])
+                self.assertEqual([b.offset for b in db.intersection()], [0])
+                self.assertEqual([b.offset for b in db.intersection([1, 3])], [0, 8])
+
+                self.assertEqual(db.first_run('shellcode', 0), 1)
+                self.assertEqual(db.first_run('shellcode', 6), 2)
+                self.assertEqual(db.first_run('shellcode', 8), 1)
+                self.assertIsNone(db.first_run('shellcode', 9))
+                self.assertIsNone(db.first_run('other', 0))
+
+                edge = db.run_edges(2)[0]
+                self.assertEqual(db.first_run_edge(edge), 2)
+
+                # adding a run that covers nothing new does not change the union
+                db.add_run({}, name='empty')
+                self.assertEqual(len(list(db.union())), 3)
+
+                merged = os.path.join(path, 'merged.cov')
+                db.export_drcov(merged, runs=[2])
+
+                with open(merged, 'rb') as infile:
+                    header, entries = infile.read().split(b'BB Table: 2 bbs\n')
+
+                self.assertIn(b'0, 0, %d, 0, 0, 0, shellcode' % len(code), header)
+                self.assertEqual(entries, bytes.fromhex('00000000 0500 0000' '05000000 0400 0000'))
+
+
+if __name__ == "__main__":
+    unittest.main()
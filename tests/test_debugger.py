@@ -3,6 +3,7 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
+import re
 import socket
 import threading
 import time
@@ -43,6 +44,45 @@ class SimpleGdbClient:
         self.__file.write(f'${msg}#{SimpleGdbClient.checksum(msg):02x}')
         self.__file.flush()
 
+    def request(self, msg: str) -> bytes:
+        """Send a packet and wait for its reply. Unlike gdb, acks are simply discarded.
+        """
+
+        self.__file.write(f'${msg}#{SimpleGdbClient.checksum(msg):02x}')
+        self.__file.flush()
+
+        buffer = b''
+
+        while True:
+            m = re.match(br'\+*\$([^#]*)#[0-9a-f]{2}', buffer, re.DOTALL)
+
+            if m:
+                break
+
+            buffer += self.__sock.recv(0x10000)
+
+        data = m[1]
+        reply = bytearray()
+        i = 0
+
+        # expand escaped characters and run-length encoding, the way gdb does
+        while i < len(data):
+            ch = data[i]
+
+            if ch == ord('}'):
+                reply.append(data[i + 1] ^ 0x20)
+                i += 2
+
+            elif ch == ord('*'):
+                reply.extend(reply[-1:] * (data[i + 1] - 29))
+                i += 2
+
+            else:
+                reply.append(ch)
+                i += 1
+
+        return bytes(reply)
+
 
 class DebuggerTest(unittest.TestCase):
     def test_gdbdebug_file_server(self):
@@ -199,5 +239,81 @@ class DebuggerTest(unittest.TestCase):
         del ql
 
 
+    def test_gdbdebug_shellcode_transfers(self):
+        X8664_LIN = bytes.fromhex('31c048bbd19d9691d08c97ff48f7db53545f995257545eb03b0f05')
+
+        ql = Qiling(code=X8664_LIN, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+        ql.debugger = 'gdb:127.0.0.1:9997'
+
+        base = ql.os.entry_point
+        stack_top = max(ubound for _, ubound, _, label, _ in ql.mem.map_info if label == '[shellcode_stack]')
+
+        replies = {}
+
+        def gdb_test_client():
+            # wait for ql to launch its gdbserver
+            while True:
+                try:
+                    client = SimpleGdbClient('127.0.0.1', 9997)
+                except ConnectionRefusedError:
+                    time.sleep(0.1)
+                else:
+                    break
+
+            with client:
+                replies['features'] = client.request('qSupported:multiprocess+;swbreak+;binary-upload+')
+                replies['noack'] = client.request('QStartNoAckMode')
+                replies['regs'] = client.request('g')
+                replies['regs_again'] = client.request('g')
+                replies['reg'] = client.request('p10')
+                replies['m'] = client.request(f'm{base:x},{len(X8664_LIN):x}')
+                replies['x'] = client.request(f'x{base:x},{len(X8664_LIN):x}')
+
+                payload = bytes(range(0x20, 0x80)) * 2
+                escaped = re.sub(br'[*#$}]', lambda m: bytes([ord('}'), m[0][0] ^ 0x20]), payload).decode('latin')
+
+                replies['X'] = client.request(f'X{stack_top - 0x100:x},{len(payload):x}:{escaped}')
+                replies['x_written'] = client.request(f'x{stack_top - 0x100:x},{len(payload):x}')
+                replies['x_partial'] = client.request(f'x{stack_top - 0x10:x},20')
+                replies['x_unmapped'] = client.request('x10,10')
+                replies['memory_map'] = client.request('qXfer:memory-map:read::0,ffff')
+
+        t = threading.Thread(target=gdb_test_client, daemon=True)
+        t.start()
+
+        ql.run()
+        t.join()
+
+        features = replies['features'].decode().split(';')
+
+        self.assertIn('PacketSize=20000', features)
+        self.assertIn('binary-upload+', features)
+        self.assertIn('qXfer:memory-map:read+', features)
+
+        self.assertEqual(replies['noack'], b'OK')
+
+        self.assertEqual(replies['regs'], replies['regs_again'])
+        self.assertEqual(int.from_bytes(bytes.fromhex(replies['reg'].decode()), 'little'), base)
+
+        self.assertEqual(replies['m'], X8664_LIN.hex().encode())
+        self.assertEqual(replies['x'], b'b' + X8664_LIN)
+
+        self.assertEqual(replies['X'], b'OK')
+        self.assertEqual(replies['x_written'], b'b' + bytes(range(0x20, 0x80)) * 2)
+
+        # reads that cross the end of mapped memory return the mapped part
+        self.assertEqual(len(replies['x_partial']), 1 + 0x10)
+        self.assertTrue(replies['x_unmapped'].startswith(b'E'))
+
+        memory_map = replies['memory_map'].decode()
+
+        self.assertTrue(memory_map.startswith('l'))
+
+        for lbound, ubound, *_ in ql.mem.map_info:
+            self.assertIn(f'<memory type="ram" start="{lbound:#x}" length="{ubound - lbound:#x}"/>', memory_map)
+
+        del ql
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import sys
+import unittest
+
+from unicorn import UC_PROT_EXEC, UC_PROT_READ, UC_PROT_WRITE
+
+sys.path.append("..")
+from qiling import Qiling
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+
+
+class DecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ql = Qiling(code=b'\x90', archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+    def test_decode_readonly(self):
+        ql = self.ql
+        address = 0x10000
+
+        ql.mem.map(address, ql.mem.pagesize, UC_PROT_READ | UC_PROT_EXEC)
+        ql.mem.write(address, bytes.fromhex('48 ff c0'))    # inc rax
+
+        insn = ql.arch.decode(address)
+
+        self.assertEqual((insn.mnemonic, insn.op_str, insn.size), ('inc', 'rax', 3))
+        self.assertIs(ql.arch.decode(address), insn)
+        self.assertEqual(ql.arch.decode_lite(address), (address, 3, 'inc', 'rax'))
+
+        # detailed info is cached separately
+        detailed = ql.arch.decode(address, detail=True)
+
+        self.assertIsNot(detailed, insn)
+        self.assertEqual(len(detailed.operands), 1)
+
+        # host side modifications invalidate the cache
+        ql.mem.write(address, bytes.fromhex('48 ff c8'))    # dec rax
+
+        self.assertEqual(ql.arch.decode(address).mnemonic, 'dec')
+        self.assertEqual(ql.arch.decode_lite(address), (address, 3, 'dec', 'rax'))
+
+        ql.mem.unmap(address, ql.mem.pagesize)
+
+        self.assertIsNone(ql.arch.decode(address))
+
+    def test_decode_writable(self):
+        ql = self.ql
+        address = 0x10000
+
+        ql.mem.map(address, ql.mem.pagesize, UC_PROT_READ | UC_PROT_WRITE | UC_PROT_EXEC)
+        ql.mem.write(address, bytes.fromhex('48 ff c0'))    # inc rax
+
+        insn = ql.arch.decode(address)
+
+        self.assertEqual(insn.mnemonic, 'inc')
+        self.assertIs(ql.arch.decode(address), insn)
+
+        # modifications made through unicorn, as emulated code would, are picked up as well
+        ql.uc.mem_write(address, bytes.fromhex('48 ff c8'))    # dec rax
+
+        self.assertEqual(ql.arch.decode(address).mnemonic, 'dec')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,6 +19,7 @@ from qiling import Qiling
 from qiling.const import QL_ARCH, QL_OS, QL_INTERCEPT, QL_STOP, QL_VERBOSE
 from qiling.exception import *
 from qiling.extensions import pipe
+from qiling.extensions.snapshot import QlSnapshot
 from qiling.os.const import STRING
 from qiling.os.posix import syscall
 from qiling.os.mapper import QlFsMappedObject
@@ -60,6 +61,41 @@ class ELFTest(unittest.TestCase):
 
         del ql
 
+    def test_elf_snapshot_rollback_linux_x8664(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/sleep_hello"], "../examples/rootfs/x8664_linux", verbose=QL_VERBOSE.DEFAULT)
+        load_address = ql.profile.getint("OS64", "load_address")
+
+        begin_point = load_address + 0x109e
+        end_point = load_address + 0x10bc
+
+        def capture(ql: Qiling):
+            hook.remove()
+
+            snapshots.append(QlSnapshot(ql))
+            ql.emu_stop()
+
+        def ram_content():
+            return [(lbound, bytes(ql.mem.read(lbound, ubound - lbound))) for lbound, ubound, _, _, is_mmio in ql.mem.map_info if not is_mmio]
+
+        snapshots = []
+        hook = ql.hook_address(capture, begin_point)
+        ql.run()
+
+        snapshot, = snapshots
+        captured = ram_content()
+
+        for _ in range(3):
+            ql.emu_start(begin_point, end_point)
+            self.assertEqual(end_point, ql.arch.regs.arch_pc)
+
+            snapshot.restore()
+            self.assertEqual(begin_point, ql.arch.regs.arch_pc)
+            self.assertEqual(captured, ram_content())
+
+        snapshot.remove()
+
+        del ql
+
     def test_elf_x_only_segment(self):
         def stop(ql: Qiling):
             ql.emu_stop()
@@ -15,11 +15,15 @@ import unittest
 
 from typing import List
 
+import gevent
+
 sys.path.append("..")
 from qiling import Qiling
 from qiling.arch.models import X86_CPU_MODEL
-from qiling.const import QL_VERBOSE, QL_INTERCEPT
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE, QL_INTERCEPT
 from qiling.os.filestruct import ql_file
+from qiling.os.linux.thread import QlLinuxThreadManagement
+from qiling.os.posix.const import EAGAIN, ETIMEDOUT
 from qiling.os.stats import QlOsNullStats
 
 
@@ -125,6 +129,57 @@ class ELFTest(unittest.TestCase):
         self.assertTrue(logged[-2].startswith('thread 1 ret val is'))
         self.assertTrue(logged[-1].startswith('thread 2 ret val is'))
 
+    def test_multithread_elf_linux_x8664_scheduler(self):
+        logged: List[str] = []
+
+        def check_write(ql: Qiling, fd: int, write_buf, count: int):
+            if fd == 1:
+                content = ql.mem.read(write_buf, count)
+
+                logged.extend(content.decode().splitlines())
+
+        profile = {'KERNEL': {'thread_quantum': '1000', 'thread_accounting': 'True'}}
+
+        ql = Qiling([fr'{X64_LINUX_ROOTFS}/bin/x8664_multithreading'], X64_LINUX_ROOTFS, cputype=X86_CPU_MODEL.INTEL_HASWELL, multithread=True, profile=profile, verbose=QL_VERBOSE.DEBUG)
+
+        ql.os.stats = QlOsNullStats()
+        ql.os.set_syscall("write", check_write, QL_INTERCEPT.ENTER)
+        ql.run()
+
+        self.assertGreaterEqual(len(logged), 2)
+        self.assertTrue(logged[-2].startswith('thread 1 ret val is'))
+        self.assertTrue(logged[-1].startswith('thread 2 ret val is'))
+
+        thread_management = ql.os.thread_management
+        stats = thread_management.stats()
+
+        self.assertEqual(thread_management.quantum, 1000)
+        self.assertGreaterEqual(len(stats), 3)
+        self.assertTrue(all(instructions > 0 and switches > 0 for instructions, switches in stats.values()))
+        self.assertFalse(thread_management.run_queue)
+        self.assertFalse(thread_management.blocked)
+
+    # built from examples/src/linux/futex_contention.c; not part of the published rootfs yet
+    @unittest.skipUnless(os.path.isfile(fr'{X64_LINUX_ROOTFS}/bin/x8664_futex_contention'), 'test binary is not available')
+    def test_multithread_elf_linux_x8664_futex(self):
+        logged: List[str] = []
+
+        def check_write(ql: Qiling, fd: int, write_buf, count: int):
+            if fd == 1:
+                content = ql.mem.read(write_buf, count)
+
+                logged.extend(content.decode().splitlines())
+
+        ql = Qiling([fr'{X64_LINUX_ROOTFS}/bin/x8664_futex_contention'], X64_LINUX_ROOTFS, multithread=True, verbose=QL_VERBOSE.DEFAULT)
+
+        ql.os.set_syscall("write", check_write, QL_INTERCEPT.ENTER)
+        ql.run()
+
+        self.assertEqual(logged[-1], 'counter=16000 pi_counter=16000 turns=8 timedwait=ETIMEDOUT')
+        self.assertFalse(ql.os.futexm.wait_list)
+
+        del ql
+
     def test_multithread_elf_linux_mips32eb(self):
         logged: List[str] = []
 
@@ -637,5 +692,141 @@ class ELFTest(unittest.TestCase):
         self.assertEqual('httpd_test_successful', feedback.decode())
 
 
+class FutexTest(unittest.TestCase):
+    """Drive futex operations from threads that each issue a single futex syscall and store its
+    return value. Threads start in the order they are spawned, so waiters are queued before the
+    threads that wake them up get to run.
+    """
+
+    CODE = bytes.fromhex(
+        '0f 05'             # syscall
+        '48 89 03'          # mov   qword [rbx], rax
+    )
+
+    DATA_BASE = 0x10000000
+
+    FUTEX_PRIVATE = 0x80
+
+    FUTEX_WAIT = 0
+    FUTEX_WAKE = 1
+    FUTEX_CMP_REQUEUE = 4
+    FUTEX_WAIT_BITSET = 9
+    FUTEX_WAKE_BITSET = 10
+
+    def setUp(self):
+        ql = Qiling(code=self.CODE, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, multithread=True, verbose=QL_VERBOSE.DISABLED)
+        ql.mem.map(self.DATA_BASE, 0x1000)
+
+        ql.os.thread_management = QlLinuxThreadManagement(ql)
+
+        self.ql = ql
+        self.threads = []
+
+    def futex(self, uaddr: int, op: int, val: int = 0, timeout: int = 0, uaddr2: int = 0, val3: int = 0) -> int:
+        """Spawn a thread calling futex with the specified arguments.
+
+        Returns: address where the thread stores the futex return value
+        """
+
+        ql = self.ql
+        entry = ql.os.entry_point
+        result = self.DATA_BASE + 0x800 + len(self.threads) * 8
+
+        ql.arch.regs.rip = entry
+        ql.arch.regs.rax = 202      # futex
+        ql.arch.regs.rdi = uaddr
+        ql.arch.regs.rsi = op | self.FUTEX_PRIVATE
+        ql.arch.regs.rdx = val
+        ql.arch.regs.r10 = timeout
+        ql.arch.regs.r8 = uaddr2
+        ql.arch.regs.r9 = val3
+        ql.arch.regs.rbx = result
+
+        self.threads.append(ql.os.thread_class.spawn(ql, entry, entry + len(self.CODE), ql.arch.save()))
+
+        return result
+
+    def timespec(self, tv_sec: int, tv_nsec: int) -> int:
+        ptr = self.DATA_BASE + 0x400
+
+        self.ql.mem.write_ptr(ptr + 0, tv_sec, 8)
+        self.ql.mem.write_ptr(ptr + 8, tv_nsec, 8)
+
+        return ptr
+
+    def run_threads(self):
+        gevent.joinall(self.threads, raise_error=True)
+
+        return self.ql.os.thread_management
+
+    def result(self, ptr: int) -> int:
+        return self.ql.mem.read_ptr(ptr, 8, signed=True)
+
+    def test_futex_wait_timeout(self):
+        uaddr = self.DATA_BASE
+
+        waiter = self.futex(uaddr, self.FUTEX_WAIT, 0, self.timespec(0, 1000))
+        thread_management = self.run_threads()
+
+        # the timeout expires on the virtual clock: one quantum to get to the syscall, then the
+        # timeout itself and another quantum to store the return value
+        self.assertEqual(self.result(waiter), -ETIMEDOUT)
+        self.assertEqual(thread_management.clock, 1000 + thread_management.quantum * 2)
+        self.assertFalse(self.ql.os.futexm.wait_list)
+
+    def test_futex_wait_wake(self):
+        uaddr = self.DATA_BASE
+
+        waiter = self.futex(uaddr, self.FUTEX_WAIT, 0, self.timespec(1, 0))
+        mismatch = self.futex(uaddr, self.FUTEX_WAIT, 1)
+        waker = self.futex(uaddr, self.FUTEX_WAKE, 1)
+        thread_management = self.run_threads()
+
+        self.assertEqual(self.result(waiter), 0)
+        self.assertEqual(self.result(mismatch), -EAGAIN)
+        self.assertEqual(self.result(waker), 1)
+        self.assertTrue(all(callback is None for _, _, callback in thread_management.timers))
+        self.assertFalse(self.ql.os.futexm.wait_list)
+
+    def test_futex_wake_bitset(self):
+        uaddr = self.DATA_BASE
+
+        waiter1 = self.futex(uaddr, self.FUTEX_WAIT_BITSET, 0, val3=0b01)
+        waiter2 = self.futex(uaddr, self.FUTEX_WAIT_BITSET, 0, val3=0b10)
+        waker1 = self.futex(uaddr, self.FUTEX_WAKE_BITSET, 0x7fffffff, val3=0b10)
+        waker2 = self.futex(uaddr, self.FUTEX_WAKE_BITSET, 0x7fffffff, val3=0b10)
+        waker3 = self.futex(uaddr, self.FUTEX_WAKE, 0x7fffffff)
+        self.run_threads()
+
+        self.assertEqual(self.result(waiter1), 0)
+        self.assertEqual(self.result(waiter2), 0)
+
+        # only the second waiter matches the bitset; the first one is left for the plain wake
+        self.assertEqual(self.result(waker1), 1)
+        self.assertEqual(self.result(waker2), 0)
+        self.assertEqual(self.result(waker3), 1)
+        self.assertFalse(self.ql.os.futexm.wait_list)
+
+    def test_futex_cmp_requeue(self):
+        uaddr1 = self.DATA_BASE
+        uaddr2 = self.DATA_BASE + 4
+
+        waiters = [self.futex(uaddr1, self.FUTEX_WAIT, 0) for _ in range(3)]
+
+        # wake one waiter and move another one over to the second futex word
+        mismatch = self.futex(uaddr1, self.FUTEX_CMP_REQUEUE, 1, 1, uaddr2, 1)
+        requeue = self.futex(uaddr1, self.FUTEX_CMP_REQUEUE, 1, 1, uaddr2, 0)
+        waker1 = self.futex(uaddr2, self.FUTEX_WAKE, 0x7fffffff)
+        waker2 = self.futex(uaddr1, self.FUTEX_WAKE, 0x7fffffff)
+        self.run_threads()
+
+        self.assertEqual([self.result(waiter) for waiter in waiters], [0, 0, 0])
+        self.assertEqual(self.result(mismatch), -EAGAIN)
+        self.assertEqual(self.result(requeue), 2)
+        self.assertEqual(self.result(waker1), 1)
+        self.assertEqual(self.result(waker2), 1)
+        self.assertFalse(self.ql.os.futexm.wait_list)
+
+
 if __name__ == "__main__":
     unittest.main()
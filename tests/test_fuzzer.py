@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from unicorn import UC_PROT_READ
+
+sys.path.append("..")
+from qiling import Qiling
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+from qiling.extensions import pipe
+from qiling.extensions.afl.qlfuzzer import QlFuzzer
+from qiling.extensions.fuzzer import QlCmpLog, QlCorpus, QlFuzzEngine, QlInputChannel, QlMutator, QlTriage
+from qiling.os.posix.const import EBADF
+
+
+class StdinFuzzer(QlFuzzer):
+    def __init__(self, argv, rootfs, **kwargs):
+        super().__init__(argv, rootfs, **kwargs)
+
+        self.ql.os.stdin = pipe.SimpleInStream(sys.stdin.fileno())
+
+    def feed_input(self, ql: Qiling, stimuli: bytes, pround: int) -> bool:
+        ql.os.stdin.write(stimuli)
+
+        return True
+
+
+class FuzzerTest(unittest.TestCase):
+
+    def test_mutator(self):
+        dictionary = [b'MAGIC']
+
+        m1 = QlMutator(dictionary, max_len=16, seed=1337)
+        m2 = QlMutator(dictionary, max_len=16, seed=1337)
+
+        data = b'hello world'
+
+        for _ in range(1000):
+            mutated = m1.mutate(data, b'other input')
+
+            # same seed, same mutations
+            self.assertEqual(mutated, m2.mutate(data, b'other input'))
+
+            self.assertGreater(len(mutated), 0)
+            self.assertLessEqual(len(mutated), 16)
+
+        # an empty input is still mutated into something
+        self.assertGreater(len(m1.mutate(b'')), 0)
+
+    def test_corpus_sync(self):
+        with tempfile.TemporaryDirectory() as path:
+            c1 = QlCorpus(path, 0)
+            c2 = QlCorpus(path, 0)
+
+            e1 = c1.add(b'first', 3)
+
+            # the same input is kept only once
+            self.assertIs(c1.add(b'first'), e1)
+            self.assertEqual(len(c1), 1)
+
+            c2.add(b'second')
+
+            found = c1.sync()
+
+            self.assertEqual([entry.data for entry in found], [b'second'])
+            self.assertEqual(len(c1), 2)
+            self.assertEqual(sorted(os.listdir(path)), sorted(QlCorpus.name_of(d) for d in (b'first', b'second')))
+
+            # nothing new to pick up
+            self.assertEqual(c1.sync(), [])
+            self.assertIn(c1.choose(), c1.entries)
+
+    def test_cmplog_x8664(self):
+        code = bytes.fromhex(
+            '8b 07'             # mov   eax, dword [rdi]
+            '3d efbeadde'       # cmp   eax, 0xdeadbeef
+            '66 81 7f 04 3412'  # cmp   word [rdi + 4], 0x1234
+            '90'                # nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        cmplog = QlCmpLog(ql)
+        cmplog.activate()
+
+        data = b'ABCDEFGH'
+
+        ptr = ql.os.entry_point + 0x1000
+        ql.mem.write(ptr, data)
+        ql.arch.regs.rdi = ptr
+
+        ql.run(end=ql.os.entry_point + len(code) - 1)
+
+        logged = {(op1, op2) for _, op1, op2 in cmplog.entries()}
+
+        self.assertIn((b'ABCD', bytes.fromhex('efbeadde')), logged)
+        self.assertIn((b'EF', bytes.fromhex('3412')), logged)
+
+        candidates = list(cmplog.candidates(data))
+
+        self.assertIn(bytes.fromhex('efbeadde') + b'EFGH', candidates)
+        self.assertIn(b'ABCD' + bytes.fromhex('3412') + b'GH', candidates)
+
+        cmplog.reset()
+        self.assertEqual(list(cmplog.entries()), [])
+
+    def test_input_channel_x8664(self):
+        code = bytes.fromhex(
+            '48 8b 07'          # mov   rax, qword [rdi]
+            '90'                # nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        channel = QlInputChannel(ql, 0x100)
+        stream = channel.stream()
+
+        # capacity is rounded up to page size
+        self.assertEqual(channel.size, ql.mem.pagesize)
+
+        ql.arch.regs.rdi = channel.address
+
+        for data in (b'ABCDEFGHIJ', b'12345678'):
+            channel.feed(data)
+
+            # the emulated memory reflects the input without being written to
+            self.assertEqual(ql.mem.read(channel.address, len(data)), data)
+
+            ql.run(end=ql.os.entry_point + len(code) - 1)
+            self.assertEqual(ql.arch.regs.rax, int.from_bytes(data[:8], 'little'))
+
+            # every new input rewinds the streams
+            self.assertEqual(stream.read(4), data[:4])
+            self.assertEqual(stream.read(), data[4:])
+            self.assertEqual(stream.read(), b'')
+
+        # inputs may be generated in-place as well
+        channel.view[:3] = b'xyz'
+        channel.set_length(3)
+
+        self.assertEqual(bytes(channel.data), b'xyz')
+        self.assertEqual(stream.read(), b'xyz')
+
+        # the emulated program is not allowed to modify its input
+        perms = next(p for lbound, _, p, *_ in ql.mem.map_info if lbound == channel.address)
+        self.assertEqual(perms, UC_PROT_READ)
+
+    def test_input_channel_bad_fd_x8664(self):
+        code = bytes.fromhex(
+            '0f 05'             # syscall
+            '90'                # nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        channel = QlInputChannel(ql, 0x100)
+        channel.bind_socket()
+        channel.feed(b'ABCD')
+
+        # recvfrom and read on descriptors out of range fail rather than raise
+        for nr in (45, 0):
+            ql.arch.regs.rax = nr
+            ql.arch.regs.rdi = 0x10000
+            ql.arch.regs.rsi = channel.address
+            ql.arch.regs.rdx = 4
+            ql.arch.regs.r10 = 0
+            ql.arch.regs.r8 = 0
+            ql.arch.regs.r9 = 0
+
+            ql.run(end=ql.os.entry_point + len(code) - 1)
+            self.assertEqual(ql.arch.regs.rax, -EBADF & 0xffffffffffffffff)
+
+    def test_engine_linux_x8664(self):
+        rootfs = '../examples/rootfs/x8664_linux'
+        argv = ['../examples/fuzzing/linux_x8664/x8664_fuzz']
+
+        fuzzer = StdinFuzzer(argv, rootfs, verbose=QL_VERBOSE.DISABLED)
+
+        main_begins = fuzzer.ea(0x1275)
+        main_ends = fuzzer.ea(0x1293)
+        stack_chk_fail = fuzzer.ea(0x126e)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            engine = QlFuzzEngine(fuzzer, workdir, main_begins, [main_ends], [stack_chk_fail], seeds=[b'B'], workers=2, timeout=500)
+            status = engine.run(execs=2000)
+
+            self.assertEqual(status['workers'], 2)
+            self.assertGreaterEqual(status['execs'], 4000)
+            self.assertGreater(status['edges'], 0)
+            self.assertGreater(status['corpus'], 0)
+
+            with open(os.path.join(workdir, 'fuzzer_stats')) as infile:
+                self.assertEqual(json.load(infile)['execs'], status['execs'])
+
+            with open(os.path.join(workdir, 'plot_data')) as infile:
+                self.assertGreater(len(infile.readlines()), 1)
+
+    def test_triage_linux_x8664(self):
+        rootfs = '../examples/rootfs/x8664_linux'
+        argv = ['../examples/fuzzing/linux_x8664/x8664_fuzz']
+
+        fuzzer = StdinFuzzer(argv, rootfs, verbose=QL_VERBOSE.DISABLED)
+
+        main_begins = fuzzer.ea(0x1275)
+        main_ends = fuzzer.ea(0x1293)
+        stack_chk_fail = fuzzer.ea(0x126e)
+
+        triage = QlTriage(fuzzer, main_begins, [main_ends], [stack_chk_fail], workers=2)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            crashes = os.path.join(workdir, 'crashes')
+            corpus = os.path.join(workdir, 'corpus')
+
+            inputs = {
+                crashes: {'smash1': b'A' * 40, 'smash2': b'A' * 40 + b'B', 'benign': b'B'},
+                corpus:  {'short': b'B', 'long': b'BBBBBBBB', 'loop': b'AB'}
+            }
+
+            for path, files in inputs.items():
+                os.makedirs(path)
+
+                for name, data in files.items():
+                    with open(os.path.join(path, name), 'wb') as outfile:
+                        outfile.write(data)
+
+            summary = os.path.join(workdir, 'triage.json')
+            status = triage.triage(crashes, summary)
+
+            self.assertEqual(status['inputs'], 3)
+            self.assertEqual(status['crashes'], 2)
+
+            # both stack smashing inputs end up in the same bucket
+            self.assertEqual(len(status['buckets']), 1)
+            self.assertEqual(status['buckets'][0]['files'], [os.path.join(crashes, 'smash1'), os.path.join(crashes, 'smash2')])
+            self.assertEqual(status['not_reproduced'], [os.path.join(crashes, 'benign')])
+
+            with open(summary) as infile:
+                self.assertEqual(json.load(infile), status)
+
+            minimized = os.path.join(workdir, 'minimized')
+            status = triage.minimize(corpus, minimized)
+
+            # the longer input does not cover anything new
+            self.assertEqual(status['inputs'], 3)
+            self.assertEqual(sorted(status['files']), ['loop', 'short'])
+            self.assertEqual(sorted(os.listdir(minimized)), ['loop', 'short'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,7 @@ import unittest
 from typing import List, Optional, Tuple
 
 from qiling import Qiling
-from qiling.const import QL_VERBOSE
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
 from qiling.extensions.coverage.formats.history import History
 
 
@@ -122,5 +122,59 @@ class HistoryTest(unittest.TestCase):
             self.assertRegex(map_for_ins[3], '|'.join((self.P_LIBC, self.P_LD)))
 
 
+class CompactHistoryTest(unittest.TestCase):
+    CODE = bytes.fromhex(
+        '48 85 ff'          # test  rdi, rdi
+        '74 03'             # jz    .skip
+        '48 ff c0'          # inc   rax
+                            # .skip:
+        '90'                # nop
+    )
+
+    def setUp(self):
+        self.ql = Qiling(code=self.CODE, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+        self.base = self.ql.os.entry_point
+
+    def test_instructions(self):
+        history = History(self.ql)
+        history.track_instruction_coverage()
+
+        self.ql.run()
+
+        self.assertEqual(list(history.get_addresses()), [self.base, self.base + 3, self.base + 8])
+        self.assertEqual([insn.mnemonic for insn in history.history], ['test', 'je', 'nop'])
+        self.assertEqual(history.history[-1].address, self.base + 8)
+        self.assertEqual([insn.mnemonic for insn in history.history[:2]], ['test', 'je'])
+
+        # instances do not share their records
+        self.assertEqual(len(History(self.ql)), 0)
+
+        history.clear_history()
+        self.assertEqual(len(history.history), 0)
+
+    def test_ring_buffer(self):
+        history = History(self.ql, maxlen=4)
+        history.track_instruction_coverage()
+
+        self.ql.arch.regs.rdi = 1
+        self.ql.run()
+
+        self.ql.arch.regs.rdi = 0
+        self.ql.run()
+
+        # only the most recent entries are kept, from the oldest to the newest
+        self.assertEqual(len(history), 4)
+        self.assertEqual(list(history.get_addresses()), [self.base + 8, self.base, self.base + 3, self.base + 8])
+
+        # indexing follows the same order once the ring wrapped around
+        self.assertEqual([history.history[i].address for i in range(4)], list(history.get_addresses()))
+        self.assertEqual(history.history[-3].address, self.base)
+        self.assertEqual([insn.address for insn in history.history[1:3]], [self.base, self.base + 3])
+        self.assertEqual(len(list(history.history)), len(history.history))
+
+        with self.assertRaises(IndexError):
+            history.history[4]
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -3,6 +3,9 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 #
 
+import os
+import tempfile
+import threading
 import unittest
 
 import sys
@@ -10,10 +13,12 @@ sys.path.append("..")
 
 from qiling.core import Qiling
 from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+from qiling.arch.cortex_m_const import IRQ
 from qiling.extensions.mcu.stm32f4 import stm32f407, stm32f411, stm32f429
 from qiling.extensions.mcu.stm32f1 import stm32f103
 from qiling.extensions.mcu.atmel import sam3x8e
 from qiling.extensions.mcu.gd32vf1 import gd32vf103
+from qiling.hw.connectivity import PeripheralTube
 
 
 class MCUTest(unittest.TestCase):
@@ -75,6 +80,46 @@ class MCUTest(unittest.TestCase):
 
         del ql
 
+    def test_mcu_usart_backend_stm32f411(self):
+        from qiling.hw.utils.serial import QlSerialBackend
+
+        def create_qiling():
+            ql = Qiling(["../examples/rootfs/mcu/stm32f411/md5_server.hex"],
+                archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f411, verbose=QL_VERBOSE.OFF)
+
+            ql.hw.create('usart2')
+            ql.hw.create('rcc')
+
+            return ql
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            record = os.path.join(tmpdir, 'input.rec')
+            output = os.path.join(tmpdir, 'output.txt')
+
+            rfd, wfd = os.pipe()
+            os.write(wfd, b'Hello\n')
+
+            ql = create_qiling()
+            backend = QlSerialBackend(input=rfd, record=record, output=output)
+            ql.hw.usart2.attach(backend)
+
+            ql.run(count=60000)
+            backend.close()
+            os.close(rfd)
+            os.close(wfd)
+
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), b'8b1a9953c4611296a827abf8c47804d7\n')
+
+            # replaying the recorded input should reproduce the same session
+            ql = create_qiling()
+            ql.hw.usart2.attach(QlSerialBackend(replay=record))
+
+            ql.run(count=60000)
+            self.assertEqual(ql.hw.usart2.recv(), b'8b1a9953c4611296a827abf8c47804d7\n')
+
+        del ql
+
     def test_mcu_patch_stm32f411(self):
         ql = Qiling(["../examples/rootfs/mcu/stm32f411/patch_test.hex"],
                     archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f411, verbose=QL_VERBOSE.DEFAULT)
@@ -129,6 +174,37 @@ class MCUTest(unittest.TestCase):
 
         del ql
 
+    def test_mcu_dma_burst_stm32f411(self):
+        from qiling.hw.const.stm32f4xx_dma import DMA, DMA_SxCR
+
+        def memcpy_steps(burst):
+            ql = Qiling(["../examples/rootfs/mcu/stm32f411/dma-clock.elf"],
+                        archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f411, verbose=QL_VERBOSE.DEFAULT)
+
+            dma2 = ql.hw.create('dma2', 'STM32F4xxDma', 0x40026400, {'stream0_intn': 0x38, 'burst': burst})
+            ql.mem.write(0x20000000, bytes(range(256)) * 16)
+
+            stream = dma2.instance.stream[0]
+            stream.PAR, stream.M0AR, stream.NDTR = 0x20000000, 0x20001000, 1024
+            stream.CR = DMA.MEMORY_TO_MEMORY | DMA.PDATAALIGN_WORD | DMA.MDATAALIGN_WORD | DMA_SxCR.MINC | DMA_SxCR.PINC | DMA_SxCR.EN
+
+            steps = 0
+            while stream.enable():
+                dma2.step()
+                steps += 1
+
+            self.assertEqual(stream.NDTR, 0)
+            self.assertEqual(stream.M0AR, 0x20002000)
+            self.assertTrue(dma2.instance.LISR & (1 << 5))
+            self.assertEqual(ql.mem.read(0x20001000, 0x1000), ql.mem.read(0x20000000, 0x1000))
+
+            del ql
+            return steps
+
+        self.assertEqual(memcpy_steps(0), 1)
+        self.assertEqual(memcpy_steps(256), 4)
+        self.assertEqual(memcpy_steps(1), 1024)
+
     def test_mcu_i2c_stm32f411(self):
         ql = Qiling(["../examples/rootfs/mcu/stm32f411/i2c-lcd.bin", 0x8000000],
                     archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f411, verbose=QL_VERBOSE.DEFAULT)
@@ -321,6 +397,183 @@ class MCUTest(unittest.TestCase):
 
         del ql
 
+    def test_mcu_hw_checkpoint_stm32f407(self):
+        ql = Qiling(["../examples/rootfs/mcu/stm32f407/backdoorlock.hex"],
+                    archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f407, verbose=QL_VERBOSE.DISABLED)
+
+        ql.hw.create('gpioa')
+        ql.hw.create('gpiob')
+
+        snapshot1 = ql.save(hw=True)
+
+        # write gpioa odr through its mmio region
+        ql.mem.write_ptr(ql.hw.gpioa.base + 0x14, 0x55, 4)
+
+        self.assertTrue(ql.hw.gpioa.dirty)
+        self.assertFalse(ql.hw.gpiob.dirty)
+
+        snapshot2 = ql.save(hw=True)
+
+        # untouched peripherals share their state with the previous checkpoint
+        self.assertIs(snapshot1['hw']['entity']['gpiob'], snapshot2['hw']['entity']['gpiob'])
+        self.assertIsNot(snapshot1['hw']['entity']['gpioa'], snapshot2['hw']['entity']['gpioa'])
+
+        ql.restore(snapshot1)
+        self.assertEqual(ql.hw.gpioa.instance.ODR, 0)
+        self.assertFalse(ql.hw.gpioa.dirty)
+
+        ql.restore(snapshot2)
+        self.assertEqual(ql.mem.read_ptr(ql.hw.gpioa.base + 0x14, 4), 0x55)
+
+        # pins set on the host side do not go through mmio, yet have to be rolled back
+        ql.hw.gpiob.set_pin(3)
+        ql.restore(snapshot2)
+        self.assertEqual(ql.hw.gpiob.instance.ODR, 0)
+
+        del ql
+
+    def test_mcu_hw_checkpoint_step_stm32f407(self):
+        ql = Qiling(["../examples/rootfs/mcu/stm32f407/backdoorlock.hex"],
+                    archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f407, verbose=QL_VERBOSE.DISABLED)
+
+        ql.hw.create('rcc')
+        ql.hw.create('tim2')
+
+        # let the clocks settle
+        ql.hw.step()
+        snapshot1 = ql.save(hw=True)
+
+        # stepping does not dirty peripherals that have nothing to do
+        ql.hw.step()
+        snapshot2 = ql.save(hw=True)
+
+        for label in ('rcc', 'tim2', 'systick', 'nvic'):
+            self.assertIs(snapshot1['hw']['entity'][label], snapshot2['hw']['entity'][label])
+
+        # a running timer changes on every step
+        tim2 = ql.hw.tim2
+        tim2.write(tim2.struct.ARR.offset, 4, 100)
+        tim2.write(tim2.struct.CR1.offset, 4, 1)
+
+        snapshot3 = ql.save(hw=True)
+
+        for _ in range(5):
+            ql.hw.step()
+
+        self.assertTrue(tim2.dirty)
+        self.assertEqual(tim2.instance.CNT, 5)
+
+        snapshot4 = ql.save(hw=True)
+        self.assertIsNot(snapshot3['hw']['entity']['tim2'], snapshot4['hw']['entity']['tim2'])
+        self.assertIs(snapshot3['hw']['entity']['rcc'], snapshot4['hw']['entity']['rcc'])
+
+        ql.restore(snapshot3)
+        self.assertEqual(tim2.instance.CNT, 0)
+
+        del ql
+
+    def test_mcu_nvic_priority_stm32f407(self):
+        ql = Qiling(["../examples/rootfs/mcu/stm32f407/backdoorlock.hex"],
+                    archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f407, verbose=QL_VERBOSE.DISABLED)
+
+        nvic = ql.hw.nvic
+        handled = []
+        nvic.interrupt_handler = lambda ql, IRQn: handled.append(IRQn)
+
+        # pended before being enabled
+        nvic.set_pending(5)
+        nvic.step()
+        self.assertEqual(handled, [])
+
+        nvic.write(nvic.struct.ISER.offset, 4, (1 << 5) | (1 << 6))
+        nvic.write(nvic.struct.IPR.offset + 5, 1, 0x40)
+        nvic.write(nvic.struct.IPR.offset + 6, 1, 0x20)
+        nvic.set_pending(6)
+        nvic.set_pending(IRQ.SYSTICK)
+
+        # systick drops below both external interrupts
+        ql.hw.scb.write(ql.hw.scb.struct.SHP.offset + 8, 4, 0x80 << 24)
+
+        saved = nvic.save()
+        nvic.step()
+        self.assertEqual(handled, [6, 5, IRQ.SYSTICK])
+        self.assertEqual(nvic.read(nvic.struct.ISPR.offset, 4), 0)
+
+        handled.clear()
+        nvic.restore(saved)
+        self.assertEqual(nvic.get_pending(6), 1)
+
+        ql.arch.regs.basepri = 0x40
+        nvic.step()
+        self.assertEqual(handled, [6])
+
+        nvic.write(nvic.struct.ICER.offset, 4, 1 << 5)
+        ql.arch.regs.basepri = 0
+        nvic.step()
+        self.assertEqual(handled, [6, IRQ.SYSTICK])
+        self.assertEqual(nvic.read(nvic.struct.ISER.offset, 4), 1 << 6)
+
+        del ql
+
+    def test_mcu_eth_descriptors_stm32f407(self):
+        import struct
+
+        ql = Qiling(["../examples/rootfs/mcu/stm32f407/backdoorlock.hex"],
+                    archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f407, verbose=QL_VERBOSE.DISABLED)
+
+        eth = ql.hw.create('eth')
+
+        # two chained descriptors per ring, guest owned
+        rx_ring, tx_ring, rx_buf, tx_buf = 0x20000000, 0x20000100, 0x20001000, 0x20002000
+
+        for i in range(2):
+            ql.mem.write(rx_ring + 16 * i, struct.pack('<4I', 1 << 31, (1 << 14) | 1524, rx_buf + 0x800 * i, rx_ring + 16 * (1 - i)))
+
+        eth.write(eth.struct.DMARDLAR.offset, 4, rx_ring)
+        eth.write(eth.struct.DMATDLAR.offset, 4, tx_ring)
+        eth.write(eth.struct.DMAOMR.offset, 4, (1 << 13) | (1 << 1))
+
+        frames = [bytes([i]) * 60 for i in range(3)]
+        eth.feed(frames)
+        eth.step()
+
+        for i in range(2):
+            rdes0, _, buf, _ = struct.unpack('<4I', ql.mem.read(rx_ring + 16 * i, 16))
+
+            self.assertFalse(rdes0 & (1 << 31))
+            self.assertEqual((rdes0 >> 16) & 0x3fff, 64)
+            self.assertEqual(ql.mem.read(buf, 60), frames[i])
+
+        # ring is exhausted: receive buffer unavailable
+        self.assertTrue(eth.instance.DMASR & (1 << 7))
+
+        frame = b'\xff' * 6 + b'\x00' * 6 + b'\x88\xb5' + b'qiling'
+        ql.mem.write(tx_buf, frame)
+        ql.mem.write(tx_ring, struct.pack('<4I', (0b1111 << 28) | (1 << 20), len(frame), tx_buf, tx_ring))
+
+        eth.write(eth.struct.DMATPDR.offset, 4, 0)
+        eth.step()
+
+        self.assertEqual(eth.recv(), frame)
+        self.assertTrue(eth.instance.DMASR & 1)
+
+        # a frame larger than the whole ring must not wrap around onto itself
+        for i in range(2):
+            ql.mem.write(rx_ring + 16 * i, struct.pack('<4I', 1 << 31, (1 << 14) | 256, rx_buf + 0x800 * i, rx_ring + 16 * (1 - i)))
+
+        eth.write(eth.struct.DMASR.offset, 4, 1 << 7)
+        eth.write(eth.struct.DMARDLAR.offset, 4, rx_ring)
+        eth.send(b'\x01' * 1000)
+        eth.step()
+
+        self.assertTrue(eth.instance.DMASR & (1 << 7))
+
+        for i in range(2):
+            rdes0, = struct.unpack('<I', ql.mem.read(rx_ring + 16 * i, 4))
+            self.assertTrue(rdes0 & (1 << 31))
+
+        del ql
+
     def test_mcu_crc_stm32f407(self):
         ql = Qiling(["../examples/rootfs/mcu/stm32f407/ai-sine-test.elf"],
                     archtype=QL_ARCH.CORTEX_M, ostype=QL_OS.MCU, env=stm32f407, verbose=QL_VERBOSE.DEFAULT)
@@ -441,6 +694,29 @@ class MCUTest(unittest.TestCase):
         self.assertEqual(ql.hw.usart3.recv(), b'Welcome to the world of Hacking!\naaaaaaaaaaaaaaaaaaaa\xa9\x05\n')
 
 
+    def test_mcu_tube_threads(self):
+        tube = PeripheralTube(capacity=0x10)
+        data = bytes(range(256)) * 1000
+
+        def produce():
+            for i in range(0, len(data), 37):
+                tube.write(data[i:i + 37])
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+
+        received = bytearray()
+
+        # consume concurrently while the producer keeps growing the buffer
+        while len(received) < len(data):
+            if tube.readable():
+                received.append(tube.get())
+                received += tube.read(50)
+
+        producer.join()
+
+        self.assertEqual(bytes(received), data)
+
 if __name__ == "__main__":
     unittest.main()
 
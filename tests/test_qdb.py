@@ -8,7 +8,10 @@ import unittest
 
 sys.path.append("..")
 from qiling import Qiling
-from qiling.const import QL_VERBOSE
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+from qiling.debugger.qdb.utils import SnapshotManager
+from qiling.exception import QlErrorOutput
+from qiling.utils import select_debugger
 
 
 class DebuggerTest(unittest.TestCase):
@@ -53,6 +56,85 @@ class DebuggerTest(unittest.TestCase):
             r'qdb_scripts/x86.qdb'
         )
 
+    def test_qdb_rr_x8664(self):
+        code = bytes.fromhex(
+            '48 89 37'              # mov   qword [rdi], rsi
+            'b8 09 00 00 00'        # mov   eax, 9              ; mmap
+            'bf 00 00 00 30'        # mov   edi, 0x30000000
+            'be 00 10 00 00'        # mov   esi, 0x1000
+            'ba 03 00 00 00'        # mov   edx, 3              ; PROT_READ | PROT_WRITE
+            '41 ba 32 00 00 00'     # mov   r10d, 0x32          ; MAP_PRIVATE | MAP_FIXED | MAP_ANONYMOUS
+            '49 c7 c0 ff ff ff ff'  # mov   r8, -1
+            '45 31 c9'              # xor   r9d, r9d
+            '0f 05'                 # syscall
+            '48 89 00'              # mov   qword [rax], rax
+            'b8 0b 00 00 00'        # mov   eax, 11             ; munmap
+            '48 89 df'              # mov   rdi, rbx
+            'be 00 10 00 00'        # mov   esi, 0x1000
+            '0f 05'                 # syscall
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+        ql.loader.brk_address = 0
+
+        buffer = 0x20000000
+        mapped = 0x30000000
+        end = ql.os.entry_point + len(code)
+
+        # munmap only drops ranges that were mmapped
+        ql.mem.map(buffer, 0x1000, info='[mmap anonymous]')
+        ql.mem.write(buffer, bytes(range(256)) * 16)
+
+        ql.arch.regs.rip = ql.os.entry_point
+        ql.arch.regs.rdi = buffer
+        ql.arch.regs.rbx = buffer
+        ql.arch.regs.rsi = 0x1122334455667788
+
+        def state():
+            layout = [(lbound, ubound, perms) for lbound, ubound, perms, *_ in ql.mem.map_info]
+            content = bytes(ql.mem.read(buffer, 0x1000)) if ql.mem.is_mapped(buffer, 0x1000) else None
+
+            return ql.arch.regs.save(), layout, content
+
+        rr = SnapshotManager(ql)
+        states = []
+
+        # record every instruction as a step
+        while ql.arch.regs.rip != end:
+            states.append(state())
+
+            rr.begin()
+            ql.emu_start(ql.arch.regs.rip, end, count=1)
+            rr.end()
+
+        self.assertEqual(len(rr.layers), 14)
+        self.assertFalse(ql.mem.is_mapped(buffer, 0x1000))
+        self.assertEqual(ql.mem.read_ptr(mapped, 8), mapped)
+
+        # munmap changed the layout only; the content of the unmapped range is restored as well
+        self.assertIsNotNone(rr.layers[-1].layout)
+        self.assertIsNotNone(rr.layers[8].layout)
+        self.assertIsNone(rr.layers[0].layout)
+        self.assertEqual(list(rr.layers[0].pages), [buffer])
+
+        # then step all the way back
+        while states:
+            rr.restore()
+
+            self.assertEqual(state(), states.pop())
+
+        self.assertFalse(rr.layers)
+        self.assertEqual(rr.size, 0)
+        self.assertFalse(ql.mem.is_mapped(mapped, 0x1000))
+        self.assertEqual(ql.mem.read(buffer, 0x100), bytes(range(256)))
+
+    def test_qdb_rr_budget(self):
+        self.assertIsNotNone(select_debugger('qdb::rr=0x1000000'))
+
+        for arg in ('rr=0', 'rr=-1'):
+            with self.assertRaises(QlErrorOutput):
+                select_debugger(f'qdb::{arg}')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import sys
+import unittest
+
+sys.path.append("..")
+from qiling import Qiling
+from qiling.const import QL_ARCH, QL_OS, QL_VERBOSE
+from qiling.os.memory import QlMemoryHeap
+from qiling.extensions.sanitizers.heap import QlSanitizedMemoryHeap
+from qiling.extensions.sanitizers.memory import QlMemorySanitizer
+
+
+HEAP_BASE = 0x10000000
+HEAP_SIZE = 0x100000
+
+
+class SanitizersTest(unittest.TestCase):
+
+    def test_heap_sanitizer_x8664(self):
+        code = bytes.fromhex(
+            '8a 07'             # mov   al, byte [rdi]
+            '88 07'             # mov   byte [rdi], al
+            '90'                # nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        heap = QlSanitizedMemoryHeap(ql, QlMemoryHeap(ql, HEAP_BASE, HEAP_BASE + HEAP_SIZE), quarantine_size=0x100)
+
+        violations = []
+
+        heap.oob_handler = lambda ql, access, addr, size, value: violations.append(('oob', addr))
+        heap.bo_handler  = lambda ql, access, addr, size, value: violations.append(('bo', addr))
+        heap.uaf_handler = lambda ql, access, addr, size, value: violations.append(('uaf', addr))
+        heap.bad_free_handler = lambda ql, addr: violations.append(('bad_free', addr))
+
+        def access(address: int) -> None:
+            ql.arch.regs.rdi = address
+            ql.run(end=ql.os.entry_point + len(code) - 1)
+
+        # pretend allocations are made from a specific call site
+        ql.arch.stack_push(0x1234)
+
+        # plenty of live buffers should not matter
+        for _ in range(1000):
+            heap.alloc(24)
+
+        p = heap.alloc(13)
+
+        self.assertEqual(p % 8, 0)
+        self.assertEqual(heap.size(p), 13)
+
+        # in bounds
+        access(p)
+        access(p + 12)
+        self.assertEqual(violations, [])
+
+        # partially addressable granule, right redzone and left redzone
+        access(p + 13)
+        access(p + 20)
+        access(p - 1)
+
+        self.assertEqual(violations, [('oob', p + 13), ('bo', p + 13), ('oob', p + 20), ('bo', p + 20), ('oob', p - 1), ('bo', p - 1)])
+        self.assertEqual(heap.reports[0].kind, 'heap-buffer-overflow')
+        self.assertEqual(heap.reports[0].buffer, p)
+        self.assertEqual(heap.reports[0].alloc_site, 0x1234)
+
+        violations.clear()
+        heap.reports.clear()
+
+        # freed from another call site
+        ql.arch.stack_write(0, 0x5678)
+        self.assertTrue(heap.free(p))
+
+        access(p)
+
+        self.assertEqual(violations, [('uaf', p), ('uaf', p)])
+        self.assertEqual((heap.reports[0].kind, heap.reports[0].alloc_site, heap.reports[0].free_site), ('heap-use-after-free', 0x1234, 0x5678))
+
+        violations.clear()
+        heap.reports.clear()
+
+        # double free and a bad free
+        self.assertFalse(heap.free(p))
+        self.assertFalse(heap.free(p + 1))
+
+        self.assertEqual(violations, [('bad_free', p), ('bad_free', p + 1)])
+        self.assertEqual([r.kind for r in heap.reports], ['double-free', 'bad-free'])
+
+        self.assertTrue(heap.validate())
+
+        # corrupt a redzone behind the sanitizer back
+        q = heap.alloc(8)
+        ql.mem.write(q + 8, b'\x00')
+
+        self.assertFalse(heap.validate())
+
+        # once the quarantine overflows, the oldest freed buffers are recycled
+        for _ in range(8):
+            heap.free(heap.alloc(64))
+
+        self.assertNotIn(p, heap.quarantined)
+        self.assertLessEqual(heap.quarantine_used, heap.quarantine_size)
+
+    def test_heap_sanitizer_save_restore_x8664(self):
+        ql = Qiling(code=b'\x90', archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        heap = QlSanitizedMemoryHeap(ql, QlMemoryHeap(ql, HEAP_BASE, HEAP_BASE + HEAP_SIZE))
+
+        p = heap.alloc(16)
+        saved = heap.save()
+
+        # a saved state must not follow later changes, and may be restored more than once
+        for _ in range(2):
+            self.assertTrue(heap.free(p))
+            q = heap.alloc(32)
+
+            heap.restore(saved)
+
+            self.assertEqual(heap.size(p), 16)
+            self.assertIsNone(heap.chunks[p].free_site)
+            self.assertNotIn(q, heap.chunks)
+            self.assertNotIn(p, heap.quarantined)
+
+    def test_memory_sanitizer_x8664(self):
+        code = bytes.fromhex(
+            'eb 1a'             # jmp   main
+                                # malloc:
+            'c3'                #   ret
+                                # free:
+            'c3'                #   ret
+                                # smash:
+            '55'                #   push  rbp
+            '48 89 e5'          #   mov   rbp, rsp
+            '48 83 ec 20'       #   sub   rsp, 32
+            '31 c0'             #   xor   eax, eax
+                                # .loop:
+            'c6 04 04 41'       #   mov   byte [rsp + rax], 0x41
+            '48 ff c0'          #   inc   rax
+            '48 39 f8'          #   cmp   rax, rdi
+            '75 f4'             #   jne   .loop
+            'c9'                #   leave
+            'c3'                #   ret
+                                # main:
+            '48 c7 c7 18000000' #   mov   rdi, 24
+            'e8 daffffff'       #   call  malloc
+            '48 89 c3'          #   mov   rbx, rax
+            'c6 43 18 01'       #   mov   byte [rbx + 24], 1
+            '48 89 df'          #   mov   rdi, rbx
+            'e8 ccffffff'       #   call  free
+            'c6 03 01'          #   mov   byte [rbx], 1
+            'c6 41 16 01'       #   mov   byte [rcx + 22], 1
+            '48 c7 c7 28000000' #   mov   rdi, 40
+            'e8 baffffff'       #   call  smash
+            '90'                #   nop
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        base = ql.os.entry_point
+        malloc, free, smash = base + 2, base + 3, base + 4
+
+        san = QlMemorySanitizer(ql)
+
+        san.hook_allocator('malloc', malloc)
+        san.hook_allocator('free', free)
+
+        # functions that do not allocate a stack frame are left alone
+        self.assertFalse(san.instrument_frame(malloc, 1))
+        self.assertTrue(san.instrument_frame(smash, 24))
+
+        # neither are functions whose frame is sized at run time: push rbp; mov rbp, rsp; sub rsp, rax; ret
+        ql.mem.write(base + 0x1000, bytes.fromhex('55 48 89 e5 48 29 c4 c3'))
+        self.assertFalse(san.instrument_frame(base + 0x1000, 8))
+
+        gbase = base + 0x2000
+        san.add_globals([(gbase, 20, 'gbuf'), (gbase + 24, 4, 'gafter')])
+        ql.arch.regs.rcx = gbase
+
+        ql.run(end=base + len(code) - 1)
+
+        kinds = [r.kind for r in san.reports]
+
+        self.assertEqual(kinds, ['heap-buffer-overflow', 'heap-use-after-free', 'global-buffer-overflow'] + ['stack-buffer-overflow'] * 8)
+
+        heap_bo, heap_uaf, global_bo, stack_bo, *stack_rest = san.reports
+
+        self.assertEqual((heap_bo.buffer_size, heap_bo.address - heap_bo.buffer, heap_bo.alloc_site), (24, 24, base + 40))
+        self.assertEqual(heap_uaf.free_site, base + 55)
+        self.assertEqual((global_bo.buffer, global_bo.address), (gbase, gbase + 22))
+        self.assertEqual((stack_bo.buffer_size, stack_bo.address - stack_bo.buffer, stack_bo.alloc_site), (32, 32, smash))
+
+        # every byte written over the saved frame pointer is caught as it is written
+        self.assertEqual((stack_bo.access, stack_bo.size, stack_bo.pc), ('write', 1, smash + 10))
+        self.assertEqual([r.address - stack_bo.address for r in stack_rest], list(range(1, 8)))
+
+        # the frame was retired on return
+        self.assertEqual(san.frames, [])
+
+        # reading past a local buffer: push rbp; mov rbp, rsp; sub rsp, 16; mov rax, [rsp + 16]; leave; ret
+        peek = base + 0x1100
+        ql.mem.write(peek, bytes.fromhex('55 48 89 e5 48 83 ec 10 48 8b 44 24 10 c9 c3'))
+        self.assertTrue(san.instrument_frame(peek, 15))
+
+        san.reports.clear()
+
+        ql.arch.stack_push(base + len(code) - 1)
+        ql.emu_start(peek, base + len(code) - 1)
+
+        self.assertEqual([(r.kind, r.access, r.size, r.pc) for r in san.reports], [('stack-buffer-overflow', 'read', 8, peek + 8)])
+        self.assertEqual(san.reports[0].address - san.reports[0].buffer, 16)
+        self.assertEqual(san.frames, [])
+
+if __name__ == "__main__":
+    unittest.main()
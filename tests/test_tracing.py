@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+#
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")
+from unicorn import UcError
+
+from qiling import Qiling
+from qiling.const import QL_ARCH, QL_ENDIAN, QL_OS, QL_VERBOSE
+from qiling.exception import QlErrorModuleNotFound
+from qiling.extensions import trace
+from qiling.extensions.tracing import utils as trace_utils
+from qiling.extensions.tracing.formats.binary import ACCESS_READ, ACCESS_WRITE, QlBinaryTrace, QlBinaryTraceReader
+from qiling.extensions.tracing.formats.memory import MemAccessRecord, QlMemTrace, QlMemTraceReader
+from qiling.extensions.tracing.formats.tenet import QlDrTrace
+
+
+class TenetTraceTest(unittest.TestCase):
+
+    CODE = bytes.fromhex(
+        '48 c7 c2 34 12 00 00'  # mov   rdx, 0x1234
+        '52'                    # push  rdx
+        '58'                    # pop   rax
+        '90'                    # nop
+    )
+
+    def __expected(self, ql: Qiling):
+        base = ql.os.entry_point
+        sp = ql.arch.regs.rsp
+
+        return [
+            f'rax=0x0,rbx=0x0,rcx=0x0,rdx=0x0,rbp=0x0,rsp={sp:#x},rsi=0x0,rdi=0x0,rip={base:#x},r8=0x0,r9=0x0,r10=0x0,r11=0x0,r12=0x0,r13=0x0,r14=0x0,r15=0x0',
+            f'rdx=0x1234,rip={base + 7:#x},mw={sp - 8:#x}:3412000000000000',
+            f'rsp={sp - 8:#x},rip={base + 8:#x},mr={sp - 8:#x}:3412000000000000',
+            f'rax=0x1234,rsp={sp:#x},rip={base + 9:#x}'
+        ]
+
+    def test_tenet_x8664(self):
+        ql = Qiling(code=self.CODE, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+        expected = self.__expected(ql)
+
+        self.assertIn('tenet', trace_utils.factory.formats)
+
+        with tempfile.TemporaryDirectory() as path:
+            trace_file = os.path.join(path, 'trace.log')
+
+            with trace_utils.collect_trace(ql, 'tenet', trace_file):
+                ql.run()
+
+            with open(trace_file) as infile:
+                self.assertEqual(infile.read().splitlines(), expected)
+
+    def test_tenet_stream_x8664(self):
+        ql = Qiling(code=self.CODE, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+        expected = self.__expected(ql)
+
+        with tempfile.TemporaryDirectory() as path:
+            trace_file = os.path.join(path, 'trace.log')
+
+            trace = QlDrTrace(ql, trace_file)
+            trace.activate()
+
+            ql.run()
+
+            trace.deactivate()
+
+            with open(trace_file) as infile:
+                self.assertEqual(infile.read().splitlines(), expected)
+
+            # a copy may be dumped elsewhere as well
+            other_file = os.path.join(path, 'other.log')
+            trace.dump_trace(other_file)
+
+            with open(other_file) as infile:
+                self.assertEqual(infile.read().splitlines(), expected)
+
+
+class BinaryTraceTest(unittest.TestCase):
+
+    CODE = bytes.fromhex(
+        '48 c7 c1 05 00 00 00'          # mov   rcx, 5
+        '48 8d b4 24 00 ff ff ff'       # lea   rsi, [rsp - 0x100]
+                                        # .loop:
+        '48 8b 06'                      # mov   rax, qword ptr [rsi]
+        '48 01 c8'                      # add   rax, rcx
+        '48 89 06'                      # mov   qword ptr [rsi], rax
+        '48 ff c9'                      # dec   rcx
+        '75 f2'                         # jnz   .loop
+    )
+
+    def test_binary_x8664(self):
+        ql = Qiling(code=self.CODE, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+
+        base = ql.os.entry_point
+        buffer = ql.arch.regs.rsp - 0x100
+
+        self.assertIn('binary', trace_utils.factory.formats)
+
+        with tempfile.TemporaryDirectory() as path:
+            trace_file = os.path.join(path, 'trace.bin')
+            tenet_file = os.path.join(path, 'trace.log')
+
+            # use a short checkpoint interval, so the trace spans several segments
+            trace = QlBinaryTrace(ql, trace_file, interval=4)
+            tenet = QlDrTrace(ql)
+
+            trace.activate()
+            tenet.activate()
+
+            ql.run()
+
+            tenet.deactivate()
+            trace.deactivate()
+
+            tenet.dump_trace(tenet_file)
+
+            with QlBinaryTraceReader(trace_file) as reader:
+                # 2 setup instructions followed by 5 loop iterations
+                self.assertEqual(len(reader), 2 + 5 * 5)
+
+                self.assertEqual(reader.pc(0), base)
+                self.assertEqual(reader.pc(26), base + 27)
+
+                frame = reader.frame(2 + 5 + 2)
+                self.assertEqual(frame.pc, base + 21)
+                self.assertEqual(frame.registers, {'rax': 5 + 4})
+                self.assertEqual([(a.address, a.data) for a in frame.accesses], [(buffer, (5 + 4).to_bytes(8, 'little'))])
+
+                # beginning of the 3rd iteration
+                state = reader.state(2 + 5 * 2)
+                self.assertEqual((state['rip'], state['rax'], state['rcx']), (base + 15, 5 + 4, 3))
+
+                self.assertIsNone(reader.read_memory(0, buffer, 8))
+                self.assertEqual(reader.read_memory(2 + 5 * 2, buffer, 8), (5 + 4).to_bytes(8, 'little'))
+                self.assertEqual(reader.read_memory(26, buffer, 8), (5 + 4 + 3 + 2 + 1).to_bytes(8, 'little'))
+
+                converted = os.path.join(path, 'converted.log')
+                reader.export_tenet(converted)
+
+            with open(converted) as infile, open(tenet_file) as expected:
+                self.assertEqual(infile.read(), expected.read())
+
+            # a trace that was not finalized can still be read, up to its last complete segment
+            with open(trace_file, 'rb') as infile:
+                data = infile.read()
+
+            with open(trace_file, 'wb') as outfile:
+                outfile.write(data[:-16])
+
+            with QlBinaryTraceReader(trace_file) as reader:
+                self.assertEqual(len(reader), 2 + 5 * 5)
+
+
+class FullTraceTest(unittest.TestCase):
+
+    class Collector(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.lines = []
+
+        def emit(self, record: logging.LogRecord):
+            self.lines.append(record.getMessage())
+
+    def __collect(self, ql: Qiling) -> 'FullTraceTest.Collector':
+        handler = FullTraceTest.Collector()
+        ql.log.addHandler(handler)
+
+        return handler
+
+    @staticmethod
+    def __trace_lines(lines):
+        # strip the color codes and break trace lines into address, mnemonic and registers
+        lines = (line.replace('\033[2m', '').replace('\033[0m', '') for line in lines if ' | ' in line)
+
+        return [(int(a, 16), i.split()[1], r) for a, i, r in (line.split(' | ') for line in lines)]
+
+    def test_full_trace_x8664(self):
+        code = bytes.fromhex(
+            '48 c7 c2 34 12 00 00'  # mov   rdx, 0x1234
+            '52'                    # push  rdx
+            '58'                    # pop   rax
+            '48 8d 44 02 08'        # lea   rax, [rdx + rax + 8]
+            '88 e0'                 # mov   al, ah
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DEBUG)
+        handler = self.__collect(ql)
+        sp = ql.arch.regs.rsp
+
+        trace.enable_full_trace(ql)
+        ql.run()
+
+        base = ql.os.entry_point
+        lines = [line for line in handler.lines if ' | ' in line]
+
+        self.assertEqual(self.__trace_lines(lines), [
+            (base,      'mov',  ''),
+            (base + 7,  'push', f'rsp = {sp:#x}, rdx = 0x1234'),
+            (base + 8,  'pop',  f'rsp = {sp - 8:#x}'),
+            (base + 9,  'lea',  'rdx = 0x1234, rax = 0x1234'),
+            (base + 14, 'mov',  'ah = 0x24')
+        ])
+
+        # effective addresses are resolved
+        self.assertIn('lea        rax, [0x2470]', lines[3])
+
+    def test_full_trace_range(self):
+        code = bytes.fromhex(
+            '01 00 02 24'           # addiu $v0, $zero, 1
+            '02 00 03 24'           # addiu $v1, $zero, 2
+            '21 20 43 00'           # addu  $a0, $v0, $v1
+            '00 00 a4 af'           # sw    $a0, ($sp)
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.MIPS, endian=QL_ENDIAN.EL, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DEBUG)
+        handler = self.__collect(ql)
+        sp = ql.arch.regs.sp
+
+        base = ql.os.entry_point
+
+        # trace only the last two instructions
+        trace.enable_full_trace(ql, begin=base + 8, end=base + 15)
+        ql.run()
+
+        self.assertEqual(self.__trace_lines(handler.lines), [
+            (base + 8,  'addu', 'a0 = 0x0, v0 = 0x1, v1 = 0x2'),
+            (base + 12, 'sw',   f'a0 = 0x3, sp = {sp:#x}')
+        ])
+
+    def test_history_trace_arm64(self):
+        code = bytes.fromhex(
+            '20 00 80 d2'           # mov   x0, #1
+            '41 00 80 d2'           # mov   x1, #2
+            '01 00 01 8b'           # add   x1, x0, x1
+            'fd 7b bf a9'           # stp   x29, x30, [sp, #-0x10]!
+            '21 00 00 b9'           # str   w1, [x1]
+        )
+
+        ql = Qiling(code=code, archtype=QL_ARCH.ARM64, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DEFAULT)
+        handler = self.__collect(ql)
+        sp = ql.arch.regs.sp
+
+        trace.enable_history_trace(ql, 3)
+
+        # the last instruction crashes the program, which emits the history
+        with self.assertRaises(UcError):
+            ql.run()
+
+        base = ql.os.entry_point
+
+        self.assertEqual(self.__trace_lines(handler.lines), [
+            (base + 8,  'add', 'x0 = 0x1, x1 = 0x2'),
+            (base + 12, 'stp', f'fp = 0x0, lr = 0x0, sp = {sp:#x}'),
+            (base + 16, 'str', 'w1 = 0x3, x1 = 0x3')
+        ])
+
+
+class MemTraceTest(unittest.TestCase):
+
+    CODE = bytes.fromhex(
+        '48 c7 c1 00 01 00 00'  # mov   rcx, 0x100
+                                # loop:
+        '51'                    # push  rcx
+        '58'                    # pop   rax
+        '48 ff c9'              # dec   rcx
+        '75 f9'                 # jnz   loop
+    )
+
+    def __trace(self, **kwargs):
+        ql = Qiling(code=self.CODE, archtype=QL_ARCH.X8664, ostype=QL_OS.LINUX, verbose=QL_VERBOSE.DISABLED)
+        sp = ql.arch.regs.rsp
+
+        tracer = QlMemTrace(ql, **kwargs)
+        tracer.activate()
+
+        ql.run()
+
+        tracer.deactivate()
+
+        with tempfile.TemporaryDirectory() as path:
+            trace_file = os.path.join(path, 'memtrace.bin')
+            tracer.dump_trace(trace_file)
+
+            with QlMemTraceReader(trace_file) as trace:
+                records = list(trace)
+
+                self.assertEqual(len(trace), len(records))
+
+                if records:
+                    self.assertEqual(trace[-1], records[-1])
+
+        return ql.os.entry_point, sp, records
+
+    def test_memtrace_x8664(self):
+        self.assertIn('memory', trace_utils.factory.formats)
+
+        base, sp, records = self.__trace()
+
+        # every iteration pushes and pops the loop counter
+        self.assertEqual(len(records), 0x200)
+
+        self.assertEqual(records[0], MemAccessRecord(0, base + 7, ACCESS_WRITE, sp - 8, 8, 0x100))
+        self.assertEqual(records[1], MemAccessRecord(1, base + 8, ACCESS_READ, sp - 8, 8, 0x100))
+        self.assertEqual(records[-1], MemAccessRecord(0x1ff, base + 8, ACCESS_READ, sp - 8, 8, 1))
+
+    def test_memtrace_sampling(self):
+        _, _, records = self.__trace(rate=3)
+
+        self.assertEqual([r.index for r in records], list(range(0, 0x200, 3)))
+
+        # record bursts of 4 accesses, leaving 8 iterations out between them
+        _, _, records = self.__trace(burst=4, gap=8)
+
+        self.assertEqual(len(records), 4 * (0x100 // 10) + 4)
+        self.assertEqual([r.index for r in records[:8]], list(range(8)))
+
+        # every burst spans 2 iterations, and the gap skips the following 8; skipped accesses are not counted
+        self.assertEqual([r.value for r in records[:8]], [0x100, 0x100, 0xff, 0xff, 0xf6, 0xf6, 0xf5, 0xf5])
+
+    def test_memtrace_regions(self):
+        _, sp, records = self.__trace(regions=['[shellcode_stack]'])
+        self.assertEqual(len(records), 0x200)
+
+        _, _, records = self.__trace(regions=[(sp, sp + 0x1000)])
+        self.assertEqual(records, [])
+
+        with self.assertRaises(QlErrorModuleNotFound):
+            self.__trace(regions=['[nonexistent]'])
+
+
+if __name__ == "__main__":
+    unittest.main()